@@ -20,6 +20,8 @@ from spectral_cube.utils import NoBeamError
 from astropy.coordinates import SkyCoord
 from tqdm.auto import tqdm
 import re
+from functools import partial
+from multiprocessing import Pool
 from astropy.io.registry import IORegistryError
 
 
@@ -167,6 +169,160 @@ def get_flux_in_region(fitsfile, region, rms_region=None):
         return flux, peak, rms
 
 
+def region_pixel_table(regions, wcs, beam, shape):
+    """
+    Build a sparse pixel-index table of the beam-sized apertures around each
+    region so that all regions can be measured from one copy of the image.
+
+    Each aperture contributes every pixel of its bounding box: the flattened
+    image index (-1 for pixels off the image) and the mask weight, matching
+    what ``mask.multiply(data)`` would produce.
+
+    Returns
+    -------
+    indices, weights : np.ndarray
+        The concatenated flat pixel indices and weights
+    offsets : np.ndarray
+        The start of each region's entries in ``indices`` and ``weights``
+    overlaps : np.ndarray
+        Whether each aperture overlaps the image at all
+    """
+    ny, nx = shape
+    indices, weights, offsets, overlaps = [], [], [], []
+    nentries = 0
+    for region in regions:
+        mask = create_beam_aperture(region, beam).to_pixel(wcs).to_mask()
+        bbox = mask.bbox
+        yy, xx = np.mgrid[bbox.iymin:bbox.iymax, bbox.ixmin:bbox.ixmax]
+        inside = (yy >= 0) & (yy < ny) & (xx >= 0) & (xx < nx)
+        indices.append(np.where(inside, yy * nx + xx, -1).ravel())
+        weights.append(mask.data.ravel())
+        offsets.append(nentries)
+        overlaps.append(inside.any())
+        nentries += inside.size
+    return (np.concatenate(indices), np.concatenate(weights),
+            np.array(offsets), np.array(overlaps))
+
+
+def measure_regions(image, regions, edge_width=20):
+    """
+    Measure the flux, peak, and RMS for every region in a 2D image, using
+    the same definitions as `get_flux_in_region` with the edge-based RMS.
+
+    Parameters
+    ----------
+    image : spectral_cube.Projection
+        The image, with a beam
+    regions : list of regions.Region
+        Point source regions
+    edge_width : int
+        The width of the image edges used to estimate the RMS
+
+    Returns
+    -------
+    flux, peak, rms : np.ndarray
+        One entry per region; NaN for regions with no valid pixels
+    """
+    beam = image.beam
+    wcs = image.wcs.celestial
+    data = np.asarray(image.value)
+
+    indices, weights, offsets, overlaps = region_pixel_table(regions, wcs, beam, data.shape)
+
+    # one gather for all of the regions; off-image pixels and pixels outside
+    # the aperture (even blank ones) are zero, as in mask.multiply
+    flatdata = data.ravel()
+    values = np.where((indices >= 0) & (weights != 0), flatdata[np.maximum(indices, 0)] * weights, 0)
+    finite = np.isfinite(values)
+    nvalid = np.add.reduceat(finite.astype(int), offsets)
+    total = np.add.reduceat(np.where(finite, values, 0), offsets)
+    peak = np.maximum.reduceat(np.where(finite, values, -np.inf), offsets)
+
+    pixel_scale = wcs.proj_plane_pixel_area()
+    beam_area = beam.sr.to(u.steradian)
+    pixels_per_beam = (beam_area / (pixel_scale * np.pi / (4 * np.log(2)))).decompose().value
+    flux = total / pixels_per_beam
+
+    # the edge RMS does not depend on the region, so it is computed once per image
+    edges = np.concatenate([
+        data[:edge_width, :].ravel(),
+        data[-edge_width:, :].ravel(),
+        data[:, :edge_width].ravel(),
+        data[:, -edge_width:].ravel()
+    ])
+    valid_edges = edges[np.isfinite(edges)]
+    rms = mad_std(valid_edges) if len(valid_edges) > 0 else np.nan
+    rms = np.full(len(regions), rms)
+
+    for ii, region in enumerate(regions):
+        if not overlaps[ii] and wcs.footprint_contains(region.center):
+            warnings.warn(f"Footprint contained region {region} but cutout was blank")
+
+    bad = ~overlaps | (nvalid == 0)
+    flux[bad] = peak[bad] = rms[bad] = np.nan
+
+    return flux, peak, rms
+
+
+def measure_fluxes_in_file(filename, regions, filetype='mosaic'):
+    """
+    Read one image and measure all of the regions in it.
+
+    Returns a list of result rows (one per region), or an empty list if the
+    image could not be used (no beam, or for MOUS images, unreadable).
+    """
+    with warnings.catch_warnings():
+        suppress_wcs_warnings()
+        suppress_numpy_warnings()
+
+        try:
+            image = read_file(filename)
+            beam = image.beam
+        except NoBeamError as ex:  # noqa: F841
+            # we can't measure fluxes from non-convolved ones, so we skip them
+            return []
+        except Exception as ex:
+            if filetype == 'mosaic':
+                raise ex
+            warnings.warn(f"Could not get beam from {filename}: {str(ex)}")
+            return []
+
+        print(f"Processing {filetype}: {os.path.basename(filename)}", flush=True)
+        print(f"Beam size: {beam.major.to(u.arcsec):.2f} x {beam.minor.to(u.arcsec):.2f}")
+
+        fluxes, peaks, rmses = measure_regions(image, regions)
+
+    return [{'filename': os.path.basename(filename),
+             'type': filetype,
+             'region': reg.meta.get('text', 'unnamed'),
+             'coords': f"{reg.center.galactic.l.deg:.6f},{reg.center.galactic.b.deg:.6f}",
+             'flux_jy': flux,
+             'peak_jy_beam': peak,
+             'rms_jy_beam': rms,
+             'beam_maj_arcsec': beam.major.to(u.arcsec).value,
+             'beam_min_arcsec': beam.minor.to(u.arcsec).value,
+             'beam_pa_deg': beam.pa.to(u.deg).value
+             }
+            for reg, flux, peak, rms in zip(regions, fluxes, peaks, rmses)]
+
+
+def measure_fluxes(filenames, regions, filetype='mosaic', num_workers=1):
+    """
+    Measure all regions in all files, reading each file once and spreading
+    the files over ``num_workers`` processes.
+    """
+    func = partial(measure_fluxes_in_file, regions=regions, filetype=filetype)
+    results = []
+    if num_workers > 1:
+        with Pool(num_workers) as pool:
+            for rows in tqdm(pool.imap(func, filenames), total=len(filenames)):
+                results.extend(rows)
+    else:
+        for filename in tqdm(filenames):
+            results.extend(func(filename))
+    return results
+
+
 def plot_source_fluxes(results_table, output_dir):
     """
     Plot the flux extracted from each source vs the image it is extracted from.
@@ -662,38 +818,10 @@ def main():
     mosaic_files = [x for x in mosaic_files if ('tt1' not in x) and ('alpha' not in x) and ('rms' not in x) and ('weight' not in x)]
     assert len(mosaic_files) > 0, f"No mosaic files found in {mosaic_pattern}"
 
-    # Initialize results table
-    results = []
+    num_workers = int(os.getenv('SLURM_NTASKS') or 1)
 
     print("Starting mosaic loop", flush=True)
-    # Process mosaic files
-    for fitsfile in tqdm(mosaic_files):
-        try:
-            beam = read_file(fitsfile).beam
-            print(f"Processing mosaic: {os.path.basename(fitsfile)}", flush=True)
-            print(f"Beam size: {beam.major.to(u.arcsec):.2f} x {beam.minor.to(u.arcsec):.2f}")
-        except NoBeamError as ex:  # noqa: F841
-            # we can't measure fluxes from non-convolved ones, so we skip them
-            continue
-        except Exception as ex:
-            raise ex
-            # warnings.warn(f"Could not get beam from {fitsfile}: {str(e)}")
-            continue
-
-        for reg in regions:
-            flux, peak, rms = get_flux_in_region(fitsfile, reg)
-            results.append({
-                'filename': os.path.basename(fitsfile),
-                'type': 'mosaic',
-                'region': reg.meta.get('text', 'unnamed'),
-                'coords': f"{reg.center.galactic.l.deg:.6f},{reg.center.galactic.b.deg:.6f}",
-                'flux_jy': flux,
-                'peak_jy_beam': peak,
-                'rms_jy_beam': rms,
-                'beam_maj_arcsec': beam.major.to(u.arcsec).value,
-                'beam_min_arcsec': beam.minor.to(u.arcsec).value,
-                'beam_pa_deg': beam.pa.to(u.deg).value
-            })
+    results = measure_fluxes(mosaic_files, regions, filetype='mosaic', num_workers=num_workers)
     assert len(results) > 0
 
     mous_pattern = os.path.join(basepath, 'data/2021.1.00172.L/science_goal.uid___A001_X1590_X30a8/group.uid___A001_X1590_X30a9/member.uid___A001*/calibrated/working/*image.tt0.pbcor')  # Adjust pattern based on MOUS file location
@@ -701,33 +829,7 @@ def main():
     assert len(mous_files) > 40
 
     print(f"Starting MOUS loop with {len(mous_files)}", flush=True)
-    # Process MOUS files
-    for imagefile in tqdm(mous_files):
-        print(f"Processing MOUS: {os.path.basename(imagefile)}")
-        try:
-            beam = read_file(imagefile).beam
-            print(f"Beam size: {beam.major.to(u.arcsec):.2f} x {beam.minor.to(u.arcsec):.2f}")
-        except Exception as e:
-            warnings.warn(f"Could not get beam from {imagefile}: {str(e)}")
-            continue
-
-        for reg in regions:
-            flux, peak, rms = get_flux_in_region(imagefile, reg)
-            try:
-                results.append({
-                    'filename': os.path.basename(imagefile),
-                    'type': 'mous',
-                    'region': reg.meta.get('text', 'unnamed'),
-                    'coords': f"{reg.center.galactic.l.deg:.6f},{reg.center.galactic.b.deg:.6f}",
-                    'flux_jy': flux,
-                    'peak_jy_beam': peak,
-                    'rms_jy_beam': rms,
-                    'beam_maj_arcsec': beam.major.to(u.arcsec).value,
-                    'beam_min_arcsec': beam.minor.to(u.arcsec).value,
-                    'beam_pa_deg': beam.pa.to(u.deg).value
-                })
-            except Exception as e:
-                warnings.warn(f"Error processing region in {fitsfile}: {str(e)}")
+    results += measure_fluxes(mous_files, regions, filetype='mous', num_workers=num_workers)
 
     # Convert results to table and save
     results_table = Table(results)
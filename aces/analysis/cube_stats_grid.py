@@ -5,11 +5,13 @@ import regions
 import os
 import time
 import numpy as np
-import warnings
 import datetime
+import sqlite3
+import warnings
+import dask
 from astropy import units as u
 from astropy.stats import mad_std
-from astropy.table import Table
+from astropy.table import Table, MaskedColumn
 from astropy import log
 from spectral_cube import SpectralCube
 from spectral_cube.utils import NoBeamError
@@ -19,6 +21,7 @@ from casa_formats_io import Table as casaTable
 from pathlib import Path
 
 from aces.analysis.imstats import get_psf_secondpeak, get_noise_region
+from aces.utils.tasks import ClaimDirectory, run_tasks
 from aces.retrieval_scripts.mous_map import get_mous_to_sb_mapping
 from aces import conf
 basepath = conf.basepath
@@ -30,11 +33,168 @@ dataroot = f'{basepath}/data/2021.1.00172.L'
 global then
 then = time.time()
 
-# number of columns in the table.  This has to be checked globally because any
-# edits to the underlying table will result in inconsistencies & crashes.
-# i.e., any time we add or remove a column from the table, we need to make sure
-# this number specifies the number of columns
-NCOLS = 50
+colnames_apriori = ['Field', 'Config', 'spw', 'suffix', 'filename', 'bmaj', 'bmin', 'bpa', 'wcs_restfreq', 'minfreq', 'maxfreq']
+colnames_fromheader = ['imsize', 'cell', 'threshold', 'niter', 'pblimit', 'pbmask', 'restfreq', 'nchan',
+                       'width', 'start', 'chanchunks', 'deconvolver', 'weighting', 'robust', 'git_version', 'git_date', 'version']
+colnames_stats = ('min max std sum mean'.split() +
+                  'min_K max_K std_K sum_K mean_K'.split() +
+                  'lowmin lowmax lowstd lowmadstd lowsum lowmean'.split() +
+                  ['mod' + x for x in 'min max std sum mean'.split()] + ['epsilon', 'timestamp'])
+colnames = colnames_apriori + colnames_fromheader + colnames_stats
+
+# The declared schema of the cube stats table: (name, SQL type, unit).
+# Quantities are stored as values in the declared unit.  Columns can be added
+# here freely; existing stores gain them (empty for old rows) when opened.
+cube_stats_columns = ([('Field', 'TEXT', None), ('Config', 'TEXT', None), ('spw', 'INTEGER', None),
+                       ('suffix', 'TEXT', None), ('filename', 'TEXT', None),
+                       ('bmaj', 'REAL', u.arcsec), ('bmin', 'REAL', u.arcsec), ('bpa', 'REAL', u.deg),
+                       ('wcs_restfreq', 'REAL', u.Hz), ('minfreq', 'REAL', u.Hz), ('maxfreq', 'REAL', u.Hz)] +
+                      [(name, 'TEXT', None) for name in colnames_fromheader] +
+                      [(name, 'REAL', u.Jy / u.beam) for name in 'min max std sum mean'.split()] +
+                      [(name, 'REAL', u.K) for name in 'min_K max_K std_K sum_K mean_K'.split()] +
+                      [(name, 'REAL', u.Jy / u.beam) for name in 'lowmin lowmax lowstd lowmadstd lowsum lowmean'.split()] +
+                      [('mod' + name, 'REAL', u.Jy / u.pix) for name in 'min max std sum mean'.split()] +
+                      [('epsilon', 'REAL', None), ('timestamp', 'TEXT', None)])
+
+cube_stats_key = ('Field', 'Config', 'spw', 'suffix')
+
+
+class CubeStatsStore:
+    """
+    Results store for the cube stats table, one row per (Field, Config, spw,
+    suffix).
+
+    Rows are written to SQLite as they are measured, so checking for
+    finished work is an indexed lookup and adding a row does not rewrite the
+    table.  `render_tables` writes the presentation formats.
+
+    Parameters
+    ----------
+    dbpath : str or Path
+        Location of the SQLite file.  Use ':memory:' for a throwaway store.
+    columns : list of (name, SQL type, unit)
+        The declared schema
+    """
+
+    def __init__(self, dbpath, columns=cube_stats_columns, key=cube_stats_key):
+        self.dbpath = dbpath
+        self.columns = columns
+        self.key = key
+        # array tasks on several nodes may write to the same store
+        self.connection = sqlite3.connect(str(dbpath), timeout=60)
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS stats ({', '.join(f'{name} {sqltype}' for name, sqltype, unit in columns)})")
+        existing = [row[1] for row in self.connection.execute("PRAGMA table_info(stats)")]
+        for name, sqltype, unit in columns:
+            if name not in existing:
+                self.connection.execute(f"ALTER TABLE stats ADD COLUMN {name} {sqltype}")
+        self.connection.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS stats_key ON stats ({', '.join(key)})")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM stats").fetchone()[0]
+
+    def has(self, *key):
+        """
+        Check whether there is a row for ``key`` = (Field, Config, spw, suffix)
+        """
+        where = " AND ".join(f"{name} = ?" for name in self.key)
+        return self.connection.execute(f"SELECT 1 FROM stats WHERE {where}", key).fetchone() is not None
+
+    def _to_sql(self, value, sqltype, unit):
+        if value is None or (isinstance(value, str) and value == '' and sqltype != 'TEXT'):
+            return None
+        if sqltype == 'TEXT':
+            return str(value)
+        if isinstance(value, u.Quantity):
+            # unitless values are assumed to be in the declared unit already
+            if unit is not None and value.unit != u.dimensionless_unscaled:
+                value = value.to_value(unit)
+            else:
+                value = value.value
+        return int(value) if sqltype == 'INTEGER' else float(value)
+
+    def add(self, row):
+        """
+        Add (or replace) one row, given as a dict of column name to value.
+        Missing columns are left empty.
+        """
+        names = [name for name, sqltype, unit in self.columns if name in row]
+        values = [self._to_sql(row[name], sqltype, unit) for name, sqltype, unit in self.columns if name in row]
+        self.connection.execute(f"INSERT OR REPLACE INTO stats ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                                values)
+        self.connection.commit()
+
+    def import_table(self, tbl):
+        """
+        Add the rows of an existing table (e.g., a ``cube_stats.ecsv``
+        written before the store existed), keeping only declared columns
+        """
+        declared = {name for name, sqltype, unit in self.columns}
+        for ii in range(len(tbl)):
+            self.add({cn: (tbl[cn].quantity[ii] if tbl[cn].unit not in (None, u.dimensionless_unscaled) else tbl[cn][ii])
+                      for cn in tbl.colnames if cn in declared})
+
+    def table(self):
+        """
+        The store as an astropy Table with the declared units
+        """
+        names = [name for name, sqltype, unit in self.columns]
+        rows = self.connection.execute(f"SELECT {', '.join(names)} FROM stats ORDER BY {', '.join(self.key)}").fetchall()
+        tbl = Table()
+        for ii, (name, sqltype, unit) in enumerate(self.columns):
+            values = [row[ii] for row in rows]
+            missing = [value is None for value in values]
+            if sqltype == 'TEXT':
+                tbl[name] = MaskedColumn(['' if value is None else value for value in values], dtype=str, mask=missing)
+            else:
+                tbl[name] = MaskedColumn([0 if value is None else value for value in values],
+                                         dtype=int if sqltype == 'INTEGER' else float, mask=missing, unit=unit)
+        return tbl
+
+
+def render_tables(store, outdir=None, basename='cube_stats'):
+    """
+    Write the store as ecsv, ipac, html, tex, and jsviewer tables in
+    ``outdir`` (default ``tbldir``)
+    """
+    outdir = tbldir if outdir is None else Path(outdir)
+    tbl = store.table()
+    tbl.write(outdir / f'{basename}.ecsv', overwrite=True)
+    tbl.write(outdir / f'{basename}.ipac', format='ascii.ipac', overwrite=True)
+    tbl.write(outdir / f'{basename}.html', format='ascii.html', overwrite=True)
+    tbl.write(outdir / f'{basename}.tex', overwrite=True)
+    tbl.write(outdir / f'{basename}.js.html', format='jsviewer', overwrite=True)
+    return tbl
+
+
+def open_store(start_from_cached=True):
+    """
+    Open the cube stats store in ``tbldir``.
+
+    If ``start_from_cached`` is False, an existing store is moved aside and
+    a new one started.  A new store is seeded from ``cube_stats.ecsv`` if
+    that exists.
+    """
+    dbpath = tbldir / 'cube_stats.sqlite'
+    if not start_from_cached and os.path.exists(dbpath):
+        shutil.move(dbpath, tbldir / f'cube_stats_{datetime.datetime.now().isoformat()}.sqlite')
+    isnew = not os.path.exists(dbpath)
+    store = CubeStatsStore(dbpath)
+    if isnew and start_from_cached and os.path.exists(tbldir / 'cube_stats.ecsv'):
+        print(f"Starting from cached file {tbldir / 'cube_stats.ecsv'}")
+        store.import_table(Table.read(tbldir / 'cube_stats.ecsv'))
+    return store
+
+
+def render_main():
+    """
+    Render the presentation tables from the store without measuring anything
+    """
+    tbl = render_tables(open_store())
+    print(tbl)
 
 
 def dt(message=""):
@@ -44,6 +204,433 @@ def dt(message=""):
     then = now
 
 
+def cube_statistics(cube):
+    """
+    Compute the whole-cube and low-signal statistics recorded in the cube
+    stats table.
+
+    The low-signal channels are those whose mean is in the lowest quartile.
+    This should be run within the cube's dask scheduler context.  It reads
+    the cube four times; `fused_cube_statistics` computes the same table
+    columns in one read.
+    """
+    # mask to select the channels with little/less emission
+    meanspec = cube.mean(axis=(1, 2))
+    lowsignal = meanspec < np.nanpercentile(meanspec, 25)
+
+    print(f"Low-signal region selected {lowsignal.sum()} channels out of {lowsignal.size}."
+          f" ({lowsignal.sum() / lowsignal.size * 100:0.2f}) %")
+
+    assert lowsignal.sum() > 0
+    assert lowsignal.sum() < lowsignal.size
+
+    # this is an open to-do item: we need to create noise estimation regions
+    # (see get_noise_region)
+    noiseest_cube = cube
+
+    dt(cube)
+
+    minfreq = cube.spectral_axis.min()
+    maxfreq = cube.spectral_axis.max()
+    restfreq = cube.wcs.wcs.restfrq
+
+    stats = cube.statistics()
+    dt("finished cube stats")
+
+    faintstats = noiseest_cube.with_mask(lowsignal[:, None, None]).statistics()
+    dt("finished low-signal cube stats")
+    dt("Doing low-signal cube mad-std")
+    # we got warnings that this was making large chunks.  Not sure there's an alternative here?
+    with dask.config.set(**{'array.slicing.split_large_chunks': False}):  # silence warning
+        flatdata = noiseest_cube.with_mask(lowsignal[:, None, None]).flattened()
+    dt("Loaded flatdata")
+    lowmadstd = mad_std(flatdata)
+    dt("Done low-signal cube mad-std")
+
+    # NOTE: the low* statistics other than lowmadstd are taken from the
+    # full-cube statistics, not from faintstats
+    del faintstats
+    return {'min': stats['min'], 'max': stats['max'], 'std': stats['sigma'],
+            'sum': stats['sum'], 'mean': stats['mean'],
+            'lowmin': stats['min'], 'lowmax': stats['max'], 'lowstd': stats['sigma'],
+            'lowsum': stats['sum'], 'lowmean': stats['mean'], 'lowmadstd': lowmadstd,
+            'minfreq': minfreq, 'maxfreq': maxfreq, 'restfreq': restfreq,
+            }
+
+
+def cube_blocks(cube, target_bytes=int(1e8), channels=None):
+    """
+    Yield (channel slice, block) pairs covering the cube's filled data (NaN
+    where masked), with each block flattened to (nchan, npix).
+
+    Dask cubes are read one dask chunk at a time in chunk order, which is
+    the order in which the loader reads the file (a few chunks are computed
+    together when the cube's scheduler has several workers).  Other cubes
+    are read in slabs of whole channels of about ``target_bytes``.  If
+    ``channels`` (a boolean array over the spectral axis) is given, blocks
+    with none of those channels are not read.
+    """
+    nchan, ny, nx = cube.shape
+    if hasattr(cube, 'use_dask_scheduler'):
+        data = cube._get_filled_data(fill=np.nan)
+        starts = np.concatenate([[0], np.cumsum(data.chunks[0])])
+        indices = [index for index in np.ndindex(*data.numblocks)
+                   if channels is None or channels[starts[index[0]]:starts[index[0] + 1]].any()]
+        nbatch = max(cube._scheduler_kwargs.get('num_workers') or 1, 1)
+        for ii in range(0, len(indices), nbatch):
+            batch = indices[ii:ii + nbatch]
+            with dask.config.set(**cube._scheduler_kwargs):
+                blocks = dask.compute(*[data.blocks[index] for index in batch])
+            for index, block in zip(batch, blocks):
+                yield (slice(starts[index[0]], starts[index[0] + 1]),
+                       np.asarray(block).reshape(block.shape[0], -1))
+    else:
+        nper = max(int(target_bytes // (ny * nx * cube._data.dtype.itemsize)), 1)
+        for c0 in range(0, nchan, nper):
+            c1 = min(c0 + nper, nchan)
+            if channels is None or channels[c0:c1].any():
+                yield slice(c0, c1), cube.filled_data[c0:c1].value.reshape(c1 - c0, -1)
+
+
+def _moments(npts, sums, sumsqs, mins, maxs):
+    """
+    Combine per-channel accumulators into min, max, sum, mean, and std
+    (with the same 'textbook' variance as `SpectralCube.statistics`)
+    """
+    npts_ = npts.sum()
+    sum_ = sums.sum()
+    valid = npts > 0
+    return {'npts': npts_,
+            'min': mins[valid].min() if valid.any() else np.nan,
+            'max': maxs[valid].max() if valid.any() else np.nan,
+            'sum': sum_,
+            'mean': sum_ / npts_,
+            'std': ((sumsqs.sum() - sum_**2 / npts_) / (npts_ - 1))**0.5,
+            }
+
+
+def histogram_bins(values, edges):
+    """
+    Bin indices of ``values`` in the uniformly spaced ``edges``: 0 below
+    the first edge, ``len(edges)`` at or above the last, else the bin number
+    plus one (the layout expected by `histogram_mad_std`)
+    """
+    nbins = edges.size - 1
+    index = np.floor((values - edges[0]) * (nbins / (edges[-1] - edges[0])))
+    return np.clip(index, -1, nbins).astype('int64') + 1
+
+
+def histogram_mad_std(counts, edges):
+    """
+    Estimate the `~astropy.stats.mad_std` of data from its histogram.
+
+    ``counts`` has an underflow bin, one bin per pair of ``edges``, and an
+    overflow bin.  The cumulative distribution is interpolated linearly
+    within bins; the median and the median absolute deviation from it are
+    both read off it, so a single histogram suffices.
+
+    Returns None if the median or the deviation range needed to hold half of
+    the points extends into the under- or overflow bins.
+    """
+    cdf = np.concatenate([[counts[0]], counts[0] + np.cumsum(counts[1:-1])]).astype('float64')
+    half = counts.sum() / 2
+    if not cdf[0] <= half <= cdf[-1]:
+        return None
+    median = np.interp(half, cdf, edges)
+
+    def within(dev):
+        return np.interp(median + dev, edges, cdf) - np.interp(median - dev, edges, cdf)
+
+    low, high = 0, min(median - edges[0], edges[-1] - median)
+    if within(high) < half:
+        return None
+    for ii in range(64):
+        mid = (low + high) / 2
+        if within(mid) < half:
+            low = mid
+        else:
+            high = mid
+    return 1.482602218505602 * high
+
+
+def fused_cube_statistics(cube, low_signal=True, nbins=2000, sketch_range=10, target_bytes=int(1e8)):
+    """
+    Single-read equivalent of `cube_statistics`.
+
+    One pass over `cube_blocks` accumulates the per-channel count, min, max,
+    sum, and sum of squares, and a per-channel histogram sketch of the
+    values.  The whole-cube statistics, the low-signal channel selection
+    (channels whose mean is in the lowest quartile) and the low-signal
+    statistics all follow from the per-channel accumulators, and
+    ``lowmadstd`` from the sum of the low-signal channels' histograms.
+
+    The sketch spans ``sketch_range`` robust standard deviations of the first
+    block read around its median, in ``nbins`` bins.  If that range turns out
+    not to hold the low-signal median and MAD, the low-signal channels (only)
+    are read a second time into a finer histogram spanning ten standard
+    deviations of the low-signal data either side of its mean, which always
+    holds them.
+
+    Parameters
+    ----------
+    low_signal : bool
+        Compute the low-signal statistics.  If False (e.g., for model cubes)
+        only the whole-cube statistics are returned.
+    """
+    nchan = cube.shape[0]
+    npts = np.zeros(nchan, dtype='int64')
+    sums = np.zeros(nchan)
+    sumsqs = np.zeros(nchan)
+    mins = np.full(nchan, np.inf)
+    maxs = np.full(nchan, -np.inf)
+    hist = np.zeros((nchan, nbins + 2), dtype='int64') if low_signal else None
+    edges = None
+
+    for chans, block in cube_blocks(cube, target_bytes=target_bytes):
+        good = np.isfinite(block)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            npts[chans] += good.sum(axis=1)
+            sums[chans] += np.nansum(block, axis=1, dtype='float64')
+            sumsqs[chans] += np.nansum(block * block, axis=1, dtype='float64')
+            mins[chans] = np.fmin(mins[chans], np.nanmin(block, axis=1))
+            maxs[chans] = np.fmax(maxs[chans], np.nanmax(block, axis=1))
+
+        if hist is None:
+            continue
+        if edges is None and good.any():
+            # a subsample is plenty to set the scale of the sketch
+            sample = block[good][::max(good.sum() // 100000, 1)]
+            center = np.median(sample)
+            scale = mad_std(sample)
+            if not (np.isfinite(scale) and scale > 0):
+                scale = np.std(sample) or 1
+            edges = center + scale * np.linspace(-sketch_range, sketch_range, nbins + 1)
+        if edges is not None:
+            for ii, chan in enumerate(range(chans.start, chans.stop)):
+                hist[chan] += np.bincount(histogram_bins(block[ii][good[ii]], edges), minlength=nbins + 2)
+
+    unit = cube.unit
+    total = _moments(npts, sums, sumsqs, mins, maxs)
+    stats = {key: total[key] * unit for key in ('min', 'max', 'sum', 'mean', 'std')}
+    stats['npts'] = total['npts']
+    stats.update({'minfreq': cube.spectral_axis.min(), 'maxfreq': cube.spectral_axis.max(),
+                  'restfreq': cube.wcs.wcs.restfrq})
+    if not low_signal:
+        return stats
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        meanspec = sums / npts
+    lowsignal = meanspec < np.nanpercentile(meanspec, 25)
+
+    print(f"Low-signal region selected {lowsignal.sum()} channels out of {lowsignal.size}."
+          f" ({lowsignal.sum() / lowsignal.size * 100:0.2f}) %")
+
+    assert lowsignal.sum() > 0
+    assert lowsignal.sum() < lowsignal.size
+
+    low = _moments(npts[lowsignal], sums[lowsignal], sumsqs[lowsignal], mins[lowsignal], maxs[lowsignal])
+    stats.update({'low' + key: low[key] * unit for key in ('min', 'max', 'sum', 'mean', 'std')})
+    stats['lownpts'] = low['npts']
+
+    lowmadstd = histogram_mad_std(hist[lowsignal].sum(axis=0), edges) if edges is not None else None
+    if lowmadstd is None:
+        dt("Low-signal histogram sketch out of range; re-reading the low-signal channels")
+        edges = low['mean'] + low['std'] * np.linspace(-10, 10, 2**16 + 1)
+        counts = np.zeros(edges.size + 1, dtype='int64')
+        for chans, block in cube_blocks(cube, target_bytes=target_bytes, channels=lowsignal):
+            values = block[lowsignal[chans]]
+            counts += np.bincount(histogram_bins(values[np.isfinite(values)], edges), minlength=edges.size + 1)
+        lowmadstd = histogram_mad_std(counts, edges)
+    stats['lowmadstd'] = lowmadstd * unit
+
+    return stats
+
+
+def find_cube_files(fullpath, suffix):
+    """
+    The (non-mfs) iter1 cubes with ``suffix`` in one member directory
+    """
+    fns = glob.glob(f'{fullpath}/calibrated/working/*.iter1{suffix}')
+    fns += glob.glob(f'{fullpath}/reclean/*.iter1{suffix}')
+    return [fn for fn in fns if 'mfs' not in fn]
+
+
+def cube_size(fn):
+    """
+    Size on disk of a FITS cube or CASA image directory, in bytes (0 if
+    neither ``fn`` nor ``fn + '.fits'`` exists)
+    """
+    for path in (fn, fn + '.fits'):
+        if os.path.isdir(path):
+            return sum(os.path.getsize(os.path.join(dirpath, name))
+                       for dirpath, dirnames, filenames in os.walk(path)
+                       for name in filenames)
+        elif os.path.exists(path):
+            return os.path.getsize(path)
+    return 0
+
+
+def find_cube_tasks(basepath, mousmap_, store, suffixes=(".image", ".image.pbcor.statcont.contsub.fits")):
+    """
+    List the cubes under ``basepath`` that are not yet in ``store``, largest
+    first, so that the longest jobs start first and the small ones fill in
+    around them.
+
+    Each task is a dict with the field, config, spw, suffix, filename, and
+    size of one cube.
+    """
+    tasks = []
+    for fullpath in glob.glob(f"{basepath}/sci*/group*/member*/"):
+        mous = os.path.basename(fullpath.strip('/')).split(".")[-1]
+        sbname = mousmap_[mous]
+        field = sbname.split("_")[3]
+        config = sbname.split("_")[5]
+        if ' ' in config:
+            # handle this case: 'Sgr_A_st_aj_03_7M Sgr_A_st_aj_03_7M_original'
+            config = config.split(" ")[0]
+
+        for suffix in suffixes:
+            for fn in find_cube_files(fullpath, suffix):
+                spw = int([x.lstrip('spw') for x in fn.split(".") if 'spw' in x][0])
+
+                if store.has(field, config, spw, suffix):
+                    print(f"Skipping {fn} as complete: {field} {config} {spw} {suffix}", flush=True)
+                    continue
+
+                modfn = fn.replace(".image", ".model")
+                if os.path.exists(fn) and not os.path.exists(modfn):
+                    log.error(f"File {fn} is missing its model {modfn}")
+                    continue
+
+                tasks.append({'field': field, 'config': config, 'spw': spw, 'suffix': suffix,
+                              'fn': fn, 'size': cube_size(fn)})
+
+    return sorted(tasks, key=lambda task: task['size'], reverse=True)
+
+
+def measure_cube(task, scheduler='synchronous', num_workers=None, target_chunksize=int(1e8)):
+    """
+    Measure one cube from `find_cube_tasks`.
+
+    Returns the table row as a list in the order of ``colnames``, or None if
+    the cube cannot be measured (no beam, or an unreadable psf).
+    """
+    field, config, spw, suffix, fn = [task[key] for key in ('field', 'config', 'spw', 'suffix', 'fn')]
+    modfn = fn.replace(".image", ".model")
+    psffn = fn.replace(".image", ".psf")
+
+    print(f"Beginning field {field} config {config} spw {spw} suffix {suffix}", flush=True)
+    print(f"File: '{fn}'", flush=True)
+
+    logtable = casaTable.read(f'{fn}/logtable')
+    hist = logtable['MESSAGE']
+
+    history = {x.split(":")[0]: ":".join(x.split(": ")[1:])
+               for x in hist if ':' in x and 'ICRS' not in x}
+    history.update({x.split("=")[0]: x.split("=")[1].lstrip()
+                    for x in hist if '=' in x})
+
+    jvmimage = fn.replace(".image", ".JvM.image")
+    if os.path.exists(jvmimage):
+        fn = jvmimage
+    elif os.path.exists(jvmimage + ".fits"):
+        fn = jvmimage + ".fits"
+    elif os.path.exists(fn):
+        pass
+    elif os.path.exists(fn + ".fits"):
+        fn = fn + ".fits"
+
+    if 'fits' in fn:
+        cube = SpectralCube.read(fn, format='fits', use_dask=True)
+    else:
+        cube = SpectralCube.read(fn, format='casa_image', target_chunksize=target_chunksize)
+
+    sched = cube.use_dask_scheduler(scheduler=scheduler, num_workers=num_workers)
+
+    try:
+        if hasattr(cube, 'beam'):
+            beam = cube.beam
+    except NoBeamError as ex:
+        print(f"Beam not found: {ex}")
+        return None
+
+    if hasattr(cube, 'beams'):
+        beams = cube.beams
+        # use the middle-ish beam
+        beam = beams[len(beams) // 2]
+
+    print(f"Beam: {beam}, {beam.major}, {beam.minor}", flush=True)
+
+    if 'imsize' not in history:
+        history['imsize'] = str(cube.shape[1:])
+    if 'cell' not in history:
+        history['cell'] = str([x.to(u.arcsec).to_string() for x in cube.wcs.celestial.proj_plane_pixel_scales()])
+    if 'restfreq' not in history:
+        history['restfreq'] = float(cube.wcs.wcs.restfrq)
+    if 'nchan' not in history:
+        history['nchan'] = int(cube.shape[0])
+
+    with sched:
+        dt(f"Computing cube statistics with scheduler {scheduler} and sched args {cube._scheduler_kwargs}")
+        cstats = fused_cube_statistics(cube)
+
+    min, max, std, sum, mean = [cstats[key] for key in ('min', 'max', 'std', 'sum', 'mean')]
+    lowmin, lowmax, lowstd, lowmadstd, lowsum, lowmean = [cstats[key] for key in
+                                                          ('lowmin', 'lowmax', 'lowstd', 'lowmadstd', 'lowsum', 'lowmean')]
+    minfreq, maxfreq, restfreq = cstats['minfreq'], cstats['maxfreq'], cstats['restfreq']
+    del cstats
+
+    if os.path.exists(modfn):
+        modcube = SpectralCube.read(modfn, format='casa_image', target_chunksize=target_chunksize)
+    elif os.path.exists(modfn + ".fits"):
+        modcube = SpectralCube.read(modfn + ".fits", format='fits', use_dask=True)
+    modsched = modcube.use_dask_scheduler(scheduler=scheduler, num_workers=num_workers)
+
+    dt(modcube)
+    dt(f"Computing model cube statistics with scheduler {scheduler} and sched args {modcube._scheduler_kwargs}")
+    with modsched:
+        modstats = fused_cube_statistics(modcube, low_signal=False)
+    dt("Done with model stats")
+    modmin = modstats['min']
+    modmax = modstats['max']
+    modstd = modstats['std']
+    modsum = modstats['sum']
+    modmean = modstats['mean']
+
+    del modcube
+    del modstats
+
+    epsilon = ''
+    if os.path.exists(psffn):
+        try:
+            (residual_peak, peakloc_as, frac, epsilon, firstnull, r_sidelobe, _) = get_psf_secondpeak(psffn, specslice=slice(cube.shape[0] // 2, cube.shape[0] // 2 + 1))
+        except Exception as ex:
+            print(f"get_psf_secondpeak failed with {ex} for file {psffn}")
+            return None
+
+    del cube
+
+    jtok_equiv = beam.jtok_equiv(u.Quantity(minfreq + maxfreq, u.Hz) / 2)
+
+    return ([field, config, spw, suffix, os.path.basename(fn), beam.major.to(u.arcsec), beam.minor.to(u.arcsec), beam.pa,
+             u.Quantity(restfreq, u.Hz), u.Quantity(minfreq, u.Hz), u.Quantity(maxfreq, u.Hz)] +
+            [history[key] if key in history else '' for key in colnames_fromheader] +
+            [min, max, std, sum, mean] +
+            list(map(lambda x: u.Quantity(x).to(u.K, jtok_equiv), [min, max, std, sum, mean])) +
+            [lowmin, lowmax, lowstd, lowmadstd, lowsum, lowmean] +
+            [modmin, modmax, modstd, modsum, modmean, epsilon, datetime.datetime.now().isoformat()])
+
+
+def run_cube_tasks(tasks, measure=measure_cube, **kwargs):
+    """
+    Measure the cube ``tasks`` with `aces.utils.tasks.run_tasks`; ``measure``
+    defaults to `measure_cube`
+    """
+    return run_tasks(tasks, measure=measure, **kwargs)
+
+
 def main(num_workers=None):
 
     if os.getenv('NO_PROGRESSBAR') is None and not (os.getenv('ENVIRON') == 'BATCH'):
@@ -118,6 +705,18 @@ def main(num_workers=None):
     target_chunksize = int(1e8)
     print(f"Target chunk size = {target_chunksize} (log10={np.log10(target_chunksize)})", flush=True)
 
+    # cubes are measured in CUBE_STATS_WORKERS processes, sharing the threads
+    # and memory of the job between them
+    nworkers = int(os.getenv('CUBE_STATS_WORKERS') or 1)
+    mem_per_worker = None
+    if nworkers > 1:
+        num_workers = max(nthreads // nworkers, 1)
+        scheduler = 'threads' if num_workers > 1 else 'synchronous'
+        if os.getenv('SLURM_MEM_PER_NODE'):
+            mem_per_worker = int(os.getenv('SLURM_MEM_PER_NODE')) * 1024**2 // nworkers
+        print(f"Using {nworkers} worker processes with {num_workers} threads"
+              f" and {mem_per_worker} bytes each", flush=True)
+
     print(f"Using scheduler {scheduler} with {nthreads} threads", flush=True)
     time.sleep(1)
     print("Slept for 1s", flush=True)
@@ -127,270 +726,51 @@ def main(num_workers=None):
     os.chdir(basepath)
     print(f"Changed from {cwd} to {basepath}, now running cube stats assembly", flush=True)
 
-    colnames_apriori = ['Field', 'Config', 'spw', 'suffix', 'filename', 'bmaj', 'bmin', 'bpa', 'wcs_restfreq', 'minfreq', 'maxfreq']
-    colnames_fromheader = ['imsize', 'cell', 'threshold', 'niter', 'pblimit', 'pbmask', 'restfreq', 'nchan',
-                           'width', 'start', 'chanchunks', 'deconvolver', 'weighting', 'robust', 'git_version', 'git_date', 'version']
-    colnames_stats = ('min max std sum mean'.split() +
-                      'min_K max_K std_K sum_K mean_K'.split() +
-                      'lowmin lowmax lowstd lowmadstd lowsum lowmean'.split() +
-                      ['mod' + x for x in 'min max std sum mean'.split()] + ['epsilon', 'timestamp'])
-
-    colnames = colnames_apriori + colnames_fromheader + colnames_stats
-    # sanity check to make sure I didn't mis-count things above
-    assert len(colnames) == NCOLS
-
-    def try_qty(x):
-        try:
-            return u.Quantity(x)
-        except Exception:
-            return list(x)
-
-    def save_tbl(rows, colnames):
-        columns = list(map(try_qty, zip(*rows)))
-        tbl = Table(columns, names=colnames)
-        tbl.write(tbldir / 'cube_stats.ecsv', overwrite=True)
-        tbl.write(tbldir / 'cube_stats.ipac', format='ascii.ipac', overwrite=True)
-        tbl.write(tbldir / 'cube_stats.html', format='ascii.html', overwrite=True)
-        tbl.write(tbldir / 'cube_stats.tex', overwrite=True)
-        tbl.write(tbldir / 'cube_stats.js.html', format='jsviewer', overwrite=True)
-        return tbl
-
     if os.getenv('START_FROM_CACHED') == 'False':
         start_from_cached = False  # TODO: make a parameter
     else:
         start_from_cached = True
-        print(f"Starting from cached file {tbldir / 'cube_stats.ecsv'}")
-    tbl = None
-    if start_from_cached and os.path.exists(tbldir / 'cube_stats.ecsv'):
-        tbl = Table.read(tbldir / 'cube_stats.ecsv')
-        print(tbl)
-        if len(tbl.colnames) != NCOLS:
-            warnings.warn("Cached file is BAD!  Moving it.")
-            shutil.move(tbldir / 'cube_stats.ecsv',
-                        tbldir / f'cube_stats_{datetime.datetime.now().isoformat()}.ecsv')
-            rows = []
-        else:
-            rows = [[tbl[cn].quantity[ii]
-                     if tbl[cn].unit not in (None, u.dimensionless_unscaled)
-                     else tbl[cn][ii] for cn in tbl.colnames]
-                    for ii in range(len(tbl))]
+    store = open_store(start_from_cached=start_from_cached)
+    print(f"Cube stats store {store.dbpath} has {len(store)} rows")
+
+    # SLURM array tasks share the queue of cubes through claim files
+    arraytask = os.getenv('SLURM_ARRAY_TASK_ID')
+    if arraytask is not None:
+        claims = ClaimDirectory(tbldir / 'cube_stats_claims' / os.getenv('SLURM_ARRAY_JOB_ID'))
+        cache_stats_file = open(tbldir / f"cube_stats_{arraytask}.txt", 'w')
     else:
-        rows = []
-
-    cache_stats_file = open(tbldir / "cube_stats.txt", 'w')
+        claims = None
+        cache_stats_file = open(tbldir / "cube_stats.txt", 'w')
 
     mousmap = get_mous_to_sb_mapping('2021.1.00172.L')
     mousmap_ = {key.replace("/", "_").replace(":", "_"): val for key, val in mousmap.items()}
 
-    for fullpath in glob.glob(f"{basepath}/sci*/group*/member*/"):
-        mous = os.path.basename(fullpath.strip('/')).split(".")[-1]
-        sbname = mousmap_[mous]
-        field = sbname.split("_")[3]
-        config = sbname.split("_")[5]
-        if ' ' in config:
-            # handle this case: 'Sgr_A_st_aj_03_7M Sgr_A_st_aj_03_7M_original'
-            config = config.split(" ")[0]
-        rerun = 'original' in sbname
-
-        for suffix in (".image", ".image.pbcor.statcont.contsub.fits"):  # ".contsub.image"):#, ".contsub.JvM.image.fits", ".JvM.image.fits"):
-            globblob = f'{fullpath}/calibrated/working/*.iter1{suffix}'
-            fns = glob.glob(globblob)
-            globblob2 = f'{fullpath}/reclean/*.iter1{suffix}'
-            fns += glob.glob(globblob2)
-
-            for fn in fns:
-                if 'mfs' in fn:
-                    continue
-
-                spw = int([x.lstrip('spw') for x in fn.split(".") if 'spw' in x][0])
-
-                if tbl is not None:
-                    row_matches = ((tbl['Field'] == field) &
-                                   (tbl['Config'] == config) &
-                                   (tbl['spw'] == spw) &
-                                   (tbl['suffix'] == suffix))
-                    if any(row_matches):
-                        print(f"Skipping {globblob} as complete: {tbl[row_matches]}", flush=True)
-                        continue
+    tasks = find_cube_tasks(basepath, mousmap_, store)
+    print(f"{len(tasks)} cubes to measure, {sum(task['size'] for task in tasks) / 1024**3:0.1f} GB in total", flush=True)
 
-                modfn = fn.replace(".image", ".model")
-                if os.path.exists(fn) and not os.path.exists(modfn):
-                    log.error(f"File {fn} is missing its model {modfn}")
-                    continue
-                psffn = fn.replace(".image", ".psf")
-
-                print(f"Beginning field {field} config {config} spw {spw} suffix {suffix}", flush=True)
-                print(f"File: '{fn}'", flush=True)
-
-                logtable = casaTable.read(f'{fn}/logtable')
-                hist = logtable['MESSAGE']
-
-                history = {x.split(":")[0]: ":".join(x.split(": ")[1:])
-                           for x in hist if ':' in x and 'ICRS' not in x}
-                history.update({x.split("=")[0]: x.split("=")[1].lstrip()
-                                for x in hist if '=' in x})
-
-                jvmimage = fn.replace(".image", ".JvM.image")
-                if os.path.exists(jvmimage):
-                    fn = jvmimage
-                elif os.path.exists(jvmimage + ".fits"):
-                    fn = jvmimage + ".fits"
-                elif os.path.exists(fn):
-                    pass
-                elif os.path.exists(fn + ".fits"):
-                    fn = fn + ".fits"
-
-                if 'fits' in fn:
-                    cube = SpectralCube.read(fn, format='fits', use_dask=True)
-                else:
-                    cube = SpectralCube.read(fn, format='casa_image', target_chunksize=target_chunksize)
-
-                sched = cube.use_dask_scheduler(scheduler=scheduler, num_workers=num_workers)
-                # print(f"Rechunking {cube} to tmp dir", flush=True)
-                # cube = cube.rechunk(save_to_tmp_dir=True)
-                # cube.use_dask_scheduler(scheduler)
-
-                try:
-                    if hasattr(cube, 'beam'):
-                        beam = cube.beam
-                except NoBeamError as ex:
-                    print(f"Beam not found: {ex}")
-                    continue
+    for task, row, error in run_cube_tasks(tasks, nworkers=nworkers, mem_per_worker=mem_per_worker, claims=claims,
+                                           scheduler=scheduler, num_workers=num_workers,
+                                           target_chunksize=target_chunksize):
+        if error is not None:
+            log.error(f"Failed to measure {task['fn']}: {error}")
+            continue
+        if row is None:
+            continue
+        store.add(dict(zip(colnames, row)))
 
-                if hasattr(cube, 'beams'):
-                    beams = cube.beams
-                    # use the middle-ish beam
-                    beam = beams[len(beams) // 2]
-
-                print(f"Beam: {beam}, {beam.major}, {beam.minor}", flush=True)
-
-                if 'imsize' not in history:
-                    history['imsize'] = str(cube.shape[1:])
-                if 'cell' not in history:
-                    history['cell'] = str([x.to(u.arcsec).to_string() for x in cube.wcs.celestial.proj_plane_pixel_scales()])
-                if 'restfreq' not in history:
-                    history['restfreq'] = float(cube.wcs.wcs.restfrq)
-                if 'nchan' not in history:
-                    history['nchan'] = int(cube.shape[0])
-
-                with sched:
-                    # mask to select the channels with little/less emission
-                    meanspec = cube.mean(axis=(1, 2))
-                    lowsignal = meanspec < np.nanpercentile(meanspec, 25)
-
-                    print(f"Low-signal region selected {lowsignal.sum()} channels out of {lowsignal.size}."
-                          f" ({lowsignal.sum() / lowsignal.size * 100:0.2f}) %")
-
-                    assert lowsignal.sum() > 0
-                    assert lowsignal.sum() < lowsignal.size
-
-                    if False:
-                        # this is an open to-do item: we need to create noise estimation regions
-                        noiseregion = get_noise_region(field)
-                        dt(f"Getting noise region {noiseregion}")
-                        assert noiseregion is not None
-                        noiseest_cube = cube.subcube_from_regions(regions.Regions.read(noiseregion))
-                    noiseest_cube = cube
-
-                    dt(cube)
-                    dt(noiseest_cube)
-
-                    minfreq = cube.spectral_axis.min()
-                    maxfreq = cube.spectral_axis.max()
-                    restfreq = cube.wcs.wcs.restfrq
-
-                    # print("getting filled data")
-                    # data = cube._get_filled_data(fill=np.nan)
-                    # print("finished getting filled data")
-                    # del data
-
-                    # try this as an experiment?  Maybe it's statistics that causes problems?
-                    #print(f"Computing cube mean with scheduler {scheduler} and sched args {cube._scheduler_kwargs}")
-                    #mean = cube.mean()
-                    dt(f"Computing cube statistics with scheduler {scheduler} and sched args {cube._scheduler_kwargs}")
-                    stats = cube.statistics()
-                    dt("finished cube stats")
-                    min = stats['min']
-                    max = stats['max']
-                    std = stats['sigma']
-                    sum = stats['sum']
-                    mean = stats['mean']
-
-                    faintstats = noiseest_cube.with_mask(lowsignal[:, None, None]).statistics()
-                    dt("finished low-signal cube stats")
-                    lowmin = stats['min']
-                    lowmax = stats['max']
-                    lowstd = stats['sigma']
-                    lowsum = stats['sum']
-                    lowmean = stats['mean']
-                    dt("Doing low-signal cube mad-std")
-                    # we got warnings that this was making large chunks.  Not sure there's an alternative here?
-                    #with dask.config.set(**{'array.slicing.split_large_chunks': True}): # try to split more
-                    with dask.config.set(**{'array.slicing.split_large_chunks': False}):  # silence warning
-                        flatdata = noiseest_cube.with_mask(lowsignal[:, None, None]).flattened()
-                    dt("Loaded flatdata")
-                    lowmadstd = mad_std(flatdata)
-                    dt("Done low-signal cube mad-std")
-
-                #min = cube.min()
-                #max = cube.max()
-                ##mad = cube.mad_std()
-                #std = cube.std()
-                #sum = cube.sum()
-                #mean = cube.mean()
-
-                del stats
-                del faintstats
-
-                if os.path.exists(modfn):
-                    modcube = SpectralCube.read(modfn, format='casa_image', target_chunksize=target_chunksize)
-                elif os.path.exists(modfn + ".fits"):
-                    modcube = SpectralCube.read(modfn + ".fits", format='fits', use_dask=True)
-                modsched = modcube.use_dask_scheduler(scheduler=scheduler, num_workers=num_workers)
-
-                dt(modcube)
-                dt(f"Computing model cube statistics with scheduler {scheduler} and sched args {modcube._scheduler_kwargs}")
-                with modsched:
-                    modstats = modcube.statistics()
-                dt("Done with model stats")
-                modmin = modstats['min']
-                modmax = modstats['max']
-                modstd = modstats['sigma']
-                modsum = modstats['sum']
-                modmean = modstats['mean']
-
-                del modcube
-                del modstats
-
-                if os.path.exists(psffn):
-                    try:
-                        (residual_peak, peakloc_as, frac, epsilon, firstnull, r_sidelobe, _) = get_psf_secondpeak(psffn, specslice=slice(cube.shape[0] // 2, cube.shape[0] // 2 + 1))
-                    except Exception as ex:
-                        print(f"get_psf_secondpeak failed with {ex} for file {psffn}")
-                        continue
-
-                del cube
-
-                jtok_equiv = beam.jtok_equiv(u.Quantity(minfreq + maxfreq, u.Hz) / 2)
-
-                row = ([field, config, spw, suffix, os.path.basename(fn), beam.major.to(u.arcsec), beam.minor.to(u.arcsec), beam.pa,
-                        u.Quantity(restfreq, u.Hz), u.Quantity(minfreq, u.Hz), u.Quantity(maxfreq, u.Hz)] +
-                       [history[key] if key in history else '' for key in colnames_fromheader] +
-                       [min, max, std, sum, mean] +
-                       list(map(lambda x: u.Quantity(x).to(u.K, jtok_equiv), [min, max, std, sum, mean])) +
-                       [lowmin, lowmax, lowstd, lowmadstd, lowsum, lowmean] +
-                       [modmin, modmax, modstd, modsum, modmean, epsilon, datetime.datetime.now().isoformat()])
-                assert len(row) == len(colnames) == NCOLS
-                rows.append(row)
-
-                cache_stats_file.write(" ".join(map(str, row)) + "\n")
-                cache_stats_file.flush()
-                print(f'len(rows): {len(rows)}, len(colnames): {len(colnames)}')
-                tbl = save_tbl(rows, colnames)
+        cache_stats_file.write(" ".join(map(str, row)) + "\n")
+        cache_stats_file.flush()
+        print(f'Cube stats store has {len(store)} rows')
 
     cache_stats_file.close()
 
-    print(tbl)
+    if arraytask is None:
+        tbl = render_tables(store)
+        print(tbl)
+    else:
+        # the array tasks finish at different times; render once with
+        # aces_cube_stats_render after the last one
+        print(f"Array task {arraytask} done; run aces_cube_stats_render when all tasks have finished")
 
     os.chdir(cwd)
 
@@ -1,6 +1,7 @@
 import numpy as np
 import json
 import os
+import warnings
 import radio_beam
 import reproject
 import regions
@@ -8,8 +9,8 @@ from astropy import constants, units as u, table, stats, coordinates, wcs, log
 from astropy.io import fits
 from spectral_cube import SpectralCube, wcs_utils, tests, Projection, OneDSpectrum
 from astropy.nddata import Cutout2D
+from astropy.wcs import WCSSUB_SPECTRAL
 from aces.analysis.parse_contdotdat import parse_contdotdat
-from aces.analysis import continuum_selection_diagnostic_plots
 from aces import conf
 import glob
 
@@ -23,7 +24,67 @@ overwrite = False
 basepath = conf.basepath
 
 
-def make_diagnostic_spectra(fn, replot=False):
+operations = ('mean', 'max', 'median')
+
+
+def region_exclusion_mask(regs, celwcs, shape):
+    """
+    Boolean image of the pixels whose centers are inside any of ``regs``.
+
+    Each region is rasterized on its bounding box only (`regions` ``to_mask``)
+    and pasted into the image, instead of testing every pixel of the image.
+    """
+    exmask = np.zeros(shape, dtype=bool)
+    for reg in regs:
+        try:
+            regmask = reg.to_pixel(celwcs).to_mask(mode='center')
+        except ValueError:
+            # regions that cannot be projected onto the image (NaN pixel
+            # coordinates) do not overlap it
+            continue
+        overlap = regmask.get_overlap_slices(shape)
+        if overlap[0] is not None:
+            exmask[overlap[0]] |= regmask.data[overlap[1]].astype(bool)
+    return exmask
+
+
+def block_spectra(cube, operations=operations, exmask=None, spectral_block_size=16):
+    """
+    Spatial mean, max, and median spectra of ``cube`` from one read, in
+    blocks of ``spectral_block_size`` channels.
+
+    Each block holds whole channels, so the per-channel median is exact.
+    Pixels in ``exmask`` (a 2D boolean image) are excluded.
+
+    Returns a dict of operation -> `~spectral_cube.OneDSpectrum`, built the
+    same way as ``getattr(cube, operation)(axis=(1, 2))``.
+    """
+    nchan = cube.shape[0]
+    spectra = {operation: np.full(nchan, np.nan) for operation in operations}
+    funcs = {'mean': np.nanmean, 'max': np.nanmax, 'median': np.nanmedian}
+    for c0 in range(0, nchan, spectral_block_size):
+        c1 = min(c0 + spectral_block_size, nchan)
+        data = cube.filled_data[c0:c1].value
+        if exmask is not None:
+            data[:, exmask] = np.nan
+        data = data.reshape(c1 - c0, -1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for operation in operations:
+                spectra[operation][c0:c1] = funcs[operation](data, axis=1)
+
+    if getattr(cube, '_beam', None) is not None:
+        beamarg = {'beam': cube.beam}
+    elif getattr(cube, '_beams', None) is not None:
+        beamarg = {'beams': cube.unmasked_beams}
+    else:
+        beamarg = {}
+    return {operation: OneDSpectrum(spectrum, unit=cube.unit, wcs=cube.wcs.sub([WCSSUB_SPECTRAL]),
+                                    header=cube._nowcs_header, spectral_unit=cube._spectral_unit, **beamarg)
+            for operation, spectrum in spectra.items()}
+
+
+def make_diagnostic_spectra(fn, replot=False, spectral_block_size=16):
     basedir = os.path.dirname(fn)
     if fn.endswith('.image'):
         basename = os.path.basename(fn)
@@ -46,29 +107,31 @@ def make_diagnostic_spectra(fn, replot=False):
     # mask cubes if they are Sgr B2 or Sgr A*
     sgrb2_a_fields = ['X15b4_X41', 'X15a0_Xa6', 'X15a0_X19c']
     if any(x in fn for x in sgrb2_a_fields):
-        yy, xx = np.mgrid[:cube.shape[1], :cube.shape[2]]
         regs = [regions.Regions.read(f'{basepath}/regions/sgramask.reg')[0],
                 regions.Regions.read(f'{basepath}/regions/sgrb2mask.reg')[0]]
-        exmask = np.zeros_like(xx)
-        for reg in regs:
-            exmask |= reg.to_pixel(cube.wcs.celestial).contains(regions.PixCoord(xx, yy))
-        cube = cube.with_mask(~exmask)
-
-    for operation in ('mean', 'max', 'median'):
-        out_fn = f'{specdir}/{basename}.{operation}spec.fits'
-        fits_exists = os.path.exists(out_fn)
-        print(f"{operation}: {fn}->{out_fn} Exists: {fits_exists}")
-
-        if overwrite or not fits_exists:
-            spec = getattr(cube, operation)(axis=(1, 2))
-            spec.write(out_fn, overwrite=overwrite)
+        exmask = region_exclusion_mask(regs, cube.wcs.celestial, cube.shape[1:])
+    else:
+        exmask = None
+
+    # compute every missing (or outdated) spectrum in a single read of the cube
+    out_fns = {operation: f'{specdir}/{basename}.{operation}spec.fits' for operation in operations}
+    fits_exists = {operation: os.path.exists(out_fn) for operation, out_fn in out_fns.items()}
+    todo = [operation for operation in operations
+            if overwrite or not fits_exists[operation]
+            or fits.getheader(out_fns[operation])['NAXIS1'] != cube.shape[0]]
+    if todo:
+        print(f"{'/'.join(todo)}: {fn} in one pass")
+        for operation, spec in block_spectra(cube, operations=todo, exmask=exmask,
+                                             spectral_block_size=spectral_block_size).items():
+            spec.write(out_fns[operation], overwrite=True)
+
+    for operation in operations:
+        out_fn = out_fns[operation]
+        print(f"{operation}: {fn}->{out_fn} Exists: {fits_exists[operation]}")
 
         spec_jy = OneDSpectrum.from_hdu(fits.open(out_fn)).with_spectral_unit(u.GHz)
-        if cube.shape[0] != spec_jy.size:
-            spec_jy = getattr(cube, operation)(axis=(1, 2))
-            spec_jy.write(out_fn, overwrite=True)
 
-        if fits_exists and not replot:
+        if fits_exists[operation] and not replot:
             continue
         try:
             jtok = cube.jtok_factors()
@@ -147,23 +210,19 @@ def main():
         pbar = ProgressBar()
         pbar.register()
 
-    gpath = 'data/2021.1.00172.L/science_goal.uid___A001_X1590_X30a8/group.uid___A001_X1590_X30a9'
+    from aces.analysis import continuum_selection_diagnostic_plots
 
-    #files = sorted(glob.glob(f'{basepath}/{gpath}/member*/calibrated/working/*.statcont.contsub.fits'))
-    files = sorted(glob.glob(f'{basepath}/{gpath}/member*/calibrated/working/*cube.I.iter1.image')
-                   + glob.glob(f'{basepath}/{gpath}/member*/calibrated/working/*cube.I.manual.image')
-                   + glob.glob(f'{basepath}/{gpath}/member*/calibrated/working/*cube.I.iter1.reclean.image')
-                   + glob.glob(f'{basepath}/{gpath}/member*/calibrated/working/*cube.I.manual.reclean.image')
-                  )
+    files = get_files()
 
     if os.getenv('SLURM_ARRAY_TASK_ID') is not None:
         slurm_array_task_id = int(os.getenv('SLURM_ARRAY_TASK_ID'))
     else:
         slurm_array_task_id = None
+    batch_size = get_batch_size()
 
     for ii, fn in enumerate(files):
-        # either if the task ID is specified and matches this one, or if it's unspecified
-        if slurm_array_task_id in (ii, None):
+        # either if the task ID is specified and matches this one's batch, or if it's unspecified
+        if slurm_array_task_id in (ii // batch_size, None):
             if slurm_array_task_id is not None:
                 print(ii, fn)
             make_diagnostic_spectra(fn)
@@ -179,18 +238,41 @@ def main():
             print()
 
 
+def get_files():
+    """
+    The cubes to make diagnostic spectra for, in a fixed order so that SLURM
+    array task IDs refer to the same files in every task
+    """
+    gpath = 'data/2021.1.00172.L/science_goal.uid___A001_X1590_X30a8/group.uid___A001_X1590_X30a9'
+
+    #files = sorted(glob.glob(f'{basepath}/{gpath}/member*/calibrated/working/*.statcont.contsub.fits'))
+    return sorted(glob.glob(f'{basepath}/{gpath}/member*/calibrated/working/*cube.I.iter1.image')
+                  + glob.glob(f'{basepath}/{gpath}/member*/calibrated/working/*cube.I.manual.image')
+                  + glob.glob(f'{basepath}/{gpath}/member*/calibrated/working/*cube.I.iter1.reclean.image')
+                  + glob.glob(f'{basepath}/{gpath}/member*/calibrated/working/*cube.I.manual.reclean.image')
+                  )
+
+
+def get_batch_size():
+    """
+    Number of cubes per SLURM array task, from DIAGSPEC_BATCH_SIZE (default 1)
+    """
+    return int(os.getenv('DIAGSPEC_BATCH_SIZE') or 1)
+
+
 def get_file_numbers():
     """
     For slurm jobs, just run through all the files that we're maybe going to make diagnostic spectra for and check which ones need it
+
+    Returns the array task IDs: the indices of the batches of
+    DIAGSPEC_BATCH_SIZE files (one file per batch by default) with any file
+    that needs spectra.
     """
 
     redo = bool(os.getenv('REDO'))
+    batch_size = get_batch_size()
 
-    filenames = sorted(glob.glob(f'{basepath}/data/2021.1.00172.L/science_goal.uid___A001_X1590_X30a8/group.uid___A001_X1590_X30a9/member.uid___A001_*/calibrated/working/*.cube.I.iter1.image')
-                       + glob.glob(f'{basepath}/data/2021.1.00172.L/science_goal.uid___A001_X1590_X30a8/group.uid___A001_X1590_X30a9/member.uid___A001_*/calibrated/working/*.cube.I.manual.image')
-                       + glob.glob(f'{basepath}/data/2021.1.00172.L/science_goal.uid___A001_X1590_X30a8/group.uid___A001_X1590_X30a9/member.uid___A001_*/calibrated/working/*.cube.I.iter1.reclean.image')
-                       + glob.glob(f'{basepath}/data/2021.1.00172.L/science_goal.uid___A001_X1590_X30a8/group.uid___A001_X1590_X30a9/member.uid___A001_*/calibrated/working/*.cube.I.manual.reclean.image')
-                      )
+    filenames = get_files()
 
     numlist = []
     for ii, fn in enumerate(filenames):
@@ -203,11 +285,11 @@ def get_file_numbers():
             raise ValueError("Unrecognized file type")
         basedir = os.path.dirname(fn)
         specdir = os.path.join(basedir, 'spectra')
-        for operation in ('max', 'mean', 'median'):
+        for operation in operations:
             out_fn = f'{specdir}/{basename}.{operation}spec.fits'
 
             if not os.path.exists(out_fn) or redo:
-                numlist.append(ii)
+                numlist.append(ii // batch_size)
 
     return sorted(set(numlist))
 
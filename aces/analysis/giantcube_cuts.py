@@ -1,9 +1,11 @@
 import numpy as np
 import time
+import warnings
 from spectral_cube import SpectralCube
 from spectral_cube import BooleanArrayMask
 import os
 from astropy.io import fits
+from astropy import stats
 from scipy import ndimage
 from radio_beam import Beam
 from astropy import units as u
@@ -19,7 +21,7 @@ import dafits
 from tqdm import tqdm
 
 from aces import conf
-from aces.imaging.make_mosaic import makepng
+from aces.imaging.make_mosaic import makepng, collapsed_projection
 
 basepath = conf.basepath
 
@@ -85,36 +87,54 @@ def get_prunemask_velo(mask, npix=1):
     return mask_
 
 
-def get_prunemask_space(mask, npix=10):
+def prune_planes(mask, npix=10):
+    """
+    Remove connected components with fewer than ``npix`` pixels from each
+    plane of a block of 2D masks (axis 0 indexes the planes).
+
+    The planes are labelled in one `ndimage.label` call with a structure
+    that does not connect neighboring planes, and the component sizes are
+    counted with one `np.bincount`, so the block is handled without a
+    Python-level loop over planes.  The labels are discarded; only the
+    boolean mask is returned.
+    """
+    struct = np.zeros((3, 3, 3), dtype=bool)
+    struct[1] = ndimage.generate_binary_structure(rank=2, connectivity=1)
+    labels, nlabels = ndimage.label(mask, structure=struct)
+    keep = np.bincount(labels.ravel(), minlength=nlabels + 1) >= npix
+    keep[0] = False
+    return keep[labels]
 
-    for kk in tqdm(range(mask.shape[0]), desc='Prunemask'):
 
-        mask_ = mask[kk, :, :]
-        ll, jj = ndimage.label(mask_)
-        counts = ndimage.histogram(ll, 1, jj + 1, jj)
-        good_inds = np.arange(1, jj + 1)[counts >= npix]
-        mask[kk, :, :] = np.isin(ll, good_inds)
+def prune_plane(mask_, npix=10):
+    """
+    Remove connected components with fewer than ``npix`` pixels from a 2D mask
+    """
+    return prune_planes(mask_[None], npix=npix)[0]
 
-    return mask
 
+def get_prunemask_space(mask, npix=10, spectral_block_size=16):
+    """
+    Remove connected components with fewer than ``npix`` pixels from each
+    channel of ``mask``, in place, ``spectral_block_size`` channels at a time
+    """
+    for kk in tqdm(range(0, mask.shape[0], spectral_block_size), desc='Prunemask'):
+        mask[kk:kk + spectral_block_size] = prune_planes(mask[kk:kk + spectral_block_size], npix=npix)
 
-def get_prunemask_space_dask(mask, npix=10):
+    return mask
 
-    masks = []
-    for kk in tqdm(range(mask.shape[0]), desc='Prunemask'):
 
-        mask_ = mask[kk, :, :]
-        ll, jj = ndmeasure.label(mask_)
-        jj = jj.compute()
-        if jj > 0:
-            counts = ndmeasure.histogram(ll, 1, jj + 1, jj)
-            # .compute is required here because the dask type is not interpreted as a boolean index array
-            good_inds = np.arange(1, jj + 1)[(counts >= npix).compute()]
-            masks.append(da.isin(ll, good_inds))
-        else:
-            masks.append(da.zeros_like(mask_))
+def get_prunemask_space_dask(mask, npix=10, spectral_block_size=16):
+    """
+    Lazy version of `get_prunemask_space` for dask arrays.
 
-    return da.stack(masks)
+    The mask is rechunked to blocks of ``spectral_block_size`` whole
+    channels (components can span spatial chunks) and `prune_planes` is
+    mapped over the blocks, so the whole mask is pruned in the single
+    compute of the returned array.
+    """
+    mask = mask.rechunk((spectral_block_size, -1, -1))
+    return mask.map_blocks(prune_planes, npix=npix, dtype=bool)
 
 
 def get_noedge_mask(cube, iterations=40):
@@ -195,6 +215,31 @@ def velocity_mask(cube, vmin_pos=-120*u.km/u.s, vmin_neg=-220*u.km/u.s, vmax_pos
     return mask[:, None, :]
 
 
+def velocity_mask_for(cube, molname):
+    """
+    Select the `velocity_mask` limits appropriate for each molecule
+    """
+    if molname in ('HC15N'):
+        print("Limiting vmin_pos to 0 km/s and vmin_neg to -100 km/s for HC15N")
+        vmask = velocity_mask(cube, vmin_pos=0 * u.km/u.s, vmin_neg=-100 * u.km/u.s)
+    elif molname in ('H13CO+', 'H13COp'):
+        print("Limiting vmin_pos to -50 km/s and vmin_neg to -150 km/s for H13CO+ == H13COp")
+        vmask = velocity_mask(cube, vmin_pos=-50 * u.km/u.s, vmin_neg=-150 * u.km/u.s)
+    elif molname in ('SO21', ):
+        print("Limiting vmax_pos to 150 km/s and vmax_neg to 50 km/s for SO21")
+        vmask = velocity_mask(cube, vmax_pos=150 * u.km/u.s, vmax_neg=50 * u.km/u.s)
+    elif molname in ('CH3CHO',):
+        print("Limiting vmax_pos to 300 km/s and vmax_neg to 200 km/s for CH3CHO")
+        vmask = velocity_mask(cube, vmax_pos=300 * u.km/u.s, vmax_neg=200 * u.km/u.s)
+    elif molname in ('CS21', 'CS'):
+        print("Limiting vmax_pos to 300 km/s and vmax_neg to 200 km/s and vmin_pos to -200 km/s and vmin_neg to -300 km/s for CS21 == CS")
+        vmask = velocity_mask(cube, vmax_pos=300 * u.km/u.s, vmax_neg=200 * u.km/u.s, vmin_pos=-200 * u.km/u.s, vmin_neg=-300 * u.km/u.s)
+    else:
+        vmask = velocity_mask(cube)
+
+    return vmask
+
+
 def do_pvs(cube, molname, mask=None, mompath=f'{basepath}/mosaics/cubes/moments//',
            howargs={}):
 
@@ -275,6 +320,109 @@ def do_pvs(cube, molname, mask=None, mompath=f'{basepath}/mosaics/cubes/moments/
             stretch='asinh', min_percent=1, max_percent=99.5)
 
 
+def fused_pv_stats(cube, masks, spectral_block_size=16, verbose=True):
+    """
+    Stream the cube once in blocks of ``spectral_block_size`` channels and
+    compute every position-velocity array of `do_pvs`: the max and mean along
+    each spatial axis, and the mean along each spatial axis within each of
+    ``masks``.
+
+    Every PV row comes from one channel, so each block fills its rows of all
+    of the arrays at once and nothing is carried between blocks.
+
+    Parameters
+    ----------
+    masks : dict
+        Mask name -> function ``(c0, c1, data)`` returning the boolean mask
+        for the channels ``c0:c1``, whose filled data are ``data``
+
+    Returns
+    -------
+    pvs : dict
+        Arrays keyed by (statistic, axis), with statistic 'max', 'mean', or
+        'mean_' + mask name
+    """
+    nchan, ny, nx = cube.shape
+    pvs = {}
+    for axis, size in ((1, nx), (2, ny)):
+        for stat in ['max', 'mean'] + [f'mean_{name}' for name in masks]:
+            pvs[(stat, axis)] = np.full((nchan, size), np.nan)
+
+    for c0 in tqdm(range(0, nchan, spectral_block_size), desc='Fused PVs (spectral blocks)', disable=not verbose):
+        c1 = min(c0 + spectral_block_size, nchan)
+        data = cube.filled_data[c0:c1].value
+        good = np.isfinite(data)
+        selections = {'': good}
+        with np.errstate(invalid='ignore'):
+            for name, get_mask in masks.items():
+                selections[f'_{name}'] = good & get_mask(c0, c1, data)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for axis in (1, 2):
+                pvs[('max', axis)][c0:c1] = np.nanmax(data, axis=axis)
+                for suffix, selection in selections.items():
+                    total = np.where(selection, data, 0).sum(axis=axis, dtype='float64')
+                    count = selection.sum(axis=axis)
+                    pvs[(f'mean{suffix}', axis)][c0:c1] = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+    return pvs
+
+
+def do_pvs_fused(cube, molname, mask=None, mompath=f'{basepath}/mosaics/cubes/moments//',
+                 spectral_block_size=16, verbose=True):
+    """
+    Write the same products as `do_pvs` from one streaming read of the cube
+    (`fused_pv_stats`) instead of eight.
+
+    ``mask`` may be a spectral-cube mask or a boolean array with the cube's
+    shape.
+    """
+    pvpath = os.path.join(mompath, 'pvs')
+    os.makedirs(f"{mompath}", exist_ok=True)
+
+    t0 = time.time()
+
+    if mask is None:
+        print("Loading noise map & calculating mask")
+        noise = fits.getdata(f"{mompath}/{molname}_CubeMosaic_noisemap.fits")
+
+        def get_mask(c0, c1, data):
+            return data > noise
+    else:
+        print("Using provided mask")
+
+        def get_mask(c0, c1, data):
+            if hasattr(mask, 'include'):
+                return mask.include(view=(slice(c0, c1), slice(None), slice(None)))
+            return np.asarray(mask[c0:c1])
+
+    # 2.5 sigma cut
+    noise_2p5 = fits.getdata(f"{mompath}/{molname}_CubeMosaic_dilated_2p5sig_mask.fits")
+
+    if verbose:
+        print(f"Fused PVs.  dt={time.time() - t0}", flush=True)
+    pvs = fused_pv_stats(cube, {'masked': get_mask,
+                                'masked_2p5': lambda c0, c1, data: data > noise_2p5},
+                         spectral_block_size=spectral_block_size, verbose=verbose)
+
+    for (stat, axis), name, pngname in ((('max', 1), 'PV_max', 'PV_max'),
+                                        (('mean', 1), 'PV_mean', 'PV_mean'),
+                                        (('max', 2), 'PV_b_max', 'PV_b_max'),
+                                        (('mean', 2), 'PV_b_mean', 'PV_b_mean'),
+                                        (('mean_masked', 1), 'PV_mean_masked', 'PV_mean_masked'),
+                                        (('mean_masked', 2), 'PV_b_mean_masked', 'PV_b_mean_masked'),
+                                        (('mean_masked_2p5', 1), 'PV_mean_masked_2p5', 'pv_mean_masked_2p5'),
+                                        (('mean_masked_2p5', 2), 'PV_b_mean_masked_2p5', 'PV_b_mean_masked_2p5')):
+        pv = collapsed_projection(cube, pvs[(stat, axis)], axis=axis)
+        pv.write(f"{pvpath}/{molname}_CubeMosaic_{name}.fits", overwrite=True)
+        makepng(data=pv.value, wcs=pv.wcs, imfn=f"{pvpath}/{molname}_CubeMosaic_{pngname}.png",
+                stretch='asinh', min_percent=1, max_percent=99.5)
+
+    if verbose:
+        print(f"Fused PVs done.  dt={time.time() - t0}", flush=True)
+
+
 def do_all_stats(cube, molname, mompath=f'{basepath}/mosaics/cubes/moments/',
                  howargs={}):
 
@@ -300,23 +448,7 @@ def do_all_stats(cube, molname, mompath=f'{basepath}/mosaics/cubes/moments/',
 
     print(f"Howargs: {howargs}.  Using vmask.")
 
-    if molname in ('HC15N'):
-        print("Limiting vmin_pos to 0 km/s and vmin_neg to -100 km/s for HC15N")
-        vmask = velocity_mask(cube, vmin_pos=0 * u.km/u.s, vmin_neg=-100 * u.km/u.s)
-    elif molname in ('H13CO+', 'H13COp'):
-        print("Limiting vmin_pos to -50 km/s and vmin_neg to -150 km/s for H13CO+ == H13COp")
-        vmask = velocity_mask(cube, vmin_pos=-50 * u.km/u.s, vmin_neg=-150 * u.km/u.s)
-    elif molname in ('SO21', ):
-        print("Limiting vmax_pos to 150 km/s and vmax_neg to 50 km/s for SO21")
-        vmask = velocity_mask(cube, vmax_pos=150 * u.km/u.s, vmax_neg=50 * u.km/u.s)
-    elif molname in ('CH3CHO',):
-        print("Limiting vmax_pos to 300 km/s and vmax_neg to 200 km/s for CH3CHO")
-        vmask = velocity_mask(cube, vmax_pos=300 * u.km/u.s, vmax_neg=200 * u.km/u.s)
-    elif molname in ('CS21', 'CS'):
-        print("Limiting vmax_pos to 300 km/s and vmax_neg to 200 km/s and vmin_pos to -200 km/s and vmin_neg to -300 km/s for CS21 == CS")
-        vmask = velocity_mask(cube, vmax_pos=300 * u.km/u.s, vmax_neg=200 * u.km/u.s, vmin_pos=-200 * u.km/u.s, vmin_neg=-300 * u.km/u.s)
-    else:
-        vmask = velocity_mask(cube)
+    vmask = velocity_mask_for(cube, molname)
     cube = cube.with_mask(vmask)
 
     print(f"max.  dt={time.time() - t0}", flush=True)
@@ -501,6 +633,300 @@ def do_all_stats(cube, molname, mompath=f'{basepath}/mosaics/cubes/moments/',
     return BooleanArrayMask(signal_mask_both, cube.wcs)
 
 
+def _noedge_structure():
+    struct = ndimage.generate_binary_structure(rank=3, connectivity=1)
+    struct[0, :, :] = False
+    struct[-1, :, :] = False
+    return struct
+
+
+def _iterative_madstd(data, noise, niter=2, threshold1=5, threshold2=3):
+    """
+    Numpy equivalent of `get_noise` applied to a block of spectra (axis 0)
+    """
+    for ii in range(niter):
+        threshold = threshold1 if ii == 0 else threshold2
+        data = np.where((data < threshold * noise) & (data > -threshold * noise), data, np.nan)
+        noise = stats.mad_std(data, axis=0, ignore_nan=True)
+    return noise
+
+
+def fused_pixel_stats(cube, spatial_block_size=512, noedge_iterations=40, verbose=True):
+    """
+    First pass of the fused reduction engine: stream the cube once in
+    spatial tiles (all channels of each tile at once) and compute every
+    per-pixel product of `do_all_stats` that does not depend on the noise map.
+
+    Each tile is read with a halo of ``noedge_iterations`` pixels so the edge
+    erosion in `get_noedge_mask` is exact in the tile interior.
+
+    Returns
+    -------
+    maps : dict
+        Plain arrays of max, argmax, mom0 (unscaled sum), madstd, noise,
+        edgelessmax, and edgelessmadstd with the cube's spatial shape
+    """
+    nchan, ny, nx = cube.shape
+    names = ('max', 'sum', 'madstd', 'noise', 'edgelessmax', 'edgelessmadstd')
+    maps = {name: np.full((ny, nx), np.nan) for name in names}
+    maps['argmax'] = np.zeros((ny, nx), dtype='int')
+    struct = _noedge_structure()
+    halo = noedge_iterations
+
+    tiles = [(y0, x0) for y0 in range(0, ny, spatial_block_size)
+             for x0 in range(0, nx, spatial_block_size)]
+    for y0, x0 in tqdm(tiles, desc='Fused pass 1 (spatial tiles)', disable=not verbose):
+        y1, x1 = min(y0 + spatial_block_size, ny), min(x0 + spatial_block_size, nx)
+        hy0, hx0 = max(y0 - halo, 0), max(x0 - halo, 0)
+        hy1, hx1 = min(y1 + halo, ny), min(x1 + halo, nx)
+        block = cube.filled_data[:, hy0:hy1, hx0:hx1].value
+        good = np.isfinite(block)
+        noedge = ndimage.binary_erosion(good, structure=struct, iterations=noedge_iterations)
+
+        inner = (slice(None), slice(y0 - hy0, y1 - hy0), slice(x0 - hx0, x1 - hx0))
+        block, good, noedge = block[inner], good[inner], noedge[inner]
+        out = (slice(y0, y1), slice(x0, x1))
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            maps['max'][out] = np.nanmax(block, axis=0)
+            maps['argmax'][out] = np.argmax(np.where(good, block, -np.inf), axis=0)
+            anygood = good.any(axis=0)
+            maps['sum'][out] = np.where(anygood, np.nansum(block, axis=0, dtype='float64'), np.nan)
+            madstd = stats.mad_std(block, axis=0, ignore_nan=True)
+            maps['madstd'][out] = madstd
+            maps['noise'][out] = _iterative_madstd(block, madstd)
+            block = np.where(noedge, block, np.nan)
+            maps['edgelessmax'][out] = np.nanmax(block, axis=0)
+            maps['edgelessmadstd'][out] = stats.mad_std(block, axis=0, ignore_nan=True)
+
+    return maps
+
+
+def fused_mask_stats(cube, noise, pruned_mask_out=None, spectral_block_size=16,
+                     noedge_iterations=40, dilation_iterations=10,
+                     threshold1=1.5, threshold2=7.0, verbose=True):
+    """
+    Second pass of the fused reduction engine: stream the cube once in
+    blocks of full channel planes and compute every product of
+    `do_all_stats` that depends on the noise map.
+
+    The high-to-low sigma dilation in `get_pruned_mask` can propagate
+    ``dilation_iterations`` channels, so each block needs that many neighbor
+    planes on either side.  Planes are kept in a rolling cache so that every
+    channel is still read only once.
+
+    Parameters
+    ----------
+    noise : array
+        The noise map from the first pass
+    pruned_mask_out : array-like, optional
+        Writeable array (e.g., a FITS memmap) with the cube's shape to receive
+        the pruned high-to-low sigma signal mask
+    dilation_iterations : int
+        Number of iterations for the binary dilation of the high sigma mask
+        into the low sigma mask.  Unlike the non-dask `get_pruned_mask`, this
+        must be finite.
+
+    Returns
+    -------
+    maps : dict
+        Unscaled moment sums, moment-1 sums, and dilated mask counts
+    spectra : dict
+        Per-channel max, mean, and mad_std of the cube and the
+        signal-masked cube
+    """
+    nchan, ny, nx = cube.shape
+    beam_area_pix = get_beam_area_pix(cube)
+    struct = _noedge_structure()
+    dilation_structure = np.ones([1, 3, 3])
+    spectral_axis = cube.spectral_axis.value
+    thresholds = {'1p0': 1.0, '2p5': 2.5, '5p0': 5.0}
+
+    maps = {'masked_sum': np.zeros((ny, nx)),
+            'masked_valid': np.zeros((ny, nx), dtype=bool),
+            'hlsig_sum': np.zeros((ny, nx)),
+            'hlsig_valid': np.zeros((ny, nx), dtype=bool),
+            'hlsig_vsum': np.zeros((ny, nx)),
+            }
+    for key in thresholds:
+        maps[f'dilated_{key}_sum'] = np.zeros((ny, nx))
+        maps[f'dilated_{key}_valid'] = np.zeros((ny, nx), dtype=bool)
+        maps[f'dilated_{key}_count'] = np.zeros((ny, nx), dtype='int')
+    spectra = {name: np.full(nchan, np.nan)
+               for name in ('hlsig_max', 'hlsig_mean', 'hlsig_std', 'max', 'mean', 'std')}
+
+    def valid_sum(key, data, mask):
+        maps[f'{key}_sum'] += np.nansum(np.where(mask, data, np.nan), axis=0, dtype='float64')
+        maps[f'{key}_valid'] |= (mask & np.isfinite(data)).any(axis=0)
+
+    # rolling cache of (data, pruned low-sigma mask, high-sigma mask) planes
+    cache = {}
+
+    for c0 in tqdm(range(0, nchan, spectral_block_size), desc='Fused pass 2 (spectral blocks)',
+                   disable=not verbose):
+        c1 = min(c0 + spectral_block_size, nchan)
+        h0, h1 = max(c0 - dilation_iterations, 0), min(c1 + dilation_iterations, nchan)
+        for key in [key for key in cache if key < h0]:
+            del cache[key]
+        missing = [ii for ii in range(h0, h1) if ii not in cache]
+        if missing:
+            planes = cube.filled_data[missing[0]:missing[-1] + 1].value
+            for ii, plane in zip(missing, planes):
+                with np.errstate(invalid='ignore'):
+                    cache[ii] = (plane,
+                                 prune_plane(plane > noise * threshold1, npix=beam_area_pix * 3),
+                                 plane > noise * threshold2)
+
+        lmask = np.array([cache[ii][1] for ii in range(h0, h1)])
+        hmask = np.array([cache[ii][2] for ii in range(h0, h1)])
+        both = ndimage.binary_dilation(hmask, iterations=dilation_iterations, mask=lmask)
+        core = slice(c0 - h0, c1 - h0)
+
+        data = np.array([cache[ii][0] for ii in range(c0, c1)])
+        good = np.isfinite(data)
+        noedge = ndimage.binary_erosion(good, structure=struct, iterations=noedge_iterations)
+        both = both[core] & noedge
+        if pruned_mask_out is not None:
+            pruned_mask_out[c0:c1] = both
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            with np.errstate(invalid='ignore'):
+                valid_sum('masked', data, data > noise)
+                valid_sum('hlsig', data, both)
+                maps['hlsig_vsum'] += np.nansum(np.where(both, data, np.nan)
+                                                * (spectral_axis[c0:c1, None, None] - spectral_axis[0]), axis=0,
+                                                dtype='float64')
+                for key, threshold in thresholds.items():
+                    dilated = ndimage.binary_dilation(data > noise * threshold, structure=dilation_structure,
+                                                      iterations=1)
+                    maps[f'dilated_{key}_count'] += dilated.sum(axis=0)
+                    valid_sum(f'dilated_{key}', data, dilated)
+
+            masked = np.where(both, data, np.nan).reshape(c1 - c0, -1)
+            flat = data.reshape(c1 - c0, -1)
+            for prefix, arr in (('hlsig_', masked), ('', flat)):
+                spectra[f'{prefix}max'][c0:c1] = np.nanmax(arr, axis=1)
+                spectra[f'{prefix}mean'][c0:c1] = np.nanmean(arr, axis=1)
+                spectra[f'{prefix}std'][c0:c1] = stats.mad_std(arr, axis=1, ignore_nan=True)
+
+    return maps, spectra
+
+
+def do_all_stats_fused(cube, molname, mompath=f'{basepath}/mosaics/cubes/moments/',
+                       spatial_block_size=512, spectral_block_size=16,
+                       noedge_iterations=40, dilation_iterations=10, verbose=True):
+    """
+    Compute the same products as `do_all_stats` with two streaming reads of
+    the cube instead of ~20.
+
+    The first pass (`fused_pixel_stats`) reads spatial tiles and produces the
+    per-pixel max, argmax/vpeak, mom0, mad_std, iterative noise, and edgeless
+    max and mad_std.  The second pass (`fused_mask_stats`) reads channel
+    blocks and produces everything that is thresholded on the noise map:
+    the pruned signal mask, the masked and dilated-mask moments, mom1, and the
+    spectra.
+
+    Returns
+    -------
+    signal_mask_both : `~spectral_cube.BooleanArrayMask`
+        The pruned signal mask, backed by a memmap of the file on disk
+    """
+    from astropy.wcs import WCSSUB_SPECTRAL
+    from spectral_cube.lower_dimensional_structures import Projection, OneDSpectrum
+    from aces.imaging.make_mosaic import create_fits_memmap
+
+    os.makedirs(f"{mompath}", exist_ok=True)
+    os.makedirs(f"{mompath}/spectra", exist_ok=True)
+
+    t0 = time.time()
+    cube = cube.with_mask(velocity_mask_for(cube, molname))
+    dv = cube._pix_size_slice(0)
+    spectral_axis = cube.spectral_axis
+    celestial_header = cube.wcs.celestial.to_header()
+    beamarg = {'beam': cube.beam} if hasattr(cube, 'beam') else {}
+
+    # build the outputs the same way SpectralCube's own reductions do
+    def proj(data, unit):
+        return Projection(data, unit=unit, wcs=cube.wcs.celestial, header=cube._nowcs_header)
+
+    def spec(data):
+        return OneDSpectrum(data, unit=cube.unit, wcs=cube.wcs.sub([WCSSUB_SPECTRAL]),
+                            header=cube._nowcs_header, spectral_unit=cube._spectral_unit, **beamarg)
+
+    def write_map(prj, name, **norm_kwargs):
+        prj.write(f"{mompath}/{molname}_CubeMosaic_{name}.fits", overwrite=True)
+        makepng(data=prj.value, wcs=prj.wcs, imfn=f"{mompath}/{molname}_CubeMosaic_{name}.png", **norm_kwargs)
+
+    if verbose:
+        print(f"Fused pass 1.  dt={time.time() - t0}", flush=True)
+    pixel_maps = fused_pixel_stats(cube, spatial_block_size=spatial_block_size,
+                                   noedge_iterations=noedge_iterations, verbose=verbose)
+    mom0_unit = cube.unit * spectral_axis.unit
+
+    write_map(proj(pixel_maps['max'], cube.unit), 'max', stretch='asinh', min_percent=0.1, max_percent=99.9)
+    write_map(proj(pixel_maps['madstd'], cube.unit), 'madstd', stretch='asinh', min_percent=0.5, max_percent=99.5)
+    noise = proj(pixel_maps['noise'], cube.unit)
+    write_map(noise, 'noisemap', stretch='asinh', min_percent=0.5, max_percent=99.5)
+    write_map(proj(pixel_maps['sum'] * dv, mom0_unit), 'mom0', stretch='asinh', vmin=-0.1, max_percent=99.5)
+    write_map(proj(pixel_maps['edgelessmax'], cube.unit), 'edgelessmax',
+              stretch='asinh', min_percent=0.1, max_percent=99.9)
+    write_map(proj(pixel_maps['edgelessmadstd'], cube.unit), 'edgelessmadstd',
+              stretch='asinh', min_percent=0.5, max_percent=99.5)
+
+    vmax = spectral_axis[pixel_maps['argmax']]
+    fits.PrimaryHDU(data=vmax.value, header=noise.header).writeto(f"{mompath}/{molname}_CubeMosaic_vpeak.fits", overwrite=True)
+    makepng(data=vmax.value, wcs=noise.wcs, imfn=f"{mompath}/{molname}_CubeMosaic_vpeak.png",
+            stretch='asinh', min_percent=0.1, max_percent=99.9)
+    del pixel_maps, vmax
+
+    if verbose:
+        print(f"Fused pass 2.  dt={time.time() - t0}", flush=True)
+    pruned_fn = f"{mompath}/{molname}_CubeMosaic_signal_mask_pruned.fits"
+    pruned_mask = create_fits_memmap(pruned_fn, cube.header, cube.shape, dtype='u1')
+    mask_maps, spectra = fused_mask_stats(cube, noise.value, pruned_mask_out=pruned_mask,
+                                          spectral_block_size=spectral_block_size,
+                                          noedge_iterations=noedge_iterations,
+                                          dilation_iterations=dilation_iterations,
+                                          verbose=verbose)
+    pruned_mask.flush()
+
+    def mom0_of(key):
+        return proj(np.where(mask_maps[f'{key}_valid'], mask_maps[f'{key}_sum'] * dv, np.nan), mom0_unit)
+
+    write_map(mom0_of('masked'), 'masked_mom0', stretch='asinh', vmin=-0.1, max_percent=99.5)
+
+    mom0 = mom0_of('hlsig')
+    mom0.write(f"{mompath}/{molname}_CubeMosaic_masked_hlsig_dilated_mom0.fits", overwrite=True)
+    makepng(data=mom0.value, wcs=mom0.wcs, imfn=f"{mompath}/{molname}_CubeMosaic_hlsig_dilated_masked_mom0.png",
+            stretch='asinh', vmin=-0.1, max_percent=99.5)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mom1 = proj(mask_maps['hlsig_vsum'] / mask_maps['hlsig_sum'] + spectral_axis.value[0], spectral_axis.unit)
+    mom1.write(f"{mompath}/{molname}_CubeMosaic_masked_hlsig_dilated_mom1.fits", overwrite=True)
+    makepng(data=mom1.value, wcs=mom0.wcs, imfn=f"{mompath}/{molname}_CubeMosaic_hlsig_dilated_masked_mom1.png",
+            stretch='linear', vmin=-0.1, max_percent=99.5, cmap=pl.cm.RdBu)
+
+    for name, key in (('masked_hlsig_dilated_maxspec', 'hlsig_max'),
+                      ('masked_hlsig_dilated_mean_spec', 'hlsig_mean'),
+                      ('masked_hlsig_dilated_stdspec', 'hlsig_std'),
+                      ('maxspec', 'max'),
+                      ('mean_spec', 'mean'),
+                      ('stdspec', 'std')):
+        spec(spectra[key]).write(f"{mompath}/spectra/{molname}_CubeMosaic_{name}.fits", overwrite=True)
+
+    for key, maskname in (('5p0', 'dilated_5p0sig_mask'), ('1p0', 'dilated_mask'), ('2p5', 'dilated_2p5sig_mask')):
+        fits.PrimaryHDU(data=mask_maps[f'dilated_{key}_count'],
+                        header=celestial_header).writeto(f"{mompath}/{molname}_CubeMosaic_{maskname}.fits", overwrite=True)
+        name = 'masked_dilated_mom0' if key == '1p0' else f'masked_{key}sig_dilated_mom0'
+        write_map(mom0_of(f'dilated_{key}'), name, stretch='asinh', vmin=-0.1, max_percent=99.5)
+
+    if verbose:
+        print(f"Fused stats done.  dt={time.time() - t0}", flush=True)
+
+    return BooleanArrayMask(pruned_mask.view(bool), cube.wcs)
+
+
 def main():
     dodask = os.getenv('USE_DASK')
     if dodask and dodask.lower() == 'false':
@@ -511,6 +937,9 @@ def main():
     do_pv = os.getenv('DO_PV')
     if do_pv and do_pv.lower() == 'false':
         do_pv = False
+    fused = os.getenv('FUSED_STATS')
+    if fused and fused.lower() == 'false':
+        fused = False
 
     if os.getenv('MOLNAME'):
         molname = os.getenv('MOLNAME')
@@ -518,11 +947,11 @@ def main():
         molname = 'CS21'
 
     print("Relevant environment variables: "
-          f"MOLNAME={os.getenv('MOLNAME')} USE_DASK={os.getenv('USE_DASK')} DOWNSAMPLE={os.getenv('DOWNSAMPLE')} DO_PV={os.getenv('DO_PV')}"
+          f"MOLNAME={os.getenv('MOLNAME')} USE_DASK={os.getenv('USE_DASK')} DOWNSAMPLE={os.getenv('DOWNSAMPLE')} DO_PV={os.getenv('DO_PV')} FUSED_STATS={os.getenv('FUSED_STATS')}"
           f"DASK_CLIENT={os.getenv('DASK_CLIENT')} SLURM_MEM_PER_NODE={os.getenv('SLURM_MEM_PER_NODE')} SLURM_NTASKS_PER_NODE={os.getenv('SLURM_NTASKS_PER_NODE')} SLURM_NTASKS={os.getenv('SLURM_NTASKS')} SLURM_STEP_NUM_TASKS={os.getenv('SLURM_STEP_NUM_TASKS')} SLURM_TASKS_PER_NODE={os.getenv('SLURM_TASKS_PER_NODE')}"
     )
 
-    print(f"giantcube_cuts main parameters: molname{molname} dodask={dodask} dods={dods} do_pv={do_pv}")
+    print(f"giantcube_cuts main parameters: molname{molname} dodask={dodask} dods={dods} do_pv={do_pv} fused={fused}")
 
     cubefilename = f'{cubepath}/{molname}_CubeMosaic_spectrally.fits'
     if not os.path.exists(cubefilename):
@@ -631,9 +1060,16 @@ def main():
             print(f"Dask client number of workers: {len(client.scheduler_info()['workers'])}")
             print(f"Using scheduler {scheduler}", flush=True)
 
-    signal_mask_both = do_all_stats(cube, molname=molname, howargs=howargs)
+    if fused:
+        # two streaming reads of the cube instead of one per statistic
+        signal_mask_both = do_all_stats_fused(cube, molname=molname)
+    else:
+        signal_mask_both = do_all_stats(cube, molname=molname, howargs=howargs)
 
-    if do_pv:
+    if do_pv and fused:
+        # one streaming read of the cube instead of one per PV diagram
+        do_pvs_fused(cube, molname=molname, mask=signal_mask_both)
+    elif do_pv:
         do_pvs(cube, molname=molname, howargs=howargs, mask=signal_mask_both)
 
     if dods:
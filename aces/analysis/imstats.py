@@ -394,7 +394,7 @@ def parse_fn(fn):
     sbname = mousmap_[muid]
     region = sbname.split("_")[3]
 
-    commands = get_commands(verbose=False)
+    commands = get_commands(verbose=False, readonly=True)
     robust = commands[sbname]['tclean_cont_pars']['aggregate']['robust']
 
     spwsplit = [x for x in split if 'spw' in x]
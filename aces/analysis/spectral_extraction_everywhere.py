@@ -1,6 +1,16 @@
+"""
+Extract the average spectrum of every continuum catalog source from every
+12m cube that covers it.
+
+The extraction is planned up front: each source is assigned to its field
+with the field number map and to every cube whose footprint contains it
+(using a KD-tree of source positions), then each cube is opened once and all
+of its sources are extracted in one pass over the channels.
+"""
 import regions
 import os
 import warnings
+import numpy as np
 from numpy import floor, ceil
 from astropy import coordinates
 from astropy import units as u
@@ -13,6 +23,9 @@ from astropy.coordinates import SkyCoord
 from astropy.wcs import WCS
 import reproject
 import scipy.ndimage
+from scipy.spatial import cKDTree
+from astropy.wcs import WCSSUB_SPECTRAL
+from spectral_cube.lower_dimensional_structures import OneDSpectrum
 
 from aces import conf
 basepath = conf.basepath
@@ -27,7 +40,7 @@ def extract_from_mask(cube, maskhdu, maskid):
     """
     """
     mask_match = maskhdu.data == maskid
-    obj_slc = scipy.ndimage.find_objects(mask_match)[0]
+    obj_slc = scipy.ndimage.find_objects(mask_match.astype(int))[0]
     mask_co = mask_match[obj_slc]
     mask_ww = WCS(maskhdu.header)[obj_slc]
 
@@ -43,93 +56,256 @@ def extract_from_mask(cube, maskhdu, maskid):
     return spec
 
 
-if __name__ == "__main__":
+def catalog_regions(catalog):
+    """
+    Make the ellipse region for each catalog row
+    """
+    centers = SkyCoord(catalog['GLON'], catalog['GLAT'], frame='galactic', unit=(u.deg, u.deg))
+    regs = [regions.EllipseSkyRegion(center,
+                                     width=row['major_sigma'] * u.arcsec,
+                                     height=row['minor_sigma'] * u.arcsec,
+                                     angle=row['position_angle'] * u.deg)
+            for center, row in zip(centers, catalog)]
+    return centers, regs
 
-    maskfile = fits.open(f"{basepath}/upload/Cont_catalog_stuff/ACES_leaf_mask_3_1_mp179.fits")
-    catalog = Table.read(f"{basepath}/upload/Cont_catalog_stuff/aces_catalog_3_1_mp179.fits")
 
-    product_dir = f"{basepath}/rawdata/2021.1.00172.L/science_goal.uid___A001_X1590_X30a8/group.uid___A001_X1590_X30a9/"
-    spectrum_dir = f"{basepath}/spectra"
+def _unit_vectors(coords):
+    return coords.galactic.cartesian.xyz.value.T
 
-    field_map = fits.open(f'{basepath}/mosaics/12m_continuum_field_number_map.fits')
-    fieldmapwcs = WCS(field_map[0].header)
-    fieldmapdata = field_map[0].data
 
-    uidtbl = Table.read(f'{basepath}/reduction_ACES/aces/data/tables/aces_SB_uids.csv')
+def plan_extraction(catalog, field_map, uidtbl, product_dir,
+                    cube_pattern='*Sgr_A_star*.cube.I.iter1.image.pbcor.fits',
+                    all_covering_fields=True):
+    """
+    Work out which catalog sources should be extracted from which cubes.
+
+    Each source is assigned to its field from the field number map.  The
+    cubes of every field are then matched to all of the sources inside
+    their footprint by querying a KD-tree of the source positions with the
+    cube's bounding circle and checking the footprint.
+
+    Parameters
+    ----------
+    catalog : `~astropy.table.Table`
+        The source catalog, with GLON/GLAT columns
+    field_map : `~astropy.io.fits.PrimaryHDU`
+        The field number map (values are 1 + the row in ``uidtbl``)
+    uidtbl : `~astropy.table.Table`
+        The table of SB uids
+    product_dir : str
+        The directory containing the ``member.uid___*`` directories
+    all_covering_fields : bool
+        If True, extract each source from every cube that covers it.  If
+        False, only use the cubes of the field the source is assigned to in
+        the field number map.
 
-    for row in catalog:
-        center = SkyCoord(row['GLON'], row['GLAT'], frame='galactic', unit=(u.deg, u.deg))
-        reg = regions.EllipseSkyRegion(center,
-                                       width=row['major_sigma'] * u.arcsec,
-                                       height=row['minor_sigma'] * u.arcsec,
-                                       angle=row['position_angle'] * u.deg)
+    Returns
+    -------
+    plan : dict
+        Mapping from cube filename to the list of catalog row numbers to
+        extract from it
+    """
+    centers, _ = catalog_regions(catalog)
+
+    # primary field of each source from the field number map
+    fieldmapwcs = WCS(field_map.header)
+    fieldmapdata = field_map.data
+    xpix, ypix = fieldmapwcs.world_to_pixel(centers)
+    xpix, ypix = np.asarray(xpix, dtype=int), np.asarray(ypix, dtype=int)
+    inbounds = (xpix >= 0) & (ypix >= 0) & (xpix < fieldmapdata.shape[1]) & (ypix < fieldmapdata.shape[0])
+    primary_field = np.zeros(len(catalog), dtype=int)
+    primary_field[inbounds] = fieldmapdata[ypix[inbounds], xpix[inbounds]]
 
-        pixcrd = list(map(lambda x: int(x), fieldmapwcs.world_to_pixel(center)))
-        field_id = fieldmapdata[pixcrd[1], pixcrd[0]]
+    tree = cKDTree(_unit_vectors(centers))
+
+    plan = {}
+    for field_id in np.unique(fieldmapdata):
         if field_id == 0:
-            #print(f"Skipped row {row}: out of bounds")
             continue
         mousid = uidtbl[field_id - 1]['12m MOUS ID']
-
-        # Can make this step more efficient by using the table to map from position to cube ID
-        # (right now this does a lot of extra looping & reading and is therefore pretty slow)
-        # basically use mosaics/12m_continuum_field_number_map.fits to load reduction_ACES/aces/data/tables/aces_SB_uids.csv
-        # to then load the appropriate folder
-        cubefns = glob.glob(f'{product_dir}/member.uid___A001_{mousid}/calibrated/working/*Sgr_A_star*.cube.I.iter1.image.pbcor.fits')
-        # print(row['index'], field_id, uidtbl[field_id]['12m MOUS ID'])
-        # print(cubefns)
-        # break
+        cubefns = sorted(glob.glob(f'{product_dir}/member.uid___A001_{mousid}/calibrated/working/{cube_pattern}'))
         for cubefn in cubefns:
+            if all_covering_fields:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    header = fits.getheader(cubefn)
+                    ww = WCS(header).celestial
+                nx, ny = header['NAXIS1'], header['NAXIS2']
+                ww._naxis = [nx, ny]
 
-            # there are two fns to check, but we're only checking the second
-            outfn = f"{spectrum_dir}/mp179_source{row['index']}_dendromaskaverage_" + cubefn.split("/")[-1]
+                # bounding circle of the cube footprint
+                corners = ww.pixel_to_world([-0.5, nx - 0.5, nx - 0.5, -0.5], [-0.5, -0.5, ny - 0.5, ny - 0.5])
+                center = ww.pixel_to_world((nx - 1) / 2, (ny - 1) / 2)
+                radius = corners.separation(center).max()
+                candidates = tree.query_ball_point(_unit_vectors(center),
+                                                   r=2 * np.sin(radius.to(u.rad).value / 2) * 1.0001)
+                candidates = np.array(sorted(candidates), dtype=int)
+                if len(candidates) > 0:
+                    candidates = candidates[ww.footprint_contains(centers[candidates])]
+            else:
+                candidates = np.flatnonzero(primary_field == field_id)
+            if len(candidates) > 0:
+                plan[cubefn] = list(candidates)
 
-            if not os.path.exists(outfn):
+    nassigned = len(set(np.concatenate([plan[key] for key in plan]))) if plan else 0
+    print(f"Planned extraction of {nassigned} of {len(catalog)} sources from {len(plan)} cubes "
+          f"({(primary_field > 0).sum()} sources are in the field map)")
+    return plan
 
-                with warnings.catch_warnings():
-                    warnings.simplefilter('ignore')
-                    cube = SpectralCube.read(cubefn)
-                    cube.allow_huge_operations = True  # suppress future warnings
-                    ww = cube.wcs.celestial
-                    ww._naxis = cube.shape[1:]
-
-                if ww.footprint_contains(center):
-                    scube = cube.subcube_from_regions([reg])
-                    print(row['index'], cubefn)
-                    avg = scube.mean(axis=(1, 2))
-                    hdu = avg.hdu
-
-                    y, x = scube.wcs.celestial.world_to_pixel(reg.center)
-                    slc = getslice()[int(floor(x)):int(ceil(x)), int(floor(y)):int(ceil(y)), :]
-                    ww = wcs_utils.slice_wcs(scube.wcs, slc, numpy_order=False)
-                    hdu.header.update(ww.to_header())
-                    hdu.data = hdu.data[:, None, None]
-                    hdu.header['CATINDX'] = row['index']
-                    hdu.header['CATGLON'] = row['GLON']
-                    hdu.header['CATGLAT'] = row['GLAT']
-                    hdu.header['CATMAJS'] = row['major_sigma']
-                    hdu.header['CATMINS'] = row['minor_sigma']
-                    hdu.header['CATPA'] = row['position_angle']
-
-                    outfn = f"{spectrum_dir}/mp179_source{row['index']}_ellipseaverage_" + cubefn.split("/")[-1]
-                    hdu.writeto(outfn, overwrite=True)
-
-                    try:
-                        spec = extract_from_mask(cube, maskfile[0], row['index'] + 1)
-                    except Exception as ex:
-                        print(f"Failed for cube {cubefn} for id {row['index']} with exception {ex}")
-                        continue
-                    hdu = spec.hdu
-                    hdu.header.update(ww.to_header())
-                    hdu.data = hdu.data[:, None, None]
-                    hdu.header['CATINDX'] = row['index']
-                    hdu.header['CATGLON'] = row['GLON']
-                    hdu.header['CATGLAT'] = row['GLAT']
-                    hdu.header['CATMAJS'] = row['major_sigma']
-                    hdu.header['CATMINS'] = row['minor_sigma']
-                    hdu.header['CATPA'] = row['position_angle']
-
-                    outfn = f"{spectrum_dir}/mp179_source{row['index']}_dendromaskaverage_" + cubefn.split("/")[-1]
-                    hdu.writeto(outfn, overwrite=True)
-                else:
-                    print('WTF?', row['index'], cubefn)
+
+def _mask_cutout_slices(cube_wcs, cube_shape, maskhdu, maskid):
+    """
+    Find the bounding box of a dendrogram mask in the pixel grid of a cube.
+
+    This is the same as the bounding box of the mask reprojected onto the
+    full cube (as in `extract_from_mask`) but only reprojects onto the
+    region around the mask.
+    """
+    mask_match = maskhdu.data == maskid
+    obj_slc = scipy.ndimage.find_objects(mask_match.astype(int))[0]
+    mask_co = mask_match[obj_slc]
+    mask_ww = WCS(maskhdu.header)[obj_slc]
+
+    # the corners of the mask cutout, one pixel beyond the edges to allow for interpolation
+    ny, nx = mask_co.shape
+    corner_x, corner_y = np.array([-1, nx, nx, -1]), np.array([-1, -1, ny, ny])
+    cx, cy = cube_wcs.world_to_pixel(mask_ww.pixel_to_world(corner_x, corner_y))
+    xlo, xhi = max(int(floor(np.min(cx))) - 1, 0), min(int(ceil(np.max(cx))) + 2, cube_shape[1])
+    ylo, yhi = max(int(floor(np.min(cy))) - 1, 0), min(int(ceil(np.max(cy))) + 2, cube_shape[0])
+    if xlo >= xhi or ylo >= yhi:
+        raise ValueError(f"Mask {maskid} does not overlap the cube")
+
+    mask_rep, _ = reproject.reproject_interp((mask_co, mask_ww),
+                                             cube_wcs[ylo:yhi, xlo:xhi],
+                                             shape_out=(yhi - ylo, xhi - xlo))
+    found = scipy.ndimage.find_objects((mask_rep > 0).astype(int))
+    if len(found) == 0:
+        raise ValueError(f"Mask {maskid} has no pixels in the cube")
+    yslc, xslc = found[0]
+    return (slice(yslc.start + ylo, yslc.stop + ylo),
+            slice(xslc.start + xlo, xslc.stop + xlo))
+
+
+def extract_sources_from_cube(cubefn, catalog, rows, maskhdu, spectrum_dir,
+                              channel_chunk=16, prefix='mp179'):
+    """
+    Extract the ellipse-average and dendrogram-mask-average spectra of many
+    sources from one cube, reading the cube once in chunks of channels.
+
+    The ellipse average is the mean within the catalog ellipse and the mask
+    average is the mean over the bounding box of the dendrogram mask, as
+    produced by ``subcube_from_regions`` and `extract_from_mask`.
+    """
+    basename = cubefn.split("/")[-1]
+    # there are two fns to check, but we're only checking the second
+    rows = [ii for ii in rows
+            if not os.path.exists(f"{spectrum_dir}/{prefix}_source{catalog[ii]['index']}_dendromaskaverage_{basename}")]
+    if len(rows) == 0:
+        return
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        cube = SpectralCube.read(cubefn)
+        cube.allow_huge_operations = True  # suppress future warnings
+    ww = cube.wcs.celestial
+    shape = cube.shape[1:]
+    centers, regs = catalog_regions(catalog[rows])
+
+    # per-source apertures in cube pixel coordinates
+    sources = []
+    for ii, center, reg in zip(rows, centers, regs):
+        row = catalog[ii]
+        mask = reg.to_pixel(ww).to_mask()
+        slcs_big, slcs_small = mask.get_overlap_slices(shape)
+        if slcs_big is None:
+            print(f"Skipped source {row['index']}: region is outside of cube {cubefn}")
+            continue
+        ellipse_mask = mask.data[slcs_small] > 0
+
+        try:
+            dendro_slcs = _mask_cutout_slices(ww, shape, maskhdu, row['index'] + 1)
+        except Exception as ex:
+            print(f"Failed for cube {cubefn} for id {row['index']} with exception {ex}")
+            dendro_slcs = None
+
+        # the single-pixel WCS of the output spectra is the cube pixel containing the source
+        xpix, ypix = np.round(ww.world_to_pixel(center)).astype(int)
+        slc = getslice()[xpix:xpix + 1, ypix:ypix + 1, :]
+        pixwcs = wcs_utils.slice_wcs(cube.wcs, slc, numpy_order=False)
+
+        sources.append({'row': row, 'ellipse_slcs': slcs_big, 'ellipse_mask': ellipse_mask,
+                        'dendro_slcs': dendro_slcs, 'wcs': pixwcs})
+    if len(sources) == 0:
+        return
+    print(f"Extracting {len(sources)} sources from {cubefn}")
+
+    # bounding box of all apertures, so only that part of each channel is read
+    allslcs = ([src['ellipse_slcs'] for src in sources] +
+               [src['dendro_slcs'] for src in sources if src['dendro_slcs'] is not None])
+    ylo, yhi = min(sl[0].start for sl in allslcs), max(sl[0].stop for sl in allslcs)
+    xlo, xhi = min(sl[1].start for sl in allslcs), max(sl[1].stop for sl in allslcs)
+
+    def local(slcs):
+        return (slice(None), slice(slcs[0].start - ylo, slcs[0].stop - ylo),
+                slice(slcs[1].start - xlo, slcs[1].stop - xlo))
+
+    nchan = cube.shape[0]
+    ellipse_spectra = np.full((len(sources), nchan), np.nan)
+    dendro_spectra = np.full((len(sources), nchan), np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for c0 in range(0, nchan, channel_chunk):
+            c1 = min(c0 + channel_chunk, nchan)
+            block = cube.filled_data[c0:c1, ylo:yhi, xlo:xhi].value
+            for jj, src in enumerate(sources):
+                ellipse_spectra[jj, c0:c1] = np.nanmean(block[local(src['ellipse_slcs'])][:, src['ellipse_mask']], axis=1)
+                if src['dendro_slcs'] is not None:
+                    dendro_spectra[jj, c0:c1] = np.nanmean(block[local(src['dendro_slcs'])], axis=(1, 2))
+
+    beamarg = {'beam': cube.beam} if hasattr(cube, 'beam') else {}
+
+    def spectrum_hdu(data, src):
+        spec = OneDSpectrum(data, unit=cube.unit, wcs=cube.wcs.sub([WCSSUB_SPECTRAL]),
+                            header=cube._nowcs_header, spectral_unit=cube._spectral_unit, **beamarg)
+        hdu = spec.hdu
+        hdu.header.update(src['wcs'].to_header())
+        hdu.data = hdu.data[:, None, None]
+        row = src['row']
+        hdu.header['CATINDX'] = row['index']
+        hdu.header['CATGLON'] = row['GLON']
+        hdu.header['CATGLAT'] = row['GLAT']
+        hdu.header['CATMAJS'] = row['major_sigma']
+        hdu.header['CATMINS'] = row['minor_sigma']
+        hdu.header['CATPA'] = row['position_angle']
+        return hdu
+
+    # write all of this cube's spectra together
+    for jj, src in enumerate(sources):
+        index = src['row']['index']
+        outfn = f"{spectrum_dir}/{prefix}_source{index}_ellipseaverage_{basename}"
+        spectrum_hdu(ellipse_spectra[jj], src).writeto(outfn, overwrite=True)
+        if src['dendro_slcs'] is not None:
+            outfn = f"{spectrum_dir}/{prefix}_source{index}_dendromaskaverage_{basename}"
+            spectrum_hdu(dendro_spectra[jj], src).writeto(outfn, overwrite=True)
+
+
+def main():
+
+    maskfile = fits.open(f"{basepath}/upload/Cont_catalog_stuff/ACES_leaf_mask_3_1_mp179.fits")
+    catalog = Table.read(f"{basepath}/upload/Cont_catalog_stuff/aces_catalog_3_1_mp179.fits")
+
+    product_dir = f"{basepath}/rawdata/2021.1.00172.L/science_goal.uid___A001_X1590_X30a8/group.uid___A001_X1590_X30a9/"
+    spectrum_dir = f"{basepath}/spectra"
+
+    field_map = fits.open(f'{basepath}/mosaics/continuum/12m_continuum_reimaged_field_number_map.fits')
+
+    uidtbl = Table.read(f'{basepath}/reduction_ACES/aces/data/tables/aces_SB_uids.csv')
+
+    plan = plan_extraction(catalog, field_map[0], uidtbl, product_dir)
+
+    for cubefn, rows in plan.items():
+        extract_sources_from_cube(cubefn, catalog, rows, maskfile[0], spectrum_dir)
+
+
+if __name__ == "__main__":
+    main()
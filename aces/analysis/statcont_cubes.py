@@ -14,17 +14,17 @@ We should eventually allow multi-cube combination using full statcont abilities
 """
 import time
 import shutil
+import numpy as np
 import warnings
 from astropy.table import Table
 from spectral_cube import SpectralCube
 import spectral_cube
 from spectral_cube.utils import NoBeamError
+from spectral_cube.cube_utils import beams_to_bintable
 from astropy.io import fits
 import dask
 from tqdm.auto import tqdm
 
-from statcont.cont_finding import c_sigmaclip_scube
-
 import glob
 
 import tempfile
@@ -33,7 +33,7 @@ import os
 import sys
 
 from aces import conf
-from aces.imaging.make_mosaic import makepng
+from aces.imaging.make_mosaic import makepng, validate_fits_file, create_fits_memmap
 
 basepath = conf.basepath
 
@@ -55,21 +55,24 @@ def get_size(start_path='.'):
 
 
 def check_fits_file(fn, remove=False, verbose=True):
-    with warnings.catch_warnings(record=True) as ww:
-        warnings.simplefilter('always')
-        if os.path.exists(fn):
-            if verbose:
-                print(f"Checking {fn} for warnings")
-            try:
-                fits.open(fn)
-            except OSError:
-                print(f"Removing broken file {fn}")
+    """
+    Remove ``fn`` if it is broken or truncated (when ``remove``).
+
+    This uses `aces.imaging.make_mosaic.validate_fits_file`, which compares
+    the file size to the header and samples a few blocks of the data, so the
+    cube is not read.
+    """
+    if os.path.exists(fn):
+        if verbose:
+            print(f"Checking {fn} for truncation")
+        verdict = validate_fits_file(fn)
+        if verdict['reason'] in ('broken', 'truncated'):
+            if verbose or remove:
+                print(f"{'Removing' if remove else 'Found'} {verdict['reason']} file {fn} "
+                      f"(size={verdict['size']}, expected={verdict['expected_size']})")
+            if remove:
                 os.remove(fn)
-            for wi in ww:
-                if "File may have been truncated" in str(wi.message):
-                    print(f"Removing truncated file {fn}")
-                    os.remove(fn)
-                    break
+        return verdict
 
 
 def check_cube(fn, zero_threshold=0, remove=False):
@@ -84,6 +87,86 @@ def check_cube(fn, zero_threshold=0, remove=False):
             os.remove(fn)
 
 
+def write_statcont_maps(cont, noise, header, outfn, noisefn):
+    """
+    Write the statcont continuum and noise maps, with the 2D ``header`` of
+    their cube
+    """
+    print(f"Writing to FITS {outfn}", flush=True)
+    fits.PrimaryHDU(data=cont, header=header).writeto(outfn, overwrite=True)
+
+    print(f"Writing noise to FITS {noisefn}", flush=True)
+    fits.PrimaryHDU(data=noise, header=header).writeto(noisefn, overwrite=True)
+
+
+def write_contsub_cube(fn, cont, outfn, slices=None, header=None, beams=None, target_bytes=2**28,
+                       verbose=True):
+    """
+    Write the continuum-subtracted cube ``fn - cont`` to ``outfn`` in one
+    sequential pass over the memmapped input.
+
+    The output is pre-sized with `aces.imaging.make_mosaic.create_fits_memmap`
+    and filled in blocks of whole channels of about ``target_bytes``, so only
+    one block is in memory at a time.
+
+    Parameters
+    ----------
+    fn : str
+        The input FITS cube.  Leading degenerate (e.g., Stokes) axes are dropped.
+    cont : `~numpy.ndarray`
+        The 2D continuum image, matching the spatial shape of ``fn[slices]``
+    slices : tuple or None
+        Subcube slices of the input, e.g. from
+        `~spectral_cube.SpectralCube.subcube_slices_from_mask`
+    header : `~astropy.io.fits.Header` or None
+        The output header; defaults to the input header
+    beams : `radio_beam.Beams` or None
+        The beams of the channels of ``fn[slices]`` of a multi-beam cube,
+        written to a BEAMS table after the data as `SpectralCube.write`
+        would
+
+    Returns
+    -------
+    throughput : float
+        The read + write throughput in MB/s
+    """
+    t0 = time.time()
+    with fits.open(fn, memmap=True) as hdul:
+        data = hdul[0].data
+        while data.ndim > 3 and data.shape[0] == 1:
+            data = data[0]
+        if slices is not None:
+            data = data[tuple(slices)]
+        if header is None:
+            header = hdul[0].header
+        if data.shape[1:] != cont.shape:
+            raise ValueError(f"The continuum shape {cont.shape} does not match the cube shape {data.shape}")
+
+        output = create_fits_memmap(outfn, header, data.shape, dtype='>f4')
+        plane_bytes = data.shape[1] * data.shape[2] * data.dtype.itemsize
+        channels_per_block = max(target_bytes // plane_bytes, 1)
+        blocks = range(0, data.shape[0], channels_per_block)
+        for c0 in (tqdm(blocks, desc='Contsub blocks') if verbose else blocks):
+            c1 = min(c0 + channels_per_block, data.shape[0])
+            output[c0:c1] = data[c0:c1] - cont
+        output.flush()
+        del output
+
+    if beams is not None:
+        if len(beams) != data.shape[0]:
+            raise ValueError(f"There are {len(beams)} beams for {data.shape[0]} channels")
+        beamhdu = beams_to_bintable(beams)
+        fits.append(outfn, beamhdu.data, header=beamhdu.header)
+
+    elapsed = time.time() - t0
+    nbytes = data.size * (data.dtype.itemsize + 4)
+    throughput = nbytes / 1024**2 / elapsed
+    if verbose:
+        print(f"Wrote {outfn}: {nbytes / 1024**2:0.1f} MB read+written in {elapsed:0.1f}s "
+              f"({throughput:0.1f} MB/s)", flush=True)
+    return throughput
+
+
 def get_file_numbers(progressbar=tqdm):
     """
     For slurm jobs, just run through all the files that we're maybe going to statcont and check which ones need it
@@ -120,6 +203,8 @@ def get_file_numbers(progressbar=tqdm):
 
 
 def main():
+    from statcont.cont_finding import c_sigmaclip_scube
+
     # need to be in main block for dask to work
     #from dask.distributed import Client
     #if os.getenv('SLURM_MEM_PER_NODE'):
@@ -234,18 +319,10 @@ def main():
                     data_to_write = result[1].compute()
                     cont = data_to_write.value
 
-                    print(f"Writing to FITS {outfn}", flush=True)
-                    fits.PrimaryHDU(data=cont,
-                                    header=cube[0].header).writeto(outfn,
-                                                                   overwrite=True)
-
                     noise_to_write = result[2]
                     noise = noise_to_write.value
 
-                    print(f"Writing noise to FITS {noisefn}", flush=True)
-                    fits.PrimaryHDU(data=noise,
-                                    header=cube[0].header).writeto(noisefn,
-                                                                   overwrite=True)
+                    write_statcont_maps(cont, noise, cube[0].header, outfn, noisefn)
             print(f"{fn} -> {outfn} in {time.time() - t0}s", flush=True)
         else:
             try:
@@ -288,16 +365,16 @@ def main():
                 cube = SpectralCube.read(fn,
                                          target_chunk_size=target_chunk_size,
                                          use_dask=True, format=fileformat)
-                cube.allow_huge_operations = True
+                slices = None
                 if cube.shape[1] != cont.shape[0] or cube.shape[2] != cont.shape[1]:
                     print(f"Minimizing {cube}", flush=True)
                     with warnings.catch_warnings():
                         warnings.simplefilter("ignore")
-                        cube = cube.minimal_subcube()
-                    cube.allow_huge_operations = True
+                        slices = cube.subcube_slices_from_mask(cube.mask)
+                        cube = cube[slices]
 
-                scube = cube - cont * cube.unit
-                scube.write(outcube, overwrite=True)
+                beams = cube.unmasked_beams if hasattr(cube, 'unmasked_beams') else None
+                write_contsub_cube(fn, cont, outcube, slices=slices, header=cube.header, beams=beams)
             else:
                 print(f"Found existing cube {outcube} and redo=False")
         else:
@@ -1,11 +1,19 @@
 import glob
+import json
 import os
 from astropy import log
 from aces.retrieval_scripts.mous_map import get_mous_to_sb_mapping
 from aces import conf
+from aces.hipergator_scripts.inventory import Inventory
 import time
 import datetime
 
+# seconds for which a status grid written by an earlier run is reused
+status_grid_max_age = 900
+
+# in-process copy of the status grid: (path, mtime, grid)
+_status_grid = None
+
 
 def get_mousmap_(**kwargs):
     mousmap = get_mous_to_sb_mapping('2021.1.00172.L', **kwargs)
@@ -18,11 +26,43 @@ def wildexists(x):
     return len(glob.glob(x)) > 0
 
 
-def main():
-    t0 = time.time()
-    cwd = os.getcwd()
-    basepath = conf.basepath
-    os.chdir(basepath)
+def image_status(inventory, mous, spw, clean, tts=''):
+    """
+    Determine the imaging status of one MOUS/spw/clean type from the inventory.
+
+    The first of the iter1/manual/reclean variants with any products
+    (preferring pipeline-stage-named images) is the one reported.
+    """
+    status = {'image': False, 'pbcor': False, 'psf': False, 'WIP': False}
+    for stage in ('s*_0', ''):
+        for iter_or_manual in ('iter1', 'manual', 'iter1.reclean', 'manual.reclean', 'iter2.reclean'):
+            image = inventory.exists(mous, spw, clean, f'{iter_or_manual}.image{tts}', stage=stage)
+            pbcor = inventory.exists(mous, spw, clean, f'{iter_or_manual}.image{tts}.pbcor', stage=stage)
+            psf = inventory.exists(mous, spw, clean, f'{iter_or_manual}.psf{tts}', stage=stage)
+            if image or pbcor or psf:
+                return {'image': image, 'pbcor': pbcor, 'psf': psf,
+                        'WIP': ("Done" if pbcor
+                                else "WIPim" if image
+                                else "WIPpsf")}
+    return status
+
+
+def status_grid_path(basepath=None):
+    basepath = conf.basepath if basepath is None else basepath
+    return f'{basepath}/reduction_ACES/aces/data/tables/imaging_completeness_grid.json'
+
+
+def compute_status_grid(inventory=None, basepath=None):
+    """
+    Crawl the working directories of every MOUS and determine the imaging
+    status of each config, spw, and image type.
+
+    Returns
+    -------
+    datatable : dict
+        {mous: {config: {spw: {imtype: {'field', 'image', 'pbcor', 'psf', 'WIP'}}}}}
+    """
+    basepath = conf.basepath if basepath is None else basepath
 
     datatable = {}
 
@@ -32,7 +72,7 @@ def main():
                'TP': [16, 18, 20, 22, 24, 26],
                }
 
-    datapath = dataroot = f'{basepath}/data/2021.1.00172.L'
+    datapath = f'{basepath}/data/2021.1.00172.L'
     # workpath = '/blue/adamginsburg/adamginsburg/ACES/workdir/'
 
     looplist = glob.glob(f"{datapath}/sci*/group*/member*/")
@@ -44,6 +84,12 @@ def main():
 
     assert len(mousmap_) > 0
 
+    # one scandir per changed working directory instead of a glob per product
+    if inventory is None:
+        inventory = Inventory(datapath=datapath)
+    inventory.refresh(directories=[os.path.join(x, 'calibrated', 'working') for x in looplist],
+                      verbose=True)
+
     for fullpath in looplist:
         log.info(f'Working on {fullpath}')
         mous = os.path.basename(fullpath.strip('/')).split(".")[-1]
@@ -70,7 +116,6 @@ def main():
         if ' ' in config:
             # handle this case: 'Sgr_A_st_aj_03_7M Sgr_A_st_aj_03_7M_original'
             config = config.split(" ")[0]
-        rerun = 'original' in sbname
 
         if 'updated' in sbname:
             field = field + "_updated"
@@ -113,33 +158,10 @@ def main():
                     else:
                         clean_ = clean
 
-                    for stepglob in ("s*_0.", ""):
-                        for scidot in ('sci.', 'sci'):
-                            for spwtxt in ('spw', ''):
-                                bn = f'{mous}.{stepglob}Sgr_A_star_{scidot}{spw}.{clean_}.I'.replace('spw', spwtxt)
-                                workingpath = f'{fullpath}/calibrated/working/'
-
-                                tts = '.tt0' if 'aggregate' in spwkey else ''
-
-                                for iter_or_manual in ('iter1', 'manual', 'iter1.reclean', 'manual.reclean', 'iter2.reclean'):
-                                    imageglob = f'{workingpath}/{bn}.{iter_or_manual}.image{tts}'
-                                    pbcorglob = f'{workingpath}/{bn}.{iter_or_manual}.image{tts}.pbcor'
-                                    psfglob = f'{workingpath}/{bn}.{iter_or_manual}.psf{tts}'
-
-                                    exists = (wildexists(pbcorglob) or
-                                              ("WIPim" if wildexists(imageglob)
-                                              else "WIPpsf" if wildexists(psfglob)
-                                              else False))
-                                    if exists:
-                                        break
-                                if exists:
-                                    break
-                            if exists:
-                                break
-                        if exists:
-                            break
+                    tts = '.tt0' if 'aggregate' in spwkey else ''
+                    status = image_status(inventory, mous, spw, clean_, tts)
                     if 'X184' in mous:
-                        print(mous, bn, exists)
+                        print(mous, spw, clean_, status)
 
                     if mous not in datatable:
                         datatable[mous] = {}
@@ -150,20 +172,22 @@ def main():
                     if clean not in datatable[mous][config][spwkey]:
                         datatable[mous][config][spwkey][clean] = {}
 
-                    datatable[mous][config][spwkey][clean] = {
-                        "field": field,
-                        "image": wildexists(imageglob),
-                        "pbcor": wildexists(pbcorglob),
-                        "psf": wildexists(psfglob),
-                        "WIP": ("Done" if wildexists(pbcorglob)
-                                else "WIPim" if wildexists(imageglob)
-                                else "WIPpsf" if wildexists(psfglob)
-                                else False)
-                    }
-
-    import json
-    with open(f'{basepath}/reduction_ACES/aces/data/tables/imaging_completeness_grid.json', 'w') as fh:
+                    datatable[mous][config][spwkey][clean] = dict(field=field, **status)
+
+    return datatable
+
+
+def write_status_grid(datatable, basepath=None):
+    """
+    Write the status grid as JSON (read by `status_grid` and `job_runner`)
+    and as human-readable tables
+    """
+    basepath = conf.basepath if basepath is None else basepath
+    jsonfile = status_grid_path(basepath)
+    # write to a temporary file first so readers never see a partial grid
+    with open(jsonfile + '.tmp', 'w') as fh:
         json.dump(datatable, fh)
+    os.replace(jsonfile + '.tmp', jsonfile)
 
     # make a table
     from astropy.table import Table
@@ -189,11 +213,34 @@ def main():
             fh.write("\n".join(tb.pformat()))
             fh.write("\n\n")
 
-    os.chdir(cwd)
+
+def status_grid(max_age=status_grid_max_age, refresh=False, inventory=None):
+    """
+    Get the imaging status grid (see `compute_status_grid`), recomputing it
+    only if the copy on disk is older than ``max_age`` seconds or if
+    ``refresh`` is set.
+    """
+    global _status_grid
+    jsonfile = status_grid_path()
+    mtime = os.path.getmtime(jsonfile) if os.path.exists(jsonfile) else None
+    if not refresh and mtime is not None and time.time() - mtime < max_age:
+        if _status_grid is None or _status_grid[:2] != (jsonfile, mtime):
+            with open(jsonfile, 'r') as fh:
+                _status_grid = (jsonfile, mtime, json.load(fh))
+        return _status_grid[2]
+
+    datatable = compute_status_grid(inventory=inventory)
+    write_status_grid(datatable)
+    _status_grid = (jsonfile, os.path.getmtime(jsonfile), datatable)
+    return datatable
+
+
+def main(inventory=None):
+    t0 = time.time()
+
+    datatable = status_grid(refresh=True, inventory=inventory)
 
     t1 = time.time()
     print(f"delivery_status took {t1 - t0} seconds = {(t1 - t0) / 60} minutes = {(t1 - t0) / 3600} hours")
 
-    # Hack for debugging
-    globals().update(locals())
-    return locals()
+    return datatable
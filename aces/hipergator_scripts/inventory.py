@@ -0,0 +1,241 @@
+"""
+An SQLite index of the contents of every ``member.uid___*/calibrated/working``
+directory.
+
+Each working directory is listed once with `os.scandir` and its entries are
+stored along with the MOUS, spw, image type, and suffix parsed from the CASA
+image names.  On later refreshes, only directories whose mtime has changed are
+re-listed, so existence questions (e.g., "is there a pbcor image for this MOUS,
+spw, and image type?") become indexed lookups instead of a glob over
+``/orange``.
+
+Example::
+
+    inventory = Inventory()
+    inventory.refresh()
+    inventory.exists('uid___A001_X15a0_Xae', '26', 'cube', 'iter1.image.pbcor')
+"""
+import os
+import re
+import glob
+import sqlite3
+import time
+
+from astropy import log
+
+from aces import conf
+
+
+# e.g.:
+# uid___A001_X15a0_Xae.s9_0.Sgr_A_star_sci.spw26.cube.I.iter1.image.pbcor
+# uid___A001_X15a0_Xae.Sgr_A_star_sci.spw25_27_29_31_33_35.cont.I.manual.image.tt0
+# uid___A001_X15a0_Xae.s9_0.Sgr_A_star_sci26.mfs.I.iter1.psf
+image_name_re = re.compile(r'^(?P<mous>uid___[A-Za-z0-9]+_[A-Za-z0-9]+_[A-Za-z0-9]+)\.'
+                           r'(?:(?P<stage>s\d+_\d+)\.)?'
+                           r'Sgr_A_star_sci\.?(?:spw)?(?P<spw>\d+(?:_\d+)*)\.'
+                           r'(?P<imtype>cube|mfs|cont)\.I\.'
+                           r'(?P<suffix>.+)$')
+
+default_dbpath = os.path.join(conf.workpath, 'working_inventory.sqlite')
+default_datapath = f'{conf.basepath}/data/2021.1.00172.L'
+
+schema = """
+CREATE TABLE IF NOT EXISTS directories (
+    directory TEXT PRIMARY KEY,
+    mous TEXT,
+    mtime REAL,
+    scanned REAL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    directory TEXT,
+    name TEXT,
+    mous TEXT,
+    stage TEXT,
+    spw TEXT,
+    imtype TEXT,
+    suffix TEXT,
+    mtime REAL,
+    PRIMARY KEY (directory, name)
+);
+CREATE INDEX IF NOT EXISTS entries_lookup ON entries (mous, spw, imtype, suffix);
+"""
+
+
+def parse_image_name(name):
+    """
+    Parse a CASA image name into its MOUS, stage, spw, imtype, and suffix.
+
+    Returns None for names that are not ACES pipeline images.  The stage is
+    '' for names without a pipeline stage and the spw has no 'spw' prefix.
+    """
+    match = image_name_re.match(name)
+    if match is None:
+        return None
+    parsed = match.groupdict()
+    parsed['stage'] = parsed['stage'] or ''
+    return parsed
+
+
+def normalize_path(path):
+    """
+    The form in which directories are stored in and looked up from the
+    index: absolute and normalized
+    """
+    return os.path.normpath(os.path.abspath(path))
+
+
+def working_directory_mous(directory):
+    """
+    Get the MOUS name (e.g., uid___A001_X15a0_Xae) from a path containing
+    ``member.uid___*``
+    """
+    for part in os.path.normpath(directory).split(os.sep)[::-1]:
+        if part.startswith('member.'):
+            return part.split(".")[-1]
+
+
+class Inventory:
+    """
+    Indexed listing of the pipeline working directories.
+
+    Parameters
+    ----------
+    dbpath : str
+        Location of the SQLite index.  Use ':memory:' for a throwaway index.
+    datapath : str
+        The project directory containing ``science_goal*/group*/member*``
+    """
+
+    def __init__(self, dbpath=default_dbpath, datapath=default_datapath):
+        self.dbpath = dbpath
+        self.datapath = datapath
+        self.connection = sqlite3.connect(dbpath)
+        self.connection.executescript(schema)
+
+    def close(self):
+        self.connection.close()
+
+    def working_directories(self):
+        return sorted(normalize_path(x)
+                      for x in glob.glob(f"{self.datapath}/sci*/group*/member*/calibrated/working"))
+
+    def refresh(self, directories=None, verbose=False):
+        """
+        Re-list any working directory whose mtime differs from the indexed one.
+
+        Returns the number of directories that were re-listed.
+        """
+        t0 = time.time()
+        if directories is None:
+            directories = self.working_directories()
+        known = dict(self.connection.execute("SELECT directory, mtime FROM directories"))
+
+        nscanned = 0
+        for directory in directories:
+            directory = normalize_path(directory)
+            try:
+                mtime = os.stat(directory).st_mtime
+            except FileNotFoundError:
+                self._forget(directory)
+                continue
+            if known.get(directory) == mtime:
+                continue
+            self._scan(directory, mtime)
+            nscanned += 1
+
+        # forget directories that have disappeared since the last refresh
+        for directory in set(known) - set(map(normalize_path, directories)):
+            if not os.path.exists(directory):
+                self._forget(directory)
+
+        self.connection.commit()
+        if verbose:
+            log.info(f"Inventory refresh re-listed {nscanned} of {len(directories)} directories "
+                     f"in {time.time() - t0:0.1f} s")
+        return nscanned
+
+    def _forget(self, directory):
+        self.connection.execute("DELETE FROM entries WHERE directory = ?", (directory,))
+        self.connection.execute("DELETE FROM directories WHERE directory = ?", (directory,))
+
+    def _scan(self, directory, mtime):
+        mous = working_directory_mous(directory)
+        rows = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                parsed = parse_image_name(entry.name) or {}
+                try:
+                    entry_mtime = entry.stat(follow_symlinks=False).st_mtime
+                except FileNotFoundError:
+                    continue
+                rows.append((directory, entry.name, parsed.get('mous', mous),
+                             parsed.get('stage'), parsed.get('spw'), parsed.get('imtype'),
+                             parsed.get('suffix'), entry_mtime))
+        self.connection.execute("DELETE FROM entries WHERE directory = ?", (directory,))
+        self.connection.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.connection.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?)",
+                                (directory, mous, mtime, time.time()))
+
+    def is_indexed(self, directory):
+        return self.connection.execute("SELECT 1 FROM directories WHERE directory = ?",
+                                       (normalize_path(directory),)).fetchone() is not None
+
+    def exists(self, mous, spw, imtype, suffix, stage=None):
+        """
+        Check whether an image exists.
+
+        Parameters
+        ----------
+        mous : str
+            e.g., 'uid___A001_X15a0_Xae'
+        spw : str or int
+            e.g., 26, 'spw26', or 'spw25_27_29_31_33_35'
+        imtype : str
+            'cube', 'mfs', or 'cont'
+        suffix : str
+            Everything after '.I.', e.g., 'iter1.image.tt0.pbcor'
+        stage : str or None
+            A glob for the pipeline stage (e.g., 's*_0'), '' to require
+            no stage, or None to accept any stage
+        """
+        spw = str(spw).replace('spw', '')
+        query = "SELECT 1 FROM entries WHERE mous = ? AND spw = ? AND imtype = ? AND suffix = ?"
+        args = [mous, spw, imtype, suffix]
+        if stage is not None:
+            query += " AND stage GLOB ?" if stage else " AND stage = ''"
+            if stage:
+                args.append(stage)
+        return self.connection.execute(query + " LIMIT 1", args).fetchone() is not None
+
+    def glob(self, pattern):
+        """
+        Glob for entries, e.g.
+        ``inventory.glob(f'{calwork}/tclean_cube_pars_*_spw25.py')``, using
+        the index if the directory is indexed and the filesystem otherwise.
+
+        Only the basename may contain wildcards.
+        """
+        directory, name = os.path.split(normalize_path(pattern))
+        if not self.is_indexed(directory):
+            return sorted(glob.glob(pattern))
+        rows = self.connection.execute("SELECT name FROM entries WHERE directory = ? AND name GLOB ? ORDER BY name",
+                                       (directory, name))
+        return [os.path.join(directory, row[0]) for row in rows]
+
+    def path_exists(self, path):
+        """
+        `os.path.exists` that uses the index if the parent directory is
+        indexed and falls back to the filesystem otherwise
+        """
+        directory, name = os.path.split(normalize_path(path))
+        if self.is_indexed(directory):
+            return self.connection.execute("SELECT 1 FROM entries WHERE directory = ? AND name = ?",
+                                           (directory, name)).fetchone() is not None
+        return os.path.exists(path)
+
+
+def main():
+    inventory = Inventory()
+    nscanned = inventory.refresh(verbose=True)
+    nentries = inventory.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+    print(f"Inventory {inventory.dbpath}: re-listed {nscanned} directories; {nentries} entries indexed")
@@ -1,62 +1,66 @@
-import numpy as np
 import os
-import json
 import copy
 import glob
 import shutil
 import subprocess
 import datetime
-from astropy.io import ascii
 import sys
 from astropy import log
-from aces.retrieval_scripts.mous_map import get_mous_to_sb_mapping
-from aces.imaging.parallel_tclean import parallel_clean_slurm
-from aces.pipeline_scripts.merge_tclean_commands import get_commands
-from aces.hipergator_scripts.delivery_status import main as delivery_status
+from aces.hipergator_scripts.inventory import Inventory
+from aces.hipergator_scripts.slurm_accounting import AccountingCache
 from aces import conf
 
-# run delivery_status before anything else because we use it to decide which jobs to start
-# in late 2024, the daemon running delivery_status died permanently
-delivery_status()
-print("Delivery status complete")
+# this module is imported by tests and other tools, so nothing here may touch
+# the filesystem or import anything slow; that all happens in main()
 
-basepath = conf.basepath
-datapath = f"{basepath}/data"
-grouppath = f"{datapath}/2021.1.00172.L/science_goal.uid___A001_X1590_X30a8/group.uid___A001_X1590_X30a9"
-
-mouses = [os.path.basename(x)
-          for x in
-          glob.glob(f'{grouppath}/member.uid___A001_X15*_X*')]
+projcode = '2021.1.00172.L'
+group_subpath = "science_goal.uid___A001_X1590_X30a8/group.uid___A001_X1590_X30a9"
 
 # the memory/ntask overrides were important before we switched to full-parallel mode
 # they should never have been used for continuum
-parameters = {#'member.uid___A001_X15a0_Xea': {'mem': 128, 'ntasks': 32, 'mpi': True, },  # the usual MPI crash error is occurring
-              'member.uid___A001_X15a0_X142': {'mem': 128, 'ntasks': 1, 'mpi': False, },  # ditto
-              'member.uid___A001_X15a0_Xca': {'mem': 128, 'ntasks': 1, 'mpi': False, },  # field ag: MPI crash
-              'member.uid___A001_X15a0_X160': {'mem': 128, 'ntasks': 1, 'mpi': False, },
-              'member.uid___A001_X15a0_X1a2': {'mem': 256, 'ntasks': 1, 'mpi': False, },  # field ar: timeout
-              'member.uid___A001_X15a0_X1a8': {'mem': 256, 'ntasks': 1, 'mpi': False, },  # write lock frozen spw33 OOMs; try MPI?.  MPI write-locks everything.
-              #'member.uid___A001_X15a0_Xa6': {'mem': 256, 'ntasks': 64, 'mpi': True, },  # spw33 is taking for-ev-er; try MPI?  created backup first: backup_20221108_beforempi/
-              #'member.uid___A001_X15a0_X190': {'mem': 256, 'ntasks': 1, 'mpi': False,
-              #                                 'jobtime': '200:00:00', 'burst': False},  # ao: same as above, too long.  But, MPI fails with writelock. NON-MPI also fails!?
-              #'member.uid___A001_X15a0_X14e': {'mem': 256, 'ntasks': 64, 'mpi': True, },  # ad: same as above, too long
-              'member.uid___A001_X15a0_Xd0': {'mem': 256, 'ntasks': 1, 'mpi': False, },  # field i spw35: timeout
-              'member.uid___A001_X15a0_X17e': {'mem': 256, 'ntasks': 1, 'mpi': False, 'nchan_per': 16},  # field al: try to avoid having subcubes
-              'member.uid___A001_X15a0_X166': {'mem': 128, 'ntasks': 1, 'mpi': False, 'nchan_per': 16},  # field ah: dramatically increase splitting
+parameter_overrides = {#'member.uid___A001_X15a0_Xea': {'mem': 128, 'ntasks': 32, 'mpi': True, },  # the usual MPI crash error is occurring
+                       'member.uid___A001_X15a0_X142': {'mem': 128, 'ntasks': 1, 'mpi': False, },  # ditto
+                       'member.uid___A001_X15a0_Xca': {'mem': 128, 'ntasks': 1, 'mpi': False, },  # field ag: MPI crash
+                       'member.uid___A001_X15a0_X160': {'mem': 128, 'ntasks': 1, 'mpi': False, },
+                       'member.uid___A001_X15a0_X1a2': {'mem': 256, 'ntasks': 1, 'mpi': False, },  # field ar: timeout
+                       'member.uid___A001_X15a0_X1a8': {'mem': 256, 'ntasks': 1, 'mpi': False, },  # write lock frozen spw33 OOMs; try MPI?.  MPI write-locks everything.
+                       #'member.uid___A001_X15a0_Xa6': {'mem': 256, 'ntasks': 64, 'mpi': True, },  # spw33 is taking for-ev-er; try MPI?  created backup first: backup_20221108_beforempi/
+                       #'member.uid___A001_X15a0_X190': {'mem': 256, 'ntasks': 1, 'mpi': False,
+                       #                                 'jobtime': '200:00:00', 'burst': False},  # ao: same as above, too long.  But, MPI fails with writelock. NON-MPI also fails!?
+                       #'member.uid___A001_X15a0_X14e': {'mem': 256, 'ntasks': 64, 'mpi': True, },  # ad: same as above, too long
+                       'member.uid___A001_X15a0_Xd0': {'mem': 256, 'ntasks': 1, 'mpi': False, },  # field i spw35: timeout
+                       'member.uid___A001_X15a0_X17e': {'mem': 256, 'ntasks': 1, 'mpi': False, 'nchan_per': 16},  # field al: try to avoid having subcubes
+                       'member.uid___A001_X15a0_X166': {'mem': 128, 'ntasks': 1, 'mpi': False, 'nchan_per': 16},  # field ah: dramatically increase splitting
 }
-newpars = parameters.copy()
 
-# June 1, 2022: try using fewer tasks to see if it reduces likelihood of race condition
-# Idea based on CASA log: try using nprocs/2 + 1 MPI services
-# July 14, 2022: the failure rate is ~1, so let's just say 'f it'
-default_parameters = {f'{os.path.basename(mous.strip("/"))}':
-                      {'mem': 128, 'ntasks': 1, 'mpi': False, }
-                      for mous in mouses}
 
-for key in newpars:
-    default_parameters[key] = newpars[key]
+def get_grouppath(basepath=None):
+    basepath = conf.basepath if basepath is None else basepath
+    return f"{basepath}/data/{projcode}/{group_subpath}"
+
+
+def get_parameters(grouppath=None):
+    """
+    Get the imaging parameters (mem, ntasks, mpi, ...) for every downloaded
+    MOUS, with `parameter_overrides` applied
+    """
+    grouppath = get_grouppath() if grouppath is None else grouppath
+    mouses = [os.path.basename(x)
+              for x in
+              glob.glob(f'{grouppath}/member.uid___A001_X15*_X*')]
+
+    # June 1, 2022: try using fewer tasks to see if it reduces likelihood of race condition
+    # Idea based on CASA log: try using nprocs/2 + 1 MPI services
+    # July 14, 2022: the failure rate is ~1, so let's just say 'f it'
+    parameters = {f'{os.path.basename(mous.strip("/"))}':
+                  {'mem': 128, 'ntasks': 1, 'mpi': False, }
+                  for mous in mouses}
 
-parameters = default_parameters
+    for key in parameter_overrides:
+        # copy so that popping 'burst' etc. in main() doesn't modify the overrides
+        parameters[key] = parameter_overrides[key].copy()
+
+    return parameters
 
 
 def main():
@@ -73,8 +77,22 @@ def main():
     if debug:
         log.setLevel('DEBUG')
 
-    with open(f'{basepath}/reduction_ACES/aces/data/tables/imaging_completeness_grid.json', 'r') as fh:
-        imaging_status = json.load(fh)
+    # imported here because they are slow to import
+    from aces.retrieval_scripts.mous_map import get_mous_to_sb_mapping
+    from aces.imaging.parallel_tclean import parallel_clean_slurm
+    from aces.pipeline_scripts.merge_tclean_commands import get_commands
+    from aces.hipergator_scripts.delivery_status import status_grid
+
+    basepath = conf.basepath
+    grouppath = get_grouppath(basepath)
+    parameters = get_parameters(grouppath)
+
+    # the delivery status decides which jobs to start.  In late 2024, the
+    # daemon that refreshed it died permanently, so it is refreshed here if it
+    # is older than DELIVERY_STATUS_MAX_AGE seconds (or on --refresh-status)
+    max_age = float(os.getenv('DELIVERY_STATUS_MAX_AGE') or 900)
+    imaging_status = status_grid(max_age=max_age, refresh='--refresh-status' in sys.argv)
+    print("Delivery status complete")
 
     datadir = os.getenv('BASEPATH') or f'{conf.basepath}/data/'
 
@@ -85,9 +103,10 @@ def main():
     mousmap = get_mous_to_sb_mapping(projcode)
     mousmap_ = {key.replace("/", "_").replace(":", "_"): val for key, val in mousmap.items()}
 
-    sacct = subprocess.check_output(['/opt/slurm/bin/sacct',
-                                     '--format=JobID,JobName%45,Account%15,QOS%17,State,Priority%8,ReqMem%8,CPUTime%15,Elapsed%15,Timelimit%15,NodeList%20'])
-    tbl = ascii.read(sacct.decode().split("\n"))
+    # only jobs active since midnight count, as with a plain `sacct` call
+    accounting = AccountingCache()
+    accounting.poll()
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
 
     scriptpath = f'{basepath}/reduction_ACES/aces/hipergator_scripts/'
 
@@ -103,6 +122,10 @@ def main():
 
     commands = get_commands()
 
+    # the tclean scripts live in the working directories, which are indexed
+    inventory = Inventory()
+    inventory.refresh()
+
     for mous, spwpars in parameters.items():
         mousname = mous.split('.')[1]
 
@@ -176,9 +199,9 @@ def main():
                     scriptname = f'{calwork}/tclean_{cleantype}_pars_Sgr_A_st_{field}_03_{config}_{spwname}.py'
                     scriptname_glob = f'{calwork}/tclean_{cleantype}_pars_Sgr_A_st_{field}*_03_{config}*_{spwname}.py'
                     if (imtype == 'mfs' and 'aggregate' in spw) or imtype == 'cube':
-                        if not os.path.exists(scriptname):
-                            if any(glob.glob(scriptname_glob)):
-                                scriptname = glob.glob(scriptname_glob)[0]
+                        if not inventory.path_exists(scriptname):
+                            if any(inventory.glob(scriptname_glob)):
+                                scriptname = inventory.glob(scriptname_glob)[0]
                             else:
                                 if '7M' in scriptname and imtype != 'cube':
                                     # April 22, 2023: I don't think I ever made aggregate high scripts
@@ -233,33 +256,32 @@ def main():
                     # workdir = "SLURM_TMPDIR"
                     jobname = f"{field}_{config}_{spw}_{imtype}"
 
-                    match = np.array([jobname in x for x in tbl['JobName']])
-                    if any(match):
-                        states = np.unique(tbl['State'][match])
+                    states = accounting.states(field, config, spw, imtype, since=today)
+                    if states:
                         if 'RUNNING' in states:
-                            jobid = tbl['JobID'][match & (tbl['State'] == 'RUNNING')]
+                            jobid = states['RUNNING']
                             log.debug(f"Skipped job {jobname} because it's RUNNING as {set(jobid)}")
                             continue
                         elif 'PENDING' in states:
-                            jobid = tbl['JobID'][match & (tbl['State'] == 'PENDING')]
+                            jobid = states['PENDING']
                             print(f"Skipped job {jobname} because it's PENDING as {set(jobid)}")
                             continue
                         elif 'COMPLETED' in states:
-                            jobid = tbl['JobID'][match & (tbl['State'] == 'COMPLETED')]
+                            jobid = states['COMPLETED']
                             if '--redo-completed' in sys.argv:
                                 print(f"Redoing job {jobname} even though it's COMPLETED as {set(jobid)} (if it is not pending)")
                             else:
                                 print(f"Skipped job {jobname} because it's COMPLETED as {set(jobid)}")
                                 continue
                         elif 'FAILED' in states:
-                            jobid = tbl['JobID'][match & (tbl['State'] == 'FAILED')]
+                            jobid = states['FAILED']
                             if '--redo-failed' in sys.argv:
                                 print(f"Redoing job {jobname} even though it's FAILED as {set(jobid)}")
                             else:
                                 print(f"Skipped job {jobname} because it's FAILED as {set(jobid)}")
                                 continue
                         elif 'TIMEOUT' in states:
-                            jobid = tbl['JobID'][match & (tbl['State'] == 'TIMEOUT')]
+                            jobid = states['TIMEOUT']
                             print(f"Restarting job {jobname} because it TIMED OUT as {set(jobid)}")
 
                     # handle specific parameters
@@ -3,6 +3,10 @@ filenames=${basepath}/data/2021.1.00172.L/science_goal.uid___A001_X1590_X30a8/gr
 nfiles=$(ls -1d ${basepath}/data/2021.1.00172.L/science_goal.uid___A001_X1590_X30a8/group.uid___A001_X1590_X30a9/member.uid___A001_*/calibrated/working/*cube.I.iter1.image | wc -l)
 echo "Working on ${nfiles} files"
 
+# each array task makes the spectra for DIAGSPEC_BATCH_SIZE cubes
+export DIAGSPEC_BATCH_SIZE=${DIAGSPEC_BATCH_SIZE:-1}
+echo "Batch size is ${DIAGSPEC_BATCH_SIZE}"
+
 flist=$(/blue/adamginsburg/adamginsburg/miniconda3/envs/python310/bin/python -c "from aces.analysis.diagnostic_spectra import get_file_numbers; rslt=get_file_numbers(); print(','.join(map(str,rslt)))" | tail -1)
 echo "Sub-list is $flist"
 
@@ -0,0 +1,225 @@
+"""
+A cache of SLURM accounting records for the imaging jobs, indexed by job name.
+
+`job_runner` names its jobs ``{field}_{config}_{spw}_{imtype}`` (with
+``_split``, ``_arr``, or ``_merge`` appended for the parallel-clean stages).
+`AccountingCache` polls ``sacct`` incrementally, starting from the time of the
+previous poll, stores the records in SQLite so that later runs only fetch what
+changed, and keeps an in-memory index from the parsed name to the jobs, so
+that checking on a job is a dict lookup instead of a scan of every job name.
+
+Example::
+
+    accounting = AccountingCache()
+    accounting.poll()
+    accounting.states('ag', 'TM1', '25', 'cube')
+    # {'RUNNING': ['12345_3', ...], 'COMPLETED': [...]}
+
+The poller is swappable; `ReplayPoller` replays recorded ``sacct`` output
+for tests.
+"""
+import os
+import re
+import sqlite3
+import datetime
+import subprocess
+
+from aces import conf
+
+
+default_dbpath = os.path.join(conf.workpath, 'slurm_accounting.sqlite')
+
+sacct_fields = ('JobID', 'JobName', 'State', 'End')
+
+jobname_re = re.compile(r'^(?P<field>[A-Za-z0-9]+)_(?P<config>7M|TM1|TP)_(?P<spw>.+)_(?P<imtype>cube|mfs)'
+                        r'(?:_(?P<stage>split|arr|merge))?$')
+
+time_format = '%Y-%m-%dT%H:%M:%S'
+
+# re-fetch a little before the previous poll in case the clocks disagree
+poll_overlap = datetime.timedelta(minutes=5)
+
+schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    jobid TEXT PRIMARY KEY,
+    jobname TEXT,
+    field TEXT,
+    config TEXT,
+    spw TEXT,
+    imtype TEXT,
+    stage TEXT,
+    state TEXT,
+    active_until TEXT,
+    ended INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_lookup ON jobs (field, config, spw, imtype);
+CREATE TABLE IF NOT EXISTS polls (
+    polled TEXT
+);
+"""
+
+
+def parse_jobname(jobname):
+    """
+    Parse a job name into (field, config, spw, imtype, stage).
+
+    Returns None for job names that are not imaging jobs, including job
+    steps such as 'batch' and 'extern'.  The stage is '' for the main job.
+    """
+    match = jobname_re.match(jobname)
+    if match is None:
+        return None
+    return (match['field'], match['config'], match['spw'], match['imtype'], match['stage'] or '')
+
+
+def parse_sacct(text):
+    """
+    Parse ``sacct --parsable2 --noheader --format=JobID,JobName,State,End``
+    output into (jobid, jobname, state, end) tuples.  States like
+    'CANCELLED by 123' are reduced to their first word and the end is None
+    for jobs that have not ended.
+    """
+    rows = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        jobid, jobname, state, end = line.split('|')[:len(sacct_fields)]
+        state = state.split()[0] if state.strip() else ''
+        end = None if end in ('', 'Unknown', 'None') else end
+        rows.append((jobid, jobname, state, end))
+    return rows
+
+
+class SacctPoller:
+    """
+    Run ``sacct`` for the current user's jobs active since ``starttime``
+    (or since midnight, sacct's default, if ``starttime`` is None)
+    """
+
+    def __init__(self, sacct='/opt/slurm/bin/sacct'):
+        self.sacct = sacct
+
+    def __call__(self, starttime=None):
+        cmd = [self.sacct, '--parsable2', '--noheader', f'--format={",".join(sacct_fields)}']
+        if starttime is not None:
+            cmd.append(f'--starttime={starttime}')
+        return subprocess.check_output(cmd).decode()
+
+
+class ReplayPoller:
+    """
+    Stand-in for `SacctPoller` that returns recorded ``sacct`` outputs in
+    order, repeating the last one, and records the requested start times
+    """
+
+    def __init__(self, outputs):
+        self.outputs = list(outputs)
+        self.starttimes = []
+
+    def __call__(self, starttime=None):
+        self.starttimes.append(starttime)
+        return self.outputs[min(len(self.starttimes), len(self.outputs)) - 1]
+
+
+class AccountingCache:
+    """
+    Indexed SLURM accounting records for the imaging jobs.
+
+    Parameters
+    ----------
+    dbpath : str
+        Location of the SQLite cache.  Use ':memory:' for a throwaway cache.
+    poller : callable
+        ``poller(starttime)`` returns ``sacct`` output in the format of
+        `SacctPoller`
+    """
+
+    def __init__(self, dbpath=default_dbpath, poller=None):
+        self.dbpath = dbpath
+        self.poller = SacctPoller() if poller is None else poller
+        self.connection = sqlite3.connect(dbpath)
+        self.connection.executescript(schema)
+        self._load_index()
+
+    def close(self):
+        self.connection.close()
+
+    def last_poll(self):
+        row = self.connection.execute("SELECT MAX(polled) FROM polls").fetchone()
+        return None if row[0] is None else datetime.datetime.strptime(row[0], time_format)
+
+    def poll(self, now=None):
+        """
+        Fetch the records of jobs active since the previous poll (or since
+        midnight, on the first poll) and update the index.
+
+        Returns the number of records fetched.
+        """
+        now = datetime.datetime.now() if now is None else now
+        last = self.last_poll()
+        starttime = None if last is None else (last - poll_overlap).strftime(time_format)
+        rows = parse_sacct(self.poller(starttime))
+
+        records = []
+        for jobid, jobname, state, end in rows:
+            parsed = parse_jobname(jobname)
+            if parsed is None:
+                continue
+            # jobs that have not ended are active at least until now
+            records.append((jobid, jobname, *parsed, state, end or now.strftime(time_format), end is not None))
+
+        # sacct lists every job that is still pending or running, so any
+        # unfinished job missing from this poll has been replaced (e.g., a
+        # pending array 123_[0-9] that has started as 123_0 ... 123_9)
+        self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS fetched (jobid TEXT PRIMARY KEY)")
+        self.connection.execute("DELETE FROM fetched")
+        self.connection.executemany("INSERT OR IGNORE INTO fetched VALUES (?)", [(row[0],) for row in records])
+        self.connection.execute("DELETE FROM jobs WHERE NOT ended AND jobid NOT IN (SELECT jobid FROM fetched)")
+
+        self.connection.executemany("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+        self.connection.execute("DELETE FROM polls")
+        self.connection.execute("INSERT INTO polls VALUES (?)", (now.strftime(time_format),))
+        self.connection.commit()
+
+        self._load_index()
+        return len(rows)
+
+    def _load_index(self):
+        self.index = {}
+        self.jobkeys = {}
+        for jobid, field, config, spw, imtype, state, active_until in self.connection.execute(
+                "SELECT jobid, field, config, spw, imtype, state, active_until FROM jobs"):
+            self._index_job(jobid, (field, config, spw, imtype), state, active_until)
+
+    def _index_job(self, jobid, key, state, active_until):
+        self.jobkeys[jobid] = key
+        self.index.setdefault(key, {})[jobid] = (state, active_until)
+
+    def jobs(self, field, config, spw, imtype, since=None):
+        """
+        All jobs (including parallel-clean stages) for one imaging target as
+        {jobid: state}.
+
+        If ``since`` is given, only jobs that were active at or after that
+        time are included, like ``sacct --starttime``.
+        """
+        since = None if since is None else since.strftime(time_format)
+        return {jobid: state
+                for jobid, (state, active_until) in self.index.get((field, config, str(spw), imtype), {}).items()
+                if since is None or active_until >= since}
+
+    def states(self, field, config, spw, imtype, since=None):
+        """
+        The jobs for one imaging target grouped by state, as {state: [jobid, ...]}
+        """
+        states = {}
+        for jobid, state in sorted(self.jobs(field, config, spw, imtype, since=since).items()):
+            states.setdefault(state, []).append(jobid)
+        return states
+
+
+def main():
+    accounting = AccountingCache()
+    nfetched = accounting.poll()
+    print(f"Accounting cache {accounting.dbpath}: fetched {nfetched} records; "
+          f"{len(accounting.jobkeys)} imaging jobs indexed")
@@ -0,0 +1,18 @@
+
+# all registered lines (aces/imaging/line_registry.py); each array task makes
+# its share of the channels of every spw, loading each spw's cubes once
+jobid=$(sbatch --job-name=aces_lines_mos_arr \
+    --output=/red/adamginsburg/ACES/logs/aces_lines_mosaic_%j_%A_%a.log  \
+    --array=0-49 \
+    --account=astronomy-dept --qos=astronomy-dept-b \
+    --ntasks=8 --nodes=1 --mem=64gb --time=96:00:00 --parsable \
+    --wrap "/red/adamginsburg/miniconda3/envs/python312/bin/aces_mosaic_12m_cubes")
+
+echo "Job IDs are ${jobid}"
+
+sbatch --job-name=aces_lines_mosaic_merge \
+    --output=/red/adamginsburg/ACES/logs/aces_lines_mosaic_merge_%j.log  \
+    --dependency=afterok:$jobid \
+    --account=astronomy-dept --qos=astronomy-dept-b \
+    --ntasks=8 --nodes=1 --mem=32gb --time=96:00:00 \
+    --wrap "/red/adamginsburg/miniconda3/envs/python312/bin/aces_mosaic_12m_cubes --combine-only"
@@ -0,0 +1,182 @@
+"""
+Registry of the giant line cubes mosaicked from the feathered 12m+7m+TP cubes.
+
+Rest frequencies and spectral windows come from
+``aces/data/tables/linelist.csv``.  `spw_defaults` holds the velocity grid,
+beam threshold, and downsampling of each 12m spectral window, and
+`mosaic_lines` names the lines to mosaic (by their ``Line`` entry in the
+table) along with any per-line overrides.
+
+All lines in one spectral window are mosaicked from the same feathered cubes,
+so `line_tasks` groups them into tasks that load those cubes once and make
+every line from them, and the tasks of all spectral windows are run by one
+executor (`aces.utils.tasks.run_tasks`) or split across the
+tasks of a SLURM array (`slurm_line_tasks`).
+
+Example::
+
+    entries = line_registry(lines=['CS21', 'H40a'])
+    tasks = line_tasks(entries, nchunks=4)
+"""
+import os
+import glob
+
+import numpy as np
+from astropy import units as u
+from astropy.table import Table
+
+from aces import conf
+from aces.imaging.make_mosaic import make_giant_mosaic_cube_header
+
+basepath = conf.basepath
+
+default_linelist = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'tables', 'linelist.csv')
+
+feather_directory = f'{basepath}/upload/Feather_12m_7m_TP'
+
+# feathered cubes of each 12m spectral window, relative to feather_directory
+feathered_cube_patterns = {
+    25: 'SPW25/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_25.image.statcont.contsub.fits',
+    27: 'SPW27/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_27.image.statcont.contsub.fits',
+    29: 'SPW29/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.hco+10.image.statcont.contsub.fits',
+    31: 'SPW31/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.hnco43.image.statcont.contsub.fits',
+    33: 'SPW33/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_33.image.statcont.contsub.fits',
+    35: 'SPW35/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_35.image.statcont.contsub.fits',
+}
+
+# spectral_factor is the factor of the spectrally-downsampled cube (None for none)
+spw_defaults = {
+    25: dict(cdelt_kms=0.84455895, nchan=600, beam_threshold=3.3 * u.arcsec, spectral_factor=2),
+    27: dict(cdelt_kms=0.84455895, nchan=600, beam_threshold=3.3 * u.arcsec, spectral_factor=2),
+    # smooth by 2 chans
+    29: dict(cdelt_kms=0.20818593, nchan=1400, beam_threshold=3.3 * u.arcsec, spectral_factor=7),
+    31: dict(cdelt_kms=0.20818593, nchan=1400, beam_threshold=3.3 * u.arcsec, spectral_factor=7),
+    33: dict(cdelt_kms=1.4844932, nchan=350, beam_threshold=3.1 * u.arcsec, spectral_factor=None),
+    # 2.35 is OK except o (2.38) and am (2.64)
+    35: dict(cdelt_kms=1.47015502, nchan=350, beam_threshold=2.75 * u.arcsec, spectral_factor=None),
+}
+
+# cubename: linelist 'Line' and overrides of spw_defaults.  restfreq overrides
+# the table where the existing cubes were made with a more precise value.
+mosaic_lines = {
+    'HC15N': dict(line='HC15N 1-0'),
+    'SO21': dict(line='SO 2(2)-1(1)'),
+    'H13CN': dict(line='H13CN 1-0'),
+    'H13COp': dict(line='H13CO+ 1-0'),
+    'SiO21': dict(line='SiO 2-1', fail_if_cube_dropped=True),
+    'HN13C': dict(line='HN13C 1-0'),
+    'HNCO': dict(line='HNCO 4-3'),
+    'HCOP': dict(line='HCO+ 1-0', restfreq=89.188526e9),
+    # am has 2.83" beam
+    'CS21': dict(line='CS 2-1', restfreq=97.98095330e9, beam_threshold=2.9 * u.arcsec,
+                 fail_if_cube_dropped=True, downsample_kwargs={'use_dask': False}),
+    'CH3CHO': dict(line='CH3CHO 5(1,4)–4(1,3) A–', restfreq=98.900951e9),
+    'H40a': dict(line='H40 Alpha', nchan=600),
+    'SO32': dict(line='SO 3(2)-2(1)'),
+    'HC3N': dict(line='HC3N 11-10', fail_if_cube_dropped=True, downsample_kwargs={'use_dask': False}),
+    'NSplus': dict(line='NS+', fail_if_cube_dropped=True),
+}
+
+
+def read_linelist(filename=default_linelist):
+    return Table.read(filename, format='ascii.csv')
+
+
+def line_registry(lines=None, linelist=None):
+    """
+    The settings of each registered line, in the order of `mosaic_lines`.
+
+    Parameters
+    ----------
+    lines : list or None
+        Cube names (keys of `mosaic_lines`) to include; None for all
+    linelist : `~astropy.table.Table` or None
+        The line table; defaults to `read_linelist`
+
+    Returns
+    -------
+    entries : list of dict
+        Each has cubename, line, spw, restfreq (Hz), cdelt_kms, nchan,
+        beam_threshold, spectral_factor, fail_if_cube_dropped, and
+        downsample_kwargs
+    """
+    if linelist is None:
+        linelist = read_linelist()
+    if lines is None:
+        lines = list(mosaic_lines)
+    unknown = [cubename for cubename in lines if cubename not in mosaic_lines]
+    if unknown:
+        raise ValueError(f"Lines {unknown} are not registered; options are {list(mosaic_lines)}")
+
+    entries = []
+    for cubename in lines:
+        settings = dict(mosaic_lines[cubename])
+        rows = linelist[linelist['Line'] == settings['line']]
+        if len(rows) != 1:
+            raise ValueError(f"Found {len(rows)} rows for {settings['line']} ({cubename}) in the line list")
+        spw = int(rows['12m SPW'][0])
+
+        entry = dict(cubename=cubename, spw=spw, restfreq=float(rows['Rest (GHz)'][0]) * 1e9,
+                     fail_if_cube_dropped=False, downsample_kwargs={})
+        entry.update(spw_defaults[spw])
+        entry.update(settings)
+        entries.append(entry)
+
+    return entries
+
+
+def line_cube_header(entry, target_header=f'{basepath}/reduction_ACES/aces/imaging/data/header_12m.hdr',
+                     test=False):
+    """
+    The header of the giant cube of line ``entry`` (before the common beam is added)
+    """
+    return make_giant_mosaic_cube_header(target_header=target_header,
+                                         reference_frequency=entry['restfreq'],
+                                         cdelt_kms=entry['cdelt_kms'],
+                                         nchan=entry['nchan'],
+                                         test=test)
+
+
+def feathered_filelist(spw):
+    return sorted(glob.glob(os.path.join(feather_directory, feathered_cube_patterns[spw])))
+
+
+def line_tasks(entries, nchunks=1):
+    """
+    Group the registered lines by spectral window into tasks.
+
+    Each task makes channel chunk ``chunk`` of ``nchunks`` of every line in
+    one spectral window, so the spectral window's cubes are loaded once for
+    all of its lines.  Tasks are ordered by the number of channels they make,
+    largest first, so that a pool finishes about when its longest task does.
+
+    Returns a list of dicts with spw, lines (registry entries), chunk, and
+    nchunks
+    """
+    groups = {}
+    for entry in entries:
+        groups.setdefault(entry['spw'], []).append(entry)
+
+    tasks = [{'spw': spw, 'lines': group, 'chunk': chunk, 'nchunks': nchunks}
+             for spw, group in groups.items()
+             for chunk in range(nchunks)]
+    return sorted(tasks, key=lambda task: -sum(len(task_channels(task, entry)) for entry in task['lines']))
+
+
+def task_channels(task, entry):
+    """
+    The channels of line ``entry`` made by ``task``
+    """
+    return np.array_split(np.arange(entry['nchan']), task['nchunks'])[task['chunk']].tolist()
+
+
+def slurm_line_tasks(tasks):
+    """
+    The share of ``tasks`` for this SLURM array task, or all of them outside
+    of an array job.  Array task ``ii`` of ``nn`` takes tasks ``ii, ii + nn, ...``.
+    """
+    if os.getenv('SLURM_ARRAY_TASK_ID') is None:
+        return tasks
+    slurm_array_task_id = int(os.getenv('SLURM_ARRAY_TASK_ID'))
+    slurm_array_task_count = int(os.getenv('SLURM_ARRAY_TASK_COUNT'))
+    return tasks[slurm_array_task_id::slurm_array_task_count]
@@ -7,6 +7,7 @@ import PIL
 from spectral_cube.lower_dimensional_structures import Projection
 from spectral_cube.spectral_cube import _regionlist_to_single_region
 from spectral_cube import SpectralCube
+from spectral_cube import wcs_utils
 from spectral_cube.wcs_utils import strip_wcs_from_header
 from spectral_cube.utils import NoBeamError
 from spectral_cube.cube_utils import mosaic_cubes
@@ -21,10 +22,13 @@ from astropy.convolution import convolve_fft, convolve, Gaussian2DKernel
 from astropy.coordinates import SkyCoord
 from reproject import reproject_interp
 from reproject.mosaicking import find_optimal_celestial_wcs, reproject_and_coadd
+import scipy.fft
 import os
 import glob
 import copy
+import hashlib
 import shutil
+import time
 from functools import partial
 from multiprocessing import Process, Pool
 import warnings
@@ -97,15 +101,186 @@ def read_as_2d(fn, minval=None, suppress_warnings=True, verbose=False):
                 return fits.HDUList([hdu])
 
 
+# Bump these whenever the computation in get_peak or get_m0 changes so that
+# previously cached products are recomputed
+provenance_versions = {'max': 1, 'mom0': 1}
+
+# number of bytes hashed from each end of an input whose mtime has changed
+provenance_hash_bytes = 2**20
+
+
+def _partial_hash(fn, nbytes=provenance_hash_bytes):
+    """
+    Hash the size and the first and last ``nbytes`` of a file
+    """
+    size = os.path.getsize(fn)
+    sha = hashlib.sha1(str(size).encode())
+    with open(fn, 'rb') as fh:
+        sha.update(fh.read(nbytes))
+        if size > nbytes:
+            fh.seek(max(size - nbytes, nbytes))
+            sha.update(fh.read())
+    return sha.hexdigest()
+
+
+def input_fingerprint(fn, with_hash=True):
+    """
+    Size, mtime (in ns), and partial hash of a FITS file or a CASA image
+    directory.
+
+    For CASA images, the size is the total over the directory, the mtime is
+    the newest in the directory, and the hash covers the file listing and the
+    largest file (the data).
+    """
+    if os.path.isdir(fn):
+        files = sorted(os.path.join(root, name)
+                       for root, dirs, names in os.walk(fn)
+                       for name in names)
+        stats = [os.stat(x) for x in files]
+        size = sum(st.st_size for st in stats)
+        mtime = max((st.st_mtime_ns for st in stats), default=os.stat(fn).st_mtime_ns)
+        if with_hash:
+            sha = hashlib.sha1()
+            for name, st in zip(files, stats):
+                sha.update(f"{os.path.relpath(name, fn)} {st.st_size}\n".encode())
+            if files:
+                sha.update(_partial_hash(max(zip(stats, files), key=lambda x: x[0].st_size)[1]).encode())
+            phash = sha.hexdigest()
+    else:
+        st = os.stat(fn)
+        size, mtime = st.st_size, st.st_mtime_ns
+        if with_hash:
+            phash = _partial_hash(fn)
+    fingerprint = {'size': size, 'mtime': mtime}
+    if with_hash:
+        fingerprint['hash'] = phash
+    return fingerprint
+
+
+def _format_slab(slab_kwargs):
+    if slab_kwargs is None:
+        return 'none'
+    return ",".join(f"{key}={u.Quantity(val).to_string()}" for key, val in sorted(slab_kwargs.items()))
+
+
+def product_provenance(fn, product, slab_kwargs=None, rest_value=None, fingerprint=None):
+    """
+    The FITS keywords recording what a cached ``product`` ('max' or 'mom0')
+    of ``fn`` was made from.  ``fingerprint`` is the `input_fingerprint` of
+    ``fn``, if it has already been taken.
+    """
+    if fingerprint is None:
+        fingerprint = input_fingerprint(fn)
+    return {'PROVIN': os.path.abspath(fn),
+            'PROVSIZE': fingerprint['size'],
+            'PROVMTIM': fingerprint['mtime'],
+            'PROVHASH': fingerprint['hash'],
+            'PROVSLAB': _format_slab(slab_kwargs),
+            'PROVREST': 'none' if rest_value is None else u.Quantity(rest_value).to_string(),
+            'PROVPROD': product,
+            'PROVVERS': provenance_versions[product],
+            }
+
+
+def cached_product_is_current(outfn, fn, product, slab_kwargs=None, rest_value=None):
+    """
+    Check whether the cached ``outfn`` was made from the current version of
+    ``fn`` with the same slab, rest value, and code version.
+
+    The input must have the recorded size and either the recorded mtime or,
+    if it has been touched or copied, the recorded partial hash.
+    """
+    if not os.path.exists(outfn):
+        return False
+    header = fits.getheader(outfn)
+    if 'PROVHASH' not in header:
+        log.info(f"Cached {outfn} has no provenance; recomputing it")
+        return False
+
+    expected = {'PROVIN': os.path.abspath(fn),
+                'PROVSLAB': _format_slab(slab_kwargs),
+                'PROVREST': 'none' if rest_value is None else u.Quantity(rest_value).to_string(),
+                'PROVPROD': product,
+                'PROVVERS': provenance_versions[product],
+                }
+    for key, value in expected.items():
+        if header.get(key) != value:
+            log.info(f"Cached {outfn} is stale: {key}={header.get(key)} but expected {value}")
+            return False
+
+    fingerprint = input_fingerprint(fn, with_hash=False)
+    if header['PROVSIZE'] != fingerprint['size']:
+        log.info(f"Cached {outfn} is stale: {fn} has changed size")
+        return False
+    if header['PROVMTIM'] != fingerprint['mtime'] and header['PROVHASH'] != input_fingerprint(fn)['hash']:
+        log.info(f"Cached {outfn} is stale: {fn} has been modified")
+        return False
+    return True
+
+
+def write_product(proj, outfn, provenance):
+    hdu = proj.hdu
+    hdu.header.update(provenance)
+    hdu.writeto(outfn, overwrite=True)
+
+
+def peak_to_K(cube, mx, fn=''):
+    """
+    Convert the peak intensity map ``mx`` of ``cube`` to K.  Maps of
+    dimensionless cubes (e.g., weights) are returned as they are.
+    """
+    if cube.unit == u.dimensionless_unscaled:
+        return mx
+    if hasattr(cube, 'beam'):
+        return mx.to(u.K)
+
+    log.warn(f"File {fn} is a multi-beam cube.")
+    beam = get_common_beam(cube.beams)
+    equiv = beam.jtok_equiv(cube.with_spectral_unit(u.GHz).spectral_axis.mean())
+    mxjy = mx
+    if hasattr(mxjy, '_beam') and mxjy._beam is None:
+        mxjy._beam = beam
+    try:
+        assert hasattr(mxjy, 'beam')
+        assert mxjy.beam is not None
+    except Exception as ex:
+        print(ex)
+        mxjy = mxjy.with_beam(beam, raise_error_jybm=False)
+
+    return mxjy.to(u.K, equivalencies=equiv)
+
+
+def moment0_to_K(cube, moment0):
+    """
+    Convert the moment 0 map ``moment0`` of ``cube`` to K km/s
+    """
+    if hasattr(cube, 'beam'):
+        equiv = cube.beam.jtok_equiv(cube.with_spectral_unit(u.GHz).spectral_axis.mean())
+    elif hasattr(cube, 'beams'):
+        beam = get_common_beam(cube.beams)
+        equiv = beam.jtok_equiv(cube.with_spectral_unit(u.GHz).spectral_axis.mean())
+
+    return (moment0 * u.s / u.km).to(u.K,
+                                     equivalencies=equiv) * u.km / u.s
+
+
 def get_peak(fn, slab_kwargs=None, rest_value=None, suffix="", save_file=True,
              folder=None, threshold=None, rel_threshold=None,
              fail_on_zeros=True, use_cache=True
              ):
+    """
+    Get the peak intensity map of ``fn`` in K.
+
+    The map is cached in ``{fn}{suffix}_max.fits`` and is reused only if
+    its provenance (see `cached_product_is_current`) matches.  The
+    threshold is applied after reading the cache, so changing it does not
+    require recomputation.
+    """
     print(".", end='', flush=True)
     outfn = fn.replace(".fits", "") + f"{suffix}_max.fits"
     if folder is not None:
         outfn = os.path.join(folder, os.path.basename(outfn))
-    if os.path.exists(outfn) and use_cache:
+    if use_cache and cached_product_is_current(outfn, fn, 'max', slab_kwargs=slab_kwargs, rest_value=rest_value):
         hdu = fits.open(outfn)
         proj = Projection.from_hdu(hdu)
         if rel_threshold is not None:
@@ -117,6 +292,8 @@ def get_peak(fn, slab_kwargs=None, rest_value=None, suffix="", save_file=True,
             raise ValueError(f"File {fn} reduced to all zeros")
         return proj
     else:
+        # record the input as it was before reading it
+        provenance = product_provenance(fn, 'max', slab_kwargs=slab_kwargs, rest_value=rest_value)
         ft = 'fits' if fn.endswith(".fits") else "casa_image"
         cube = SpectralCube.read(fn,
                                  use_dask=True,
@@ -126,30 +303,11 @@ def get_peak(fn, slab_kwargs=None, rest_value=None, suffix="", save_file=True,
         if slab_kwargs is not None:
             cube = cube.spectral_slab(**slab_kwargs)
         with cube.use_dask_scheduler('threads'):
-            if cube.unit == u.dimensionless_unscaled:
-                mx = cube.max(axis=0)
-            else:
-                if hasattr(cube, 'beam'):
-                    mx = cube.max(axis=0).to(u.K)
-                else:
-                    log.warn(f"File {fn} is a multi-beam cube.")
-                    beam = get_common_beam(cube.beams)
-                    equiv = beam.jtok_equiv(cube.with_spectral_unit(u.GHz).spectral_axis.mean())
-                    mxjy = cube.max(axis=0)
-                    if hasattr(mxjy, '_beam') and mxjy._beam is None:
-                        mxjy._beam = beam
-                    try:
-                        assert hasattr(mxjy, 'beam')
-                        assert mxjy.beam is not None
-                    except Exception as ex:
-                        print(ex)
-                        mxjy = mxjy.with_beam(beam, raise_error_jybm=False)
-
-                    mx = mxjy.to(u.K, equivalencies=equiv)
+            mx = peak_to_K(cube, cube.max(axis=0), fn)
         if fail_on_zeros and np.nansum(mx.value) == 0:
             raise ValueError(f"File {fn} reduced to all zeros")
         if save_file:
-            mx.hdu.writeto(outfn, overwrite=True)
+            write_product(mx, outfn, provenance)
 
         if rel_threshold is not None:
             threshold = rel_threshold * mx.max()
@@ -161,35 +319,193 @@ def get_peak(fn, slab_kwargs=None, rest_value=None, suffix="", save_file=True,
 
 def get_m0(fn, slab_kwargs=None, rest_value=None, suffix="", save_file=True,
            folder=None, use_cache=True):
+    """
+    Get the moment 0 map of ``fn`` in K km/s.
+
+    The map is cached in ``{fn}{suffix}_mom0.fits`` and is reused only if
+    its provenance (see `cached_product_is_current`) matches.
+    """
     print(".", end='', flush=True)
     outfn = fn.replace(".fits", "") + f"{suffix}_mom0.fits"
     if folder is not None:
         outfn = os.path.join(folder, os.path.basename(outfn))
-    if os.path.exists(outfn) and use_cache:
+    if use_cache and cached_product_is_current(outfn, fn, 'mom0', slab_kwargs=slab_kwargs, rest_value=rest_value):
         hdu = fits.open(outfn)
         proj = Projection.from_hdu(hdu)
         return proj
     else:
+        provenance = product_provenance(fn, 'mom0', slab_kwargs=slab_kwargs, rest_value=rest_value)
         ft = 'fits' if fn.endswith(".fits") else "casa_image"
         cube = SpectralCube.read(fn, use_dask=True, format=ft).with_spectral_unit(u.km / u.s, velocity_convention='radio', rest_value=rest_value)
         cube.beam_threshold = 0.1  # SO2 or the one after it had 5% beam variance
         if slab_kwargs is not None:
             cube = cube.spectral_slab(**slab_kwargs)
         with cube.use_dask_scheduler('threads'):
-            moment0 = cube.moment0(axis=0)
-        if hasattr(cube, 'beam'):
-            equiv = cube.beam.jtok_equiv(cube.with_spectral_unit(u.GHz).spectral_axis.mean())
-        elif hasattr(cube, 'beams'):
-            beam = get_common_beam(cube.beams)
-            equiv = beam.jtok_equiv(cube.with_spectral_unit(u.GHz).spectral_axis.mean())
-
-        moment0 = (moment0 * u.s / u.km).to(u.K,
-                                            equivalencies=equiv) * u.km / u.s
+            moment0 = moment0_to_K(cube, cube.moment0(axis=0))
         if save_file:
-            moment0.hdu.writeto(outfn, overwrite=True)
+            write_product(moment0, outfn, provenance)
         return moment0
 
 
+def line_slab_maps(cube, channel_ranges, products=('max', 'mom0'), channel_widths=None,
+                   spectral_block_size=16):
+    """
+    The peak and moment 0 of several channel ranges of ``cube`` from one
+    sequential read of the channels they cover, in blocks of
+    ``spectral_block_size`` channels.
+
+    Parameters
+    ----------
+    cube : `~spectral_cube.SpectralCube`
+        A cube with a velocity spectral axis (for the moment 0)
+    channel_ranges : dict
+        Key -> (start, stop) channel range
+    products : tuple
+        Any of 'max' and 'mom0'
+    channel_widths : dict or None
+        Key -> the channel width for the moment 0 of that key (e.g., in the
+        velocity frame of each line); defaults to the channel width of
+        ``cube``
+
+    Returns
+    -------
+    maps : dict
+        (key, product) -> 2D array, matching ``cube[start:stop].max(axis=0)``
+        and ``cube[start:stop].moment0(axis=0)`` (in the cube's units, or
+        the cube's units times the units of ``channel_widths``)
+    """
+    nchan, ny, nx = cube.shape
+    if channel_widths is None:
+        channel_widths = {key: cube._pix_size_slice(0) for key in channel_ranges}
+    maps, counts = {}, {}
+    for key in channel_ranges:
+        if 'max' in products:
+            maps[(key, 'max')] = np.full((ny, nx), np.nan, dtype=cube._data.dtype)
+        if 'mom0' in products:
+            maps[(key, 'mom0')] = np.zeros((ny, nx))
+            counts[key] = np.zeros((ny, nx), dtype='int')
+
+    start = min(c0 for c0, c1 in channel_ranges.values())
+    stop = min(max(c1 for c0, c1 in channel_ranges.values()), nchan)
+    for b0 in range(start, stop, spectral_block_size):
+        b1 = min(b0 + spectral_block_size, stop)
+        todo = {key: (max(c0, b0), min(c1, b1)) for key, (c0, c1) in channel_ranges.items()
+                if c0 < b1 and c1 > b0}
+        if not todo:
+            continue
+        data = cube.filled_data[b0:b1].value
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for key, (c0, c1) in todo.items():
+                block = data[c0 - b0:c1 - b0]
+                if 'max' in products:
+                    np.fmax(maps[(key, 'max')], np.nanmax(block, axis=0), out=maps[(key, 'max')])
+                if 'mom0' in products:
+                    weighted = block.astype(np.float64) * channel_widths[key]
+                    maps[(key, 'mom0')] += np.nansum(weighted, axis=0)
+                    counts[key] += np.isfinite(weighted).sum(axis=0)
+
+    # pixels with no valid channels are NaN, as in moment0
+    for key in counts:
+        maps[(key, 'mom0')][counts[key] == 0] = np.nan
+    return maps
+
+
+def collapsed_projection(cube, value, axis, unit=None):
+    """
+    A `~spectral_cube.lower_dimensional_structures.Projection` of ``value``,
+    a reduction of ``cube`` along numpy ``axis`` computed outside of
+    SpectralCube, with the WCS, metadata, and (for spatial maps) beam that
+    SpectralCube's own reductions give.  ``unit`` defaults to the cube's.
+    """
+    # {numpy axis: wcs axis}, as used by SpectralCube's own projections
+    np2wcs = {0: 2, 1: 1, 2: 0}
+    meta = {'collapse_axis': axis}
+    meta.update(cube._meta)
+    beamarg = {'beam': cube.beam} if axis == 0 and hasattr(cube, 'beam') else {}
+    return Projection(value, unit=cube.unit if unit is None else unit,
+                      wcs=wcs_utils.drop_axis(cube._wcs, np2wcs[axis]),
+                      meta=meta, header=cube._nowcs_header, **beamarg)
+
+
+def get_line_maps(fn, lines, slab_kwargs=None, products=('max', 'mom0'), save_file=True,
+                  folder=None, use_cache=True, spectral_block_size=16):
+    """
+    Make the `get_peak` and `get_m0` maps of several lines in ``fn`` from a
+    single sequential read of the cube, instead of one read per line and
+    product.
+
+    The maps are written to the same cache files, with the same provenance,
+    as `get_peak` and `get_m0` would write, so later calls to those (e.g.,
+    with a threshold) read them from the cache.  Lines whose cached maps are
+    current are skipped.
+
+    Parameters
+    ----------
+    lines : dict
+        Suffix (as passed to `get_peak`) -> rest frequency
+    slab_kwargs : dict or None
+        ``lo`` and ``hi`` velocities around each line
+
+    Returns
+    -------
+    maps : dict
+        (suffix, product) -> `~spectral_cube.lower_dimensional_structures.Projection`
+        for the maps that were computed
+    """
+    outfns = {(suffix, product): fn.replace(".fits", "") + f"{suffix}_{product}.fits"
+              for suffix in lines for product in products}
+    if folder is not None:
+        outfns = {key: os.path.join(folder, os.path.basename(outfn)) for key, outfn in outfns.items()}
+    todo = [key for key in outfns
+            if not (use_cache and cached_product_is_current(outfns[key], fn, key[1], slab_kwargs=slab_kwargs,
+                                                            rest_value=lines[key[0]]))]
+    if not todo:
+        return {}
+
+    # record the input as it was before reading it
+    fingerprint = input_fingerprint(fn)
+    ft = 'fits' if fn.endswith(".fits") else "casa_image"
+    cube = SpectralCube.read(fn, use_dask=True, format=ft)
+    cube.beam_threshold = 0.1  # SO2 or the one after it had 5% beam variance
+
+    # the channels of each line, as spectral_slab would select them
+    slabs, channel_ranges, channel_widths = {}, {}, {}
+    for suffix in {suffix for suffix, product in todo}:
+        vcube = cube.with_spectral_unit(u.km / u.s, velocity_convention='radio', rest_value=lines[suffix])
+        if slab_kwargs is None:
+            slabs[suffix], channel_ranges[suffix] = vcube, (0, vcube.shape[0])
+        else:
+            ilo, ihi = sorted((vcube.closest_spectral_channel(slab_kwargs['lo']),
+                               vcube.closest_spectral_channel(slab_kwargs['hi'])))
+            slabs[suffix], channel_ranges[suffix] = vcube.spectral_slab(**slab_kwargs), (ilo, ihi + 1)
+        channel_widths[suffix] = vcube._pix_size_slice(0)
+
+    with cube.use_dask_scheduler('threads'):
+        arrays = line_slab_maps(cube, channel_ranges,
+                                products=tuple({product for suffix, product in todo}),
+                                channel_widths=channel_widths,
+                                spectral_block_size=spectral_block_size)
+
+    maps = {}
+    for suffix, product in todo:
+        slab = slabs[suffix]
+        unit = slab.unit * u.km / u.s if product == 'mom0' else slab.unit
+        proj = collapsed_projection(slab, arrays[(suffix, product)], axis=0, unit=unit)
+        if product == 'max':
+            proj = peak_to_K(slab, proj, fn)
+        else:
+            proj = moment0_to_K(slab, proj)
+
+        if save_file:
+            provenance = product_provenance(fn, product, slab_kwargs=slab_kwargs, rest_value=lines[suffix],
+                                            fingerprint=fingerprint)
+            write_product(proj, outfns[(suffix, product)], provenance)
+        maps[(suffix, product)] = proj
+
+    return maps
+
+
 def check_hdus(hdus):
     bad = 0
     for hdu in hdus:
@@ -241,6 +557,152 @@ def makepng(data, wcs, imfn, footprint=None, cmap=None, **norm_kwargs):
         print(ex)
 
 
+def _convolution_memory_estimate(shape, itemsize=8):
+    """
+    Approximate peak bytes needed to convolve one field with ``convolve_fft``:
+    the input, the output, and the padded complex arrays (kernel, image, and
+    their product) that can be up to 2x larger on each axis.
+    """
+    npix = int(np.prod(shape))
+    return npix * (2 * itemsize + 3 * 4 * 16)
+
+
+def _convolve_batch(batch):
+    """
+    Convolve a batch of fields to the common beam, writing each result into
+    its slot in the shared memmap.
+
+    This is a module-level function (not a closure) so that it can be pickled
+    and shipped to worker processes.
+    """
+    results = []
+    for job in batch:
+        prj = Projection.from_hdu(fits.PrimaryHDU(data=job['data'], header=job['header']))
+        prj.beam = job['beam']
+        rslt = prj.convolve_to(job['commonbeam']).hdu
+        data = rslt.data * job['scalefactor']
+
+        out = np.memmap(job['memmap_filename'], dtype=job['dtype'], mode='r+',
+                        offset=job['offset'], shape=job['shape'])
+        out[:] = data
+        out.flush()
+        del out
+        results.append((job['index'], rslt.header))
+    return results
+
+
+def convolve_to_commonbeam(prjs, commonbeam, beams=None, scalefactors=None,
+                           num_workers=None, memory_budget=4e9,
+                           scheduler='processes', working_directory=None,
+                           verbose=True):
+    """
+    Convolve a list of 2D projections to a common beam in parallel.
+
+    Each field is convolved with `~spectral_cube.Projection.convolve_to`, so
+    the results are identical to the serial approach, then multiplied by its
+    ``scalefactor``.  The convolved fields are written into a single shared
+    memmap and returned as HDUs whose data are views into that memmap, so the
+    parent process never holds more than the inputs in memory.
+
+    Parameters
+    ----------
+    prjs : list of `~spectral_cube.Projection`
+        The 2D images to convolve
+    commonbeam : `radio_beam.Beam`
+        The beam to convolve to
+    beams : list of `radio_beam.Beam`, optional
+        Beams to use for projections that have no beam attached
+    scalefactors : list of float, optional
+        Multiplicative factor applied to each field after convolution
+        (default 1)
+    num_workers : int, optional
+        Number of worker processes.  Defaults to the number of CPUs.
+    memory_budget : float
+        Approximate memory limit per worker in bytes.  Fields are sorted by
+        footprint size, largest first, and packed into batches that fit
+        within this budget; a single field larger than the budget is given its
+        own batch.
+    scheduler : str or dask client
+        'processes' uses a `multiprocessing.Pool`.  Anything else is passed
+        to `dask.compute` as the scheduler (e.g., 'threads', 'synchronous',
+        or a ``dask.distributed.Client``).
+    working_directory : str, optional
+        Where to put the shared memmap file.  Defaults to the system
+        temporary directory.
+
+    Returns
+    -------
+    hdus : list of `~astropy.io.fits.PrimaryHDU`
+        The convolved images in the same order as ``prjs``
+    """
+    import tempfile
+
+    if beams is None:
+        beams = [None] * len(prjs)
+    # the header may not carry the beam, so pass it along explicitly
+    beams = [prj.beam if getattr(prj, '_beam', None) is not None else bm
+             for prj, bm in zip(prjs, beams)]
+    if scalefactors is None:
+        scalefactors = [1] * len(prjs)
+    scalefactors = [u.Quantity(sf).to_value(u.dimensionless_unscaled) for sf in scalefactors]
+
+    # lay out the fields end-to-end in the shared memmap
+    dtypes = [(np.ones(1, dtype=prj.dtype) * sf).dtype for prj, sf in zip(prjs, scalefactors)]
+    offsets = np.cumsum([0] + [prj.size * dt.itemsize for prj, dt in zip(prjs, dtypes)])
+
+    with tempfile.NamedTemporaryFile(dir=working_directory, suffix='_commonbeam.dat',
+                                     delete=False) as fh:
+        memmap_filename = fh.name
+        fh.truncate(max(int(offsets[-1]), 1))
+
+    jobs = [dict(index=ii, data=prj.value, header=prj.header, beam=bm,
+                 commonbeam=commonbeam, scalefactor=sf, dtype=dt,
+                 memmap_filename=memmap_filename, offset=int(offset),
+                 shape=prj.shape)
+            for ii, (prj, bm, sf, dt, offset) in enumerate(zip(prjs, beams, scalefactors, dtypes, offsets))]
+
+    # largest footprints first so the slowest fields start earliest
+    jobs = sorted(jobs, key=lambda job: job['data'].size, reverse=True)
+    batches = []
+    batch, batch_inputs, batch_workspace = [], 0, 0
+    for job in jobs:
+        inputs = job['data'].nbytes
+        workspace = _convolution_memory_estimate(job['shape'], job['dtype'].itemsize)
+        if batch and (batch_inputs + inputs + max(batch_workspace, workspace)) > memory_budget:
+            batches.append(batch)
+            batch, batch_inputs, batch_workspace = [], 0, 0
+        batch.append(job)
+        batch_inputs += inputs
+        batch_workspace = max(batch_workspace, workspace)
+    if batch:
+        batches.append(batch)
+
+    if verbose:
+        log.info(f"Convolving {len(jobs)} fields to {commonbeam} in {len(batches)} batches")
+
+    headers = {}
+    if scheduler == 'processes':
+        with Pool(num_workers) as pool:
+            for rslt in tqdm(pool.imap_unordered(_convolve_batch, batches), total=len(batches),
+                             desc='Convolving batches', disable=not verbose):
+                headers.update(dict(rslt))
+    else:
+        import dask
+        tasks = [dask.delayed(_convolve_batch)(batch) for batch in batches]
+        for rslt in dask.compute(*tasks, scheduler=scheduler, num_workers=num_workers):
+            headers.update(dict(rslt))
+
+    hdus = [fits.PrimaryHDU(data=np.memmap(memmap_filename, dtype=dt, mode='r',
+                                           offset=int(offset), shape=prj.shape),
+                            header=headers[ii])
+            for ii, (prj, dt, offset) in enumerate(zip(prjs, dtypes, offsets))]
+    # the open maps keep the data alive on POSIX systems, so we don't need to
+    # leave the file lying around in the working directory
+    os.remove(memmap_filename)
+
+    return hdus
+
+
 def make_mosaic(twod_hdus, name, norm_kwargs={}, slab_kwargs=None,
                 weights=None,
                 target_header=None,
@@ -252,10 +714,18 @@ def make_mosaic(twod_hdus, name, norm_kwargs={}, slab_kwargs=None,
                 folder=None,  # must be specified though
                 basepath='./',
                 footprint_threshold=1e-3,
-                doplots=True
+                doplots=True,
+                convolve_num_workers=1,
+                convolve_memory_budget=4e9,
                ):
     """
     Given a long list of 2D HDUs and an output name, make a giant mosaic.
+
+    convolve_num_workers : int or None
+        Number of processes to use for the common-beam convolution stage.  1
+        (the default) runs in-process; None uses all CPUs.
+    convolve_memory_budget : float
+        Approximate memory limit in bytes for each convolution worker
     """
 
     if target_header is None:
@@ -293,20 +763,19 @@ def make_mosaic(twod_hdus, name, norm_kwargs={}, slab_kwargs=None,
                 prj.beam = bm
 
         log.info(f"Convolving HDUs to common beam {cb:0.2f} = {cb.major.to(u.arcsec):0.2f} {cb.minor.to(u.arcsec):0.2f} {cb.pa:0.2f}")
-        pb = ProgressBar(len(prjs))
 
         # when convolving to a new beam, but retaining Jy/beam units, the beam
         # size is getting larger so the unit is too.
-        def reprj(prj, scalefactor=1):
-            rslt = prj.convolve_to(cb).hdu
-            rslt.data = rslt.data * scalefactor
-            pb.update()
-            return rslt
-
+        scalefactors = [cb.sr / prj.beam.sr for prj in prjs]
         # DEBUG: make sure the beam scaling factor makes sense
-        print([cb.sr / prj.beam.sr for prj in prjs])
-        # parallelization of this failed
-        twod_hdus = [reprj(prj, scalefactor=cb.sr / prj.beam.sr) for prj in prjs]
+        print(scalefactors)
+        twod_hdus = convolve_to_commonbeam(prjs, cb, beams=beams,
+                                           scalefactors=scalefactors,
+                                           num_workers=convolve_num_workers,
+                                           memory_budget=convolve_memory_budget,
+                                           scheduler='synchronous' if convolve_num_workers == 1 else 'processes',
+                                           working_directory=conf.workpath if os.path.isdir(conf.workpath) else None,
+                                           )
 
     log.info(f"Reprojecting and coadding {len(twod_hdus)} HDUs.")
     # number of items to count in progress bar
@@ -461,8 +930,16 @@ def all_lines(header, parallel=False, array='12m',
                              ),
               lines='all', folder='',
               globdir='calibrated/working', use_weights=True,
-              use_cache=True
+              use_cache=True, shared_reads=True,
               ):
+    """
+    Make the peak intensity and moment 0 mosaics of each line in the line list.
+
+    If ``shared_reads``, the maps of all selected lines in one spw are made
+    by `get_line_maps` from a single read of each cube (and weight cube)
+    when the first of those lines is reached; the later per-line calls then
+    read them from the cache.
+    """
 
     from astropy.table import Table
 
@@ -471,16 +948,17 @@ def all_lines(header, parallel=False, array='12m',
     if parallel:
         processes = []
 
+    selected = []
     for ii, row in enumerate(tbl):
         if os.getenv("SLURM_ARRAY_TASK_ID") is not None and int(os.getenv('SLURM_ARRAY_TASK_ID')) != ii:
             continue
-
-        spwn = row[f'{array} SPW']
         line = row['Line'].replace(" ", "_").replace("(", "_").replace(")", "_")
-        restf = row['Rest (GHz)'] * u.GHz
-
         if lines != 'all' and not (line in lines or row['Line'] in lines):
             continue
+        selected.append((row[f'{array} SPW'], line, row['Rest (GHz)'] * u.GHz))
+    read_spws = set()
+
+    for spwn, line, restf in selected:
 
         log.info(f"{array} {line} {restf}")
 
@@ -498,11 +976,30 @@ def all_lines(header, parallel=False, array='12m',
                     filelist.remove(ifn)
                     weightfiles.remove(wfn)
 
+        if shared_reads and spwn not in read_spws:
+            # the maps of every selected line in this spw, from one read of each cube
+            spw_lines = {f'_{line_}': restf_ for spwn_, line_, restf_ in selected if spwn_ == spwn}
+            reads = [(filelist, {'lo': -200 * u.km / u.s, 'hi': 200 * u.km / u.s}, ('max', 'mom0'))]
+            if use_weights:
+                reads.append((weightfiles, {'lo': -2 * u.km / u.s, 'hi': 2 * u.km / u.s}, ('max',)))
+            for fns, slab_kwargs, products in reads:
+                read_maps = partial(get_line_maps, lines=spw_lines, slab_kwargs=slab_kwargs,
+                                    products=products, use_cache=use_cache)
+                if parallel:
+                    with Pool() as pool:
+                        pool.map(read_maps, fns)
+                else:
+                    for fn in fns:
+                        read_maps(fn)
+            read_spws.add(spwn)
+        # the maps read above are current, whether or not use_cache was set
+        line_use_cache = use_cache or shared_reads
+
         if parallel:
             pool = Pool()
             hdus = pool.map(partial(get_peak,
                                     **{'slab_kwargs': {'lo': -200 * u.km / u.s, 'hi': 200 * u.km / u.s},
-                                       'use_cache': use_cache,
+                                       'use_cache': line_use_cache,
                                        'rest_value': restf},
                                     suffix=f'_{line}',
                                     ),
@@ -513,7 +1010,7 @@ def all_lines(header, parallel=False, array='12m',
             if use_weights:
                 wthdus = pool.map(partial(get_peak,
                                           **{'slab_kwargs': {'lo': -2 * u.km / u.s, 'hi': 2 * u.km / u.s},
-                                             'use_cache': use_cache,
+                                             'use_cache': line_use_cache,
                                              'rest_value': restf},
                                           suffix=f'_{line}',
                                           rel_threshold=0.25,  # pb limit
@@ -523,13 +1020,13 @@ def all_lines(header, parallel=False, array='12m',
                 check_hdus(wthdus)
         else:
             hdus = [get_peak(fn, slab_kwargs={'lo': -200 * u.km / u.s, 'hi': 200 * u.km / u.s},
-                             use_cache=use_cache,
+                             use_cache=line_use_cache,
                              rest_value=restf, suffix=f'_{line}').hdu for fn in filelist]
             check_hdus(hdus)
             print(flush=True)
             if use_weights:
                 wthdus = [get_peak(fn, slab_kwargs={'lo': -2 * u.km / u.s, 'hi': 2 * u.km / u.s},
-                                   use_cache=use_cache,
+                                   use_cache=line_use_cache,
                                    rest_value=restf, suffix=f'_{line}',
                                    rel_threshold=0.25,  # pb limit
                                    ).hdu for fn in weightfiles]
@@ -558,12 +1055,12 @@ def all_lines(header, parallel=False, array='12m',
         if parallel:
             pool = Pool()
             m0hdus = pool.map(partial(get_m0, **{'slab_kwargs': {'lo': -200 * u.km / u.s, 'hi': 200 * u.km / u.s},
-                                                 'use_cache': use_cache,
+                                                 'use_cache': line_use_cache,
                                                  'rest_value': restf}, suffix=f'_{line}'), filelist)
             m0hdus = [x.hdu for x in m0hdus]
         else:
             m0hdus = [get_m0(fn, slab_kwargs={'lo': -200 * u.km / u.s, 'hi': 200 * u.km / u.s},
-                             use_cache=use_cache, rest_value=restf, suffix=f'_{line}').hdu for fn in filelist]
+                             use_cache=line_use_cache, rest_value=restf, suffix=f'_{line}').hdu for fn in filelist]
             print(flush=True)
 
         if parallel:
@@ -697,7 +1194,244 @@ def make_giant_mosaic_cube_channels(header, cubes, weightcubes, commonbeam,
             print("\n\n", flush=True)
 
 
-def check_channel(chanfn, verbose=True):
+def output_window(wcs_in, shape_in, wcs_out, shape_out, margin=2):
+    """
+    The pixel bounding box, as (yslice, xslice), of the footprint of an
+    image (``wcs_in``, ``shape_in``) on the grid (``wcs_out``, ``shape_out``),
+    grown by ``margin`` pixels and clipped to the grid.  The two WCSes may
+    be in different celestial frames.
+
+    Returns None if the footprint misses the grid.
+    """
+    footprint = get_wcs_footprint(wcs_in, shape_in)
+    xpix, ypix = wcs_out.world_to_pixel(footprint)
+    ymin = max(int(np.floor(np.min(ypix))) - margin, 0)
+    ymax = min(int(np.ceil(np.max(ypix))) + margin + 1, shape_out[0])
+    xmin = max(int(np.floor(np.min(xpix))) - margin, 0)
+    xmax = min(int(np.ceil(np.max(xpix))) + margin + 1, shape_out[1])
+    if ymin >= ymax or xmin >= xmax:
+        return None
+    return slice(ymin, ymax), slice(xmin, xmax)
+
+
+def _reproject_chunk(cube, spectral_grid, wcs_window, shape_window, commonbeam=None):
+    """
+    Reproject the channels of ``cube`` around ``spectral_grid`` onto the
+    celestial grid ``wcs_window``.  Only the input channels that bracket
+    ``spectral_grid`` are read.
+
+    Returns a (len(spectral_grid), ny, nx) array, NaN where there are no
+    data, or None if the cube does not cover ``spectral_grid``.
+    """
+    inaxis = cube.spectral_axis.to(spectral_grid.unit)
+    indiff = np.abs(np.diff(inaxis)).max()
+    keep = np.nonzero((inaxis >= spectral_grid.min() - indiff) & (inaxis <= spectral_grid.max() + indiff))[0]
+    if keep.size < 2:
+        return None
+    slab = cube[keep.min():keep.max() + 1]
+    if commonbeam is not None:
+        slab = slab.convolve_to(commonbeam)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        slab = slab.spectral_interpolate(spectral_grid, suppress_smooth_warning=True, fill_value=np.nan)
+        data = slab._get_filled_data(fill=np.nan)
+        if hasattr(data, 'compute'):
+            data = data.compute(**slab._scheduler_kwargs)
+    reprojected, _ = reproject_interp((data, slab.wcs.celestial), wcs_window,
+                                      shape_out=data.shape[:1] + tuple(shape_window))
+    return reprojected
+
+
+def mosaic_cubes_windowed(cubes, header, output_file, weightcubes=None, commonbeam=None,
+                          spectral_block_size=32, fail_if_cube_dropped=True, verbose=True):
+    """
+    Weighted mosaic of ``cubes`` onto the grid of ``header``, written to a
+    pre-sized FITS file.
+
+    Each cube is reprojected only into the window of the output that its
+    footprint covers (`output_window`), one chunk of ``spectral_block_size``
+    output channels at a time, and accumulated into memmaps of the weighted
+    sum and the sum of weights.  Peak memory is therefore about one field
+    times one spectral chunk, rather than the full output grid per cube.
+
+    Parameters
+    ----------
+    cubes : list of `~spectral_cube.SpectralCube`
+        Cubes with the same spectral units as ``header``
+    header : `~astropy.io.fits.Header`
+        The 3D output header
+    weightcubes : list or None
+        Weights for each cube; masked or NaN weights count as zero.  If
+        None, overlapping cubes are averaged.
+    commonbeam : `radio_beam.Beam` or None
+        If given, each chunk is convolved to this beam before reprojection
+    """
+    wcs_out = WCS(header)
+    shape_out = (header['NAXIS3'], header['NAXIS2'], header['NAXIS1'])
+    spectral_axis = u.Quantity(wcs_out.spectral.pixel_to_world(np.arange(shape_out[0])))
+
+    output = create_fits_memmap(output_file, header, shape_out, dtype='>f4')
+    weightsum_file = f'{output_file}.weightsum'
+    weightsum = np.memmap(weightsum_file, dtype='float32', mode='w+', shape=shape_out)
+
+    pbar = tqdm(list(enumerate(cubes)), desc='Cubes (windowed mosaic)') if verbose else enumerate(cubes)
+    for ii, cube in pbar:
+        window = output_window(cube.wcs.celestial, cube.shape[1:], wcs_out.celestial, shape_out[1:])
+        if window is None:
+            if fail_if_cube_dropped:
+                raise ValueError(f"Cube {ii} does not overlap the output grid")
+            warnings.warn(f"Cube {ii} does not overlap the output grid; skipping it")
+            continue
+        ys, xs = window
+        wcs_window = wcs_out.celestial[ys, xs]
+        shape_window = (ys.stop - ys.start, xs.stop - xs.start)
+
+        for c0 in range(0, shape_out[0], spectral_block_size):
+            c1 = min(c0 + spectral_block_size, shape_out[0])
+            data = _reproject_chunk(cube, spectral_axis[c0:c1], wcs_window, shape_window,
+                                    commonbeam=commonbeam)
+            if data is None:
+                continue
+            if weightcubes is not None:
+                weight = _reproject_chunk(weightcubes[ii], spectral_axis[c0:c1], wcs_window, shape_window)
+                if weight is None:
+                    continue
+                weight = np.nan_to_num(weight, nan=0)
+            else:
+                weight = np.ones_like(data)
+            weight[~np.isfinite(data)] = 0
+
+            output[c0:c1, ys, xs] += np.where(weight > 0, data * weight, 0)
+            weightsum[c0:c1, ys, xs] += weight
+
+    # normalize in place, one chunk at a time
+    for c0 in range(0, shape_out[0], spectral_block_size):
+        c1 = min(c0 + spectral_block_size, shape_out[0])
+        wsum = weightsum[c0:c1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            output[c0:c1] = np.where(wsum > 0, output[c0:c1] / wsum, np.nan)
+
+    output.flush()
+    del output, weightsum
+    os.remove(weightsum_file)
+
+
+# verdicts of validate_fits_file, keyed by (path, size, mtime in ns)
+_fits_verdicts = {}
+
+
+def validate_fits_file(fn, nsamples=16, sample_bytes=2**16, zero_threshold=1000):
+    """
+    Quickly check that the primary HDU of a FITS file is complete and that
+    its data are not blank, without reading the data.
+
+    The file size is compared to the size implied by the header (BITPIX and
+    NAXISn), and ``nsamples`` evenly-strided blocks of ``sample_bytes`` of
+    the data are read with `os.pread` to tell NaN or zero fill from real
+    data.  Verdicts are cached by path, size, and mtime, so a file is only
+    sampled again if it has changed.
+
+    Returns
+    -------
+    verdict : dict
+        ``ok`` (bool), ``reason`` ('ok', 'missing', 'broken', 'truncated',
+        'blank', or 'zeros'), the ``expected_size`` and ``size`` of the file,
+        and the number of ``sampled``, ``finite``, ``nonzero``, and ``zero``
+        pixels.  'blank' means no sampled pixel is finite and nonzero and
+        'zeros' means the sample has no NaNs but more zeros than
+        ``zero_threshold`` scaled to the sampled fraction, which is how a
+        zero-filled mosaic channel looks.
+    """
+    if not os.path.exists(fn):
+        return {'ok': False, 'reason': 'missing'}
+    st = os.stat(fn)
+    key = (os.path.abspath(fn), st.st_size, st.st_mtime_ns)
+    if key in _fits_verdicts:
+        return _fits_verdicts[key]
+
+    verdict = {'ok': False, 'reason': 'broken', 'size': st.st_size, 'expected_size': None,
+               'sampled': 0, 'finite': 0, 'nonzero': 0, 'zero': 0}
+    try:
+        with open(fn, 'rb') as fh:
+            header = fits.Header.fromfile(fh)
+            data_offset = fh.tell()
+    except (OSError, ValueError, EOFError):
+        _fits_verdicts[key] = verdict
+        return verdict
+
+    bitpix = header.get('BITPIX')
+    dtype = {8: 'u1', 16: '>i2', 32: '>i4', 64: '>i8', -32: '>f4', -64: '>f8'}.get(bitpix)
+    if dtype is None:
+        _fits_verdicts[key] = verdict
+        return verdict
+    dtype = np.dtype(dtype)
+    naxis = header.get('NAXIS', 0)
+    npix = int(np.prod([header[f'NAXIS{ii + 1}'] for ii in range(naxis)])) if naxis > 0 else 0
+    data_size = npix * dtype.itemsize
+    verdict['expected_size'] = data_offset + data_size
+    if st.st_size < data_offset + data_size:
+        verdict['reason'] = 'truncated'
+        _fits_verdicts[key] = verdict
+        return verdict
+
+    # evenly-strided blocks, aligned to pixels, that span the data
+    sample_bytes = max(min(sample_bytes, data_size) // dtype.itemsize * dtype.itemsize, dtype.itemsize)
+    nsamples = max(min(nsamples, data_size // sample_bytes), 1) if data_size else 0
+    starts = np.linspace(0, data_size - sample_bytes, nsamples).astype('int64') // dtype.itemsize * dtype.itemsize
+    fd = os.open(fn, os.O_RDONLY)
+    try:
+        for start in np.unique(starts):
+            block = np.frombuffer(os.pread(fd, sample_bytes, data_offset + int(start)), dtype=dtype)
+            if dtype.kind == 'f':
+                finite = np.isfinite(block)
+            elif 'BLANK' in header:
+                finite = block != header['BLANK']
+            else:
+                finite = np.ones(block.shape, dtype='bool')
+            verdict['sampled'] += block.size
+            verdict['finite'] += int(finite.sum())
+            verdict['zero'] += int((finite & (block == 0)).sum())
+    finally:
+        os.close(fd)
+    verdict['nonzero'] = verdict['finite'] - verdict['zero']
+
+    if verdict['nonzero'] == 0:
+        verdict['reason'] = 'blank'
+    elif (verdict['finite'] == verdict['sampled'] and
+          verdict['zero'] > max(zero_threshold * verdict['sampled'] / npix, 1)):
+        verdict['reason'] = 'zeros'
+    else:
+        verdict['ok'], verdict['reason'] = True, 'ok'
+
+    _fits_verdicts[key] = verdict
+    return verdict
+
+
+def check_channel(chanfn, verbose=True, fast=True):
+    """
+    Check that a channel mosaic is not empty or zero-filled.
+
+    If ``fast``, `validate_fits_file` decides truncated or broken files, and
+    accepts the channel if its sample has both real data and NaNs (so it can
+    be neither blank nor NaN-less and zero-filled).  Any other sampled
+    verdict is not trusted, because the caller deletes failed channels, and
+    the whole channel is read instead.
+    """
+    if fast:
+        verdict = validate_fits_file(chanfn)
+        if verdict['reason'] in ('missing', 'broken', 'truncated'):
+            if verbose:
+                print(f"{chanfn} failed ({verdict['reason']}): size={verdict.get('size')} "
+                      f"expected={verdict.get('expected_size')}")
+            return False
+        if verdict['ok'] and verdict['finite'] < verdict['sampled']:
+            if verbose:
+                print(f"{chanfn} succeeded: sampled={verdict['sampled']} finite={verdict['finite']} "
+                      f"nonzero={verdict['nonzero']} zero={verdict['zero']}")
+            return True
+        if verbose:
+            print(f"{chanfn} sample was inconclusive ({verdict['reason']}); reading the whole channel")
+
     data = fits.getdata(chanfn)
     if np.all(np.isnan(data)) or np.nansum(data) == 0:
         if verbose:
@@ -713,71 +1447,40 @@ def check_channel(chanfn, verbose=True):
         return True
 
 
-def make_giant_mosaic_cube(filelist,
-                           reference_frequency,
-                           cdelt_kms,
-                           cubename,
-                           nchan,
-                           test=False, verbose=True,
-                           weightfilelist='auto',
-                           target_header=f'{basepath}/reduction_ACES/aces/imaging/data/header_12m.hdr',
-                           working_directory='/red/adamginsburg/ACES/workdir/mosaics/',
-                           channelmosaic_directory=f'{basepath}/mosaics/HNCO_Channels/',
-                           beam_threshold=3.2 * u.arcsec,
-                           channels='all',
-                           fail_if_cube_dropped=True,
-                           skip_channel_mosaicing=False,
-                           skip_final_combination=False,
-                           use_reproject_cube=False,
-                           parallel=True,
-                           use_beams=True,
-                           min_weight_fraction=0.05,
-                           **kwargs
-                           ):
+def load_giant_mosaic_inputs(filelist,
+                             weightfilelist='auto',
+                             beam_threshold=3.2 * u.arcsec,
+                             use_beams=True,
+                             min_weight_fraction=0.05,
+                             verbose=True,
+                             ):
     """
-    This takes too long as a full cube, so we have to do it slice-by-slice
-
-    channels : 'all' or a list of ints
-        This gives you the option to run only one channel at a time
-    beam_threshold : angle-like quantity
-        Cubes with beams larger than this will be excldued
+    Read the cubes and weight cubes for a giant mosaic, drop the cubes with
+    beams larger than ``beam_threshold``, and determine the common beam.
+
+    The cubes are left in their native spectral units so the same inputs can
+    be shared by every line in a spectral window; `giant_mosaic_line_cubes`
+    converts them to velocity around one line.
+
+    Returns
+    -------
+    cubes, weightcubes : list
+    commonbeam : radio_beam.Beam or None
+        None if the cubes have no beams or ``use_beams`` is False
     """
-
-    if verbose:
-        print(f"Mosaicing files {filelist} with weightfilelist={weightfilelist} and {nchan} channels", flush=True)
-
-    reference_frequency = u.Quantity(reference_frequency, u.Hz)
-
-    # Part 1: Make the header
-    header = make_giant_mosaic_cube_header(target_header=target_header,
-                                           reference_frequency=reference_frequency,
-                                           cdelt_kms=cdelt_kms,
-                                           nchan=nchan,
-                                           test=test)
-
-    # Part 2: Load the cubes
-    print("Converting spectral units", flush=True)
     with warnings.catch_warnings():
         warnings.simplefilter('ignore')
         cubes = [SpectralCube.read(fn,
                                    format='fits' if fn.endswith('fits') else 'casa_image',
-                                   use_dask=True).with_spectral_unit(u.km / u.s,
-                                                                     velocity_convention='radio',
-                                                                     rest_value=reference_frequency)
+                                   use_dask=True)
                  for fn in filelist]
         if weightfilelist == 'auto':
-            weightcubes = [(SpectralCube.read(fn.replace(".image.pbcor", ".weight"),
-                                              format='fits' if fn.endswith('fits') else 'casa_image', use_dask=True)
-                            .with_spectral_unit(u.km / u.s,
-                                                velocity_convention='radio',
-                                                rest_value=reference_frequency)
-                            ) for fn in filelist]
+            weightcubes = [SpectralCube.read(fn.replace(".image.pbcor", ".weight"),
+                                             format='fits' if fn.endswith('fits') else 'casa_image', use_dask=True)
+                           for fn in filelist]
         elif weightfilelist is not None:
             weightcubes = [SpectralCube.read(fn, format='fits' if fn.endswith('fits') else 'casa_image',
                                              use_dask=True)
-                           .with_spectral_unit(u.km / u.s,
-                                               velocity_convention='radio',
-                                               rest_value=reference_frequency)
                            for fn in weightfilelist]
         else:
             weightcubes = []
@@ -788,13 +1491,7 @@ def make_giant_mosaic_cube(filelist,
             weightcubes = [weightcube.with_mask(weightcube > min_weight_fraction * weightcube[weightcube.shape[0] // 2, :, :].max())
                            for weightcube in weightcubes]
 
-    # BUGFIX: there are FITS headers that incorrectly specify UTC in caps
-    for cube in cubes + weightcubes:
-        cube._wcs.wcs.timesys = cube.wcs.wcs.timesys.lower()
-        if hasattr(cube.mask, '_wcs'):
-            cube.mask._wcs.wcs.timesys = cube.wcs.wcs.timesys.lower()
-
-    # Part 3: Filter out bad cubes
+    # Filter out bad cubes
     # flag out wild outliers
     # there are 2 as of writing
     if verbose:
@@ -836,7 +1533,7 @@ def make_giant_mosaic_cube(filelist,
     if verbose:
         print(f"Cube, weightcube shapes after cut: {[(c1.shape, c2.shape) for c1, c2 in zip(cubes, weightcubes)]}")
 
-    # Part 4: Determine common beam
+    # Determine common beam
     if use_beams:
         if verbose:
             print("Determining common beam")
@@ -845,16 +1542,126 @@ def make_giant_mosaic_cube(filelist,
                                         else get_common_beam(cube.beams)
                                         for cube in cubes])
         commonbeam = get_common_beam(beams)
-        header.update(commonbeam.to_header_keywords())
     else:
         commonbeam = None
 
+    return cubes, weightcubes, commonbeam
+
+
+def giant_mosaic_line_cubes(cubes, weightcubes, reference_frequency):
+    """
+    Convert the cubes from `load_giant_mosaic_inputs` to radio velocity
+    around ``reference_frequency``.  This is cheap: no data are read.
+    """
+    reference_frequency = u.Quantity(reference_frequency, u.Hz)
+    print("Converting spectral units", flush=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        cubes = [cube.with_spectral_unit(u.km / u.s,
+                                         velocity_convention='radio',
+                                         rest_value=reference_frequency)
+                 for cube in cubes]
+        weightcubes = [cube.with_spectral_unit(u.km / u.s,
+                                               velocity_convention='radio',
+                                               rest_value=reference_frequency)
+                       for cube in weightcubes]
+
+    # BUGFIX: there are FITS headers that incorrectly specify UTC in caps
+    for cube in cubes + weightcubes:
+        cube._wcs.wcs.timesys = cube.wcs.wcs.timesys.lower()
+        if hasattr(cube.mask, '_wcs'):
+            cube.mask._wcs.wcs.timesys = cube.wcs.wcs.timesys.lower()
+
+    return cubes, weightcubes
+
+
+def make_giant_mosaic_cube(filelist,
+                           reference_frequency,
+                           cdelt_kms,
+                           cubename,
+                           nchan,
+                           test=False, verbose=True,
+                           weightfilelist='auto',
+                           target_header=f'{basepath}/reduction_ACES/aces/imaging/data/header_12m.hdr',
+                           working_directory='/red/adamginsburg/ACES/workdir/mosaics/',
+                           channelmosaic_directory=f'{basepath}/mosaics/HNCO_Channels/',
+                           beam_threshold=3.2 * u.arcsec,
+                           channels='all',
+                           fail_if_cube_dropped=True,
+                           skip_channel_mosaicing=False,
+                           skip_final_combination=False,
+                           use_reproject_cube=False,
+                           parallel=True,
+                           use_beams=True,
+                           min_weight_fraction=0.05,
+                           inputs=None,
+                           **kwargs
+                           ):
+    """
+    This takes too long as a full cube, so we have to do it slice-by-slice
+
+    channels : 'all' or a list of ints
+        This gives you the option to run only one channel at a time
+    beam_threshold : angle-like quantity
+        Cubes with beams larger than this will be excldued
+    use_reproject_cube : bool or 'windowed'
+        If True, mosaic the whole cubes at once with `mosaic_cubes`.  If
+        'windowed', use `mosaic_cubes_windowed`, which reprojects each cube
+        only into its footprint on the output grid, one spectral chunk at a
+        time (``spectral_block_size`` in ``kwargs``).
+    inputs : tuple or None
+        The output of `load_giant_mosaic_inputs`, to share the loaded cubes
+        between lines from the same files.  If given, ``filelist``,
+        ``weightfilelist``, ``beam_threshold``, ``use_beams`` and
+        ``min_weight_fraction`` are not used to load them again.
+    """
+
+    if verbose:
+        print(f"Mosaicing files {filelist} with weightfilelist={weightfilelist} and {nchan} channels", flush=True)
+
+    reference_frequency = u.Quantity(reference_frequency, u.Hz)
+
+    # Part 1: Make the header
+    header = make_giant_mosaic_cube_header(target_header=target_header,
+                                           reference_frequency=reference_frequency,
+                                           cdelt_kms=cdelt_kms,
+                                           nchan=nchan,
+                                           test=test)
+
+    # Parts 2-4: Load the cubes, filter out bad cubes, and determine the common beam
+    if inputs is None:
+        inputs = load_giant_mosaic_inputs(filelist,
+                                          weightfilelist=weightfilelist,
+                                          beam_threshold=beam_threshold,
+                                          use_beams=use_beams,
+                                          min_weight_fraction=min_weight_fraction,
+                                          verbose=verbose)
+    cubes, weightcubes, commonbeam = inputs
+    cubes, weightcubes = giant_mosaic_line_cubes(cubes, weightcubes, reference_frequency)
+    if commonbeam is not None:
+        header.update(commonbeam.to_header_keywords())
+
     if channels == 'all':
         channels = range(header['NAXIS3'])
     elif channels == 'slurm':
         channels = slurm_set_channels(nchan)
 
-    if use_reproject_cube:
+    if use_reproject_cube == 'windowed':
+        output_working_file = f'{working_directory}/{cubename}_CubeMosaic.fits'
+        output_file = f'{basepath}/mosaics/cubes/{cubename}_CubeMosaic.fits'
+        mosaic_cubes_windowed(cubes, header,
+                              output_file=output_working_file,
+                              weightcubes=weightcubes if len(weightcubes) == len(cubes) else None,
+                              commonbeam=commonbeam,
+                              fail_if_cube_dropped=fail_if_cube_dropped,
+                              verbose=verbose,
+                              **kwargs
+                              )
+        if verbose:
+            print(f"Moving {output_working_file} to {output_file}")
+        shutil.move(output_working_file, output_file)
+        assert os.path.exists(output_file), f"Failed to move {output_working_file} to {output_file}"
+    elif use_reproject_cube:
         # uses new (June 2024) feature of reproject to memmap intermediate steps
         output_working_file = f'{working_directory}/{cubename}_CubeMosaic.fits'
         output_file = f'{basepath}/mosaics/cubes/{cubename}_CubeMosaic.fits'
@@ -907,14 +1714,51 @@ def make_giant_mosaic_cube(filelist,
                                               )
 
 
+def read_channel_journal(journal_file):
+    """
+    Read the journal of completed channel slabs written by
+    `combine_channels_into_mosaic_cube`.
+
+    Returns a dict mapping each completed channel to the time it was written.
+    """
+    completed = {}
+    if not os.path.exists(journal_file):
+        return completed
+    with open(journal_file, 'r') as fh:
+        for line in fh:
+            # a partially-written last line from an interrupted run; its
+            # fields may still parse if only the time was cut short
+            if not line.endswith('\n'):
+                continue
+            try:
+                start, stop, written = line.split()
+                start, stop, written = int(start), int(stop), float(written)
+            except ValueError:
+                continue
+            for chan in range(start, stop):
+                completed[chan] = written
+    return completed
+
+
 def combine_channels_into_mosaic_cube(header, cubename, nchan, channels,
                                       working_directory='/red/adamginsburg/ACES/workdir/mosaics/',
                                       channelmosaic_directory=f'{basepath}/mosaics/HNCO_Channels/',
                                       verbose=False,
+                                      channels_per_slab=64,
                                       ):
+    """
+    Copy the per-channel mosaics into the full cube.
+
+    Runs of up to ``channels_per_slab`` consecutive channels are buffered and
+    written as one contiguous slab with `os.pwrite`.  Each completed slab is
+    recorded in a journal next to the cube (``<cube>.journal``) after its data
+    are synced to disk, so a resumed run skips completed channels without
+    reading them again unless the channel file has been modified since.
+    """
     # Part 6: Create output supergiant cube into which final product will be stashed
     output_working_file = f'{working_directory}/{cubename}_CubeMosaic.fits'
     output_file = f'{basepath}/mosaics/cubes/{cubename}_CubeMosaic.fits'
+    journal_file = f'{output_working_file}.journal'
     if verbose:
         print(f"Beginning combination: working file is {output_working_file} (exists={os.path.exists(output_working_file)}) and final output is {output_file} (exists={os.path.exists(output_file)})")
     if os.path.exists(output_working_file) and not os.path.exists(output_file):
@@ -941,53 +1785,136 @@ def combine_channels_into_mosaic_cube(header, cubename, nchan, channels,
             fobj.seek(len(header.tostring()) +
                       (np.prod(shape_opt) * np.abs(header['BITPIX'] // 8)) - 1)
             fobj.write(b'\0')
+        # a journal left over from a previous cube does not apply to this one
+        if os.path.exists(journal_file):
+            os.remove(journal_file)
     elif os.path.exists(output_file) and not os.path.exists(output_working_file):
         if verbose:
             print(f"Working on file {output_file}, but moving it to {output_working_file} first")
         shutil.move(output_file, output_working_file)
+        if os.path.exists(f'{output_file}.journal'):
+            shutil.move(f'{output_file}.journal', journal_file)
         if verbose:
             print(f"Completed move of {output_file} to {output_working_file}")
     else:
         raise ValueError(f"This outcome should not be possible: both {output_file} and {output_working_file} exist")
 
-    hdu = fits.open(output_working_file)
-    if hdu[0].data.shape[0] != nchan:
-        raise ValueError(f"Existing file on disk {output_working_file} has {hdu[0].data.shape[0]} channels instead of the requested {nchan}")
+    with fits.open(output_working_file) as hdu:
+        shape = hdu[0].shape
+        bitpix = hdu[0].header['BITPIX']
+        data_offset = hdu.fileinfo(0)['datLoc']
+    if shape[0] != nchan:
+        raise ValueError(f"Existing file on disk {output_working_file} has {shape[0]} channels instead of the requested {nchan}")
+
+    # FITS data are big-endian
+    dtype = np.dtype({8: 'u1', 16: '>i2', 32: '>i4', 64: '>i8', -32: '>f4', -64: '>f8'}[bitpix])
+    plane_size = shape[1] * shape[2] * dtype.itemsize
+    buffer = np.empty((channels_per_slab, shape[1], shape[2]), dtype=dtype)
 
-    hdu = fits.open(output_working_file, mode='update', overwrite=True)
-    output_array = hdu[0].data
-    hdu.flush()  # make sure the header gets written right
+    completed = read_channel_journal(journal_file)
 
-    # Part 7: Populate supergiant cube by copying data over, channel-by-channel
+    # Part 7: Populate supergiant cube by copying data over in slabs of consecutive channels
     if verbose:
         print(f"Beginning channel filling from channel mosaic directory {channelmosaic_directory}")
         pbar = tqdm(channels, desc='Channels')
     else:
         pbar = channels
-    status = {'filled': [], 'skipped': []}
-    for chan in pbar:
-        chanfn = f'{channelmosaic_directory}/{cubename}_CubeMosaic_channel{chan}.fits'
-        if os.path.exists(chanfn):
-            if verbose:
-                pbar.set_description('Channels (filling)')
-            output_array[chan] = fits.getdata(chanfn)
-            if verbose:
-                pbar.set_description('Channels (flushing)')
-            hdu.flush()
-            status['filled'].append(chan)
-        else:
-            pbar.set_description("Channels (skip)")
-            status['skipped'].append(chan)
+    status = {'filled': [], 'skipped': [], 'already done': []}
+
+    fd = os.open(output_working_file, os.O_RDWR)
+    try:
+        with open(journal_file, 'a') as journal:
+
+            slab_start, slab_time, nbuffered = None, None, 0
+
+            def write_slab():
+                if nbuffered == 0:
+                    return
+                os.pwrite(fd, memoryview(buffer[:nbuffered]).cast('B'),
+                          data_offset + slab_start * plane_size)
+                os.fsync(fd)
+                journal.write(f"{slab_start} {slab_start + nbuffered} {slab_time}\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+
+            for chan in pbar:
+                chanfn = f'{channelmosaic_directory}/{cubename}_CubeMosaic_channel{chan}.fits'
+                if not os.path.exists(chanfn):
+                    if verbose:
+                        pbar.set_description("Channels (skip)")
+                    status['skipped'].append(chan)
+                    continue
+                if chan in completed and os.path.getmtime(chanfn) <= completed[chan]:
+                    status['already done'].append(chan)
+                    continue
+
+                if nbuffered > 0 and (chan != slab_start + nbuffered or nbuffered == channels_per_slab):
+                    if verbose:
+                        pbar.set_description('Channels (writing)')
+                    write_slab()
+                    nbuffered = 0
+                if nbuffered == 0:
+                    # record the time before reading so that a channel file
+                    # modified during the slab is not considered done
+                    slab_start, slab_time = chan, time.time()
+
+                if verbose:
+                    pbar.set_description('Channels (filling)')
+                buffer[nbuffered] = fits.getdata(chanfn)
+                nbuffered += 1
+                status['filled'].append(chan)
+            write_slab()
+    finally:
+        os.close(fd)
 
     if verbose:
         print(f"Status of filling: {status}")
         print(f"Moving {output_working_file} to {output_file}")
     shutil.move(output_working_file, output_file)
+    shutil.move(journal_file, f'{output_file}.journal')
     assert os.path.exists(output_file), f"Failed to move {output_working_file} to {output_file}"
     if verbose:
         print(f"Successfully moved {output_working_file} to {output_file}")
 
 
+def create_fits_memmap(filename, header, shape, dtype='>f4', overwrite=True):
+    """
+    Create a pre-sized FITS file without writing any data and return a
+    writeable memmap of its data segment.
+
+    Parameters
+    ----------
+    filename : str
+        The output file
+    header : `~astropy.io.fits.Header`
+        The header to write.  The NAXIS and BITPIX keywords are set from
+        ``shape`` and ``dtype``.
+    shape : tuple
+        The numpy-order shape of the data
+    dtype : str
+        A big-endian numpy dtype (FITS is big-endian); one of
+        '>f4', '>f8', '>i2', '>i4', '>i8', or 'u1'
+    """
+    dtype = np.dtype(dtype)
+    # start from a minimal header so the mandatory keywords are in the right order
+    structural = ('SIMPLE', 'BITPIX', 'NAXIS', 'EXTEND', 'BSCALE', 'BZERO', 'BLANK')
+    hdu = fits.PrimaryHDU(data=np.zeros([1] * len(shape), dtype=dtype.newbyteorder('=')))
+    hdu.header.extend([card for card in header.cards
+                       if card.keyword not in structural and not card.keyword.startswith('NAXIS')])
+    header = hdu.header
+    for ii, size in enumerate(shape[::-1]):
+        header[f'NAXIS{ii + 1}'] = size
+
+    header.tofile(filename, overwrite=overwrite)
+    header_size = len(header.tostring())
+    data_size = int(np.prod(shape)) * dtype.itemsize
+    with open(filename, 'rb+') as fobj:
+        # FITS files must be padded to a multiple of 2880 bytes
+        fobj.truncate(header_size + int(np.ceil(data_size / 2880) * 2880))
+
+    return np.memmap(filename, dtype=dtype, mode='r+', offset=header_size, shape=tuple(shape))
+
+
 def slurm_set_channels(nchan):
     if os.getenv('SLURM_ARRAY_TASK_ID') is not None:
         slurm_array_task_id = int(os.getenv('SLURM_ARRAY_TASK_ID'))
@@ -1115,7 +2042,204 @@ def rms_map(img, kernel=Gaussian2DKernel(10)):
     return rms
 
 
-def rms(prefix='12m_continuum', folder='12m_flattened', threshold=2.5, nbeams=3, maxiter=50):
+class FFTSmoother:
+    """
+    Convolution of images of one shape with one kernel, giving the same
+    result as ``convolve_fft(img, kernel, allow_huge=True)`` (NaNs
+    interpolated over, zero fill outside the image) but with the kernel's
+    transform computed once and reused for every image.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the images to be convolved
+    kernel : `~astropy.convolution.Kernel2D` or array
+        The kernel; it is normalized to unit sum
+    tile_size : int, optional
+        Convolve in tiles of at most ``tile_size`` x ``tile_size`` pixels (plus
+        the kernel's half-width on each side, so the result is unchanged) to
+        bound the memory use
+    workers : int, optional
+        Number of threads for `scipy.fft`
+    """
+
+    def __init__(self, shape, kernel, tile_size=None, workers=None):
+        kernel = np.asarray(getattr(kernel, 'array', kernel), dtype='float64')
+        self.shape = tuple(shape)
+        self.halo = tuple(size // 2 for size in kernel.shape)
+        tileshape = self.shape if tile_size is None else tuple(min(tile_size, size) for size in self.shape)
+        self.tileshape = tileshape
+        self.padshape = tuple(size + 2 * halo for size, halo in zip(tileshape, self.halo))
+        # at least one halo beyond the padded tile so the wrap-around of the
+        # circular convolution does not reach the tile
+        self.fftshape = tuple(scipy.fft.next_fast_len(size + halo, real=True)
+                              for size, halo in zip(self.padshape, self.halo))
+        self.workers = workers
+
+        # kernel centered on the origin
+        bigkernel = np.zeros(self.fftshape)
+        bigkernel[:kernel.shape[0], :kernel.shape[1]] = kernel / kernel.sum()
+        bigkernel = np.roll(bigkernel, (-self.halo[0], -self.halo[1]), axis=(0, 1))
+        self.kernel_fft = scipy.fft.rfft2(bigkernel, workers=workers)
+
+    def convolve_filled(self, data, outside=0):
+        """
+        Convolve ``data`` (which must be finite) as if it were surrounded by
+        ``outside``
+        """
+        (hy, hx), (ty, tx) = self.halo, self.tileshape
+        ny, nx = self.shape
+        result = np.empty(self.shape)
+        for y0 in range(0, ny, ty):
+            for x0 in range(0, nx, tx):
+                y1, x1 = min(y0 + ty, ny), min(x0 + tx, nx)
+                tile = np.full(self.padshape, outside, dtype='float64')
+                sy0, sx0 = max(y0 - hy, 0), max(x0 - hx, 0)
+                sy1, sx1 = min(y1 + hy, ny), min(x1 + hx, nx)
+                tile[sy0 - y0 + hy:sy1 - y0 + hy, sx0 - x0 + hx:sx1 - x0 + hx] = data[sy0:sy1, sx0:sx1]
+                conv = scipy.fft.irfft2(scipy.fft.rfft2(tile, s=self.fftshape, workers=self.workers) * self.kernel_fft,
+                                        s=self.fftshape, workers=self.workers)
+                result[y0:y1, x0:x1] = conv[hy:hy + y1 - y0, hx:hx + x1 - x0]
+        return result
+
+    def smoother(self, valid, outside_weight=1):
+        """
+        A function that smooths images whose valid pixels are ``valid``,
+        interpolating over the others.  The weights are convolved once and
+        shared by every image smoothed with the returned function.
+        """
+        weights = self.convolve_filled(valid.astype('float64'), outside=outside_weight)
+        noweight = weights < 10 * np.finfo(weights.dtype).eps
+
+        def smooth(img):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                smoothed = self.convolve_filled(np.where(valid, img, 0)) / weights
+            smoothed[noweight] = 0
+            return smoothed
+
+        return smooth
+
+
+def _block_sum(data, factor, outside=0):
+    ny, nx = data.shape
+    padded = np.full((-(-ny // factor) * factor, -(-nx // factor) * factor), outside, dtype='float64')
+    padded[:ny, :nx] = data
+    return padded.reshape(padded.shape[0] // factor, factor, padded.shape[1] // factor, factor).sum(axis=(1, 3))
+
+
+def _upsample(data, factor, shape):
+    """
+    Bilinear interpolation of block-summed ``data`` back to ``shape``, one
+    axis at a time
+    """
+    for axis, size in enumerate(shape):
+        # coarse pixel i is centered on fine pixel factor * i + (factor - 1) / 2
+        coord = np.clip((np.arange(size) - (factor - 1) / 2) / factor, 0, data.shape[axis] - 1)
+        index = np.minimum(coord.astype(int), data.shape[axis] - 2) if data.shape[axis] > 1 else np.zeros(size, dtype=int)
+        frac = coord - index
+        lower, upper = np.take(data, index, axis=axis), np.take(data, np.minimum(index + 1, data.shape[axis] - 1), axis=axis)
+        frac = frac[:, None] if axis == 0 else frac[None, :]
+        data = lower * (1 - frac) + upper * frac
+    return data
+
+
+def fft_rms_map(img, kernelwidth, smoother=None, downsample=1, tile_size=None, workers=None):
+    """
+    `rms_map` with a Gaussian kernel of width ``kernelwidth`` pixels, using
+    an `FFTSmoother` so that the kernel transform is shared between the two
+    smoothing steps (and, if ``smoother`` is passed in, between calls).  The
+    smoothing weights, i.e. the convolved map of valid pixels, are also
+    computed once and shared.
+
+    With ``downsample`` > 1, the smoothing is done on ``downsample`` x
+    ``downsample`` block sums with a correspondingly narrower kernel and
+    interpolated back to full resolution.  This adds the block width in
+    quadrature to the kernel width, so it should be used only with
+    ``downsample`` well below ``kernelwidth``.
+
+    Returns the rms map and the smoother, which can be reused for images of
+    the same shape.
+    """
+    valid = np.isfinite(img)
+    if downsample == 1:
+        if smoother is None:
+            smoother = FFTSmoother(img.shape, Gaussian2DKernel(kernelwidth), tile_size=tile_size, workers=workers)
+        smooth = smoother.smoother(valid)
+    else:
+        coarse_valid = _block_sum(valid, downsample, outside=1)
+        if smoother is None:
+            smoother = FFTSmoother(coarse_valid.shape, Gaussian2DKernel(kernelwidth / downsample),
+                                   tile_size=tile_size, workers=workers)
+        smooth_coarse = smoother.smoother(np.ones(coarse_valid.shape, dtype=bool), outside_weight=downsample**2)
+        coarse_weights = smooth_coarse(coarse_valid)
+
+        def smooth(data):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                smoothed = smooth_coarse(_block_sum(np.where(valid, data, 0), downsample)) / coarse_weights
+            return _upsample(np.nan_to_num(smoothed), downsample, img.shape)
+
+    sm = smooth(img)
+    var = (img - sm)**2
+    # rounding in the transforms can leave tiny negative variances
+    return np.clip(smooth(var), 0, None)**0.5, smoother
+
+
+def iterative_rms_map(img, kernelwidth, threshold=2.5, maxiter=50, mask_tolerance=1e-5,
+                      downsample=1, tile_size=None, workers=None, verbose=True):
+    """
+    RMS map with the pixels above ``threshold`` times the local rms masked,
+    iterating until the mask stops changing.
+
+    Each iteration masks the pixels detected against the previous map and
+    recomputes it with `fft_rms_map`, reusing one `FFTSmoother`.  Iteration
+    stops when an iteration detects no more than ``mask_tolerance`` times
+    the number of valid pixels (``mask_tolerance=0`` iterates until nothing
+    new is detected) or after ``maxiter`` iterations.
+
+    Returns
+    -------
+    rms : array
+        The rms map before masking
+    maskedrms : array
+        The rms map after masking
+    ndet : list
+        The number of pixels masked in each iteration
+    """
+    rms, smoother = fft_rms_map(img, kernelwidth, downsample=downsample, tile_size=tile_size, workers=workers)
+    nvalid = np.isfinite(img).sum()
+
+    datacopy = np.array(img, dtype='float64')
+    maskedrms = rms
+    ndet = []
+    for ii in range(maxiter):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            detections = (datacopy / maskedrms) > threshold
+        ndet_this = detections.sum()
+        if ndet_this <= mask_tolerance * nvalid:
+            if verbose:
+                print(f"Converged in {ii} iterations ({ndet_this} new detections)")
+            break
+        ndet.append(ndet_this)
+        if verbose:
+            print(f"Iteration {ii} detected {ndet}")
+
+        datacopy[detections] = np.nan
+        maskedrms, smoother = fft_rms_map(datacopy, kernelwidth, smoother=smoother, downsample=downsample)
+
+    return rms, maskedrms, ndet
+
+
+def rms(prefix='12m_continuum', folder='12m_flattened', threshold=2.5, nbeams=3, maxiter=50,
+        mask_tolerance=1e-5, downsample=1, tile_size=None, workers=None):
+    """
+    Write an rms map and a masked rms map (see `iterative_rms_map`) for each
+    mosaic matching ``prefix`` in ``folder``.
+
+    The rms is measured in a Gaussian kernel ``nbeams`` beam major axes wide.
+    ``workers`` defaults to the number of CPUs available to this process.
+    """
+    if workers is None and hasattr(os, 'sched_getaffinity'):
+        workers = len(os.sched_getaffinity(0))
     rms_targets = glob.glob(f'{basepath}/mosaics/{folder}/{prefix}*mosaic.fits')
     rms_targets = [x for x in rms_targets if 'rms' not in x]
     print("Making RMS maps for", rms_targets)
@@ -1132,31 +2256,20 @@ def rms(prefix='12m_continuum', folder='12m_flattened', threshold=2.5, nbeams=3,
             kernelwidth = (2.5 * u.arcsec / pixscale).decompose()
 
         nans = np.isnan(fh[0].data)
-        rms = rms_map(fh[0].data, kernel=Gaussian2DKernel(kernelwidth))
+        rms, maskedrms, ndet = iterative_rms_map(fh[0].data, float(kernelwidth), threshold=threshold,
+                                                 maxiter=maxiter, mask_tolerance=mask_tolerance,
+                                                 downsample=downsample, tile_size=tile_size,
+                                                 workers=workers)
         rms[nans] = np.nan
 
         outname = fn.replace("_mosaic.fits", "_rms_mosaic.fits")
         fits.PrimaryHDU(data=rms, header=fh[0].header).writeto(outname, overwrite=True)
         print(f"Finished RMS map for {fn}")
 
-        datacopy = copy.copy(fh[0].data)
-        ndet = []
-        for ii in range(maxiter):
-            # second iteration: threshold and try again
-            detections = (datacopy / rms) > threshold
-            ndet_this = detections.sum()
-            if ndet_this == 0:
-                print(f"Converged in {ii} iterations")
-                break
-            ndet.append(ndet_this)
-            print(f"Iteration {ii} detected {ndet}")
-
-            datacopy[detections] = np.nan
-            rms = rms_map(datacopy, kernel=Gaussian2DKernel(kernelwidth))
-        rms[nans] = np.nan
+        maskedrms[nans] = np.nan
 
         outname = fn.replace("_mosaic.fits", "_maskedrms_mosaic.fits")
-        fits.PrimaryHDU(data=rms, header=fh[0].header).writeto(outname, overwrite=True)
+        fits.PrimaryHDU(data=maskedrms, header=fh[0].header).writeto(outname, overwrite=True)
         print(f"Finished masked RMS map for {fn}.  Detections iterated: {ndet}")
 
 
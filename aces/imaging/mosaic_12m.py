@@ -18,10 +18,13 @@ from aces.imaging.make_mosaic import (read_as_2d, get_peak,
                                       get_m0,
                                       make_downsampled_cube,
                                       make_giant_mosaic_cube,
+                                      load_giant_mosaic_inputs,
                                       rms,
                                       downsample_spectrally
                                       )
 from aces.imaging.make_mosaic import make_mosaic as make_mosaic_, all_lines as all_lines_
+from aces.imaging.line_registry import line_registry, line_tasks, task_channels, slurm_line_tasks, feathered_filelist
+from aces.utils.tasks import run_tasks
 # import os
 # from functools import partial
 from multiprocessing import Process, Pool
@@ -668,202 +671,173 @@ def get_weightfile(filename, spw):
     return flist[0]
 
 
-def make_giant_mosaic_cube_cs21(**kwargs):
+def line_filelists(spw, description=''):
     """
-    Sep 2023: Fields ar and ad are excluded because of their beams
-    and shouldn't be, but it is.
-    (but they're back in as of 2024ish)
+    The feathered cubes of ``spw`` and their weight files
     """
+    filelist = feathered_filelist(spw)
 
-    #filelist = glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw33.cube.I.iter1.image.pbcor.statcont.contsub.fits')
-    #filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw33.cube.I.manual*image.pbcor.statcont.contsub.fits')
-    #filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*sci33.cube.I.manual*image.pbcor.statcont.contsub.fits')
-    #filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw33.cube.I.iter1.reclean*image.pbcor.statcont.contsub.fits')
-    # this next line is only for field am and should be removed b/c we need the .pb/.weight
-    #filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/manual/*33.cube.I.manual.pbcor.fits')
-    # TODO when feathered data are ready
-    filelist = glob.glob('/orange/adamginsburg/ACES/upload/Feather_12m_7m_TP/SPW33/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_33.image.statcont.contsub.fits')
-
-    print(f"Found {len(filelist)} CS 2-1-containing spw33 files")
+    print(f"Found {len(filelist)} {description}spw{spw} files")
 
     check_files(filelist)
 
-    weightfilelist = [get_weightfile(fn, spw=33) for fn in filelist]
+    weightfilelist = [get_weightfile(fn, spw=spw) for fn in filelist]
     for fn in weightfilelist:
         assert os.path.exists(fn)
 
-    # am has 2.83" beam
-    restfrq = 97.98095330e9
-    cdelt_kms = 1.4844932
-    make_giant_mosaic_cube(filelist,
-                           weightfilelist=weightfilelist,
-                           reference_frequency=restfrq,
-                           cdelt_kms=cdelt_kms,
-                           cubename='CS21',
-                           nchan=350,
-                           beam_threshold=2.9 * u.arcsec,
-                           channelmosaic_directory=f'{basepath}/mosaics/CS21_Channels/',
-                           **kwargs,)
-
-    if not kwargs.get('skip_final_combination') and not kwargs.get('test'):
-        # for unknown reasons, this one _really_ doesn't like dask
-        make_downsampled_cube(f'{basepath}/mosaics/cubes/CS21_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/CS21_CubeMosaic_downsampled9.fits',
-                              overwrite=True,
-                              use_dask=False
-                              )
+    return filelist, weightfilelist
 
 
-def make_giant_mosaic_cube_sio21(**kwargs):
+def line_cube_kwargs(entry):
+    return dict(reference_frequency=entry['restfreq'],
+                cdelt_kms=entry['cdelt_kms'],
+                cubename=entry['cubename'],
+                nchan=entry['nchan'],
+                beam_threshold=entry['beam_threshold'],
+                channelmosaic_directory=f'{basepath}/mosaics/{entry["cubename"]}_Channels/',
+                fail_if_cube_dropped=entry['fail_if_cube_dropped'],
+                )
 
-    filelist = glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw27.cube.I.iter1.image.pbcor.statcont.contsub.fits')
-    filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw27.cube.I.manual*image.pbcor.statcont.contsub.fits')
-    filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*sci27.cube.I.manual*image.pbcor.statcont.contsub.fits')
-    # should exist in cal/working filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/manual/*27.cube.I.manual.pbcor.fits')
-    filelist = glob.glob('/orange/adamginsburg/ACES/upload/Feather_12m_7m_TP/SPW27/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_27.image.statcont.contsub.fits')
 
-    print(f"Found {len(filelist)} SiO 2-1-containing spw27 files")
+def downsample_line_cube(entry):
+    cubename = entry['cubename']
+    make_downsampled_cube(f'{basepath}/mosaics/cubes/{cubename}_CubeMosaic.fits',
+                          f'{basepath}/mosaics/cubes/{cubename}_CubeMosaic_downsampled9.fits',
+                          **entry['downsample_kwargs'])
+    if entry['spectral_factor'] is not None:
+        downsample_spectrally(f'{basepath}/mosaics/cubes/{cubename}_CubeMosaic.fits',
+                              f'{basepath}/mosaics/cubes/{cubename}_CubeMosaic_spectrally.fits',
+                              factor=entry['spectral_factor'],
+                              )
 
-    check_files(filelist)
 
-    weightfilelist = [get_weightfile(fn, spw=27) for fn in filelist]
-    for fn in weightfilelist:
-        assert os.path.exists(fn)
+def make_registered_line_cube(cubename, **kwargs):
+    """
+    Make the giant cube of one line in `aces.imaging.line_registry`.
+    ``kwargs`` are passed to `make_giant_mosaic_cube`.
+    """
+    entry, = line_registry(lines=[cubename])
+    filelist, weightfilelist = line_filelists(entry['spw'], description=f'{cubename}-containing ')
 
-    restfrq = 86.84696e9
-    cdelt_kms = 0.84455895
     make_giant_mosaic_cube(filelist,
                            weightfilelist=weightfilelist,
-                           reference_frequency=restfrq,
-                           cdelt_kms=cdelt_kms,
-                           cubename='SiO21',
-                           nchan=600,
-                           # field am is 3.22"
-                           beam_threshold=3.3 * u.arcsec,
-                           channelmosaic_directory=f'{basepath}/mosaics/SiO21_Channels/',
+                           **line_cube_kwargs(entry),
                            **kwargs,)
 
     if not kwargs.get('skip_final_combination') and not kwargs.get('test'):
-        make_downsampled_cube(f'{basepath}/mosaics/cubes/SiO21_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/SiO21_CubeMosaic_downsampled9.fits',
-                              )
-        downsample_spectrally(f'{basepath}/mosaics/cubes/SiO21_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/SiO21_CubeMosaic_spectrally.fits',
-                              factor=2,
-                              )
-
+        downsample_line_cube(entry)
 
-def make_giant_mosaic_cube_hnco(**kwargs):
 
-    # filelist = glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw31.cube.I.iter1.image.pbcor.statcont.contsub.fits')
-    # filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw31.cube.I.manual*image.pbcor.statcont.contsub.fits')
-    # filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*sci31.cube.I.manual*image.pbcor.statcont.contsub.fits')
-    # filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/manual/*31.cube.I.manual.pbcor.fits')
-    filelist = glob.glob('/orange/adamginsburg/ACES/upload/Feather_12m_7m_TP/SPW31/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.hnco43.image.statcont.contsub.fits')
+def make_line_cubes(task, combine=False, test=False, verbose=True, **kwargs):
+    """
+    Make every line of one task from `aces.imaging.line_registry.line_tasks`.
 
-    print(f"Found {len(filelist)} HNCO-containing spw31 files")
+    The spectral window's cubes are loaded once (once per beam threshold)
+    and shared by all of its lines.  If ``combine``, the channels of each
+    line (made by all tasks) are combined into the final and downsampled
+    cubes instead.
+    """
+    filelist, weightfilelist = line_filelists(task['spw'])
+
+    inputs = {}
+    for entry in task['lines']:
+        beam_threshold = entry['beam_threshold']
+        if beam_threshold not in inputs:
+            inputs[beam_threshold] = load_giant_mosaic_inputs(filelist,
+                                                              weightfilelist=weightfilelist,
+                                                              beam_threshold=beam_threshold,
+                                                              verbose=verbose)
+
+        logprint(f"{'Combining' if combine else 'Mosaicing'} {entry['cubename']} from spw{task['spw']} "
+                 f"(chunk {task['chunk']} of {task['nchunks']})")
+        make_giant_mosaic_cube(filelist,
+                               weightfilelist=weightfilelist,
+                               inputs=inputs[beam_threshold],
+                               channels='all' if combine else task_channels(task, entry),
+                               skip_channel_mosaicing=combine,
+                               skip_final_combination=not combine,
+                               test=test,
+                               verbose=verbose,
+                               **line_cube_kwargs(entry),
+                               **kwargs)
+
+        if combine and not test:
+            downsample_line_cube(entry)
+
+    return [entry['cubename'] for entry in task['lines']]
+
+
+def main_cubes():
+    """
+    Make the giant cubes of all registered lines (or those given with
+    --lines) with one shared pool of workers.
 
-    check_files(filelist)
+    In a SLURM array, each array task makes its share of the channel chunks
+    of every spectral window and the combination is left to a separate
+    ``--combine-only`` job that runs after the array.
+    """
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option('--lines', dest='lines', default=None,
+                      help="Comma-separated cube names to make (default: all registered lines)")
+    parser.add_option('--nchunks', dest='nchunks', default=None, type='int',
+                      help="Number of channel chunks per line (default: the SLURM array size, or 1)")
+    parser.add_option('--workers', dest='workers', default=1, type='int',
+                      help="Number of worker processes")
+    parser.add_option('--combine-only', dest='combine_only', default=False, action='store_true',
+                      help="Only combine the channels into cubes")
+    parser.add_option('--test', dest='test', default=False, action='store_true')
+    (options, args) = parser.parse_args()
 
-    weightfilelist = [get_weightfile(fn, spw=31) for fn in filelist]
-    for fn in weightfilelist:
-        assert os.path.exists(fn)
+    np.seterr('ignore')
 
-    restfrq = 87.925238e9
-    cdelt_kms = 0.20818593  # smooth by 2 chans
-    make_giant_mosaic_cube(filelist,
-                           weightfilelist=weightfilelist,
-                           reference_frequency=restfrq,
-                           cdelt_kms=cdelt_kms,
-                           cubename='HNCO',
-                           nchan=1400,
-                           beam_threshold=3.3 * u.arcsec,
-                           channelmosaic_directory=f'{basepath}/mosaics/HNCO_Channels/',
-                           fail_if_cube_dropped=False,
-                           #use_reproject_cube=True,
-                           parallel=os.getenv('SLURM_NTASKS'),
-                           **kwargs,)
+    entries = line_registry(lines=options.lines.split(",") if options.lines else None)
+    in_array = os.getenv('SLURM_ARRAY_TASK_ID') is not None
+    nchunks = options.nchunks or (int(os.getenv('SLURM_ARRAY_TASK_COUNT')) if in_array else 1)
+
+    stages = [True] if options.combine_only else ([False] if in_array else [False, True])
+    for combine in stages:
+        tasks = line_tasks(entries, nchunks=1 if combine else nchunks)
+        if not combine:
+            tasks = slurm_line_tasks(tasks)
+        logprint(f"{'Combining' if combine else 'Mosaicing'} {len(tasks)} tasks with {options.workers} workers")
+
+        errors = []
+        for task, cubenames, error in run_tasks(tasks, measure=make_line_cubes, nworkers=options.workers,
+                                                combine=combine, test=options.test):
+            if error is not None:
+                errors.append(f"spw{task['spw']} chunk {task['chunk']}: {error}")
+                logprint(f"Failed spw{task['spw']} chunk {task['chunk']}: {error}")
+            else:
+                logprint(f"Finished {cubenames} chunk {task['chunk']}")
 
-    # 2024-06-15: using reproject_cube; no final step needed
-    if not kwargs.get('skip_final_combination') and not kwargs.get('test'):
-        make_downsampled_cube(f'{basepath}/mosaics/cubes/HNCO_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/HNCO_CubeMosaic_downsampled9.fits',
-                              )
-        downsample_spectrally(f'{basepath}/mosaics/cubes/HNCO_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/HNCO_CubeMosaic_spectrally.fits',
-                              factor=7,
-                              )
+        if errors:
+            raise ValueError(f"{len(errors)} tasks failed: {errors}")
 
 
-def make_giant_mosaic_cube_nsplus(**kwargs):
+def make_giant_mosaic_cube_cs21(**kwargs):
+    """
+    Sep 2023: Fields ar and ad are excluded because of their beams
+    and shouldn't be, but it is.
+    (but they're back in as of 2024ish)
+    """
+    make_registered_line_cube('CS21', **kwargs)
 
-    filelist = glob.glob('/orange/adamginsburg/ACES/upload/Feather_12m_7m_TP/SPW35/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_35.image.statcont.contsub.fits')
 
-    print(f"Found {len(filelist)} NSplus-containing spw35 files")
+def make_giant_mosaic_cube_sio21(**kwargs):
+    make_registered_line_cube('SiO21', **kwargs)
 
-    check_files(filelist)
 
-    weightfilelist = [get_weightfile(fn, spw=35) for fn in filelist]
-    for fn in weightfilelist:
-        assert os.path.exists(fn)
+def make_giant_mosaic_cube_hnco(**kwargs):
+    make_registered_line_cube('HNCO', **kwargs)
 
-    restfrq = 100.198e9
-    cdelt_kms = 1.47015502
-    make_giant_mosaic_cube(filelist,
-                           weightfilelist=weightfilelist,
-                           reference_frequency=restfrq,
-                           cdelt_kms=cdelt_kms,
-                           cubename='NSplus',
-                           nchan=350,
-                           # 2.35 is OK except o (2.38) and am (2.64)
-                           # but am, despite its 2.64" beam, was excluded (??) with the 2.65" threshold.  As was o.  So maybe this is just a rerun?
-                           beam_threshold=2.75 * u.arcsec,
-                           channelmosaic_directory=f'{basepath}/mosaics/NSplus_Channels/',
-                           **kwargs,)
 
-    if not kwargs.get('skip_final_combination') and not kwargs.get('test'):
-        make_downsampled_cube(f'{basepath}/mosaics/cubes/NSplus_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/NSplus_CubeMosaic_downsampled9.fits',
-                              )
+def make_giant_mosaic_cube_nsplus(**kwargs):
+    make_registered_line_cube('NSplus', **kwargs)
 
 
 def make_giant_mosaic_cube_hc3n(**kwargs):
-
-    #filelist = glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw35.cube.I.iter1.image.pbcor.statcont.contsub.fits')
-    #filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw35.cube.I.manual*image.pbcor.statcont.contsub.fits')
-    #filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*sci35.cube.I.manual*image.pbcor.statcont.contsub.fits')
-    #filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw35.cube.I.iter1.reclean.image.pbcor.statcont.contsub.fits')
-    #filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/manual/*35.cube.I.manual.pbcor.fits')
-    filelist = glob.glob('/orange/adamginsburg/ACES/upload/Feather_12m_7m_TP/SPW35/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_35.image.statcont.contsub.fits')
-
-    print(f"Found {len(filelist)} HC3N-containing spw35 files")
-
-    check_files(filelist)
-
-    weightfilelist = [get_weightfile(fn, spw=35) for fn in filelist]
-    for fn in weightfilelist:
-        assert os.path.exists(fn)
-
-    restfrq = 100.0763e9
-    cdelt_kms = 1.47015502
-    make_giant_mosaic_cube(filelist,
-                           weightfilelist=weightfilelist,
-                           reference_frequency=restfrq,
-                           cdelt_kms=cdelt_kms,
-                           cubename='HC3N',
-                           nchan=350,
-                           # 2.35 is OK except o (2.38) and am (2.64)
-                           # but am, despite its 2.64" beam, was excluded (??) with the 2.65" threshold.  As was o.  So maybe this is just a rerun?
-                           beam_threshold=2.75 * u.arcsec,
-                           channelmosaic_directory=f'{basepath}/mosaics/HC3N_Channels/',
-                           **kwargs,)
-
-    if not kwargs.get('skip_final_combination') and not kwargs.get('test'):
-        make_downsampled_cube(f'{basepath}/mosaics/cubes/HC3N_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/HC3N_CubeMosaic_downsampled9.fits',
-                              overwrite=True,
-                              use_dask=False
-                              )
+    make_registered_line_cube('HC3N', **kwargs)
 
 
 def make_giant_mosaic_cube_hnco_TP7m12m_minitest(**kwargs):
@@ -947,44 +921,7 @@ def make_giant_mosaic_cube_hnco_TP7m12m(**kwargs):
 
 
 def make_giant_mosaic_cube_hcop(**kwargs):
-
-    #filelist = glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw29.cube.I.iter1.image.pbcor.statcont.contsub.fits')
-    #filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw29.cube.I.manual*image.pbcor.statcont.contsub.fits')
-    #filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*sci29.cube.I.manual*image.pbcor.statcont.contsub.fits')
-    #filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/manual/*29.cube.I.manual.pbcor.fits')
-    filelist = glob.glob('/orange/adamginsburg/ACES/upload/Feather_12m_7m_TP/SPW29/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.hco+10.image.statcont.contsub.fits')
-
-    print(f"Found {len(filelist)} HCOP-containing spw29 files")
-
-    check_files(filelist)
-
-    weightfilelist = [get_weightfile(fn, spw=29) for fn in filelist]
-    for fn in weightfilelist:
-        assert os.path.exists(fn)
-
-    restfrq = 89.188526e9
-    cdelt_kms = 0.20818593  # smooth by 2 chans
-    make_giant_mosaic_cube(filelist,
-                           weightfilelist=weightfilelist,
-                           reference_frequency=restfrq,
-                           cdelt_kms=cdelt_kms,
-                           cubename='HCOP',
-                           nchan=1400,
-                           beam_threshold=3.3 * u.arcsec,
-                           channelmosaic_directory=f'{basepath}/mosaics/HCOP_Channels/',
-                           fail_if_cube_dropped=False,
-                           #use_reproject_cube=True,
-                           parallel=os.getenv('SLURM_NTASKS'),
-                           **kwargs,)
-
-    if not kwargs.get('skip_final_combination') and not kwargs.get('test'):
-        make_downsampled_cube(f'{basepath}/mosaics/cubes/HCOP_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/HCOP_CubeMosaic_downsampled9.fits',
-                              )
-        downsample_spectrally(f'{basepath}/mosaics/cubes/HCOP_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/HCOP_CubeMosaic_spectrally.fits',
-                              factor=7,
-                              )
+    make_registered_line_cube('HCOP', **kwargs)
 
 
 def make_giant_mosaic_cube_hnco_TP7m(**kwargs):
@@ -1031,288 +968,35 @@ def make_giant_mosaic_cube_hnco_TP7m(**kwargs):
 
 
 def make_giant_mosaic_cube_ch3cho(**kwargs):
-
-    filelist = sorted(glob.glob('/orange/adamginsburg/ACES/upload/Feather_12m_7m_TP/SPW33/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_33.image.statcont.contsub.fits'))
-
-    print(f"Found {len(filelist)} SO 3-2-containing spw33 files")
-
-    check_files(filelist)
-
-    weightfilelist = [get_weightfile(fn, spw=33) for fn in filelist]
-    for fn in weightfilelist:
-        assert os.path.exists(fn)
-
-    restfreq = 98.900951e9
-    cdelt_kms = 1.4844932
-    make_giant_mosaic_cube(filelist,
-                           weightfilelist=weightfilelist,
-                           reference_frequency=restfreq,
-                           cdelt_kms=cdelt_kms,
-                           cubename='CH3CHO',
-                           nchan=350,
-                           beam_threshold=3.1 * u.arcsec,
-                           channelmosaic_directory=f'{basepath}/mosaics/CH3CHO_Channels/',
-                           # we prefer to fail_if_dropped; enabling this for debugging
-                           fail_if_cube_dropped=False,
-                           **kwargs,)
-
-    if not kwargs.get('skip_final_combination') and not kwargs.get('test'):
-        make_downsampled_cube(f'{basepath}/mosaics/cubes/CH3CHO_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/CH3CHO_CubeMosaic_downsampled9.fits',
-                              )
+    make_registered_line_cube('CH3CHO', **kwargs)
 
 
 def make_giant_mosaic_cube_so32(**kwargs):
-
-    #filelist = glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw33.cube.I.iter1.image.pbcor.statcont.contsub.fits')
-    #filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw33.cube.I.manual*image.pbcor.statcont.contsub.fits')
-    #filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*sci33.cube.I.manual*image.pbcor.statcont.contsub.fits')
-    #filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/calibrated/working/*spw33.cube.I.iter1.reclean*image.pbcor.statcont.contsub.fits')
-    ##filelist += glob.glob(f'{basepath}/rawdata/2021.1.00172.L/s*/g*/m*/manual/*33.cube.I.manual.pbcor.fits')
-    #filelist = sorted(filelist)
-    filelist = sorted(glob.glob('/orange/adamginsburg/ACES/upload/Feather_12m_7m_TP/SPW33/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_33.image.statcont.contsub.fits'))
-
-    print(f"Found {len(filelist)} SO 3-2-containing spw33 files")
-
-    check_files(filelist)
-
-    weightfilelist = [get_weightfile(fn, spw=33) for fn in filelist]
-    for fn in weightfilelist:
-        assert os.path.exists(fn)
-
-    restfreq = 99.29987e9
-    cdelt_kms = 1.4844932
-    make_giant_mosaic_cube(filelist,
-                           weightfilelist=weightfilelist,
-                           reference_frequency=restfreq,
-                           cdelt_kms=cdelt_kms,
-                           cubename='SO32',
-                           nchan=350,
-                           beam_threshold=3.1 * u.arcsec,
-                           channelmosaic_directory=f'{basepath}/mosaics/SO32_Channels/',
-                           # we prefer to fail_if_dropped; enabling this for debugging
-                           fail_if_cube_dropped=False,
-                           **kwargs,)
-
-    if not kwargs.get('skip_final_combination') and not kwargs.get('test'):
-        make_downsampled_cube(f'{basepath}/mosaics/cubes/SO32_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/SO32_CubeMosaic_downsampled9.fits',
-                              )
+    make_registered_line_cube('SO32', **kwargs)
 
 
 def make_giant_mosaic_cube_h13cn(**kwargs):
-
-    filelist = sorted(glob.glob('/orange/adamginsburg/ACES/upload/Feather_12m_7m_TP/SPW25/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_25.image.statcont.contsub.fits'))
-
-    print(f"Found {len(filelist)} H13CN-containing spw25 files")
-
-    check_files(filelist)
-
-    weightfilelist = [get_weightfile(fn, spw=25) for fn in filelist]
-    for fn in weightfilelist:
-        assert os.path.exists(fn)
-
-    restfreq = 86.33992e9
-    cdelt_kms = 0.84455895
-    make_giant_mosaic_cube(filelist,
-                           weightfilelist=weightfilelist,
-                           reference_frequency=restfreq,
-                           cdelt_kms=cdelt_kms,
-                           cubename='H13CN',
-                           nchan=600,
-                           beam_threshold=3.3 * u.arcsec,
-                           channelmosaic_directory=f'{basepath}/mosaics/H13CN_Channels/',
-                           # we prefer to fail_if_dropped; enabling this for debugging
-                           fail_if_cube_dropped=False,
-                           **kwargs,)
-
-    if not kwargs.get('skip_final_combination') and not kwargs.get('test'):
-        make_downsampled_cube(f'{basepath}/mosaics/cubes/H13CN_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/H13CN_CubeMosaic_downsampled9.fits',
-                              )
-        downsample_spectrally(f'{basepath}/mosaics/cubes/H13CN_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/H13CN_CubeMosaic_spectrally.fits',
-                              factor=2,
-                              )
+    make_registered_line_cube('H13CN', **kwargs)
 
 
 def make_giant_mosaic_cube_h13cop(**kwargs):
-
-    filelist = sorted(glob.glob('/orange/adamginsburg/ACES/upload/Feather_12m_7m_TP/SPW27/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_27.image.statcont.contsub.fits'))
-
-    print(f"Found {len(filelist)} h13cop-containing spw27 files")
-
-    check_files(filelist)
-
-    weightfilelist = [get_weightfile(fn, spw=27) for fn in filelist]
-    for fn in weightfilelist:
-        assert os.path.exists(fn)
-
-    restfreq = 86.7543e9
-    cdelt_kms = 0.84455895
-    make_giant_mosaic_cube(filelist,
-                           weightfilelist=weightfilelist,
-                           reference_frequency=restfreq,
-                           cdelt_kms=cdelt_kms,
-                           cubename='H13COp',
-                           nchan=600,
-                           beam_threshold=3.3 * u.arcsec,
-                           channelmosaic_directory=f'{basepath}/mosaics/H13COp_Channels/',
-                           # we prefer to fail_if_dropped; enabling this for debugging
-                           fail_if_cube_dropped=False,
-                           **kwargs,)
-
-    if not kwargs.get('skip_final_combination') and not kwargs.get('test'):
-        make_downsampled_cube(f'{basepath}/mosaics/cubes/H13COp_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/H13COp_CubeMosaic_downsampled9.fits',
-                              )
-        downsample_spectrally(f'{basepath}/mosaics/cubes/H13COp_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/H13COp_CubeMosaic_spectrally.fits',
-                              factor=2,
-                              )
+    make_registered_line_cube('H13COp', **kwargs)
 
 
 def make_giant_mosaic_cube_hn13c(**kwargs):
-
-    filelist = sorted(glob.glob('/orange/adamginsburg/ACES/upload/Feather_12m_7m_TP/SPW27/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_27.image.statcont.contsub.fits'))
-
-    print(f"Found {len(filelist)} hn13c-containing spw27 files")
-
-    check_files(filelist)
-
-    weightfilelist = [get_weightfile(fn, spw=27) for fn in filelist]
-    for fn in weightfilelist:
-        assert os.path.exists(fn)
-
-    # biggest beams are am & r (3.15")
-    restfreq = 87.09085e9
-    cdelt_kms = 0.84455895
-    make_giant_mosaic_cube(filelist,
-                           weightfilelist=weightfilelist,
-                           reference_frequency=restfreq,
-                           cdelt_kms=cdelt_kms,
-                           cubename='HN13C',
-                           nchan=600,
-                           beam_threshold=3.3 * u.arcsec,
-                           channelmosaic_directory=f'{basepath}/mosaics/HN13C_Channels/',
-                           # we prefer to fail_if_dropped; enabling this for debugging
-                           fail_if_cube_dropped=False,
-                           **kwargs,)
-
-    if not kwargs.get('skip_final_combination') and not kwargs.get('test'):
-        make_downsampled_cube(f'{basepath}/mosaics/cubes/HN13C_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/HN13C_CubeMosaic_downsampled9.fits',
-                              )
-        downsample_spectrally(f'{basepath}/mosaics/cubes/HN13C_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/HN13C_CubeMosaic_spectrally.fits',
-                              factor=2,
-                              )
+    make_registered_line_cube('HN13C', **kwargs)
 
 
 def make_giant_mosaic_cube_so21(**kwargs):
-
-    filelist = sorted(glob.glob('/orange/adamginsburg/ACES/upload/Feather_12m_7m_TP/SPW25/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_25.image.statcont.contsub.fits'))
-
-    print(f"Found {len(filelist)} SO 2-1-containing spw25 files")
-
-    check_files(filelist)
-
-    weightfilelist = [get_weightfile(fn, spw=25) for fn in filelist]
-    for fn in weightfilelist:
-        assert os.path.exists(fn)
-
-    restfreq = 86.09395e9
-    cdelt_kms = 0.84455895
-
-    # biggest beams are am & r (3.15")
-    make_giant_mosaic_cube(filelist,
-                           weightfilelist=weightfilelist,
-                           reference_frequency=restfreq,
-                           cdelt_kms=cdelt_kms,
-                           cubename='SO21',
-                           nchan=600,
-                           beam_threshold=3.3 * u.arcsec,
-                           channelmosaic_directory=f'{basepath}/mosaics/SO21_Channels/',
-                           # we prefer to fail_if_dropped; enabling this for debugging
-                           fail_if_cube_dropped=False,
-                           **kwargs,)
-
-    if not kwargs.get('skip_final_combination') and not kwargs.get('test'):
-        make_downsampled_cube(f'{basepath}/mosaics/cubes/SO21_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/SO21_CubeMosaic_downsampled9.fits',
-                              )
-        downsample_spectrally(f'{basepath}/mosaics/cubes/SO21_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/SO21_CubeMosaic_spectrally.fits',
-                              factor=2,
-                              )
+    make_registered_line_cube('SO21', **kwargs)
 
 
 def make_giant_mosaic_cube_hc15n(**kwargs):
-
-    filelist = sorted(glob.glob('/orange/adamginsburg/ACES/upload/Feather_12m_7m_TP/SPW25/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_25.image.statcont.contsub.fits'))
-
-    print(f"Found {len(filelist)} HC15N-containing spw25 files")
-
-    check_files(filelist)
-
-    weightfilelist = [get_weightfile(fn, spw=25) for fn in filelist]
-    for fn in weightfilelist:
-        assert os.path.exists(fn)
-
-    restfreq = 86.05496e9
-    cdelt_kms = 0.84455895
-    make_giant_mosaic_cube(filelist,
-                           weightfilelist=weightfilelist,
-                           reference_frequency=restfreq,
-                           cdelt_kms=cdelt_kms,
-                           cubename='HC15N',
-                           nchan=600,
-                           beam_threshold=3.3 * u.arcsec,
-                           channelmosaic_directory=f'{basepath}/mosaics/HC15N_Channels/',
-                           # we prefer to fail_if_dropped; enabling this for debugging
-                           fail_if_cube_dropped=False,
-                           **kwargs,)
-
-    if not kwargs.get('skip_final_combination') and not kwargs.get('test'):
-        make_downsampled_cube(f'{basepath}/mosaics/cubes/HC15N_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/HC15N_CubeMosaic_downsampled9.fits',
-                              )
-        downsample_spectrally(f'{basepath}/mosaics/cubes/HC15N_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/HC15N_CubeMosaic_spectrally.fits',
-                              factor=2,
-                              )
+    make_registered_line_cube('HC15N', **kwargs)
 
 
 def make_giant_mosaic_cube_h40a(**kwargs):
-
-    filelist = sorted(glob.glob('/orange/adamginsburg/ACES/upload/Feather_12m_7m_TP/SPW33/cubes/Sgr_A_st_*.TP_7M_12M_feather_all.SPW_33.image.statcont.contsub.fits'))
-
-    print(f"Found {len(filelist)} H40a-containing spw33 files")
-
-    check_files(filelist)
-
-    weightfilelist = [get_weightfile(fn, spw=33) for fn in filelist]
-    for fn in weightfilelist:
-        assert os.path.exists(fn)
-
-    restfreq = 99.02295e9
-    cdelt_kms = 1.4844932
-    make_giant_mosaic_cube(filelist,
-                           weightfilelist=weightfilelist,
-                           reference_frequency=restfreq,
-                           cdelt_kms=cdelt_kms,
-                           cubename='H40a',
-                           nchan=600,
-                           beam_threshold=3.1 * u.arcsec,
-                           channelmosaic_directory=f'{basepath}/mosaics/H40a_Channels/',
-                           # we prefer to fail_if_dropped; enabling this for debugging
-                           fail_if_cube_dropped=False,
-                           **kwargs,)
-
-    if not kwargs.get('skip_final_combination') and not kwargs.get('test'):
-        make_downsampled_cube(f'{basepath}/mosaics/cubes/H40a_CubeMosaic.fits',
-                              f'{basepath}/mosaics/cubes/H40a_CubeMosaic_downsampled9.fits',
-                              )
+    make_registered_line_cube('H40a', **kwargs)
 
 
 def make_giant_mosaic_cube_hcop_noTP(**kwargs):
@@ -1,10 +1,126 @@
 import os
 import textwrap
 import datetime
+import hashlib
+import time
 from astropy import units as u
 import subprocess
 
 
+def submit_job(cmd, dry=False):
+    """
+    Submit an sbatch command line and return the job ID ('PLACEHOLDER' if dry)
+    """
+    print(cmd.split())
+    if dry:
+        return 'PLACEHOLDER'
+    output = subprocess.check_output(cmd.split()).decode()
+    print(output)
+    return output.split()[-1]
+
+
+def split_lock_file(workdir, vis, spw):
+    """
+    The lock file held while the split of ``vis`` to ``spw`` is pending or
+    running; it contains the split job's ID
+    """
+    key = hashlib.sha1(",".join(sorted(map(os.path.basename, vis))).encode()).hexdigest()[:12]
+    return os.path.join(workdir, f"split_spw{spw}_{key}.lock")
+
+
+def split_is_complete(outputvis):
+    return os.path.exists(outputvis) and os.path.exists(outputvis + ".split_complete")
+
+
+def split_users_dir(outputvis):
+    """
+    The directory holding one file for each submission that still uses the
+    split ``outputvis``.  The split is only removed once it is empty.
+    """
+    return outputvis + ".users"
+
+
+def register_split_user(outputvises, token):
+    """
+    Record that the submission ``token`` uses the split MSes ``outputvises``
+    until its merge job releases them
+    """
+    for outputvis in outputvises:
+        usersdir = split_users_dir(outputvis)
+        # a merge job may remove an empty users directory between the two steps
+        for ii in range(3):
+            os.makedirs(usersdir, exist_ok=True)
+            try:
+                with open(os.path.join(usersdir, token), 'w') as fh:
+                    fh.write(os.getenv('SLURM_JOB_ID', ''))
+                break
+            except FileNotFoundError:
+                continue
+
+
+# inserted into the merge script, which runs in CASA without aces
+release_split_user = textwrap.dedent("""
+    def release_split_user(outputvis, token):
+        \"\"\"
+        Drop the reference of submission ``token`` to ``outputvis``.  Returns
+        True if no other submission uses it, so it can be removed.
+        \"\"\"
+        usersdir = outputvis + '.users'
+        if os.path.exists(os.path.join(usersdir, token)):
+            os.remove(os.path.join(usersdir, token))
+        if os.path.isdir(usersdir):
+            try:
+                # fails if another submission has registered since
+                os.rmdir(usersdir)
+            except OSError:
+                return False
+        return True
+    """)
+
+
+def job_is_queued(jobid, squeue='/opt/slurm/bin/squeue'):
+    """
+    Check whether a job is pending or running
+    """
+    try:
+        result = subprocess.check_output([squeue, '-h', '-o', '%i', '-j', str(jobid)],
+                                         stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        # squeue errors out on job IDs that have left the queue
+        return False
+    return str(jobid) in result.decode().split()
+
+
+def acquire_split_lock(lockfile, squeue='/opt/slurm/bin/squeue', lock_wait=30):
+    """
+    Try to take the split lock.
+
+    Returns None if the lock was acquired; the caller must then write its
+    split job ID into ``lockfile``.  If another split job holds the lock and
+    is still queued, returns that job's ID.  Locks left behind by jobs that
+    are no longer queued (e.g., ones that hit their time limit) are taken
+    over.  An empty lock belongs to a submission in progress and is waited on
+    for up to ``lock_wait`` seconds.
+    """
+    try:
+        fd = os.open(lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        os.close(fd)
+        return None
+    except FileExistsError:
+        # another submitter may have just created the lock and not yet
+        # written its job ID into it
+        for ii in range(lock_wait):
+            with open(lockfile) as fh:
+                owner = fh.read().strip()
+            if owner:
+                break
+            time.sleep(1)
+        if owner and job_is_queued(owner, squeue=squeue):
+            return owner
+        print(f"Taking over stale split lock {lockfile} from job {owner or 'unknown'}")
+        return None
+
+
 def parallel_clean_slurm(nchan, imagename, spw, start=0, width=1, nchan_per=128,
                          ntasks=4, mem_per_cpu='4gb', jobname='array_clean',
                          account='astronomy-dept', qos='astronomy-dept-b',
@@ -17,14 +133,34 @@ def parallel_clean_slurm(nchan, imagename, spw, start=0, width=1, nchan_per=128,
                          savedir=None,
                          remove_incomplete_psf=True,
                          remove_incomplete_weight=True,
+                         sbatch='/opt/slurm/bin/sbatch',
+                         squeue='/opt/slurm/bin/squeue',
                          **kwargs):
     """
+    Submit a split -> tclean array -> merge job graph.
+
+    The per-spw MSes are split once, by a single job holding a lock file in
+    ``workdir``.  The tclean array depends on that job (``afterok``) and only
+    reads the split MSes.  If the split MSes are already complete, no split
+    job is submitted; if another submission's split job is still queued, the
+    array depends on that job instead.  Each submission registers itself as
+    a user of the split MSes (`register_split_user`), and its merge job
+    removes them only if no other submission still uses them.
+
     Parameters
     ----------
     savedir:
         Where to put the files in the end
     workdir:
         Where to store the intermediate files
+    sbatch, squeue:
+        The SLURM commands to use
+
+    Returns
+    -------
+    jobids : dict
+        The 'split', 'array', and 'merge' job IDs.  'split' is None if no
+        split was needed.
     """
 
     print(f"Starting parallel clean in workdir={workdir} with casa={CASAVERSION}")
@@ -51,11 +187,12 @@ def parallel_clean_slurm(nchan, imagename, spw, start=0, width=1, nchan_per=128,
     assert 'interactive' not in tclean_kwargs
     tclean_kwargs['calcres'] = True
     tclean_kwargs['calcpsf'] = True
+    # the array tasks share the split MSes, so none of them may write to them
+    tclean_kwargs['savemodel'] = 'none'
 
-    # TODO:
-    # since we're no longer splitting out subsections of the MS, the split should only be done once
-    # and the split job should be a dependency of the tclean array job.
-    # In the current version, there is probably a race condition.
+    lockfile = split_lock_file(workdir, tclean_kwargs['vis'], spw)
+    outputvises = [os.path.join(workdir, os.path.basename(vis).replace('.ms', f'_spw{spw}.ms'))
+                   for vis in tclean_kwargs['vis']]
 
     rename_vis = textwrap.dedent(f"""
 
@@ -80,6 +217,8 @@ def parallel_clean_slurm(nchan, imagename, spw, start=0, width=1, nchan_per=128,
 
         import sys
 
+        lockfile = '{lockfile}'
+
         def test_valid(vis):
             try:
                 msmd.open(vis)
@@ -93,38 +232,65 @@ def parallel_clean_slurm(nchan, imagename, spw, start=0, width=1, nchan_per=128,
                 return False
 
 
-        for vis in {tclean_kwargs['vis']}:
-            outputvis=f'{{rename_vis(vis)}}'
-            if not os.path.exists(outputvis) or not test_valid(outputvis):
+        def mark_complete(outputvis):
+            with open(outputvis + '.split_complete', 'w') as fh:
+                fh.write(os.getenv('SLURM_JOB_ID', ''))
+
+
+        try:
+            for vis in {tclean_kwargs['vis']}:
+                outputvis=f'{{rename_vis(vis)}}'
+                if os.path.exists(outputvis + '.split_complete') and os.path.exists(outputvis):
+                    logprint(f"{{outputvis}} is already split")
+                    continue
+                if os.path.exists(outputvis) and test_valid(outputvis):
+                    # split by an earlier version of this script, which did not mark completion
+                    mark_complete(outputvis)
+                    continue
+
+                # split to a temporary name so a partial MS is never visible as outputvis
+                tmpvis = outputvis + '.splitting'
+                if os.path.exists(tmpvis):
+                    assert 'orange' not in tmpvis
+                    shutil.rmtree(tmpvis)
                 try:
                     logprint(f"Splitting {{vis}} with defaults")
                     split(vis=vis,
-                        outputvis=outputvis,
+                        outputvis=tmpvis,
                         field='{field}',
                         spw=splitspw)
-                    if not os.path.exists(outputvis):
+                    if not os.path.exists(tmpvis):
                         raise ValueError("Did not split")
                     else:
                         logprint(f"Splitting {{vis}} with default (CORRECTED) was successful")
                 except Exception as ex:
                     logprint(f"Failed first attempt with exception {{ex}}")
                     logprint(f"Splitting {{vis}} with datacolumn='data'")
+                    if os.path.exists(tmpvis):
+                        shutil.rmtree(tmpvis)
                     split(vis=vis,
-                          outputvis=outputvis,
+                          outputvis=tmpvis,
                           field='{field}',
                           datacolumn='data',
                           spw=splitspw)
 
-        for vis in {tclean_kwargs['vis']}:
-            outputvis=f'{{rename_vis(vis)}}'
-            if not os.path.exists(outputvis):
-                # fail!
-                sys.exit(1)
-
-            # test that vis is valid
-            msmd.open(vis)
-            nchan_max = msmd.nchan(0)
-            msmd.close()
+                os.rename(tmpvis, outputvis)
+                if test_valid(outputvis):
+                    mark_complete(outputvis)
+
+            for vis in {tclean_kwargs['vis']}:
+                outputvis=f'{{rename_vis(vis)}}'
+                if not os.path.exists(outputvis + '.split_complete'):
+                    # fail!
+                    sys.exit(1)
+        finally:
+            # release the lock whether or not the split succeeded so that a
+            # later submission can retry
+            if os.path.exists(lockfile):
+                with open(lockfile) as fh:
+                    owner = fh.read().strip()
+                if owner == os.getenv('SLURM_JOB_ID'):
+                    os.remove(lockfile)
 
         """)
 
@@ -166,6 +332,8 @@ def parallel_clean_slurm(nchan, imagename, spw, start=0, width=1, nchan_per=128,
         tclean_kwargs['vis'] = [rename_vis(vis) for vis in tclean_kwargs['vis']]
 
         for vis in tclean_kwargs['vis']:
+            if not os.path.exists(vis + '.split_complete'):
+                raise ValueError(f"{{vis}} has not been split completely; the split job should have run first")
             msmd.open(vis)
             # assume spw=0
             nchan_max = msmd.nchan(0)
@@ -235,21 +403,35 @@ def parallel_clean_slurm(nchan, imagename, spw, start=0, width=1, nchan_per=128,
         fh.write(runsplitcmd)
     print(f"Wrote runsplit {slurmsplitcmdsh}")
 
-    slurmsplitcmd = (f'/opt/slurm/bin/sbatch --ntasks={ntasks} '
+    slurmsplitcmd = (f'{sbatch} --ntasks={ntasks} '
                      f'--mem-per-cpu={mem_per_cpu} --output={logdir}/{jobname}_%j_%A_%a.log '
                      f'--job-name={jobname}_split --account={account} '
                      f'--qos={qos} --export=ALL --time={jobtime} {slurmsplitcmdsh}\n')
 
-
-    if dry:
-        print(slurmsplitcmd.split())
-        scriptjobid = 'PLACEHOLDER'
+    # register before checking the split so that no other submission's merge
+    # can remove the split MSes while this submission's array uses them
+    split_user = f"{os.path.basename(imagename)}_{os.getpid()}_{time.time_ns()}"
+    if not dry:
+        register_split_user(outputvises, split_user)
+
+    if all(split_is_complete(vis) for vis in outputvises):
+        print(f"Split MSes {outputvises} are complete; not splitting")
+        scriptjobid = None
+    elif dry:
+        scriptjobid = submit_job(slurmsplitcmd, dry=True)
     else:
-        print(slurmsplitcmd.split())
-        sbatch = subprocess.check_output(slurmsplitcmd.split())
-        scriptjobid = sbatch.decode().split()[-1]
-        print(f'Split: {sbatch.decode()} with jobname={jobname}')
-
+        scriptjobid = acquire_split_lock(lockfile, squeue=squeue)
+        if scriptjobid is not None:
+            print(f"Split job {scriptjobid} holds {lockfile}; the array will wait for it")
+        else:
+            try:
+                scriptjobid = submit_job(slurmsplitcmd)
+            except Exception:
+                os.remove(lockfile)
+                raise
+            with open(lockfile, 'w') as fh:
+                fh.write(scriptjobid)
+            print(f'Split: {scriptjobid} with jobname={jobname}')
 
     scriptname = os.path.join(workdir, f"{imagename}_parallel_script.py")
     with open(scriptname, 'w') as fh:
@@ -271,21 +453,16 @@ def parallel_clean_slurm(nchan, imagename, spw, start=0, width=1, nchan_per=128,
         fh.write(runcmd)
     print(f"Wrote command {slurmcmd}")
 
-    cmd = (f'/opt/slurm/bin/sbatch --ntasks={ntasks} '
+    dependency = f'--dependency=afterok:{scriptjobid} ' if scriptjobid is not None else ''
+    cmd = (f'{sbatch} --ntasks={ntasks} '
            f'--mem-per-cpu={mem_per_cpu} --output={logdir}/{jobname}_%j_%A_%a.log '
            f'--job-name={jobname}_arr --account={account} '
            f'--array=0-{NARRAY} '
-           f'--dependency=afterok:{scriptjobid} '
+           f'{dependency}'
            f'--qos={qos} --export=ALL --time={jobtime} {slurmcmd}\n')
 
-    if dry:
-        print(cmd.split())
-        jobid = 'PLACEHOLDER'
-    else:
-        print(cmd.split())
-        sbatch = subprocess.check_output(cmd.split())
-        jobid = sbatch.decode().split()[-1]
-        print(f'{sbatch.decode()} with jobname={jobname}')
+    jobid = submit_job(cmd, dry=dry)
+    print(f'Array: {jobid} with jobname={jobname}')
 
 
     mergescriptname = os.path.join(workdir, imagename + "_merge_script.py")
@@ -432,12 +609,20 @@ os.chdir('{workdir}')
 tclean_kwargs = {tclean_kwargs}
 
 {rename_vis}
+{release_split_user}
 
+# the split MSes are shared with any other submission for the same MSes and
+# spw, so only the last one to finish removes them
 for vis in tclean_kwargs['vis']:
     vis = rename_vis(vis)
+    if not release_split_user(vis, '{split_user}'):
+        logprint(f"Keeping visibility {{vis}}: another submission still uses it")
+        continue
     logprint(f"Removing visibility {{vis}}")
     assert 'orange' not in vis
-    shutil.rmtree(vis)
+    shutil.rmtree(vis, ignore_errors=True)
+    if os.path.exists(vis + '.split_complete'):
+        os.remove(vis + '.split_complete')
 """)
 
     with open(mergescriptname, 'w') as fh:
@@ -458,14 +643,12 @@ for vis in tclean_kwargs['vis']:
     with open(slurmcmd_merge, 'w') as fh:
         fh.write(runcmd_merge)
 
-    cmd = (f'/opt/slurm/bin/sbatch --ntasks={ntasks * 4} '
+    cmd = (f'{sbatch} --ntasks={ntasks * 4} '
            f'--mem-per-cpu={mem_per_cpu} --output={logdir}/{jobname}_merge_%j_%A_%a.log --job-name={jobname}_merge --account={account} '
            f'--dependency=afterok:{jobid} '
            f'--qos={qos} --export=ALL --time={jobtime} {slurmcmd_merge}')
 
-    if dry:
-        print(cmd.split())
-    else:
-        print(cmd.split())
-        sbatch = subprocess.check_output(cmd.split())
-        print(f'{sbatch.decode()} with jobname={jobname}_merge')
+    mergejobid = submit_job(cmd, dry=dry)
+    print(f'Merge: {mergejobid} with jobname={jobname}_merge')
+
+    return {'split': scriptjobid, 'array': jobid, 'merge': mergejobid}
@@ -20,6 +20,7 @@ import textwrap
 import string
 from aces import conf
 from aces.pipeline_scripts.merge_tclean_commands import get_commands
+from aces.hipergator_scripts.inventory import Inventory
 from aces.analysis.parse_contdotdat import contchannels_to_linechannels
 
 if os.getenv('DUMMYRUN'):
@@ -67,6 +68,10 @@ def main():
 
     commands = get_commands()
 
+    # index the working directories once instead of globbing each image name
+    inventory = Inventory(datapath=f'{datadir}/{projcode}')
+    inventory.refresh()
+
     for sbname, allpars in commands.items():
         mous_ = allpars['mous']
         mous = mous_[6:].replace("/", "_")
@@ -82,9 +87,9 @@ def main():
                     baseimname = tcpars['imagename']
                     stage_wildcard_name = ".".join(baseimname.split(".")[:1] + ["*"] + baseimname.split(".")[2:])
                     imname = f"{workingpath}/{baseimname}"
-                    exists = {suffix: os.path.exists(f"{imname}.{suffix}") for suffix in suffixes[partype]}
+                    exists = {suffix: inventory.path_exists(f"{imname}.{suffix}") for suffix in suffixes[partype]}
                     imname_wild = f"{workingpath}/{stage_wildcard_name}"
-                    exists_wild = {suffix: len(glob.glob(f"{imname_wild}.{suffix}")) > 0 for suffix in suffixes[partype]}
+                    exists_wild = {suffix: len(inventory.glob(f"{imname_wild}.{suffix}")) > 0 for suffix in suffixes[partype]}
 
                     # make the clean scripts
                     os.chdir(workingpath)
@@ -1,11 +1,11 @@
 import os
-import gc
 import warnings
 import numpy as np
 from tqdm import tqdm
 from radio_beam import Beam
 from astropy.io import fits
 from astropy import units as u
+from astropy.wcs import WCS
 from spectral_cube import SpectralCube
 from reproject.mosaicking import find_optimal_celestial_wcs
 from casatasks import exportfits, importfits, imregrid, rmtables
@@ -86,16 +86,55 @@ def regrid_fits_to_template(input_fits, template_fits, output_fits, overwrite=Tr
     rmtables([input_image, template_image, regrid_image])
 
 
+def field_bounding_box(header, wcs_out, shape_out, pad=2, nsamples=64):
+    """
+    Find the pixel bounding box of a field in the output celestial grid.
+
+    The edges of the field are sampled, converted to world coordinates, and
+    then to output pixel coordinates.
+
+    Returns
+    -------
+    (ymin, ymax, xmin, xmax) or None if the field does not overlap the output grid
+    """
+    wcs_in = WCS(header).celestial
+    nx, ny = header['NAXIS1'], header['NAXIS2']
+    xx = np.linspace(-0.5, nx - 0.5, nsamples)
+    yy = np.linspace(-0.5, ny - 0.5, nsamples)
+    edge_x = np.concatenate([xx, xx, np.full(nsamples, -0.5), np.full(nsamples, nx - 0.5)])
+    edge_y = np.concatenate([np.full(nsamples, -0.5), np.full(nsamples, ny - 0.5), yy, yy])
+
+    coords = wcs_in.pixel_to_world(edge_x, edge_y)
+    out_x, out_y = wcs_out.world_to_pixel(coords)
+    ok = np.isfinite(out_x) & np.isfinite(out_y)
+    if not ok.any():
+        return None
+
+    xmin = max(int(np.floor(out_x[ok].min())) - pad, 0)
+    xmax = min(int(np.ceil(out_x[ok].max())) + pad + 1, shape_out[1])
+    ymin = max(int(np.floor(out_y[ok].min())) - pad, 0)
+    ymax = min(int(np.ceil(out_y[ok].max())) + pad + 1, shape_out[0])
+    if xmin >= xmax or ymin >= ymax:
+        return None
+    return ymin, ymax, xmin, xmax
+
+
 def weighted_reproject_and_coadd(cube_files, weight_files, dir_tmp='./tmp/', overwrite_dir_tmp=False):
     '''
     Function to reproject and coadd the cubes and weights.
 
+    Each cube and weight is regridded only onto the sub-region of the target
+    grid that it covers and then added into two on-disk accumulators,
+    sum(weight * data) and sum(weight), so only one field and the output are
+    held in memory at a time.
+
     Inputs:
     - cube_files: a list of paths to the cube files
     - weight_files: a list of paths to the weight files
 
     Outputs:
-    - a HDU object representing the reprojected and coadded data
+    - a HDU object representing the reprojected and coadded data.  The data
+      are a memmap of ``{dir_tmp}/coadd.dat``.
     '''
     tqdm.write("[INFO] Reprojecting and co-adding cubes and weights.")
     assert len(cube_files) == len(weight_files), "Mismatched number of cubes and weights."
@@ -128,16 +167,36 @@ def weighted_reproject_and_coadd(cube_files, weight_files, dir_tmp='./tmp/', ove
 
         tqdm.write("Skipping processing of fake hdu data")
 
+    # the regridding template as written to disk (i.e., without the spectral keywords)
+    template_header = fits.getheader('%s/hdu_out.fits' % dir_tmp)
+    wcs_out = WCS(template_header).celestial
+    shape_out = (template_header['NAXIS2'], template_header['NAXIS1'])
+
     n_hdus = len(cube_files)
-    data_reproject = []
-    reprojected_data, reprojected_weights = [], []
+    weighted_data_sum, weights_sum = None, None
 
     p_bar = tqdm(range(n_hdus * 2))
     p_bar.refresh()
     for i in range(n_hdus):
+        # regrid the cube and its weights onto the part of the output grid they cover
+        bboxes = [field_bounding_box(fits.getheader(fn), wcs_out, shape_out)
+                  for fn in (cube_files[i], weight_files[i])]
+        bboxes = [bb for bb in bboxes if bb is not None]
+        if len(bboxes) == 0:
+            tqdm.write("[INFO] Field %i does not overlap the output grid; skipping" % i)
+            p_bar.update(2)
+            continue
+        ymin, ymax, xmin, xmax = (min(bb[0] for bb in bboxes), max(bb[1] for bb in bboxes),
+                                  min(bb[2] for bb in bboxes), max(bb[3] for bb in bboxes))
+
+        cutout_template = '%s/hdu_out_%i.fits' % (dir_tmp, i)
+        cutout_header = template_header.copy()
+        cutout_header['CRPIX1'] -= xmin
+        cutout_header['CRPIX2'] -= ymin
+        fits.PrimaryHDU(np.ones((ymax - ymin, xmax - xmin)), cutout_header).writeto(cutout_template, overwrite=True)
+
         if os.path.isfile('%s/cube_regrid_%i.fits' % (dir_tmp, i)):
             tqdm.write("[INFO] Exists, not processing primary_hdu[%i]" % i)
-            cube_regrid = fits.open('%s/cube_regrid_%i.fits' % (dir_tmp, i))[0]
         else:
             tqdm.write("[INFO] Processing primary_hdu[%i]" % i)
             cube = primary_hdus[i]
@@ -149,66 +208,62 @@ def weighted_reproject_and_coadd(cube_files, weight_files, dir_tmp='./tmp/', ove
                     hdu_out.header[key] = cube.header[key]
 
             regrid_fits_to_template('%s/cube.fits' % dir_tmp,
-                                    '%s/hdu_out.fits' % dir_tmp,
+                                    cutout_template,
                                     '%s/cube_regrid_%i.fits' % (dir_tmp, i))
-
-            cube_regrid = fits.open('%s/cube_regrid_%i.fits' % (dir_tmp, i))[0]
             del cube
-
-        reprojected_data.append(cube_regrid.data)
-        del cube_regrid
-        gc.collect()
-
         p_bar.update(1)
         p_bar.refresh()
 
         if os.path.isfile('%s/cube_weight_regrid_%i.fits' % (dir_tmp, i)):
-
             tqdm.write("Exists, not processing weight_hdus[%i]" % i)
-            cube_weight_regrid = fits.open('%s/cube_weight_regrid_%i.fits' % (dir_tmp, i))[0]
         else:
             tqdm.write("[INFO] Processing weight_hdus[%i]" % i)
             cube_weight = weight_hdus[i]
             cube_weight.writeto('%s/cube_weight.fits' % dir_tmp, overwrite=True)
 
             regrid_fits_to_template('%s/cube_weight.fits' % dir_tmp,
-                                    '%s/hdu_out.fits' % dir_tmp,
+                                    cutout_template,
                                     '%s/cube_weight_regrid_%i.fits' % (dir_tmp, i))
-
-            cube_weight_regrid = fits.open('%s/cube_weight_regrid_%i.fits' % (dir_tmp, i))[0]
             del cube_weight
 
-        reprojected_weights.append(cube_weight_regrid.data)
-        del cube_weight_regrid
-        gc.collect()
+        data = fits.getdata('%s/cube_regrid_%i.fits' % (dir_tmp, i))
+        weight = fits.getdata('%s/cube_weight_regrid_%i.fits' % (dir_tmp, i))
+        if data.shape[-2:] == shape_out:
+            # regridded onto the full output grid (e.g., by an older version of this function)
+            data = data[..., ymin:ymax, xmin:xmax]
+            weight = weight[..., ymin:ymax, xmin:xmax]
+        assert data.shape == weight.shape, f"Regridded cube and weight {i} have different shapes"
+
+        if weighted_data_sum is None:
+            acc_shape = data.shape[:-2] + shape_out
+            weighted_data_sum = np.memmap('%s/coadd.dat' % dir_tmp, dtype=np.float32, mode='w+', shape=acc_shape)
+            weights_sum = np.memmap('%s/coadd_weight.dat' % dir_tmp, dtype=np.float32, mode='w+', shape=acc_shape)
+        assert data.shape[:-2] == weighted_data_sum.shape[:-2], f"Cube {i} has a different number of channels"
+
+        # add plane by plane; NaNs contribute nothing, as in np.nansum
+        for index in np.ndindex(data.shape[:-2]):
+            wplane = weight[index].astype(np.float32)
+            weighted_data_sum[index + (slice(ymin, ymax), slice(xmin, xmax))] += np.nan_to_num(data[index].astype(np.float32) * wplane)
+            weights_sum[index + (slice(ymin, ymax), slice(xmin, xmax))] += np.nan_to_num(wplane)
+        del data, weight
+
         p_bar.update(1)
         p_bar.refresh()
 
-    tqdm.write('[INFO] Creating weighted_data')
-    weighted_data = np.array(reprojected_data, dtype=np.float32) * np.array(reprojected_weights, dtype=np.float32)
-    del reprojected_data
-    gc.collect()
-
-    tqdm.write('[INFO] Summing weighted_data --> weighted_data_sum')
-    weighted_data_sum = np.nansum(weighted_data, axis=0)
-    del weighted_data
-    gc.collect()
-
-    tqdm.write('[INFO] Summing reprojected_weights --> reprojected_weights_sum')
-    reprojected_weights_sum = np.nansum(reprojected_weights, axis=0)
-    del reprojected_weights
-    gc.collect()
+    if weighted_data_sum is None:
+        raise ValueError("None of the fields overlap the output grid")
 
     tqdm.write('[INFO] Creating data_reproject')
-    data_reproject = weighted_data_sum / reprojected_weights_sum
-    del weighted_data_sum
-    del reprojected_weights_sum
-    gc.collect()
+    # divide in place, plane by plane, so the output reuses the sum(weight * data) accumulator
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for index in np.ndindex(weighted_data_sum.shape[:-2]):
+            weighted_data_sum[index] /= weights_sum[index]
+    weighted_data_sum.flush()
+    del weights_sum
+    os.remove('%s/coadd_weight.dat' % dir_tmp)
 
     tqdm.write('[INFO] Creating hdu_reproject')
-    hdu_reproject = fits.PrimaryHDU(data_reproject, hdu_out.header)
-    del data_reproject
-    gc.collect()
+    hdu_reproject = fits.PrimaryHDU(weighted_data_sum, hdu_out.header)
 
     return hdu_reproject
 
@@ -84,6 +84,15 @@ def main(verbose=False):
 
     assert len(aggregate_high_commands) >= ncmds
 
+    # only touch the file if something changed so that the compiled command
+    # store in merge_tclean_commands stays valid
+    new_contents = json.dumps(aggregate_high_commands, indent=2)
+    if os.path.exists(aggregate_high_file):
+        with open(aggregate_high_file, "r") as fh:
+            if fh.read() == new_contents:
+                log.debug(f"{aggregate_high_file} is up to date")
+                return
+
     log.debug(f"Overwriting to {aggregate_high_file}")
     with open(aggregate_high_file, "w") as fh:
-        json.dump(aggregate_high_commands, fh, indent=2)
+        fh.write(new_contents)
@@ -1,5 +1,9 @@
 import json
+import hashlib
 import itertools
+import pickle
+import tempfile
+import types
 from astropy import log
 from astropy.table import Table
 import os
@@ -13,6 +17,18 @@ from aces import conf
 
 pipedir = os.path.dirname(__file__)
 
+# the JSON files that are merged into the final command list; the compiled
+# store is only rebuilt when one of these changes
+source_files = ("default_tclean_commands.json",
+                "aggregate_high_tclean_commands.json",
+                "override_tclean_commands.json",
+                "spw_selections.json",
+                )
+compiled_cache_path = f"{pipedir}/compiled_tclean_commands.pickle"
+
+# in-process memo: (source file stat signature, pickled commands, frozen view)
+_compiled = None
+
 
 def merge_aggregate(commands, verbose=False):
     from aces.pipeline_scripts import generate_aggregate_high_commands
@@ -119,8 +135,113 @@ def main(verbose=False):
     return commands
 
 
-def get_commands(verbose=False):
-    return main()
+def _source_signature():
+    """
+    Cheap (mtime, size) signature of the source files used to decide whether
+    the in-process memo is still valid
+    """
+    signature = []
+    for fn in source_files:
+        try:
+            st = os.stat(f"{pipedir}/{fn}")
+            signature.append((fn, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            signature.append((fn, None, None))
+    return tuple(signature)
+
+
+def _source_hash():
+    """
+    Hash of the contents of the source files; this is the key of the on-disk
+    compiled store
+    """
+    sha = hashlib.sha256()
+    for fn in source_files:
+        sha.update(fn.encode())
+        if os.path.exists(f"{pipedir}/{fn}"):
+            with open(f"{pipedir}/{fn}", "rb") as fh:
+                sha.update(hashlib.sha256(fh.read()).digest())
+    return sha.hexdigest()
+
+
+def _freeze(obj):
+    """
+    Recursively convert dicts to read-only mappings and lists to tuples
+    """
+    if isinstance(obj, dict):
+        return types.MappingProxyType({key: _freeze(val) for key, val in obj.items()})
+    elif isinstance(obj, list):
+        return tuple(_freeze(val) for val in obj)
+    return obj
+
+
+def _load_compiled():
+    try:
+        with open(compiled_cache_path, "rb") as fh:
+            key, payload = pickle.load(fh)
+        return key, payload
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, ValueError, TypeError):
+        return None, None
+
+
+def _save_compiled(key, payload):
+    # write to a temporary file and rename so readers never see a partial file
+    try:
+        fd, tmpname = tempfile.mkstemp(dir=pipedir, prefix=".compiled_tclean_commands")
+        with os.fdopen(fd, "wb") as fh:
+            pickle.dump((key, payload), fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.chmod(tmpname, 0o664)
+        os.replace(tmpname, compiled_cache_path)
+    except OSError as ex:
+        log.warning(f"Could not write compiled tclean commands to {compiled_cache_path}: {ex}")
+
+
+def compile_commands(verbose=False):
+    """
+    Return the pickled merged commands, rebuilding them (and the on-disk
+    store) only if the content of the source JSON files has changed.
+    """
+    key = _source_hash()
+    cached_key, payload = _load_compiled()
+    if cached_key == key:
+        return payload
+
+    log.debug("Source tclean commands have changed; recompiling")
+    commands = main(verbose=verbose)
+    payload = pickle.dumps(commands, protocol=pickle.HIGHEST_PROTOCOL)
+    # main() may have regenerated the aggregate_high file, so re-hash to store
+    # the result under the key that the next call will compute
+    _save_compiled(_source_hash(), payload)
+    return payload
+
+
+def get_commands(verbose=False, readonly=False):
+    """
+    Get the merged tclean commands.
+
+    The merge is done once per change of the source JSON files and memoized
+    in-process, so this is cheap to call repeatedly.
+
+    Parameters
+    ----------
+    verbose : bool
+        Print the overrides if the commands need to be recompiled
+    readonly : bool
+        If True, return the shared immutable view of the commands (nested
+        read-only mappings and tuples).  Otherwise, return a fresh mutable
+        copy that the caller is free to modify.
+    """
+    global _compiled
+
+    signature = _source_signature()
+    if _compiled is None or _compiled[0] != signature:
+        payload = compile_commands(verbose=verbose)
+        # the signature is taken again in case the aggregate_high file was rewritten
+        _compiled = (_source_signature(), payload, _freeze(pickle.loads(payload)))
+
+    if readonly:
+        return _compiled[2]
+    return pickle.loads(_compiled[1])
 
 
 def make_table():
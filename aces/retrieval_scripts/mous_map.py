@@ -1,5 +1,4 @@
 import os
-from astroquery.alma import Alma
 import json
 from .. import conf
 
@@ -8,6 +7,8 @@ datapath = f'{conf.basepath}/data/'
 
 def get_mous_to_sb_mapping(project_code, refresh=False, mousmapfile=f'{datapath}/mous_mapping.json', verbose=False):
     if refresh or not os.path.exists(mousmapfile):
+        # astroquery is slow to import and is only needed to refresh the map
+        from astroquery.alma import Alma
         if verbose:
             print("Downloading MOUS map from ALMA archive")
         tbl = Alma.query(payload={'project_code': project_code},
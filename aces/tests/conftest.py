@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+
+
+def make_cube_header(shape, **keywords):
+    """
+    A small RA/Dec/frequency cube header near Sgr A* for a (nchan, ny, nx)
+    ``shape``, centered on the image, with 0.36" pixels and a 1.08" beam.
+    ``keywords`` override or add header keywords.
+    """
+    nchan, ny, nx = shape
+    header = fits.Header({'NAXIS': 3, 'NAXIS1': nx, 'NAXIS2': ny, 'NAXIS3': nchan,
+                          'CTYPE1': 'RA---SIN', 'CRVAL1': 266.4, 'CDELT1': -1e-4, 'CRPIX1': nx // 2, 'CUNIT1': 'deg',
+                          'CTYPE2': 'DEC--SIN', 'CRVAL2': -28.9, 'CDELT2': 1e-4, 'CRPIX2': ny // 2, 'CUNIT2': 'deg',
+                          'CTYPE3': 'FREQ', 'CRVAL3': 86e9, 'CDELT3': 1e6, 'CRPIX3': 1, 'CUNIT3': 'Hz',
+                          'BUNIT': 'Jy/beam', 'BMAJ': 3e-4, 'BMIN': 3e-4, 'BPA': 0})
+    header.update(keywords)
+    return header
+
+
+@pytest.fixture
+def cube_header():
+    """
+    `make_cube_header`, for tests that need a header but not a file
+    """
+    return make_cube_header
+
+
+@pytest.fixture
+def synthetic_cube(tmp_path):
+    """
+    A factory that writes a cube with a `make_cube_header` header to
+    ``tmp_path`` and returns its filename.
+
+    Call it with the ``data`` to write, or with a ``shape`` to write unit
+    Gaussian noise from ``seed``; other keyword arguments are header
+    keywords.
+    """
+    def write(data=None, shape=None, name='cube.fits', seed=0, **keywords):
+        if data is None:
+            data = np.random.default_rng(seed).normal(size=shape).astype('float32')
+        fn = str(tmp_path / name)
+        fits.PrimaryHDU(data=data, header=make_cube_header(data.shape, **keywords)).writeto(fn)
+        return fn
+    return write
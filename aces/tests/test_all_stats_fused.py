@@ -0,0 +1,82 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from spectral_cube import SpectralCube
+
+from aces.analysis.giantcube_cuts import do_all_stats, do_all_stats_fused
+
+# products of the high-to-low sigma dilation of the pruned signal mask
+HLSIG_PRODUCTS = {'HNCO_CubeMosaic_signal_mask_pruned.fits',
+                  'HNCO_CubeMosaic_masked_hlsig_dilated_mom0.fits',
+                  'HNCO_CubeMosaic_masked_hlsig_dilated_mom1.fits',
+                  'spectra/HNCO_CubeMosaic_masked_hlsig_dilated_maxspec.fits',
+                  'spectra/HNCO_CubeMosaic_masked_hlsig_dilated_mean_spec.fits',
+                  'spectra/HNCO_CubeMosaic_masked_hlsig_dilated_stdspec.fits'}
+
+# pixels whose spectra have blanked channels ahead of the line peak
+HOLE = (slice(2, 4), slice(50, 56), slice(78, 84))
+
+
+@pytest.fixture
+def cubefn(synthetic_cube):
+    # large enough to survive the 40-pixel edge erosion
+    nchan, ny, nx = 24, 120, 128
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(nchan, ny, nx)).astype('float32')
+    zz, yy, xx = np.ogrid[:nchan, :ny, :nx]
+    for cz, cy, cx, amp in ((8, 55, 60, 12), (16, 70, 75, 8), (12, 50, 80, 20)):
+        data += amp * np.exp(-((zz - cz)**2 / 4 + (yy - cy)**2 / 20 + (xx - cx)**2 / 20))
+    data[:, :4, :] = np.nan
+    data[:, :, -3:] = np.nan
+    data[HOLE] = np.nan
+    return synthetic_cube(data, CTYPE1='GLON-CAR', CRVAL1=0.0, CDELT1=-1e-3,
+                          CTYPE2='GLAT-CAR', CRVAL2=0.0, CDELT2=1e-3,
+                          CTYPE3='VRAD', CRVAL3=-60, CDELT3=5.0, CUNIT3='km/s',
+                          BUNIT='K', BMAJ=3e-3, BMIN=3e-3)
+
+
+def products(mompath):
+    return {os.path.relpath(fn, mompath): fits.getdata(fn).astype('float64')
+            for fn in glob.glob(f'{mompath}/**/*.fits', recursive=True)}
+
+
+def run_both(cubefn, tmp_path, **kwargs):
+    # the numpy path of do_all_stats is the reference: it dilates the
+    # pruned mask to convergence and takes vpeak from argmax(how='ray')
+    do_all_stats(SpectralCube.read(cubefn), 'HNCO', mompath=f'{tmp_path}/reference')
+    do_all_stats_fused(SpectralCube.read(cubefn, use_dask=True), 'HNCO', mompath=f'{tmp_path}/fused',
+                       spatial_block_size=32, spectral_block_size=8, verbose=False, **kwargs)
+    reference, fused = products(f'{tmp_path}/reference'), products(f'{tmp_path}/fused')
+    assert set(reference) == set(fused)
+    return reference, fused
+
+
+def test_fused_matches_do_all_stats(cubefn, tmp_path):
+    reference, fused = run_both(cubefn, tmp_path)
+
+    for name in reference:
+        if name == 'HNCO_CubeMosaic_vpeak.fits':
+            continue
+        np.testing.assert_allclose(fused[name], reference[name], rtol=1e-5, atol=1e-6,
+                                   equal_nan=True, err_msg=name)
+
+    # vpeak is the true argmax; the ray strategy indexes the spectrum with
+    # its blanked channels removed, so it is two channels early in the hole
+    vpeak_ref, vpeak = reference['HNCO_CubeMosaic_vpeak.fits'], fused['HNCO_CubeMosaic_vpeak.fits']
+    hole = np.zeros(vpeak.shape, dtype='bool')
+    hole[HOLE[1:]] = True
+    np.testing.assert_array_equal(vpeak[~hole], vpeak_ref[~hole])
+    np.testing.assert_array_equal(vpeak[hole] - vpeak_ref[hole], 10.0)
+
+
+def test_fused_dilation_iterations(cubefn, tmp_path):
+    # the dilation here converges within the default 10 iterations; fewer
+    # iterations only change the products of the dilated mask
+    reference, fused = run_both(cubefn, tmp_path, dilation_iterations=1)
+
+    for name in reference:
+        matches = np.allclose(fused[name], reference[name], rtol=1e-5, atol=1e-6, equal_nan=True)
+        assert matches == (name not in HLSIG_PRODUCTS | {'HNCO_CubeMosaic_vpeak.fits'}), name
@@ -0,0 +1,84 @@
+import os
+import time
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from aces.imaging import make_mosaic
+from aces.imaging.make_mosaic import combine_channels_into_mosaic_cube, read_channel_journal
+
+NCHAN, NY, NX = 10, 8, 9
+
+
+@pytest.fixture
+def mosaic_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(make_mosaic, 'basepath', str(tmp_path))
+    for name in ('mosaics/cubes', 'work', 'channels'):
+        os.makedirs(tmp_path / name)
+    return tmp_path
+
+
+@pytest.fixture
+def written_channels(monkeypatch):
+    """
+    The channels written by each `os.pwrite` call
+    """
+    written = []
+    pwrite = os.pwrite
+
+    def spy(fd, data, offset):
+        written.append(data.nbytes)
+        return pwrite(fd, data, offset)
+    monkeypatch.setattr(os, 'pwrite', spy)
+    return written
+
+
+def write_channel(tmp_path, chan):
+    data = np.full((NY, NX), chan, dtype='float32')
+    fits.PrimaryHDU(data=data).writeto(tmp_path / 'channels' / f'test_CubeMosaic_channel{chan}.fits', overwrite=True)
+
+
+def combine(tmp_path, header):
+    combine_channels_into_mosaic_cube(header.copy(), 'test', NCHAN, range(NCHAN),
+                                      working_directory=str(tmp_path / 'work'),
+                                      channelmosaic_directory=str(tmp_path / 'channels'),
+                                      channels_per_slab=4)
+
+
+def test_read_channel_journal(tmp_path):
+    journal_file = tmp_path / 'cube.journal'
+    assert read_channel_journal(journal_file) == {}
+    # the last line was cut short by an interrupted run
+    journal_file.write_text("0 3 100.0\n5 6 200.0\n6 8 30")
+    assert read_channel_journal(journal_file) == {0: 100.0, 1: 100.0, 2: 100.0, 5: 200.0}
+
+
+def test_resume_writes_only_missing_channels(mosaic_dirs, cube_header, written_channels):
+    header = fits.PrimaryHDU(data=np.zeros((NCHAN, NY, NX), dtype='float32'),
+                             header=cube_header((NCHAN, NY, NX))).header
+    plane_bytes = NY * NX * 4
+    output_file = mosaic_dirs / 'mosaics' / 'cubes' / 'test_CubeMosaic.fits'
+
+    for chan in (0, 1, 2, 3, 4, 5, 8):
+        write_channel(mosaic_dirs, chan)
+    combine(mosaic_dirs, header)
+    # 0-3 fill one slab; 4-5 and 8 are not consecutive
+    assert [nbytes // plane_bytes for nbytes in written_channels] == [4, 2, 1]
+    assert sorted(read_channel_journal(f'{output_file}.journal')) == [0, 1, 2, 3, 4, 5, 8]
+
+    # fill in the missing channels and update channel 2
+    written_channels.clear()
+    for chan in (6, 7, 9):
+        write_channel(mosaic_dirs, chan)
+    fn2 = mosaic_dirs / 'channels' / 'test_CubeMosaic_channel2.fits'
+    fits.PrimaryHDU(data=np.full((NY, NX), 20, dtype='float32')).writeto(fn2, overwrite=True)
+    os.utime(fn2, (time.time() + 10, time.time() + 10))
+    combine(mosaic_dirs, header)
+
+    assert [nbytes // plane_bytes for nbytes in written_channels] == [1, 2, 1]
+    assert sorted(read_channel_journal(f'{output_file}.journal')) == list(range(NCHAN))
+    data = fits.getdata(output_file)
+    expected = np.arange(NCHAN, dtype='float32')
+    expected[2] = 20
+    np.testing.assert_array_equal(data, np.broadcast_to(expected[:, None, None], data.shape))
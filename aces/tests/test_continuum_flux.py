@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from astropy.wcs import WCS
+from regions import PointSkyRegion
+
+from aces.analysis.continuum_flux_pointsource_check import (get_flux_in_region, measure_fluxes,
+                                                            measure_regions, read_file)
+
+NY, NX = 50, 60
+
+# pixel positions of the regions; the beam-sized apertures have a 3-pixel radius
+POSITIONS = {'inside': (30, 25),
+             'edge': (1, 25),
+             'corner': (NX - 1.5, NY - 1),
+             'off image': (-20, 25),
+             'in blank patch': (45, 15),
+             'partly blank': (40, 15)}
+
+
+def reference(fn, region):
+    """
+    `get_flux_in_region` as plain values; it returns quantities, or NaN
+    """
+    return [getattr(value, 'value', value) for value in get_flux_in_region(fn, region)]
+
+
+@pytest.fixture
+def imagefns(synthetic_cube, cube_header):
+    """
+    Two single-channel images with point sources and a NaN patch
+    """
+    fns = []
+    for seed in (1, 2):
+        data = np.random.default_rng(seed).normal(0, 0.1, size=(1, NY, NX)).astype('float32')
+        yy, xx = np.mgrid[:NY, :NX]
+        for xpix, ypix in POSITIONS.values():
+            data[0] += seed * np.exp(-((xx - xpix)**2 + (yy - ypix)**2) / (2 * 1.3**2))
+        data[0, 10:20, 42:52] = np.nan
+        fns.append(synthetic_cube(data, name=f'image{seed}.fits'))
+    return fns
+
+
+@pytest.fixture
+def regions(imagefns, cube_header):
+    wcs = WCS(cube_header((1, NY, NX))).celestial
+    return [PointSkyRegion(center=wcs.pixel_to_world(xpix, ypix), meta={'text': name})
+            for name, (xpix, ypix) in POSITIONS.items()]
+
+
+def test_measure_regions_matches_get_flux_in_region(imagefns, regions):
+    flux, peak, rms = measure_regions(read_file(imagefns[0]), regions)
+
+    expected = np.array([reference(imagefns[0], region) for region in regions])
+    np.testing.assert_allclose(flux, expected[:, 0], rtol=1e-6, equal_nan=True)
+    np.testing.assert_allclose(peak, expected[:, 1], rtol=1e-6, equal_nan=True)
+    np.testing.assert_allclose(rms, expected[:, 2], rtol=1e-6, equal_nan=True)
+
+    # an aperture off the image is NaN; one on blank pixels is zero, since
+    # mask.multiply zero-fills the pixels outside the aperture
+    names = list(POSITIONS)
+    assert np.isnan(flux[names.index('off image')])
+    assert flux[names.index('in blank patch')] == 0
+    assert np.isfinite(flux[[names.index(name) for name in ('inside', 'edge', 'corner', 'partly blank')]]).all()
+
+
+def test_measure_fluxes_pool(imagefns, regions):
+    serial = measure_fluxes(imagefns, regions, num_workers=1)
+    parallel = measure_fluxes(imagefns, regions, num_workers=2)
+
+    assert len(parallel) == len(imagefns) * len(regions)
+    assert [(row['filename'], row['region']) for row in parallel] == [(row['filename'], row['region']) for row in serial]
+    for key in ('flux_jy', 'peak_jy_beam', 'rms_jy_beam'):
+        np.testing.assert_allclose([row[key] for row in parallel], [row[key] for row in serial], equal_nan=True)
+
+    fluxes = [reference(fn, region)[0] for fn in imagefns for region in regions]
+    np.testing.assert_allclose([row['flux_jy'] for row in parallel], fluxes, rtol=1e-6, equal_nan=True)
@@ -0,0 +1,52 @@
+import numpy as np
+import radio_beam
+from astropy import units as u
+from astropy.io import fits
+from spectral_cube import SpectralCube
+from spectral_cube.cube_utils import beams_to_bintable
+
+from aces.analysis.statcont_cubes import write_contsub_cube
+
+
+def test_write_contsub_cube(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(1, 9, 12, 10)).astype('float32')
+    cont = rng.normal(size=(6, 5)).astype('float32')
+    fn = str(tmp_path / 'cube.fits')
+    fits.PrimaryHDU(data=data).writeto(fn)
+
+    outfn = str(tmp_path / 'contsub.fits')
+    slices = (slice(1, 8), slice(3, 9), slice(2, 7))
+    # a tiny target forces one channel per block
+    throughput = write_contsub_cube(fn, cont, outfn, slices=slices, target_bytes=1, verbose=False)
+
+    assert throughput > 0
+    np.testing.assert_array_equal(fits.getdata(outfn), data[0][slices] - cont)
+
+
+def test_write_contsub_cube_multibeam(synthetic_cube, tmp_path):
+    fn = synthetic_cube(shape=(5, 12, 10))
+    beams = radio_beam.Beams(major=np.linspace(2, 3, 5) * u.arcsec, minor=np.full(5, 2) * u.arcsec,
+                             pa=np.zeros(5) * u.deg)
+    with fits.open(fn) as hdul:
+        header = hdul[0].header
+        for key in ('BMAJ', 'BMIN', 'BPA'):
+            header.remove(key, ignore_missing=True)
+        header['CASAMBM'] = True
+        fits.HDUList([fits.PrimaryHDU(data=hdul[0].data, header=header),
+                      beams_to_bintable(beams)]).writeto(fn, overwrite=True)
+
+    cube = SpectralCube.read(fn)
+    assert len(cube.beams) == 5
+    slices = (slice(1, 4), slice(None), slice(None))
+    cont = np.ones(cube.shape[1:], dtype='float32')
+
+    outfn = str(tmp_path / 'contsub.fits')
+    write_contsub_cube(fn, cont, outfn, slices=slices, header=cube[slices].header,
+                       beams=cube[slices].unmasked_beams, verbose=False)
+
+    outcube = SpectralCube.read(outfn)
+    assert len(outcube.beams) == 3
+    np.testing.assert_allclose(outcube.beams.major.to(u.arcsec).value, beams.major[1:4].to(u.arcsec).value,
+                               rtol=1e-6)
+    np.testing.assert_allclose(outcube.unitless_filled_data[:], cube.unitless_filled_data[1:4] - cont)
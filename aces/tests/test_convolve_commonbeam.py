@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+import radio_beam
+from astropy import units as u
+from astropy.wcs import WCS
+from spectral_cube import Projection
+
+from aces.imaging.make_mosaic import convolve_to_commonbeam
+
+
+@pytest.fixture
+def projections():
+    rng = np.random.default_rng(7)
+    prjs = []
+    for ii, (ny, nx) in enumerate(((40, 50), (30, 30), (45, 36))):
+        wcs = WCS(naxis=2)
+        wcs.wcs.ctype = ['RA---SIN', 'DEC--SIN']
+        wcs.wcs.crval = [266.4, -28.9]
+        wcs.wcs.crpix = [nx / 2, ny / 2]
+        wcs.wcs.cdelt = [-1e-4, 1e-4]
+        wcs.wcs.cunit = ['deg', 'deg']
+        data = rng.normal(size=(ny, nx))
+        # NaN edges, as in primary-beam-cut fields
+        data[:3] = np.nan
+        data[:, -4:] = np.nan
+        beam = radio_beam.Beam(major=(1.0 + 0.2 * ii) * u.arcsec, minor=1.0 * u.arcsec, pa=20 * ii * u.deg)
+        prjs.append(Projection(data, wcs=wcs, unit=u.Jy / u.beam, beam=beam))
+    return prjs
+
+
+@pytest.mark.parametrize('scheduler', ('processes', 'threads', 'synchronous'))
+def test_matches_serial_convolve_to(projections, scheduler):
+    commonbeam = radio_beam.Beams(beams=[prj.beam for prj in projections]).common_beam()
+    scalefactors = [1, 2.5, 0.5]
+
+    hdus = convolve_to_commonbeam(projections, commonbeam, scalefactors=scalefactors,
+                                  num_workers=2, memory_budget=1e5, scheduler=scheduler, verbose=False)
+
+    for prj, sf, hdu in zip(projections, scalefactors, hdus):
+        expected = prj.convolve_to(commonbeam) * sf
+        np.testing.assert_array_equal(np.isnan(hdu.data), np.isnan(expected.value))
+        np.testing.assert_allclose(hdu.data, expected.value, rtol=1e-10, equal_nan=True)
+        assert hdu.header['BMAJ'] == pytest.approx(commonbeam.major.to(u.deg).value)
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+from astropy import units as u
+from astropy.table import Table
+
+from aces.analysis import cube_stats_grid
+from aces.analysis.cube_stats_grid import CubeStatsStore, cube_stats_columns, open_store
+
+KEY = {'Field': 'a', 'Config': '12M', 'spw': 25, 'suffix': '.image'}
+
+
+def test_add_converts_units(tmp_path):
+    store = CubeStatsStore(tmp_path / 'stats.sqlite')
+    store.add(dict(KEY, bmaj=1 * u.arcmin, minfreq=86 * u.GHz, max=2 * u.mJy / u.beam,
+                   max_K=0.5 * u.K, epsilon=0.1))
+    assert store.has('a', '12M', 25, '.image')
+    assert not store.has('a', '12M', 27, '.image')
+
+    row = store.table()[0]
+    assert row['bmaj'] == pytest.approx(60)
+    assert row['minfreq'] == pytest.approx(86e9)
+    assert row['max'] == pytest.approx(2e-3)
+    assert row['max_K'] == pytest.approx(0.5)
+    assert row['epsilon'] == pytest.approx(0.1)
+    assert store.table()['min'].mask[0]
+
+    # a row with the same key replaces the old one
+    store.add(dict(KEY, max=3 * u.Jy / u.beam))
+    assert len(store) == 1
+    assert store.table()[0]['max'] == pytest.approx(3)
+
+
+def test_import_table_round_trip(tmp_path):
+    tbl = Table({'Field': ['a', 'b'], 'Config': ['12M', '7M'], 'spw': [25, 27],
+                 'suffix': ['.image', '.image.pbcor'], 'bmaj': [1.5, 6.0] * u.arcsec,
+                 'max': [10, 20] * u.mJy / u.beam, 'niter': ['1000', '0'],
+                 'undeclared': [1, 2]})
+    tbl.write(tmp_path / 'cube_stats.ecsv')
+
+    store = CubeStatsStore(tmp_path / 'stats.sqlite')
+    store.import_table(Table.read(tmp_path / 'cube_stats.ecsv'))
+    result = store.table()
+
+    assert len(result) == 2
+    assert 'undeclared' not in result.colnames
+    assert list(result['Field']) == ['a', 'b']
+    assert list(result['spw']) == [25, 27]
+    assert list(result['niter']) == ['1000', '0']
+    assert result['bmaj'].unit == u.arcsec
+    assert list(result['bmaj']) == pytest.approx([1.5, 6.0])
+    assert list(result['max']) == pytest.approx([0.01, 0.02])
+
+
+def test_old_store_gains_columns(tmp_path):
+    dbpath = tmp_path / 'stats.sqlite'
+    old = CubeStatsStore(dbpath, columns=cube_stats_columns[:6])
+    old.add(dict(KEY, bmaj=2 * u.arcsec))
+    old.close()
+
+    store = CubeStatsStore(dbpath)
+    result = store.table()
+    assert result.colnames == [name for name, sqltype, unit in cube_stats_columns]
+    assert result['bmaj'][0] == pytest.approx(2)
+    assert result['max'].mask[0]
+
+    store.add(dict(KEY, bmaj=2 * u.arcsec, max=1 * u.Jy / u.beam))
+    assert len(store) == 1
+    assert store.table()['max'][0] == pytest.approx(1)
+
+
+def test_open_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(cube_stats_grid, 'tbldir', tmp_path)
+    Table({'Field': ['a'], 'Config': ['12M'], 'spw': [25], 'suffix': ['.image']}).write(tmp_path / 'cube_stats.ecsv')
+
+    # a new store is seeded from the ecsv
+    store = open_store()
+    assert store.has('a', '12M', 25, '.image')
+    store.add(dict(KEY, Field='b'))
+    store.close()
+
+    # an existing store is reopened as is
+    store = open_store()
+    assert len(store) == 2
+    store.close()
+
+    # START_FROM_CACHED=False moves the store aside and starts an empty one
+    store = open_store(start_from_cached=False)
+    assert len(store) == 0
+    store.close()
+    moved = [fn for fn in os.listdir(tmp_path) if fn.startswith('cube_stats_') and fn.endswith('.sqlite')]
+    assert len(moved) == 1
+    assert len(CubeStatsStore(tmp_path / moved[0])) == 2
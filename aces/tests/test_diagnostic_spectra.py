@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import regions
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+from spectral_cube import SpectralCube
+
+from aces.analysis.diagnostic_spectra import region_exclusion_mask, block_spectra
+
+
+@pytest.fixture
+def cube(synthetic_cube):
+    rng = np.random.default_rng(5)
+    data = rng.normal(0, 1, size=(11, 40, 50)).astype('float32')
+    data[:, 10:20, 10:20] += 20
+    data[:, :, :3] = np.nan
+    return SpectralCube.read(synthetic_cube(data), use_dask=True).with_spectral_unit(u.GHz)
+
+
+def test_region_exclusion_mask_matches_contains(cube):
+    celwcs = cube.wcs.celestial
+    regs = [regions.CircleSkyRegion(celwcs.pixel_to_world(14, 15), radius=7 * 0.36 * u.arcsec),
+            regions.RectangleSkyRegion(celwcs.pixel_to_world(48, 2), width=4 * 0.36 * u.arcsec,
+                                       height=6 * 0.36 * u.arcsec),
+            regions.CircleSkyRegion(SkyCoord(0 * u.deg, 0 * u.deg), radius=1 * u.arcsec)]
+
+    yy, xx = np.mgrid[:cube.shape[1], :cube.shape[2]]
+    expected = np.zeros(cube.shape[1:], dtype=bool)
+    for reg in regs:
+        expected |= reg.to_pixel(celwcs).contains(regions.PixCoord(xx, yy))
+
+    exmask = region_exclusion_mask(regs, celwcs, cube.shape[1:])
+    assert exmask.sum() > 0
+    np.testing.assert_array_equal(exmask, expected)
+
+
+def test_block_spectra_match_cube_reductions(cube):
+    exmask = np.zeros(cube.shape[1:], dtype=bool)
+    exmask[8:22, 8:22] = True
+    masked = cube.with_mask(~exmask)
+
+    spectra = block_spectra(cube, exmask=exmask, spectral_block_size=4)
+    for operation, spec in spectra.items():
+        expected = getattr(masked, operation)(axis=(1, 2))
+        np.testing.assert_allclose(spec.value, expected.value, rtol=1e-5)
+        assert spec.unit == expected.unit
+        assert spec.spectral_axis.unit == u.GHz
+        np.testing.assert_allclose(spec.spectral_axis.value, expected.spectral_axis.value)
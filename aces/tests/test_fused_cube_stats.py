@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from astropy import units as u
+from astropy.io import fits
+from astropy.stats import mad_std
+from spectral_cube import SpectralCube
+
+from aces.analysis.cube_stats_grid import fused_cube_statistics, histogram_bins, histogram_mad_std
+
+
+@pytest.fixture
+def cubefn(synthetic_cube):
+    rng = np.random.default_rng(42)
+    data = rng.normal(0, 0.01, size=(40, 32, 30)).astype('float32')
+    # a line in the middle channels and a blanked edge
+    data[15:25, 10:20, 10:20] += 0.5
+    data[:, :3, :] = np.nan
+    return synthetic_cube(data, RESTFRQ=86e9)
+
+
+def expected(data):
+    meanspec = np.nanmean(data, axis=(1, 2))
+    low = data[meanspec < np.nanpercentile(meanspec, 25)]
+    return {'max': np.nanmax(data), 'sum': np.nansum(data, dtype='float64'), 'std': np.nanstd(data, ddof=1),
+            'lowmin': np.nanmin(low), 'lowmean': np.nanmean(low, dtype='float64'),
+            'lowmadstd': mad_std(low, ignore_nan=True)}
+
+
+@pytest.mark.parametrize('use_dask', (True, False))
+def test_fused_matches_exact(cubefn, use_dask):
+    cube = SpectralCube.read(cubefn, use_dask=use_dask)
+    if use_dask:
+        cube = cube.rechunk((7, 16, 16))
+    stats = fused_cube_statistics(cube, target_bytes=10000)
+    exact = expected(fits.getdata(cubefn))
+
+    for key in ('max', 'sum', 'std', 'lowmin', 'lowmean'):
+        np.testing.assert_allclose(stats[key].to_value(u.Jy / u.beam), exact[key], rtol=1e-5)
+    np.testing.assert_allclose(stats['lowmadstd'].value, exact['lowmadstd'], rtol=1e-2)
+
+
+def test_fused_refines_out_of_range_sketch(cubefn):
+    cube = SpectralCube.read(cubefn, use_dask=True)
+    # a sketch range much narrower than the noise forces the second read
+    stats = fused_cube_statistics(cube, sketch_range=0.01)
+    np.testing.assert_allclose(stats['lowmadstd'].value, expected(fits.getdata(cubefn))['lowmadstd'], rtol=1e-2)
+
+
+def histogram(values, edges):
+    return np.bincount(histogram_bins(values, edges), minlength=edges.size + 1)
+
+
+def test_histogram_mad_std():
+    values = np.random.default_rng(1).normal(3, 2, size=100000)
+    edges = np.linspace(-20, 20, 4001)
+    np.testing.assert_array_equal(histogram(values, edges)[1:-1], np.histogram(values, edges)[0])
+    np.testing.assert_allclose(histogram_mad_std(histogram(values, edges), edges), mad_std(values), rtol=1e-3)
+    edges = np.linspace(-20, -10, 11)
+    assert histogram_mad_std(histogram(values, edges), edges) is None
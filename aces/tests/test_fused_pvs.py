@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from spectral_cube import SpectralCube, BooleanArrayMask
+
+from aces.analysis.giantcube_cuts import do_pvs, do_pvs_fused
+
+
+@pytest.fixture
+def cube(synthetic_cube):
+    rng = np.random.default_rng(3)
+    data = rng.normal(0, 1, size=(24, 20, 26)).astype('float32')
+    data[8:14, 5:12, 6:15] += 4
+    data[:, :2] = np.nan
+    # a Galactic cube with a velocity axis, like the giant mosaics
+    return SpectralCube.read(synthetic_cube(data, CTYPE1='GLON-CAR', CRVAL1=0.1, CDELT1=-1e-3,
+                                            CTYPE2='GLAT-CAR', CRVAL2=0.0, CDELT2=1e-3,
+                                            CTYPE3='VRAD', CRVAL3=-5e4, CDELT3=5e3, CUNIT3='m/s',
+                                            BUNIT='K', BMAJ=3e-3, BMIN=3e-3))
+
+
+def write_inputs(mompath, noise):
+    os.makedirs(os.path.join(mompath, 'pvs'))
+    fits.PrimaryHDU(data=noise).writeto(os.path.join(mompath, 'HNCO_CubeMosaic_noisemap.fits'))
+    fits.PrimaryHDU(data=(noise * 1.5).astype(int)).writeto(os.path.join(mompath, 'HNCO_CubeMosaic_dilated_2p5sig_mask.fits'))
+
+
+@pytest.mark.parametrize('masktype', (None, 'array', 'mask'))
+def test_fused_pvs_match(cube, tmp_path, masktype):
+    noise = np.full(cube.shape[1:], 1.5)
+    signal = cube.filled_data[:].value > 2
+    mask = {None: None, 'array': signal, 'mask': BooleanArrayMask(signal, cube.wcs)}[masktype]
+
+    for name in ('reference', 'fused'):
+        write_inputs(str(tmp_path / name), noise)
+    do_pvs(cube, 'HNCO', mask=mask, mompath=str(tmp_path / 'reference'))
+    do_pvs_fused(cube, 'HNCO', mask=mask, mompath=str(tmp_path / 'fused'), spectral_block_size=5, verbose=False)
+
+    fns = sorted(fn for fn in os.listdir(tmp_path / 'reference' / 'pvs') if fn.endswith('.fits'))
+    assert len(fns) == 8
+    assert fns == sorted(fn for fn in os.listdir(tmp_path / 'fused' / 'pvs') if fn.endswith('.fits'))
+    for fn in fns:
+        reference = fits.open(tmp_path / 'reference' / 'pvs' / fn)[0]
+        fused = fits.open(tmp_path / 'fused' / 'pvs' / fn)[0]
+        np.testing.assert_allclose(fused.data, reference.data, rtol=1e-5, atol=1e-6, err_msg=fn)
+        for key in ('CTYPE1', 'CTYPE2', 'CRVAL1', 'CDELT2', 'BUNIT'):
+            assert fused.header[key] == reference.header[key]
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# modules that must be cheap and side-effect-free to import, and their
+# budgets in seconds, on top of `import aces`
+budgets = {'aces.hipergator_scripts.job_runner': 0.2,
+           'aces.hipergator_scripts.delivery_status': 0.2,
+           }
+
+timer = """
+import time
+from aces import conf
+conf.basepath = {basepath!r}
+t0 = time.perf_counter()
+import {module}
+print(time.perf_counter() - t0)
+"""
+
+
+@pytest.mark.parametrize('module', budgets)
+def test_import_time(module, tmp_path):
+    # an empty data root: importing must not crawl it or write to it
+    basepath = tmp_path / 'root'
+    basepath.mkdir()
+
+    # import the same aces as this test
+    import aces
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(aces.__file__))]
+                                        + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+
+    # best of three, to be robust against a busy machine
+    times = [float(subprocess.check_output([sys.executable, '-c', timer.format(basepath=str(basepath), module=module)],
+                                           cwd=tmp_path, env=env).decode().split()[-1])
+             for ii in range(3)]
+
+    assert min(times) < budgets[module], f"import {module} took {min(times):0.3f} s"
+    assert os.listdir(basepath) == []
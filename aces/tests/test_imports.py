@@ -22,13 +22,13 @@ def test_imports():
     from aces.retrieval_scripts import mous_map
 
     # CASA from aces.hipergator_scripts import hack_plotms
-    # don't test hipergator scripts unless
+    from aces.hipergator_scripts import job_runner
+    from aces.hipergator_scripts import delivery_status
+    # don't test the other hipergator scripts unless we're on hipergator
     import socket
     if 'ufhpc' in socket.gethostname():
         from aces.hipergator_scripts import link_repipeline_weblogs
-        from aces.hipergator_scripts import job_runner
         from aces.hipergator_scripts import ghapi_update
-        from aces.hipergator_scripts import delivery_status
 
     from aces.analysis import imstats
     from aces.analysis import spectral_extraction_Feb2022
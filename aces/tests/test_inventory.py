@@ -0,0 +1,123 @@
+import os
+
+import pytest
+
+from aces.hipergator_scripts.inventory import Inventory, parse_image_name, working_directory_mous
+
+MOUS = 'uid___A001_X15a0_Xae'
+
+
+@pytest.mark.parametrize(('name', 'expected'), (
+    (f'{MOUS}.s9_0.Sgr_A_star_sci.spw26.cube.I.iter1.image.pbcor',
+     {'mous': MOUS, 'stage': 's9_0', 'spw': '26', 'imtype': 'cube', 'suffix': 'iter1.image.pbcor'}),
+    (f'{MOUS}.Sgr_A_star_sci.spw25_27_29_31_33_35.cont.I.manual.image.tt0',
+     {'mous': MOUS, 'stage': '', 'spw': '25_27_29_31_33_35', 'imtype': 'cont', 'suffix': 'manual.image.tt0'}),
+    (f'{MOUS}.s9_0.Sgr_A_star_sci26.mfs.I.iter1.psf',
+     {'mous': MOUS, 'stage': 's9_0', 'spw': '26', 'imtype': 'mfs', 'suffix': 'iter1.psf'}),
+    ('tclean_cube_pars_Sgr_A_st_ae_12M_spw25.py', None),
+))
+def test_parse_image_name(name, expected):
+    assert parse_image_name(name) == expected
+
+
+def make_working(datapath, mous, names):
+    directory = os.path.join(datapath, 'science_goal.uid___A001_X1', 'group.uid___A001_X2',
+                             f'member.{mous}', 'calibrated', 'working')
+    os.makedirs(directory)
+    for name in names:
+        os.makedirs(os.path.join(directory, name))
+    return directory
+
+
+def bump_mtime(directory):
+    st = os.stat(directory)
+    os.utime(directory, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+@pytest.fixture
+def working(tmp_path):
+    return make_working(tmp_path / 'data', MOUS, [f'{MOUS}.s9_0.Sgr_A_star_sci.spw26.cube.I.iter1.image',
+                                                  f'{MOUS}.s9_0.Sgr_A_star_sci.spw26.cube.I.iter1.image.pbcor',
+                                                  f'{MOUS}.Sgr_A_star_sci.spw25.mfs.I.manual.psf'])
+
+
+def test_working_directory_mous(working):
+    assert working_directory_mous(working) == MOUS
+
+
+def test_refresh(tmp_path, working):
+    inventory = Inventory(':memory:', datapath=str(tmp_path / 'data'))
+    assert inventory.refresh() == 1
+    assert inventory.is_indexed(working)
+
+    # unchanged directories are not re-listed
+    assert inventory.refresh() == 0
+
+    os.makedirs(os.path.join(working, f'{MOUS}.s9_0.Sgr_A_star_sci.spw26.cube.I.iter1.psf'))
+    bump_mtime(working)
+    assert inventory.refresh() == 1
+    assert inventory.exists(MOUS, 26, 'cube', 'iter1.psf')
+
+    # a removed directory is dropped from the index
+    other = make_working(tmp_path / 'data', 'uid___A001_X15a0_Xb0', [])
+    assert inventory.refresh() == 1
+    os.rmdir(other)
+    inventory.refresh()
+    assert not inventory.is_indexed(other)
+    assert inventory.is_indexed(working)
+
+
+def test_relative_datapath(tmp_path, working, monkeypatch):
+    # paths are stored in the same form they are looked up in
+    monkeypatch.chdir(tmp_path)
+    inventory = Inventory(':memory:', datapath='data')
+    inventory.refresh()
+    relative = os.path.relpath(working, tmp_path)
+    assert inventory.is_indexed(working)
+    assert inventory.is_indexed(relative)
+    assert inventory.is_indexed(relative + '/')
+    assert inventory.refresh([relative]) == 0
+    assert inventory.path_exists(f'{relative}/{MOUS}.Sgr_A_star_sci.spw25.mfs.I.manual.psf')
+
+
+def test_exists(tmp_path, working):
+    inventory = Inventory(':memory:', datapath=str(tmp_path / 'data'))
+    inventory.refresh()
+    assert inventory.exists(MOUS, 26, 'cube', 'iter1.image.pbcor')
+    assert inventory.exists(MOUS, 'spw26', 'cube', 'iter1.image.pbcor', stage='s*_0')
+    assert not inventory.exists(MOUS, 26, 'cube', 'iter1.image.pbcor', stage='')
+    assert inventory.exists(MOUS, 25, 'mfs', 'manual.psf', stage='')
+    assert not inventory.exists(MOUS, 25, 'cube', 'manual.psf')
+    assert not inventory.exists(MOUS, 27, 'cube', 'iter1.image.pbcor')
+
+
+def test_glob_and_path_exists(tmp_path, working):
+    inventory = Inventory(':memory:', datapath=str(tmp_path / 'data'))
+    inventory.refresh()
+    assert inventory.glob(f'{working}/{MOUS}.*.spw26.cube.I.iter1.image*') == [
+        f'{working}/{MOUS}.s9_0.Sgr_A_star_sci.spw26.cube.I.iter1.image',
+        f'{working}/{MOUS}.s9_0.Sgr_A_star_sci.spw26.cube.I.iter1.image.pbcor']
+    assert inventory.glob(f'{working}/*.model') == []
+
+    # the index answers for indexed directories, even if stale
+    image = f'{working}/{MOUS}.s9_0.Sgr_A_star_sci.spw26.cube.I.iter1.image'
+    assert inventory.path_exists(image)
+    os.rmdir(image)
+    assert inventory.path_exists(image)
+    assert not inventory.path_exists(f'{working}/{MOUS}.s9_0.Sgr_A_star_sci.spw26.cube.I.iter1.model')
+
+    # and the filesystem for others
+    assert inventory.path_exists(str(tmp_path / 'data'))
+    assert not inventory.path_exists(str(tmp_path / 'nothere'))
+
+
+def test_unindexed_directory_uses_filesystem(tmp_path, working):
+    inventory = Inventory(':memory:', datapath=str(tmp_path / 'data'))
+    inventory.refresh()
+
+    # a working directory created after the refresh
+    other = make_working(tmp_path / 'data', 'uid___A001_X15a0_Xb0', ['tclean_cube_pars_Sgr_A_st_b0_12M_spw25.py'])
+    assert not inventory.is_indexed(other)
+    assert inventory.glob(f'{other}/tclean_cube_pars_*_spw25.py') == [f'{other}/tclean_cube_pars_Sgr_A_st_b0_12M_spw25.py']
+    assert inventory.glob(f'{other}/tclean_cube_pars_*_spw27.py') == []
+    assert inventory.path_exists(f'{other}/tclean_cube_pars_Sgr_A_st_b0_12M_spw25.py')
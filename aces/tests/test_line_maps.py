@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from astropy import units as u
+from astropy.io import fits
+
+from aces.imaging.make_mosaic import get_line_maps, get_peak, get_m0
+
+
+@pytest.fixture
+def cubefn(synthetic_cube):
+    rng = np.random.default_rng(3)
+    data = rng.normal(0, 0.01, size=(60, 12, 10)).astype('float32')
+    data[15:25, 4:8, 3:6] += 0.5
+    data[40:45, 2:5, 2:5] += 0.2
+    data[:, 0, :] = np.nan
+    data[20:40, 1, 1] = np.nan
+    return synthetic_cube(data, RESTFRQ=86e9, SPECSYS='LSRK')
+
+
+def test_line_maps_match_per_line(cubefn, tmp_path):
+    lines = {'_a': 86.02 * u.GHz, '_b': 86.042 * u.GHz, '_edge': 86.058 * u.GHz}
+    slab_kwargs = {'lo': -30 * u.km / u.s, 'hi': 30 * u.km / u.s}
+    maps = get_line_maps(cubefn, lines, slab_kwargs=slab_kwargs, folder=str(tmp_path), spectral_block_size=7)
+    assert len(maps) == 6
+
+    for suffix, rest_value in lines.items():
+        # per-line maps computed without the cache
+        peak = get_peak(cubefn, slab_kwargs=slab_kwargs, rest_value=rest_value, suffix=suffix,
+                        save_file=False, use_cache=False)
+        m0 = get_m0(cubefn, slab_kwargs=slab_kwargs, rest_value=rest_value, suffix=suffix,
+                    save_file=False, use_cache=False)
+        np.testing.assert_allclose(maps[(suffix, 'max')].value, peak.value, rtol=1e-6)
+        np.testing.assert_allclose(maps[(suffix, 'mom0')].value, m0.value, rtol=1e-6)
+        assert maps[(suffix, 'max')].unit == peak.unit
+        assert maps[(suffix, 'mom0')].unit == m0.unit
+
+        # and the cached files are picked up by get_peak and get_m0
+        cached = get_peak(cubefn, slab_kwargs=slab_kwargs, rest_value=rest_value, suffix=suffix,
+                          folder=str(tmp_path))
+        np.testing.assert_allclose(cached.value, peak.value, rtol=1e-6)
+        assert fits.getheader(str(tmp_path / f'cube{suffix}_mom0.fits'))['BUNIT'] == m0.unit.to_string('fits')
+
+    # everything is cached now
+    assert get_line_maps(cubefn, lines, slab_kwargs=slab_kwargs, folder=str(tmp_path)) == {}
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from astropy import units as u
+
+from aces.imaging.line_registry import line_registry, line_tasks, task_channels, slurm_line_tasks
+from aces.imaging.make_mosaic import load_giant_mosaic_inputs, giant_mosaic_line_cubes
+
+
+def test_registry_from_linelist():
+    entries = {entry['cubename']: entry for entry in line_registry()}
+    assert entries['H13CN']['spw'] == 25
+    assert entries['H13CN']['restfreq'] == 86.33992e9
+    assert entries['HNCO']['nchan'] == 1400
+    assert entries['CS21']['restfreq'] == 97.98095330e9
+    assert entries['CS21']['beam_threshold'] == 2.9 * u.arcsec
+    assert entries['H40a']['nchan'] == 600
+    assert entries['SO32']['beam_threshold'] == 3.1 * u.arcsec
+
+    with pytest.raises(ValueError):
+        line_registry(lines=['CO10'])
+
+
+def test_tasks_share_spws():
+    entries = line_registry()
+    tasks = line_tasks(entries, nchunks=3)
+    # one task per spw per chunk, holding every line of that spw
+    assert len(tasks) == 3 * len({entry['spw'] for entry in entries})
+    for task in tasks:
+        assert {entry['spw'] for entry in task['lines']} == {task['spw']}
+
+    # every channel of every line is made exactly once
+    for entry in entries:
+        channels = sum((task_channels(task, entry) for task in tasks if entry in task['lines']), [])
+        assert sorted(channels) == list(range(entry['nchan']))
+
+
+def test_slurm_split(monkeypatch):
+    tasks = line_tasks(line_registry(), nchunks=4)
+    monkeypatch.setenv('SLURM_ARRAY_TASK_COUNT', '4')
+    shares = []
+    for ii in range(4):
+        monkeypatch.setenv('SLURM_ARRAY_TASK_ID', str(ii))
+        shares.append(slurm_line_tasks(tasks))
+    assert sorted(map(id, sum(shares, []))) == sorted(map(id, tasks))
+
+
+def test_shared_inputs(synthetic_cube):
+    filelist = [synthetic_cube(np.ones((10, 8, 8), dtype='float32'), name=f'cube{ii}.fits',
+                               BMAJ=bmaj / 3600, BMIN=1 / 3600)
+                for ii, bmaj in enumerate((2, 3, 4))]
+    cubes, weightcubes, commonbeam = load_giant_mosaic_inputs(filelist, weightfilelist=filelist,
+                                                              beam_threshold=3.5 * u.arcsec, verbose=False)
+    assert len(cubes) == len(weightcubes) == 2
+    assert commonbeam.major.to(u.arcsec).value == pytest.approx(3)
+
+    # two lines from the same inputs
+    for restfreq in (86.001e9, 86.005e9):
+        linecubes, lineweights = giant_mosaic_line_cubes(cubes, weightcubes, restfreq)
+        assert linecubes[0].spectral_axis.unit == u.km / u.s
+        np.testing.assert_allclose(linecubes[0].with_spectral_unit(u.Hz).spectral_axis.value,
+                                   cubes[0].spectral_axis.value)
+    assert cubes[0].spectral_axis.unit == u.Hz
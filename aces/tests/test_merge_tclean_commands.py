@@ -0,0 +1,72 @@
+import json
+import os
+import pickle
+import shutil
+
+import pytest
+
+from aces.pipeline_scripts import generate_aggregate_high_commands, merge_tclean_commands as mtc
+
+
+@pytest.fixture
+def pipedir(tmp_path, monkeypatch):
+    """
+    A copy of the source JSON files, with the compiled store next to them
+    """
+    for fn in mtc.source_files:
+        shutil.copy(f"{mtc.pipedir}/{fn}", tmp_path / fn)
+    monkeypatch.setattr(mtc, 'pipedir', str(tmp_path))
+    monkeypatch.setattr(generate_aggregate_high_commands, 'pipedir', str(tmp_path))
+    monkeypatch.setattr(mtc, 'compiled_cache_path', str(tmp_path / 'compiled_tclean_commands.pickle'))
+    monkeypatch.setattr(mtc, '_compiled', None)
+    return tmp_path
+
+
+def test_compiled_matches_main(pipedir):
+    commands = mtc.get_commands()
+    assert commands == mtc.main()
+    assert os.path.exists(mtc.compiled_cache_path)
+
+    # the read-only view has the same content
+    readonly = mtc.get_commands(readonly=True)
+    sbname = next(iter(commands))
+    assert set(readonly) == set(commands)
+    assert dict(readonly[sbname]['tclean_cube_pars']).keys() == commands[sbname]['tclean_cube_pars'].keys()
+    with pytest.raises(TypeError):
+        readonly[sbname]['tclean_cube_pars'] = {}
+
+    # mutable copies are independent of each other
+    commands[sbname] = None
+    assert mtc.get_commands()[sbname] is not None
+
+
+def test_compiled_store_invalidation(pipedir, monkeypatch):
+    commands = mtc.get_commands()
+
+    # a touch changes the stat signature but not the content: the store is
+    # reused without re-merging
+    def fail(verbose=False):
+        raise AssertionError("recompiled")
+    override_fn = pipedir / 'override_tclean_commands.json'
+    st = os.stat(override_fn)
+    os.utime(override_fn, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    with monkeypatch.context() as mp:
+        mp.setattr(mtc, 'main', fail)
+        assert mtc.get_commands() == commands
+
+    # a content change recompiles, both in-process and on disk
+    with open(override_fn) as fh:
+        override = json.load(fh)
+    sbname = next(iter(override))
+    override[sbname]['tclean_cube_pars'] = {'spw99': {'niter': 1}}
+    with open(override_fn, 'w') as fh:
+        json.dump(override, fh)
+
+    recompiled = mtc.get_commands()
+    assert recompiled != commands
+    assert recompiled == mtc.main()
+    assert recompiled[sbname]['tclean_cube_pars']['spw99'] == {'niter': 1}
+    with open(mtc.compiled_cache_path, 'rb') as fh:
+        key, payload = pickle.load(fh)
+    assert key == mtc._source_hash()
+    assert pickle.loads(payload) == recompiled
@@ -0,0 +1,143 @@
+import os
+import stat
+
+import pytest
+
+from aces.imaging.parallel_tclean import parallel_clean_slurm, split_lock_file, split_users_dir, release_split_user
+
+
+fake_sbatch = """#!/bin/sh
+# record the submission and hand out increasing job IDs
+n=$(( $(cat {tmpdir}/jobid 2>/dev/null || echo 1000) + 1 ))
+echo $n > {tmpdir}/jobid
+echo "$n $@" >> {tmpdir}/submissions
+echo "Submitted batch job $n"
+"""
+
+# reports the jobs listed in the 'queued' file as pending
+fake_squeue = """#!/bin/sh
+for last; do true; done
+grep -x "$last" {tmpdir}/queued 2>/dev/null
+exit 0
+"""
+
+
+@pytest.fixture
+def slurm(tmp_path):
+    for name, script in (('sbatch', fake_sbatch), ('squeue', fake_squeue)):
+        path = tmp_path / name
+        path.write_text(script.format(tmpdir=tmp_path))
+        path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return tmp_path
+
+
+def submissions(tmpdir):
+    """
+    The submitted jobs as {jobid: {'name': job name, 'dependency': jobid or None}}
+    """
+    jobs = {}
+    if not os.path.exists(tmpdir / 'submissions'):
+        return jobs
+    with open(tmpdir / 'submissions') as fh:
+        for line in fh:
+            jobid, *args = line.split()
+            flags = dict(arg[2:].split('=', 1) for arg in args if arg.startswith('--') and '=' in arg)
+            jobs[jobid] = {'name': flags['job-name'],
+                           'dependency': flags['dependency'].split(':')[1] if 'dependency' in flags else None}
+    return jobs
+
+
+def run(slurm, vis):
+    workdir = slurm / 'work'
+    workdir.mkdir(exist_ok=True)
+    return parallel_clean_slurm(nchan=512, imagename=str(slurm / 'cube'), spw=25,
+                                vis=vis, workdir=str(workdir), logdir=str(slurm),
+                                jobname='test', sbatch=str(slurm / 'sbatch'),
+                                squeue=str(slurm / 'squeue'))
+
+
+def test_split_array_merge_graph(slurm):
+    vis = ['/data/uid___A002_Xf_X1.ms', '/data/uid___A002_Xf_X2.ms']
+    jobids = run(slurm, vis)
+
+    jobs = submissions(slurm)
+    assert [job['name'] for job in jobs.values()] == ['test_split', 'test_arr', 'test_merge']
+    assert jobs[jobids['array']]['dependency'] == jobids['split']
+    assert jobs[jobids['merge']]['dependency'] == jobids['array']
+
+    # the split job holds the lock until it finishes
+    lockfile = split_lock_file(str(slurm / 'work'), vis, 25)
+    with open(lockfile) as fh:
+        assert fh.read() == jobids['split']
+
+    with open(str(slurm / 'cube_parallel_script.py')) as fh:
+        script = fh.read()
+    assert 'split(' not in script
+    assert "'savemodel': 'none'" in script
+
+
+def test_second_submission_waits_for_queued_split(slurm):
+    vis = ['/data/uid___A002_Xf_X1.ms']
+    first = run(slurm, vis)
+    (slurm / 'queued').write_text(first['split'] + "\n")
+
+    second = run(slurm, vis)
+
+    jobs = submissions(slurm)
+    assert [job['name'] for job in jobs.values()].count('test_split') == 1
+    assert second['split'] == first['split']
+    assert jobs[second['array']]['dependency'] == first['split']
+
+
+def test_stale_lock_is_taken_over(slurm):
+    vis = ['/data/uid___A002_Xf_X1.ms']
+    first = run(slurm, vis)
+    # the first split job left the queue without releasing its lock
+
+    second = run(slurm, vis)
+
+    assert second['split'] != first['split']
+    assert submissions(slurm)[second['array']]['dependency'] == second['split']
+
+
+def test_no_split_when_complete(slurm):
+    vis = ['/data/uid___A002_Xf_X1.ms']
+    outputvis = slurm / 'work' / 'uid___A002_Xf_X1_spw25.ms'
+    outputvis.mkdir(parents=True)
+    (slurm / 'work' / 'uid___A002_Xf_X1_spw25.ms.split_complete').write_text('999')
+
+    jobids = run(slurm, vis)
+
+    jobs = submissions(slurm)
+    assert jobids['split'] is None
+    assert [job['name'] for job in jobs.values()] == ['test_arr', 'test_merge']
+    assert jobs[jobids['array']]['dependency'] is None
+
+
+def release(outputvis, token):
+    namespace = {'os': os}
+    exec(release_split_user, namespace)
+    return namespace['release_split_user'](str(outputvis), token)
+
+
+def test_split_is_kept_until_last_merge(slurm):
+    vis = ['/data/uid___A002_Xf_X1.ms']
+    outputvis = slurm / 'work' / 'uid___A002_Xf_X1_spw25.ms'
+    outputvis.mkdir(parents=True)
+    (slurm / 'work' / 'uid___A002_Xf_X1_spw25.ms.split_complete').write_text('999')
+
+    # two submissions share the completed split
+    run(slurm, vis)
+    run(slurm, vis)
+    tokens = os.listdir(split_users_dir(str(outputvis)))
+    assert len(tokens) == 2
+
+    # the merge script releases its own submission's reference
+    with open(str(slurm / 'cube_merge_script.py')) as fh:
+        mergescript = fh.read()
+    assert sum(f"release_split_user(vis, '{token}')" in mergescript for token in tokens) == 1
+
+    # the first merge to finish keeps the MS; the last one may remove it
+    assert not release(outputvis, tokens[0])
+    assert release(outputvis, tokens[1])
+    assert not os.path.exists(split_users_dir(str(outputvis)))
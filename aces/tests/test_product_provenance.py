@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+import pytest
+from astropy import units as u
+from astropy.io import fits
+
+from aces.imaging.make_mosaic import cached_product_is_current, product_provenance
+
+SLAB = {'lo': -200 * u.km / u.s, 'hi': 200 * u.km / u.s}
+REST = 87.925237 * u.GHz
+
+
+@pytest.fixture
+def cached(synthetic_cube, tmp_path):
+    """
+    A cube and a 'max' product cached from it
+    """
+    fn = synthetic_cube(shape=(4, 10, 12))
+    outfn = str(tmp_path / 'cube_max.fits')
+    hdu = fits.PrimaryHDU(data=np.zeros((10, 12)))
+    hdu.header.update(product_provenance(fn, 'max', slab_kwargs=SLAB, rest_value=REST))
+    hdu.writeto(outfn)
+    return fn, outfn
+
+
+def is_current(outfn, fn, slab_kwargs=SLAB, rest_value=REST):
+    return cached_product_is_current(outfn, fn, 'max', slab_kwargs=slab_kwargs, rest_value=rest_value)
+
+
+def test_touch_keeps_product_current(cached):
+    fn, outfn = cached
+    assert is_current(outfn, fn)
+
+    st = os.stat(fn)
+    os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert is_current(outfn, fn)
+
+
+def test_content_change_makes_product_stale(cached):
+    fn, outfn = cached
+    # same size, same header, different data
+    size = os.path.getsize(fn)
+    with fits.open(fn, mode='update') as hdul:
+        hdul[0].data[2, 5, 5] += 1
+    assert os.path.getsize(fn) == size
+    assert not is_current(outfn, fn)
+
+
+@pytest.mark.parametrize('kwargs', (
+    {'slab_kwargs': {'lo': -2 * u.km / u.s, 'hi': 2 * u.km / u.s}},
+    {'slab_kwargs': None},
+    {'rest_value': 86.84696 * u.GHz},
+    {'rest_value': None},
+))
+def test_changed_slab_or_rest_value_makes_product_stale(cached, kwargs):
+    fn, outfn = cached
+    assert not is_current(outfn, fn, **kwargs)
@@ -0,0 +1,27 @@
+import numpy as np
+import dask.array as da
+from scipy import ndimage
+
+from aces.analysis.giantcube_cuts import get_prunemask_space, get_prunemask_space_dask
+
+
+def prune_plane_reference(mask, npix):
+    labels, nlabels = ndimage.label(mask)
+    counts = ndimage.histogram(labels, 1, nlabels + 1, nlabels)
+    return np.isin(labels, np.arange(1, nlabels + 1)[counts >= npix])
+
+
+def test_prune_masks_match_per_channel_labelling():
+    rng = np.random.default_rng(0)
+    mask = ndimage.gaussian_filter(rng.normal(size=(20, 60, 70)), (0, 1.5, 1.5)) > 0.2
+    # a lone pixel in every channel of one column must not be joined across channels
+    mask[:, 29:32, 29:32] = False
+    mask[:, 30, 30] = True
+    mask[3] = False
+    expected = np.array([prune_plane_reference(plane, 12) for plane in mask])
+
+    np.testing.assert_array_equal(get_prunemask_space(mask.copy(), npix=12, spectral_block_size=6), expected)
+
+    lazy = get_prunemask_space_dask(da.from_array(mask, chunks=(7, 30, 35)), npix=12, spectral_block_size=6)
+    assert lazy.dtype == bool
+    np.testing.assert_array_equal(lazy.compute(), expected)
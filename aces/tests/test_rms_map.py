@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from astropy.convolution import Gaussian2DKernel
+
+from aces.imaging.make_mosaic import rms_map, fft_rms_map, iterative_rms_map
+
+
+@pytest.fixture
+def image():
+    rng = np.random.default_rng(0)
+    ny, nx = 180, 210
+    yy, xx = np.mgrid[:ny, :nx]
+    img = rng.normal(0, 1, size=(ny, nx)) * (1 + 0.5 * np.sin(xx / 40))
+    for y, x in rng.integers(10, 170, size=(8, 2)):
+        img += 30 * np.exp(-((yy - y)**2 + (xx - x)**2) / (2 * 2**2))
+    # blank outside an elliptical footprint and a hole inside it
+    img[(yy - 90)**2 / 85**2 + (xx - 105)**2 / 100**2 > 1] = np.nan
+    img[40:50, 60:66] = np.nan
+    return img
+
+
+def test_fft_rms_map_matches_rms_map(image):
+    expected = rms_map(image, kernel=Gaussian2DKernel(4))
+    valid = np.isfinite(image) & np.isfinite(expected)
+    for tile_size in (None, 64):
+        result, smoother = fft_rms_map(image, 4, tile_size=tile_size)
+        np.testing.assert_allclose(result[valid], expected[valid], rtol=1e-10)
+
+
+def test_downsampled_rms_map(image):
+    expected = rms_map(image, kernel=Gaussian2DKernel(6))
+    valid = np.isfinite(image) & np.isfinite(expected)
+    result, smoother = fft_rms_map(image, 6, downsample=2)
+    assert np.median(np.abs(result[valid] / expected[valid] - 1)) < 0.01
+
+
+def test_iterative_rms_map_matches_loop(image):
+    # the masking loop of `rms`, with rms_map
+    maskedrms = rms_map(image, kernel=Gaussian2DKernel(4))
+    datacopy = image.copy()
+    ndet = []
+    for ii in range(50):
+        detections = (datacopy / maskedrms) > 2.5
+        if detections.sum() == 0:
+            break
+        ndet.append(detections.sum())
+        datacopy[detections] = np.nan
+        maskedrms = rms_map(datacopy, kernel=Gaussian2DKernel(4))
+
+    rms, result, ndet_ = iterative_rms_map(image, 4, mask_tolerance=0, verbose=False)
+    assert ndet_ == ndet
+    valid = np.isfinite(image) & np.isfinite(maskedrms)
+    np.testing.assert_allclose(result[valid], maskedrms[valid], rtol=1e-8)
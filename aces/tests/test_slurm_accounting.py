@@ -0,0 +1,64 @@
+import datetime
+
+from aces.hipergator_scripts.slurm_accounting import AccountingCache, ReplayPoller, parse_jobname
+
+
+# recorded `sacct --parsable2 --noheader --format=JobID,JobName,State,End`
+first_poll = """\
+1001|ag_TM1_25_cube|COMPLETED|2024-03-01T02:00:00
+1001.batch|batch|COMPLETED|2024-03-01T02:00:00
+1001.extern|extern|COMPLETED|2024-03-01T02:00:00
+1002|ag_TM1_aggregate_high_mfs|RUNNING|Unknown
+1003_[0-30]|ba_TM1_25_cube_arr|PENDING|Unknown
+1004|ba_TM1_25_cube_split|RUNNING|Unknown
+1005|a_7M_27_cube|CANCELLED by 12345|2024-03-01T03:00:00
+1006|interactive|RUNNING|Unknown
+"""
+
+second_poll = """\
+1002|ag_TM1_aggregate_high_mfs|FAILED|2024-03-01T05:00:00
+1004|ba_TM1_25_cube_split|COMPLETED|2024-03-01T04:30:00
+1003_0|ba_TM1_25_cube_arr|RUNNING|Unknown
+1003_[1-30]|ba_TM1_25_cube_arr|PENDING|Unknown
+"""
+
+
+def test_parse_jobname():
+    assert parse_jobname('ag_TM1_aggregate_high_mfs') == ('ag', 'TM1', 'aggregate_high', 'mfs', '')
+    assert parse_jobname('ba_TM1_25_cube_merge') == ('ba', 'TM1', '25', 'cube', 'merge')
+    assert parse_jobname('batch') is None
+
+
+def test_replayed_polls(tmp_path):
+    poller = ReplayPoller([first_poll, second_poll])
+    accounting = AccountingCache(dbpath=str(tmp_path / 'acct.sqlite'), poller=poller)
+
+    accounting.poll(now=datetime.datetime(2024, 3, 1, 4, 0, 0))
+    assert poller.starttimes == [None]
+    assert accounting.states('ag', 'TM1', '25', 'cube') == {'COMPLETED': ['1001']}
+    assert accounting.states('ba', 'TM1', '25', 'cube') == {'PENDING': ['1003_[0-30]'], 'RUNNING': ['1004']}
+    assert accounting.states('a', '7M', 27, 'cube') == {'CANCELLED': ['1005']}
+    # job names are matched exactly, not as substrings ('a_TM1...' is in 'ba_TM1...')
+    assert accounting.states('a', 'TM1', '25', 'cube') == {}
+
+    # the second poll only asks for what changed since the first
+    accounting.poll(now=datetime.datetime(2024, 3, 1, 6, 0, 0))
+    assert poller.starttimes[1] == '2024-03-01T03:55:00'
+    assert accounting.states('ag', 'TM1', 'aggregate_high', 'mfs') == {'FAILED': ['1002']}
+    # the pending array record was replaced by the per-task records
+    assert accounting.states('ba', 'TM1', '25', 'cube') == {'COMPLETED': ['1004'], 'RUNNING': ['1003_0'],
+                                                            'PENDING': ['1003_[1-30]']}
+    # records from the first poll are kept
+    assert accounting.states('ag', 'TM1', '25', 'cube') == {'COMPLETED': ['1001']}
+
+    # only jobs active after `since` count
+    since = datetime.datetime(2024, 3, 1, 2, 30, 0)
+    assert accounting.states('ag', 'TM1', '25', 'cube', since=since) == {}
+    assert 'CANCELLED' in accounting.states('a', '7M', '27', 'cube', since=since)
+
+    # a new process picks up where the last one left off
+    accounting.close()
+    reopened = AccountingCache(dbpath=str(tmp_path / 'acct.sqlite'), poller=ReplayPoller(['']))
+    assert reopened.states('ag', 'TM1', 'aggregate_high', 'mfs') == {'FAILED': ['1002']}
+    reopened.poll(now=datetime.datetime(2024, 3, 1, 7, 0, 0))
+    assert reopened.poller.starttimes == ['2024-03-01T05:55:00']
@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+import pytest
+from astropy import units as u
+from astropy.io import fits
+from astropy.table import Table
+from astropy.wcs import WCS
+from spectral_cube import SpectralCube
+
+from aces.analysis.spectral_extraction_everywhere import (catalog_regions, extract_from_mask,
+                                                          extract_sources_from_cube, plan_extraction)
+
+NCHAN, NY, NX = 6, 40, 40
+GALACTIC = {'CTYPE1': 'GLON-CAR', 'CTYPE2': 'GLAT-CAR', 'CRVAL2': 0.0}
+
+
+@pytest.fixture
+def fields(tmp_path, synthetic_cube):
+    """
+    Two overlapping 12m fields with one cube each, a field number map, and a
+    dendrogram mask of four catalog sources: one in each field only, one in
+    the overlap (mapped to field 1), and one outside both.
+    """
+    cubefns = []
+    for field_id, (mousid, glon) in enumerate((('X1', 0.0), ('X2', -0.002)), start=1):
+        working = tmp_path / 'product' / f'member.uid___A001_{mousid}' / 'calibrated' / 'working'
+        os.makedirs(working)
+        fn = synthetic_cube(shape=(NCHAN, NY, NX), seed=field_id, CRVAL1=glon, **GALACTIC,
+                            name=f'uid___A001_{mousid}.s38_0.Sgr_A_star_sci.spw25.cube.I.iter1.image.pbcor.fits')
+        os.rename(fn, working / os.path.basename(fn))
+        cubefns.append(str(working / os.path.basename(fn)))
+
+    # the map covers both fields on the cube pixel grid
+    header = fits.Header({'NAXIS': 2, 'NAXIS1': 2 * NX, 'NAXIS2': NY,
+                          'CTYPE1': 'GLON-CAR', 'CRVAL1': 0.0, 'CDELT1': -1e-4, 'CRPIX1': NX // 2, 'CUNIT1': 'deg',
+                          'CTYPE2': 'GLAT-CAR', 'CRVAL2': 0.0, 'CDELT2': 1e-4, 'CRPIX2': NY // 2, 'CUNIT2': 'deg'})
+    field_data = np.zeros((NY, 2 * NX), dtype=int)
+    field_data[:, :30] = 1
+    field_data[:, 30:] = 2
+    field_map = fits.PrimaryHDU(data=field_data, header=header)
+
+    catalog = Table({'index': [0, 1, 2, 3],
+                     'GLON': [0.0012, 359.9992, 359.997, 0.01],
+                     'GLAT': [0.0, 0.0005, -0.0003, 0.0],
+                     'major_sigma': [1.5, 1.2, 2.0, 1.0],
+                     'minor_sigma': [1.0, 1.0, 1.2, 1.0],
+                     'position_angle': [0.0, 30.0, 100.0, 0.0]})
+
+    mask_data = np.zeros(field_data.shape, dtype=int)
+    centers, _ = catalog_regions(catalog)
+    for index, (xpix, ypix) in zip(catalog['index'], np.array(WCS(header).world_to_pixel(centers)).T):
+        if 0 <= xpix < 2 * NX:
+            mask_data[int(ypix) - 2:int(ypix) + 3, int(xpix) - 3:int(xpix) + 2] = index + 1
+    maskhdu = fits.PrimaryHDU(data=mask_data, header=header)
+
+    uidtbl = Table({'12m MOUS ID': ['X1', 'X2']})
+    return cubefns, field_map, uidtbl, catalog, maskhdu, str(tmp_path / 'product')
+
+
+def test_plan_extraction(fields):
+    cubefns, field_map, uidtbl, catalog, maskhdu, product_dir = fields
+
+    plan = plan_extraction(catalog, field_map, uidtbl, product_dir)
+    assert plan == {cubefns[0]: [0, 1], cubefns[1]: [1, 2]}
+
+    plan = plan_extraction(catalog, field_map, uidtbl, product_dir, all_covering_fields=False)
+    assert plan == {cubefns[0]: [0, 1], cubefns[1]: [2]}
+
+
+def test_matches_per_source_extraction(fields, tmp_path):
+    cubefns, field_map, uidtbl, catalog, maskhdu, product_dir = fields
+    spectrum_dir = tmp_path / 'spectra'
+    os.makedirs(spectrum_dir)
+
+    plan = plan_extraction(catalog, field_map, uidtbl, product_dir)
+    for cubefn, rows in plan.items():
+        extract_sources_from_cube(cubefn, catalog, rows, maskhdu, str(spectrum_dir), channel_chunk=4)
+
+    _, regs = catalog_regions(catalog)
+    for cubefn, rows in plan.items():
+        cube = SpectralCube.read(cubefn)
+        basename = os.path.basename(cubefn)
+        for ii in rows:
+            ellipse = cube.subcube_from_regions([regs[ii]]).mean(axis=(1, 2))
+            dendromask = extract_from_mask(cube, maskhdu, ii + 1)
+            assert np.isfinite(ellipse).all() and np.isfinite(dendromask).all()
+
+            hdu = fits.open(spectrum_dir / f'mp179_source{ii}_ellipseaverage_{basename}')[0]
+            np.testing.assert_allclose(hdu.data.squeeze(), ellipse.value, rtol=1e-6)
+            assert hdu.header['CATINDX'] == ii
+            data = fits.getdata(spectrum_dir / f'mp179_source{ii}_dendromaskaverage_{basename}')
+            np.testing.assert_allclose(data.squeeze(), dendromask.value, rtol=1e-6)
+
+            # the spectrum's single-pixel WCS points at the source
+            center = catalog_regions(catalog[ii:ii + 1])[0][0]
+            pixel = WCS(hdu.header).celestial.pixel_to_world(0, 0)
+            assert pixel.separation(center) < 1e-4 * u.deg
@@ -0,0 +1,72 @@
+import os
+import signal
+
+from aces.utils.tasks import run_tasks, ClaimDirectory
+
+
+def fake_measure(task, scale=1):
+    if task['fn'] == 'broken':
+        raise MemoryError("out of memory")
+    return [task['fn'], task['size'] * scale, os.getpid()]
+
+
+def make_tasks(sizes):
+    return [{'field': 'ag', 'config': 'TM1', 'spw': spw, 'suffix': '.image',
+             'fn': f'cube{spw}', 'size': size}
+            for spw, size in enumerate(sizes)]
+
+
+def test_serial_in_order():
+    tasks = make_tasks([30, 20, 10])
+    results = list(run_tasks(tasks, measure=fake_measure, scale=2))
+    assert [row[:2] for task, row, error in results] == [['cube0', 60], ['cube1', 40], ['cube2', 20]]
+    assert all(error is None for task, row, error in results)
+
+
+def test_errors_are_reported():
+    tasks = make_tasks([30, 20])
+    tasks[0]['fn'] = 'broken'
+    results = list(run_tasks(tasks, measure=fake_measure))
+    assert results[0][1] is None
+    assert results[0][2] == "MemoryError: out of memory"
+    assert results[1][2] is None
+
+
+def test_claimed_tasks_are_skipped(tmp_path):
+    tasks = make_tasks([30, 20, 10])
+    other = ClaimDirectory(str(tmp_path))
+    assert other.claim(tasks[1])
+    assert not other.claim(tasks[1])
+
+    results = list(run_tasks(tasks, measure=fake_measure, claims=ClaimDirectory(str(tmp_path))))
+    assert [task['fn'] for task, row, error in results] == ['cube0', 'cube2']
+
+
+def test_pool(tmp_path):
+    tasks = make_tasks([50, 40, 30, 20, 10])
+    tasks[2]['fn'] = 'broken'
+    results = list(run_tasks(tasks, measure=fake_measure, nworkers=2, mem_per_worker=2 * 1024**3,
+                             claims=ClaimDirectory(str(tmp_path)), poll_interval=0.01))
+    assert sorted(task['spw'] for task, row, error in results) == [0, 1, 2, 3, 4]
+    assert [task['spw'] for task, row, error in results if error is not None] == [2]
+    # each worker process measures one cube
+    pids = [row[2] for task, row, error in results if row is not None]
+    assert len(set(pids)) == len(pids)
+    assert os.getpid() not in pids
+    assert len(os.listdir(tmp_path)) == 5
+
+
+def killed_measure(task):
+    if task['fn'] == 'killed':
+        os.kill(os.getpid(), signal.SIGKILL)
+    return [task['fn'], task['size'], os.getpid()]
+
+
+def test_killed_worker_is_reported():
+    tasks = make_tasks([30, 20, 10])
+    tasks[1]['fn'] = 'killed'
+    results = list(run_tasks(tasks, measure=killed_measure, nworkers=2, poll_interval=0.01))
+    errors = {task['spw']: error for task, row, error in results}
+    assert sorted(errors) == [0, 1, 2]
+    assert errors[0] is None and errors[2] is None
+    assert errors[1] == f"Worker exited with code {-signal.SIGKILL} without a result"
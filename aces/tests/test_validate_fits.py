@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+from astropy.io import fits
+
+from aces.imaging.make_mosaic import check_channel, validate_fits_file
+
+
+def write(tmp_path, name, data):
+    fn = str(tmp_path / name)
+    fits.PrimaryHDU(data=data).writeto(fn)
+    return fn
+
+
+def test_validate_fits_file(tmp_path):
+    data = np.full((200, 300), np.nan)
+    data[50:150, 100:200] = np.random.default_rng(0).normal(size=(100, 100))
+
+    good = write(tmp_path, 'good.fits', data)
+    assert validate_fits_file(good)['ok']
+    assert check_channel(good, verbose=False)
+    assert check_channel(good, verbose=False, fast=False)
+
+    blank = write(tmp_path, 'blank.fits', np.full((200, 300), np.nan))
+    assert validate_fits_file(blank)['reason'] == 'blank'
+    assert not check_channel(blank, verbose=False)
+
+    zeros = write(tmp_path, 'zeros.fits', np.nan_to_num(data))
+    assert validate_fits_file(zeros)['reason'] == 'zeros'
+    assert not check_channel(zeros, verbose=False, fast=False)
+
+    truncated = write(tmp_path, 'truncated.fits', data)
+    with open(truncated, 'rb+') as fh:
+        fh.truncate(os.path.getsize(truncated) // 2)
+    assert validate_fits_file(truncated)['reason'] == 'truncated'
+
+    empty = str(tmp_path / 'empty.fits')
+    open(empty, 'w').close()
+    assert validate_fits_file(empty)['reason'] == 'broken'
+
+
+def test_validate_fits_file_cache(tmp_path):
+    fn = write(tmp_path, 'cube.fits', np.ones((4, 10, 10), dtype='float32'))
+    assert validate_fits_file(fn)['ok']
+
+    # rewriting the file with a new mtime gives a new verdict
+    fits.PrimaryHDU(data=np.full((4, 10, 10), np.nan, dtype='float32')).writeto(fn, overwrite=True)
+    st = os.stat(fn)
+    os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert validate_fits_file(fn)['reason'] == 'blank'
+
+
+def test_check_channel_reads_inconclusive_samples(tmp_path):
+    # a small patch of data between the sampled blocks of a NaN channel
+    data = np.full((2000, 2000), np.nan, dtype='float32')
+    data[50:60, 100:140] = 1
+    fn = write(tmp_path, 'patch.fits', data)
+    assert validate_fits_file(fn)['reason'] == 'blank'
+    assert check_channel(fn, verbose=False)
+    assert check_channel(fn, verbose=False, fast=False)
+
+    # a zero-filled channel is still rejected after the full read
+    zeros = write(tmp_path, 'zeros.fits', np.nan_to_num(data))
+    assert not check_channel(zeros, verbose=False)
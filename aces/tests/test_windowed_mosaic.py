@@ -0,0 +1,45 @@
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+from spectral_cube import SpectralCube
+
+from aces.imaging.make_mosaic import mosaic_cubes_windowed, output_window
+
+
+# TAN fields on a radio velocity axis, offset in RA by crpix1
+field_keywords = dict(CTYPE1='RA---TAN', CTYPE2='DEC--TAN', CTYPE3='VRAD', CRVAL3=0, CDELT3=1.0, CUNIT3='km/s',
+                      RESTFRQ=86e9, BUNIT='K')
+
+
+def test_output_window(cube_header):
+    outwcs = WCS(cube_header((1, 20, 60), CRPIX1=30, **field_keywords)).celestial
+    inwcs = WCS(cube_header((1, 20, 10), CRPIX1=5, **field_keywords)).celestial
+    ys, xs = output_window(inwcs, (20, 10), outwcs, (20, 60), margin=0)
+    assert (ys.start, ys.stop) == (0, 20)
+    assert xs.start <= 25 and xs.stop >= 35 and xs.stop - xs.start <= 12
+    farwcs = WCS(cube_header((1, 20, 10), CRPIX1=500, **field_keywords)).celestial
+    assert output_window(farwcs, (20, 10), outwcs, (20, 60)) is None
+
+
+def test_mosaic_cubes_windowed(synthetic_cube, cube_header, tmp_path):
+    # two fields that overlap in the middle of the output grid, with constant
+    # values and weights, on the output spectral grid
+    cubes, weightcubes = [], []
+    for ii, (crpix1, value, weight) in enumerate(((25, 1.0, 1.0), (15, 3.0, 3.0))):
+        for kind, fill, cubelist in (('cube', value, cubes), ('weight', weight, weightcubes)):
+            fn = synthetic_cube(np.full((12, 20, 20), fill, dtype='float32'), name=f'{kind}{ii}.fits',
+                                CRPIX1=crpix1, **field_keywords)
+            cubelist.append(SpectralCube.read(fn, use_dask=True))
+
+    outheader = cube_header((12, 20, 60), CRPIX1=30, **field_keywords)
+    outfn = str(tmp_path / 'mosaic.fits')
+    mosaic_cubes_windowed(cubes, outheader, outfn, weightcubes=weightcubes,
+                          spectral_block_size=5, verbose=False)
+
+    data = fits.getdata(outfn)
+    assert data.shape == (12, 20, 60)
+    # the first field alone, the overlap, the second field alone, and no field
+    np.testing.assert_allclose(data[:, 10, 8], 1)
+    np.testing.assert_allclose(data[:, 10, 20], (1 * 1 + 3 * 3) / 4, rtol=1e-6)
+    np.testing.assert_allclose(data[:, 10, 30], 3)
+    assert np.all(np.isnan(data[:, 10, 50]))
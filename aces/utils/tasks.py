@@ -0,0 +1,134 @@
+"""
+Run independent tasks (e.g., one per cube) across worker processes, and
+share them between the tasks of a SLURM array with claim files.
+"""
+import os
+import time
+import socket
+import resource
+import multiprocessing
+
+
+class ClaimDirectory:
+    """
+    Claims on tasks shared between processes that may be on different nodes
+    (e.g., the tasks of one SLURM array), so that each task is run once.
+
+    A claim is a file created with O_EXCL, which is atomic on the shared
+    filesystems; the first process to create it owns the task.  Tasks are
+    named by their field, config, spw, and suffix.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def claim(self, task):
+        claimfn = os.path.join(self.path, f"{task['field']}_{task['config']}_{task['spw']}{task['suffix']}.claim")
+        try:
+            fd = os.open(claimfn, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(f"{socket.gethostname()} {os.getpid()} {os.getenv('SLURM_ARRAY_TASK_ID', '')}")
+        return True
+
+
+def limit_worker_memory(mem_bytes):
+    """
+    Cap the worker's heap at ``mem_bytes`` so that a task too large for its
+    share of the node raises MemoryError in that worker instead of bringing
+    down the node with the OOM killer.
+
+    RLIMIT_DATA is used rather than RLIMIT_AS so that the memory-mapped
+    cubes themselves do not count against the cap.
+    """
+    if mem_bytes:
+        resource.setrlimit(resource.RLIMIT_DATA, (int(mem_bytes), int(mem_bytes)))
+
+
+def _measure_task(measure, task, kwargs):
+    try:
+        return task, measure(task, **kwargs), None
+    except Exception as ex:
+        return task, None, f"{type(ex).__name__}: {ex}"
+
+
+def _measure_worker(sender, measure, task, kwargs, mem_per_worker):
+    limit_worker_memory(mem_per_worker)
+    sender.send(_measure_task(measure, task, kwargs))
+    sender.close()
+
+
+def run_tasks(tasks, measure, nworkers=1, mem_per_worker=None, claims=None, poll_interval=1, **kwargs):
+    """
+    Run ``measure`` on ``tasks`` (in order) across ``nworkers`` processes.
+
+    Tasks are handed out one at a time as workers become free, so with the
+    tasks sorted largest first the run takes about as long as the longest
+    task (or the total divided by ``nworkers``, whichever is longer).  Each
+    task runs in its own worker process, with its memory capped at
+    ``mem_per_worker`` bytes.  A worker that dies without a result (e.g.,
+    killed by the OOM killer) is reported as an error for its task.  If
+    ``claims`` (a `ClaimDirectory`) is given, tasks claimed by another
+    process are skipped, so several runs (e.g., SLURM array tasks) can share
+    one queue.
+
+    Yields (task, result, error) as each task finishes; ``result`` is the
+    return value of ``measure(task, **kwargs)`` and ``error`` is a message
+    if it raised, else None.
+    """
+    tasks = iter(tasks)
+
+    def next_task():
+        for task in tasks:
+            if claims is None or claims.claim(task):
+                return task
+
+    if nworkers <= 1:
+        task = next_task()
+        while task is not None:
+            yield _measure_task(measure, task, kwargs)
+            task = next_task()
+        return
+
+    pending = []
+
+    def submit():
+        task = next_task()
+        if task is not None:
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_measure_worker,
+                                              args=(sender, measure, task, kwargs, mem_per_worker))
+            process.start()
+            # the child holds its own copy of the sending end
+            sender.close()
+            pending.append((task, process, receiver))
+
+    for ii in range(nworkers):
+        submit()
+    while pending:
+        done = []
+        for entry in list(pending):
+            task, process, receiver = entry
+            # check for a result before liveness, as a worker exits right after sending it
+            if receiver.poll():
+                try:
+                    done.append(receiver.recv())
+                except EOFError:
+                    done.append(None)
+            elif process.is_alive():
+                continue
+            else:
+                done.append(None)
+            process.join()
+            if done[-1] is None:
+                done[-1] = (task, None, f"Worker exited with code {process.exitcode} without a result")
+            receiver.close()
+            pending.remove(entry)
+        if not done:
+            time.sleep(poll_interval)
+            continue
+        for result in done:
+            yield result
+            submit()
@@ -0,0 +1,204 @@
+"""
+Benchmarks of the cube statistics hot paths on a synthetic mosaic cube.
+
+Each benchmark records wall time (``time_*``), peak RSS (``peakmem_*``), and
+bytes read (``track_*_bytes_read``).
+"""
+import os
+import shutil
+import tempfile
+import warnings
+
+import numpy as np
+from astropy.io import fits
+from spectral_cube import SpectralCube
+
+from aces.analysis import giantcube_cuts
+from aces.analysis.cube_stats_grid import cube_statistics, fused_cube_statistics
+from aces.analysis.statcont_cubes import write_statcont_maps, write_contsub_cube
+
+from .synthetic import make_giant_cube, bytes_read
+
+
+class CubeBenchmark:
+    """
+    Shared setup: one synthetic cube in a temporary directory
+    """
+    timeout = 1200
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cubefn = make_giant_cube(os.path.join(self.tmpdir, 'bench_CubeMosaic.fits'))
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def read_cube(self, use_dask=True):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return SpectralCube.read(self.cubefn, use_dask=use_dask)
+
+    def bytes_read(self, func):
+        return bytes_read(func, self.tmpdir)
+
+
+class GiantCubeStats(CubeBenchmark):
+    """
+    `giantcube_cuts.do_all_stats` and its fused two-pass counterpart
+    """
+
+    def run(self):
+        # the numpy path: the dask path of do_all_stats does not run with
+        # current dask_image and dafits
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            giantcube_cuts.do_all_stats(self.read_cube(use_dask=False), 'HNCO',
+                                        mompath=os.path.join(self.tmpdir, 'moments'))
+
+    def run_fused(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            giantcube_cuts.do_all_stats_fused(self.read_cube(), 'HNCO',
+                                              mompath=os.path.join(self.tmpdir, 'moments_fused'),
+                                              verbose=False)
+
+    def time_do_all_stats(self):
+        self.run()
+
+    def peakmem_do_all_stats(self):
+        self.run()
+
+    def track_do_all_stats_bytes_read(self):
+        return self.bytes_read(self.run)
+    track_do_all_stats_bytes_read.unit = 'bytes'
+
+    def time_do_all_stats_fused(self):
+        self.run_fused()
+
+    def peakmem_do_all_stats_fused(self):
+        self.run_fused()
+
+    def track_do_all_stats_fused_bytes_read(self):
+        return self.bytes_read(self.run_fused)
+    track_do_all_stats_fused_bytes_read.unit = 'bytes'
+
+
+class GiantCubePVs(CubeBenchmark):
+    """
+    `giantcube_cuts.do_pvs` and its single-read counterpart
+    """
+
+    def setup(self):
+        super().setup()
+        self.mompath = os.path.join(self.tmpdir, 'moments')
+        os.makedirs(os.path.join(self.mompath, 'pvs'))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            noise = self.read_cube().std(axis=0).value
+        fits.PrimaryHDU(data=noise).writeto(os.path.join(self.mompath, 'HNCO_CubeMosaic_noisemap.fits'))
+        fits.PrimaryHDU(data=np.zeros(noise.shape, dtype=int)).writeto(
+            os.path.join(self.mompath, 'HNCO_CubeMosaic_dilated_2p5sig_mask.fits'))
+
+    def run(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            giantcube_cuts.do_pvs(self.read_cube(), 'HNCO', mompath=self.mompath)
+
+    def run_fused(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            giantcube_cuts.do_pvs_fused(self.read_cube(), 'HNCO', mompath=self.mompath, verbose=False)
+
+    def time_do_pvs(self):
+        self.run()
+
+    def peakmem_do_pvs(self):
+        self.run()
+
+    def track_do_pvs_bytes_read(self):
+        return self.bytes_read(self.run)
+    track_do_pvs_bytes_read.unit = 'bytes'
+
+    def time_do_pvs_fused(self):
+        self.run_fused()
+
+    def peakmem_do_pvs_fused(self):
+        self.run_fused()
+
+    def track_do_pvs_fused_bytes_read(self):
+        return self.bytes_read(self.run_fused)
+    track_do_pvs_fused_bytes_read.unit = 'bytes'
+
+
+class CubeStatsGrid(CubeBenchmark):
+    """
+    The per-cube statistics of `cube_stats_grid`, multi-pass and fused
+    """
+
+    def run(self):
+        cube = self.read_cube()
+        with cube.use_dask_scheduler('synchronous'):
+            cube_statistics(cube)
+
+    def run_fused(self):
+        cube = self.read_cube()
+        with cube.use_dask_scheduler('synchronous'):
+            fused_cube_statistics(cube)
+
+    def time_cube_statistics(self):
+        self.run()
+
+    def peakmem_cube_statistics(self):
+        self.run()
+
+    def track_cube_statistics_bytes_read(self):
+        return self.bytes_read(self.run)
+    track_cube_statistics_bytes_read.unit = 'bytes'
+
+    def time_fused_cube_statistics(self):
+        self.run_fused()
+
+    def peakmem_fused_cube_statistics(self):
+        self.run_fused()
+
+    def track_fused_cube_statistics_bytes_read(self):
+        return self.bytes_read(self.run_fused)
+    track_fused_cube_statistics_bytes_read.unit = 'bytes'
+
+
+class StatcontCubes(CubeBenchmark):
+    """
+    The products written by `statcont_cubes.main` after the continuum has
+    been found: the continuum and noise maps and the contsub cube.
+
+    The continuum itself comes from the external statcont package, so a
+    median continuum stands in for it here.
+    """
+
+    def setup(self):
+        super().setup()
+        data = fits.getdata(self.cubefn)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.cont = np.nanmedian(data, axis=0)
+            self.noise = np.nanstd(data, axis=0)
+
+    def run(self):
+        header = self.read_cube()[0].header
+        prefix = os.path.join(self.tmpdir, 'bench.statcont')
+        write_statcont_maps(self.cont, self.noise, header, f'{prefix}.cont.fits', f'{prefix}.noise.fits')
+        return write_contsub_cube(self.cubefn, self.cont, f'{prefix}.contsub.fits', verbose=False)
+
+    def time_statcont_products(self):
+        self.run()
+
+    def peakmem_statcont_products(self):
+        self.run()
+
+    def track_statcont_products_bytes_read(self):
+        return self.bytes_read(self.run)
+    track_statcont_products_bytes_read.unit = 'bytes'
+
+    def track_contsub_throughput(self):
+        return self.run()
+    track_contsub_throughput.unit = 'MB/s'
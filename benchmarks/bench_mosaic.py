@@ -0,0 +1,131 @@
+"""
+Benchmarks of the mosaicking hot paths on synthetic fields.
+
+Each benchmark records wall time (``time_*``), peak RSS (``peakmem_*``), and
+bytes read (``track_*_bytes_read``).
+"""
+import os
+import shutil
+import tempfile
+import warnings
+
+import numpy as np
+import radio_beam
+from astropy.convolution import Gaussian2DKernel
+from spectral_cube import SpectralCube
+
+from aces.imaging.make_mosaic import (make_mosaic, make_giant_mosaic_cube_channels, rms_map,
+                                      fft_rms_map, iterative_rms_map)
+
+from .synthetic import make_fields_2d, make_field_cubes, bytes_read
+
+
+class MakeMosaic:
+    """
+    `make_mosaic` of six 2D fields with different beams, convolved to a
+    circular common beam and weighted by their primary beams
+    """
+    timeout = 600
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, 'mosaics', 'bench'))
+        self.header, self.hdus, self.weights = make_fields_2d()
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def run(self):
+        make_mosaic(self.hdus, name='bench', weights=self.weights,
+                    target_header=self.header, commonbeam='circular',
+                    cbar_unit='Jy/beam', array='12m', folder='bench',
+                    basepath=self.tmpdir, doplots=False)
+
+    def time_make_mosaic(self):
+        self.run()
+
+    def peakmem_make_mosaic(self):
+        self.run()
+
+    def track_make_mosaic_bytes_read(self):
+        return bytes_read(self.run, self.tmpdir)
+    track_make_mosaic_bytes_read.unit = 'bytes'
+
+
+class MakeGiantMosaicCubeChannels:
+    """
+    `make_giant_mosaic_cube_channels` for eight channels of four field cubes
+    """
+    timeout = 1200
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        fielddir = os.path.join(self.tmpdir, 'fields')
+        os.makedirs(fielddir)
+        self.header, cubefns, weightfns = make_field_cubes(fielddir)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.cubes = [SpectralCube.read(fn) for fn in cubefns]
+            self.weightcubes = [SpectralCube.read(fn) for fn in weightfns]
+        # a circular beam just larger than every field beam; the general
+        # common-beam solver struggles with this few, this similar, beams
+        self.commonbeam = radio_beam.Beam(1.05 * max(cube.beam.major for cube in self.cubes))
+        self.channels = list(range(12, 20))
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def run(self):
+        # completed channels are skipped, so start each run from scratch
+        working_directory = os.path.join(self.tmpdir, 'work')
+        channelmosaic_directory = os.path.join(self.tmpdir, 'channels')
+        for path in (working_directory, channelmosaic_directory):
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+        make_giant_mosaic_cube_channels(self.header, self.cubes, self.weightcubes,
+                                        commonbeam=self.commonbeam,
+                                        cubename='bench', verbose=False,
+                                        working_directory=working_directory,
+                                        channelmosaic_directory=channelmosaic_directory,
+                                        channels=self.channels)
+
+    def time_make_giant_mosaic_cube_channels(self):
+        self.run()
+
+    def peakmem_make_giant_mosaic_cube_channels(self):
+        self.run()
+
+    def track_make_giant_mosaic_cube_channels_bytes_read(self):
+        return bytes_read(self.run, self.tmpdir)
+    track_make_giant_mosaic_cube_channels_bytes_read.unit = 'bytes'
+
+
+class RMSMap:
+    """
+    The rms maps of `make_mosaic.rms` on a 2000 x 2000 mosaic with a
+    blanked border and point sources: the `convolve_fft` estimator and the
+    shared-transform estimators
+    """
+    timeout = 600
+    kernelwidth = 9
+
+    def setup(self):
+        rng = np.random.default_rng(0)
+        size = 2000
+        yy, xx = np.mgrid[:size, :size]
+        self.image = rng.normal(0, 1, size=(size, size))
+        for y, x in rng.integers(0, size, size=(50, 2)):
+            self.image += 30 * np.exp(-((yy - y)**2 + (xx - x)**2) / (2 * 3**2))
+        self.image[(yy - size / 2)**2 + (xx - size / 2)**2 > (size / 2)**2] = np.nan
+
+    def time_rms_map(self):
+        rms_map(self.image, kernel=Gaussian2DKernel(self.kernelwidth))
+
+    def time_fft_rms_map(self):
+        fft_rms_map(self.image, self.kernelwidth)
+
+    def time_fft_rms_map_downsampled(self):
+        fft_rms_map(self.image, self.kernelwidth, downsample=3)
+
+    def time_iterative_rms_map(self):
+        iterative_rms_map(self.image, self.kernelwidth, verbose=False)
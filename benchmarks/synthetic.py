@@ -0,0 +1,233 @@
+"""
+Synthetic ACES-like data for the benchmarks.
+
+The target grid is a cutout of the real 12m mosaic header
+(``aces/imaging/data/header_12m.hdr``) and the fields are laid out on it
+like 12m pointings: each has its own beam, a Gaussian primary beam used as
+the weight, and a few Gaussian sources on top of noise.
+"""
+import os
+
+import numpy as np
+import radio_beam
+from astropy import units as u
+from astropy.io import fits
+from astropy.wcs import WCS
+
+import aces
+
+header_12m_file = os.path.join(os.path.dirname(aces.__file__), 'imaging', 'data', 'header_12m.hdr')
+
+# HNCO 4-3; any rest frequency works but this keeps the headers realistic
+restfreq = 87.925238e9
+
+
+def target_header(nx=400, ny=240):
+    """
+    A ``nx`` x ``ny`` cutout from the center of the 12m mosaic header
+    """
+    header = fits.Header.fromtextfile(header_12m_file)
+    header['CRPIX1'] -= (header['NAXIS1'] - nx) / 2
+    header['CRPIX2'] -= (header['NAXIS2'] - ny) / 2
+    header['NAXIS1'] = nx
+    header['NAXIS2'] = ny
+    return header
+
+
+def target_cube_header(nx=400, ny=240, nchan=32, cdelt_kms=2.0):
+    """
+    The cutout of `target_header` with a radio velocity axis centered on 0
+    """
+    header = target_header(nx, ny)
+    header['NAXIS'] = 3
+    header['WCSAXES'] = 3
+    header['NAXIS3'] = nchan
+    header['CTYPE3'] = 'VRAD'
+    header['CUNIT3'] = 'km/s'
+    header['CRPIX3'] = nchan // 2 + 1
+    header['CRVAL3'] = 0.0
+    header['CDELT3'] = cdelt_kms
+    header['RESTFRQ'] = restfreq
+    header['SPECSYS'] = 'LSRK'
+    return header
+
+
+def field_centers(header, nfields):
+    """
+    Pixel centers of ``nfields`` overlapping pointings across the target grid
+    """
+    ncols = int(np.ceil(nfields / 2))
+    xx = np.linspace(0.25, 0.75, ncols) * header['NAXIS1']
+    yy = np.array([0.4, 0.6]) * header['NAXIS2']
+    return [(xx[ii % ncols], yy[ii // ncols]) for ii in range(nfields)]
+
+
+def _field_wcs(header, center, npix, pixscale):
+    target = WCS(header).celestial
+    crval = target.pixel_to_world(*center)
+    ww = WCS(naxis=2)
+    ww.wcs.ctype = ['RA---SIN', 'DEC--SIN']
+    ww.wcs.cunit = ['deg', 'deg']
+    ww.wcs.crval = [crval.icrs.ra.deg, crval.icrs.dec.deg]
+    ww.wcs.crpix = [npix / 2 + 0.5, npix / 2 + 0.5]
+    ww.wcs.cdelt = [-pixscale.to(u.deg).value, pixscale.to(u.deg).value]
+    return ww
+
+
+def _field_images(npix, pixscale, beam, rng, nchan=None, pb_fwhm=60 * u.arcsec):
+    yy, xx = np.mgrid[:npix, :npix] - (npix - 1) / 2
+    rr2 = (xx**2 + yy**2) * pixscale.to(u.arcsec).value**2
+    pb = np.exp(-rr2 / (2 * (pb_fwhm.to(u.arcsec).value / 2.355)**2)).astype('float32')
+    pb[pb < 0.2] = np.nan
+
+    shape = (npix, npix) if nchan is None else (nchan, npix, npix)
+    data = rng.normal(scale=1e-3, size=shape).astype('float32')
+    sigma_pix = (beam.major / pixscale).decompose().value / 2.355
+    for _ in range(5):
+        cx, cy = rng.uniform(0.25, 0.75, size=2) * npix
+        source = np.exp(-((xx + (npix - 1) / 2 - cx)**2 + (yy + (npix - 1) / 2 - cy)**2) / (2 * sigma_pix**2))
+        if nchan is None:
+            data += rng.uniform(5e-3, 5e-2) * source
+        else:
+            vcen = rng.uniform(0.2, 0.8) * nchan
+            profile = np.exp(-(np.arange(nchan) - vcen)**2 / 8)
+            data += rng.uniform(5e-3, 5e-2) * profile[:, None, None] * source
+    data = data / pb
+    return data, pb
+
+
+def make_fields_2d(nfields=6, npix=160, nx=400, ny=240, seed=0):
+    """
+    Make continuum-like images of each field and their primary beams
+
+    Returns
+    -------
+    header : `~astropy.io.fits.Header`
+        The target header
+    hdus : list of `~astropy.io.fits.HDUList`
+        The field images, as they would be opened from disk
+    weights : list of `~astropy.io.fits.PrimaryHDU`
+    """
+    rng = np.random.default_rng(seed)
+    header = target_header(nx, ny)
+    pixscale = 0.3 * u.arcsec
+    hdus, weights = [], []
+    for ii, center in enumerate(field_centers(header, nfields)):
+        beam = radio_beam.Beam(major=(1.5 + 0.1 * ii) * u.arcsec, minor=(1.2 + 0.05 * ii) * u.arcsec,
+                               pa=(10 * ii) * u.deg)
+        ww = _field_wcs(header, center, npix, pixscale)
+        data, pb = _field_images(npix, pixscale, beam, rng)
+
+        hdr = ww.to_header()
+        hdr['BUNIT'] = 'Jy/beam'
+        hdr.update(beam.to_header_keywords())
+        hdus.append(fits.HDUList([fits.PrimaryHDU(data=data, header=hdr)]))
+        weights.append(fits.PrimaryHDU(data=pb**2, header=ww.to_header()))
+    return header, hdus, weights
+
+
+def make_field_cubes(directory, nfields=4, npix=120, nchan=32, nx=320, ny=200, seed=0):
+    """
+    Write pipeline-like field cubes (``.image.pbcor.fits``) and their
+    weight cubes (``.weight.fits``) to ``directory``
+
+    Returns
+    -------
+    header : `~astropy.io.fits.Header`
+        The target cube header
+    cubefns, weightfns : lists of str
+    """
+    rng = np.random.default_rng(seed)
+    header = target_cube_header(nx, ny, nchan)
+    pixscale = 0.3 * u.arcsec
+    cubefns, weightfns = [], []
+    for ii, center in enumerate(field_centers(header, nfields)):
+        beam = radio_beam.Beam(major=(1.5 + 0.1 * ii) * u.arcsec, minor=(1.2 + 0.05 * ii) * u.arcsec,
+                               pa=(10 * ii) * u.deg)
+        ww = _field_wcs(header, center, npix, pixscale)
+        data, pb = _field_images(npix, pixscale, beam, rng, nchan=nchan)
+
+        hdr = ww.to_header()
+        hdr['WCSAXES'] = 3
+        for key in ('CTYPE3', 'CUNIT3', 'CRPIX3', 'CRVAL3', 'CDELT3', 'RESTFRQ', 'SPECSYS'):
+            hdr[key] = header[key]
+        # the field cubes are on a slightly different spectral grid from the target
+        hdr['CRVAL3'] = header['CRVAL3'] + 0.3 * ii
+        weight_header = hdr.copy()
+        hdr['BUNIT'] = 'Jy/beam'
+        hdr.update(beam.to_header_keywords())
+
+        name = f'uid___A001_X15a0_X{ii:02x}.s38_0.Sgr_A_star_sci.spw25.cube.I.iter1'
+        cubefn = os.path.join(directory, f'{name}.image.pbcor.fits')
+        weightfn = os.path.join(directory, f'{name}.weight.fits')
+        fits.PrimaryHDU(data=data, header=hdr).writeto(cubefn, overwrite=True)
+        fits.PrimaryHDU(data=np.broadcast_to(pb**2, data.shape), header=weight_header).writeto(weightfn, overwrite=True)
+        cubefns.append(cubefn)
+        weightfns.append(weightfn)
+    return header, cubefns, weightfns
+
+
+def make_giant_cube(filename, nchan=64, nx=320, ny=200, seed=0):
+    """
+    Write a mosaic-like cube on the `target_cube_header` grid with extended
+    emission, a NaN border, and a blanked patch
+    """
+    rng = np.random.default_rng(seed)
+    header = target_cube_header(nx, ny, nchan, cdelt_kms=5.0)
+    header['BUNIT'] = 'K'
+    header.update(radio_beam.Beam(2 * u.arcsec).to_header_keywords())
+
+    data = rng.normal(size=(nchan, ny, nx)).astype('float32')
+    zz, yy, xx = np.ogrid[:nchan, :ny, :nx]
+    for _ in range(12):
+        cz, cy, cx = rng.uniform([5, 10, 10], [nchan - 5, ny - 10, nx - 10])
+        data += rng.uniform(3, 20) * np.exp(-((zz - cz)**2 / 8 + (yy - cy)**2 / 40 + (xx - cx)**2 / 40))
+    data[:, :8, :] = np.nan
+    data[:, :, -5:] = np.nan
+    data[5:9, ny // 2:ny // 2 + 20, nx // 2:nx // 2 + 20] = np.nan
+
+    fits.PrimaryHDU(data=data, header=header).writeto(filename, overwrite=True)
+    return filename
+
+
+def io_counters():
+    """
+    Read this process's I/O counters from ``/proc/self/io`` (Linux only).
+
+    ``rchar`` counts bytes requested through read calls, including page-cache
+    hits; ``read_bytes`` counts bytes actually fetched from storage, which
+    includes memmapped reads.
+    """
+    with open('/proc/self/io') as fh:
+        return {key: int(val) for key, val in (line.split(':') for line in fh)}
+
+
+def drop_from_page_cache(directory):
+    """
+    Ask the kernel to evict every file under ``directory`` from the page
+    cache so that the next reads, memmapped or not, go to storage
+    """
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            fd = os.open(os.path.join(root, name), os.O_RDONLY)
+            try:
+                os.fdatasync(fd)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+
+def bytes_read(func, directory):
+    """
+    Run ``func`` with a cold cache for ``directory`` and return the number of
+    bytes it read.
+
+    FITS data are usually memmapped, which ``rchar`` does not see, while
+    explicit reads that hit the cache are missed by ``read_bytes``; the
+    larger of the two is a lower bound on the real I/O.
+    """
+    drop_from_page_cache(directory)
+    before = io_counters()
+    func()
+    after = io_counters()
+    return max(after['rchar'] - before['rchar'], after['read_bytes'] - before['read_bytes'])